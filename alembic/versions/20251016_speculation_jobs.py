@@ -0,0 +1,66 @@
+"""add speculation_jobs table for cross-process speculation queue
+
+Revision ID: 20251016_specjobs
+Revises: 20250928_uniqsess
+Create Date: 2025-10-16 10:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "20251016_specjobs"
+down_revision: Union[str, None] = "20250928_uniqsess"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "speculation_jobs",
+        sa.Column("id", sa.Integer(), primary_key=True, index=True),
+        sa.Column("kind", sa.String(length=10), nullable=False),
+        sa.Column("session_id", sa.Integer(), nullable=False),
+        sa.Column("parent_id", sa.Integer(), nullable=False),
+        sa.Column("choice", sa.String(), nullable=False, server_default=""),
+        sa.Column("depth", sa.Integer(), nullable=False),
+        sa.Column("level", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("lineage", postgresql.ARRAY(sa.String()), nullable=False, server_default="{}"),
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("status", sa.String(length=20), nullable=False, server_default="queued"),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("lease_owner", sa.String(length=64), nullable=True),
+        sa.Column("lease_expires_at", sa.DateTime(), nullable=True),
+        sa.Column("enqueued_at", sa.DateTime(), server_default=sa.func.now(), nullable=False),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(["session_id"], ["game_sessions.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["parent_id"], ["story_nodes.id"], ondelete="CASCADE"),
+    )
+    op.create_index("ix_speculation_jobs_session_id", "speculation_jobs", ["session_id"])
+    op.create_index("ix_specjob_claim", "speculation_jobs", ["status", "level", "id"])
+    op.create_index(
+        "uq_specjob_active_child",
+        "speculation_jobs",
+        ["session_id", "parent_id", "choice"],
+        unique=True,
+        postgresql_where=sa.text("kind = 'child' AND status IN ('queued', 'running')"),
+    )
+    op.create_index(
+        "uq_specjob_queued_expand",
+        "speculation_jobs",
+        ["session_id", "parent_id"],
+        unique=True,
+        postgresql_where=sa.text("kind = 'expand' AND status = 'queued'"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("uq_specjob_queued_expand", table_name="speculation_jobs")
+    op.drop_index("uq_specjob_active_child", table_name="speculation_jobs")
+    op.drop_index("ix_specjob_claim", table_name="speculation_jobs")
+    op.drop_index("ix_speculation_jobs_session_id", table_name="speculation_jobs")
+    op.drop_table("speculation_jobs")
@@ -0,0 +1,58 @@
+"""add materialized depth/path columns to story_nodes
+
+Revision ID: 20251017_nodepath
+Revises: 20251016_specjobs
+Create Date: 2025-10-17 10:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "20251017_nodepath"
+down_revision: Union[str, None] = "20251016_specjobs"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "story_nodes",
+        sa.Column("depth", sa.Integer(), nullable=False, server_default="1"),
+    )
+    op.add_column(
+        "story_nodes",
+        sa.Column("path", postgresql.ARRAY(sa.Integer()), nullable=False, server_default="{}"),
+    )
+
+    # 回填：自根节点递归计算每个节点的深度与祖先路径
+    conn = op.get_bind()
+    conn.execute(sa.text(
+        """
+        WITH RECURSIVE tree AS (
+            SELECT id, 1 AS depth, ARRAY[]::integer[] AS path
+            FROM story_nodes
+            WHERE parent_id IS NULL
+            UNION ALL
+            SELECT child.id, tree.depth + 1, tree.path || child.parent_id
+            FROM story_nodes AS child
+            JOIN tree ON child.parent_id = tree.id
+        )
+        UPDATE story_nodes AS n
+        SET depth = tree.depth, path = tree.path
+        FROM tree
+        WHERE n.id = tree.id
+        """
+    ))
+
+    op.create_index("ix_story_nodes_path", "story_nodes", ["path"], postgresql_using="gin")
+    op.create_index("ix_story_nodes_session_depth", "story_nodes", ["session_id", "depth"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_story_nodes_session_depth", table_name="story_nodes")
+    op.drop_index("ix_story_nodes_path", table_name="story_nodes")
+    op.drop_column("story_nodes", "path")
+    op.drop_column("story_nodes", "depth")
@@ -0,0 +1,34 @@
+"""add llm_response_cache table shared across workers
+
+Revision ID: 20251018_llmcache
+Revises: 20251017_nodepath
+Create Date: 2025-10-18 10:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "20251018_llmcache"
+down_revision: Union[str, None] = "20251017_nodepath"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "llm_response_cache",
+        sa.Column("key", sa.String(length=64), primary_key=True),
+        sa.Column("call_site", sa.String(length=50), nullable=False),
+        sa.Column("model", sa.String(length=100), nullable=True),
+        sa.Column("response", sa.Text(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_llm_response_cache_expires_at", "llm_response_cache", ["expires_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_llm_response_cache_expires_at", table_name="llm_response_cache")
+    op.drop_table("llm_response_cache")
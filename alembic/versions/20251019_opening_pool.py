@@ -0,0 +1,39 @@
+"""add opening_pool table for cross-user opening reuse
+
+Revision ID: 20251019_openingpool
+Revises: 20251018_llmcache
+Create Date: 2025-10-19 10:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "20251019_openingpool"
+down_revision: Union[str, None] = "20251018_llmcache"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "opening_pool",
+        sa.Column("id", sa.Integer(), primary_key=True, index=True),
+        sa.Column("wish_digest", sa.String(length=64), nullable=False),
+        sa.Column("wish", sa.String(length=100), nullable=False),
+        sa.Column("source_session_id", sa.Integer(), nullable=True, unique=True),
+        sa.Column("root", sa.JSON(), nullable=False),
+        sa.Column("children", sa.JSON(), nullable=False),
+        sa.Column("served_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index("ix_opening_pool_wish_digest", "opening_pool", ["wish_digest"])
+    # 收录候选：按愿望查找其它玩家的会话
+    op.create_index("ix_game_sessions_wish", "game_sessions", ["wish"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_game_sessions_wish", table_name="game_sessions")
+    op.drop_index("ix_opening_pool_wish_digest", table_name="opening_pool")
+    op.drop_table("opening_pool")
@@ -0,0 +1,46 @@
+"""add llm_usage table for token accounting per call site, user and session
+
+Revision ID: 20251020_llmusage
+Revises: 20251019_openingpool
+Create Date: 2025-10-20 10:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "20251020_llmusage"
+down_revision: Union[str, None] = "20251019_openingpool"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "llm_usage",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("bucket_start", sa.DateTime(), nullable=False),
+        sa.Column("user_id", sa.String(length=36), nullable=False, server_default=""),
+        sa.Column("session_id", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("call_site", sa.String(length=32), nullable=False),
+        sa.Column("traffic", sa.String(length=16), nullable=False),
+        sa.Column("model", sa.String(length=100), nullable=False, server_default=""),
+        sa.Column("calls", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("prompt_tokens", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("completion_tokens", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        # upsert 累加的冲突目标；不可为 NULL 的维度列保证冲突判定生效
+        sa.UniqueConstraint(
+            "bucket_start", "user_id", "session_id", "call_site", "traffic", "model",
+            name="uq_llm_usage_bucket",
+        ),
+    )
+    op.create_index("ix_llm_usage_bucket_start", "llm_usage", ["bucket_start"])
+    op.create_index("ix_llm_usage_session_id", "llm_usage", ["session_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_llm_usage_session_id", table_name="llm_usage")
+    op.drop_index("ix_llm_usage_bucket_start", table_name="llm_usage")
+    op.drop_table("llm_usage")
@@ -0,0 +1,27 @@
+"""add score to speculation_jobs so claims within a level follow predicted branch probability
+
+Revision ID: 20251021_specjobscore
+Revises: 20251020_llmusage
+Create Date: 2025-10-21 10:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "20251021_specjobscore"
+down_revision: Union[str, None] = "20251020_llmusage"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "speculation_jobs",
+        sa.Column("score", sa.Float(), nullable=False, server_default="1"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("speculation_jobs", "score")
@@ -0,0 +1,36 @@
+"""add indexes for collecting expired speculative story nodes and their images
+
+Revision ID: 20251022_nodegc
+Revises: 20251021_specjobscore
+Create Date: 2025-10-22 10:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "20251022_nodegc"
+down_revision: Union[str, None] = "20251021_specjobscore"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_story_nodes_speculative_expiry",
+        "story_nodes",
+        ["speculative_expires_at"],
+        postgresql_where=sa.text("is_speculative"),
+    )
+    op.create_index(
+        "ix_story_nodes_generated_image",
+        "story_nodes",
+        ["image_url"],
+        postgresql_where=sa.text("image_url LIKE '%/static/generated/%'"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_story_nodes_generated_image", table_name="story_nodes")
+    op.drop_index("ix_story_nodes_speculative_expiry", table_name="story_nodes")
@@ -0,0 +1,42 @@
+"""add start_pregenerations table so /start sees pregenerations from any worker
+
+Revision ID: 20251023_startpregen
+Revises: 20251022_nodegc
+Create Date: 2025-10-23 10:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "20251023_startpregen"
+down_revision: Union[str, None] = "20251022_nodegc"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "start_pregenerations",
+        sa.Column("cache_key", sa.String(length=128), primary_key=True),
+        sa.Column("status", sa.String(length=10), nullable=False, server_default="running"),
+        sa.Column(
+            "session_id",
+            sa.Integer(),
+            sa.ForeignKey("game_sessions.id", ondelete="CASCADE"),
+            nullable=True,
+        ),
+        sa.Column(
+            "node_id",
+            sa.Integer(),
+            sa.ForeignKey("story_nodes.id", ondelete="CASCADE"),
+            nullable=True,
+        ),
+        sa.Column("trace", sa.String(length=64), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("start_pregenerations")
@@ -3,7 +3,7 @@
 """
 
 from fastapi import APIRouter, HTTPException, status, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from typing import List, Dict, Optional, Tuple, Any
@@ -14,22 +14,34 @@ from core.story_engine import story_engine
 from core.history_context import build_prompt_context
 from config.logging_config import LOGGER, story_logger, make_trace_id, kv_text, log_context
 from config.settings import settings
-from database.base import get_db, SessionLocal
+from database.base import get_db, SessionLocal, session_scope
 from database import crud, models
 # 导入新的安全依赖
 from .user import get_current_user
-from core.content_moderation import check_wish_safety_llm
+from core.content_moderation import check_wish_safety_llm_async
 from core.prompt_templates import PREPARE_LEVEL_PROMPT
-from core.llm_clients import llm_client
+from core.llm_clients import async_llm_client, provider_guard_metrics
+from core.llm_usage import bind_usage, usage_tracker
+from core.llm_cache import llm_cache
+from core.opening_pool import opening_pool
+from core.history_compaction import history_compactor
+from core.node_gc import node_gc
 from core.story_state import build_story_history, extract_chapter_number, build_story_segment_from_node
 from core.speculation import speculation_service, speculation_get_metrics
+from core.image_jobs import image_jobs, node_image_status, IMAGE_STATUS_PENDING
+from core.notify import notify_hub, start_key, choice_key, node_key
+import asyncio
 import hashlib
 import json
 import re
 import threading
+import time
 
 SAVE_STATUSES = {"active", "completed", "failed"}
 
+# SSE 响应头：禁用缓存与反向代理缓冲，保证增量及时送达
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
 
 def _ensure_session_ownership(session: models.GameSession, user_id: str) -> None:
     if not session or session.user_id != user_id:
@@ -66,6 +78,10 @@ router = APIRouter()
 _FIRST_STORY_CACHE_MAX = getattr(settings, "first_story_cache_max_entries", 100)
 _FIRST_STORY_CACHE: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # key: f"{user_id}:{wish_digest}"
 _CACHE_LOCK = threading.Lock()
+# 本进程内正在进行的首节预生成（cache key）；/start 据此判断是否值得等待
+_PREGEN_INFLIGHT: set[str] = set()
+# 共享模式下超过该时长（秒）仍为 running 的预生成记录视为已中断（进程崩溃），/start 不再等待
+_PREGEN_STALE_SECONDS = 300
 
 
 def _make_cache_key(user_id: str, wish: str) -> str:
@@ -99,10 +115,67 @@ def _cache_remove(key: str) -> None:
             LOGGER.debug(f"[预生成] 已从缓存中移除 key={key}")
 
 
+def _pregeneration_shared() -> bool:
+    """多 worker 部署（预推演队列或通知后端为 postgres）时，/start 可能落在与预生成不同的 worker 上，状态记录在 start_pregenerations 表。"""
+    return settings.speculation_queue_backend == "postgres" or settings.notify_backend == "postgres"
+
+
+def _mark_pregeneration_started(key: str) -> None:
+    """登记预生成开始；共享模式下写库（阻塞调用，需在线程中执行），同时作废该 key 上一次未领取的结果。"""
+    with _CACHE_LOCK:
+        _PREGEN_INFLIGHT.add(key)
+    if _pregeneration_shared():
+        with session_scope() as db:
+            crud.mark_start_pregeneration(db, key, "running")
+
+
+def _mark_pregeneration_finished(key: str) -> None:
+    """预生成结束（成功或失败）：唤醒在 /start 等待的请求。"""
+    with _CACHE_LOCK:
+        _PREGEN_INFLIGHT.discard(key)
+    notify_hub.notify(start_key(key))
+
+
+def _discard_pregeneration(key: str) -> None:
+    """预生成失败：清理结果与共享记录，让 /start 立即降级到实时生成。"""
+    _cache_remove(key)
+    if not _pregeneration_shared():
+        return
+    try:
+        with session_scope() as db:
+            crud.delete_start_pregeneration(db, key)
+    except Exception as exc:  # noqa: BLE001
+        LOGGER.warning(f"[预生成] 清理共享记录失败 key={key}: {exc}")
+
+
+def _pregeneration_pending(key: str) -> bool:
+    """该 key 的预生成是否仍在进行；共享模式下还要查其它 worker 登记的记录（阻塞调用，需在线程中执行）。"""
+    with _CACHE_LOCK:
+        if key in _PREGEN_INFLIGHT:
+            return True
+    if not _pregeneration_shared():
+        return False
+    with session_scope() as db:
+        return crud.is_start_pregeneration_running(db, key, _PREGEN_STALE_SECONDS)
+
+
+def _pop_pregenerated(cache_key: str) -> Optional[Dict[str, Any]]:
+    """
+    领取已完成的预生成结果（只能领取一次）：单 worker 查本进程缓存；
+    共享模式下预生成可能落在其它 worker，只认 start_pregenerations 中标记完成且未被领取的记录，
+    不把玩家已有的会话根节点当作预生成结果（阻塞调用，需在线程中执行）。
+    """
+    if not _pregeneration_shared():
+        return _cache_pop(cache_key)
+    with session_scope() as db:
+        return crud.take_start_pregeneration(db, cache_key)
+
+
 def _background_generate_with_pregeneration(user_id: str, wish: str, trace: str | None = None) -> None:
     """后台生成第一节故事并创建完整数据库记录，触发预生成"""
     wish_norm = (wish or "").strip()
     log = story_logger(trace=trace or make_trace_id(), user_id=user_id, wish=wish_norm, task="pregeneration")
+    bind_usage(user_id=user_id)
     db = SessionLocal()
     try:
         log.info("pregeneration start" + kv_text())
@@ -124,34 +197,51 @@ def _background_generate_with_pregeneration(user_id: str, wish: str, trace: str
                 log = log.bind(session=session.id)
                 log.info("pregeneration session reused after IntegrityError")
 
-        node = crud.get_root_node_for_session(db, session.id)
+        session_id = session.id
+        bind_usage(session_id=session_id)
+        node = crud.get_root_node_for_session(db, session_id)
+        pool_entry = None if node else opening_pool.acquire(db, wish_norm)
         if node:
             log = log.bind(node=node.id)
             log.info("pregeneration reuse root node")
+        elif pool_entry is not None:
+            node = opening_pool.clone_into(db, session_id, pool_entry)
+            log = log.bind(node=node.id)
+            log.info("pregeneration opening pool hit" + kv_text(entry=pool_entry.id))
         else:
+            # 模型调用期间不占用连接：先归还，生成完成后同一 Session 重新取连接写入
+            db.close()
+
             # 1. 生成第一节故事
             log.info("pregeneration story engine start")
             raw_data = story_engine.start_story(wish=wish_norm)
             log.info("pregeneration story ready" + kv_text(text_len=len(raw_data.text)))
 
             # 3. 创建第一个故事节点
-            node = crud.create_story_node(db, session_id=session.id, segment=raw_data)
+            node = crud.create_story_node(db, session_id=session_id, segment=raw_data)
             log = log.bind(node=node.id)
             log.info("pregeneration node created")
             log.info("pregeneration node image" + kv_text(image=raw_data.image_url))
+        image_jobs.ensure(node)
 
-        # 4. 缓存会话和节点信息供start接口使用
+        # 4. 缓存会话和节点信息供start接口使用（共享模式下标记为完成，任一 worker 的 /start 均可领取）
         cache_key = _make_cache_key(user_id, wish_norm)
-        _cache_store(cache_key, {
-            "session_id": session.id,
-            "node_id": node.id,
-            "trace": trace,
-        })
+        if _pregeneration_shared():
+            crud.mark_start_pregeneration(db, cache_key, "ready", session_id=session_id, node_id=node.id, trace=trace)
+        else:
+            _cache_store(cache_key, {
+                "session_id": session_id,
+                "node_id": node.id,
+                "trace": trace,
+            })
         log.info("pregeneration cache stored")
 
-        # 5. 触发预生成：第一节相对概要已占1层，这里只需补齐到 max_depth，因此使用 (max_depth - 1)
-        pre_depth = max(0, int(getattr(settings, 'speculation_max_depth', 0)) - 1)
-        speculation_service.enqueue(session.id, node.id, depth=pre_depth)
+        # 5. 触发预生成：第一节相对概要已占1层，这里只需补齐到该玩家的预推演深度 - 1
+        pre_depth = max(0, speculation_service.depth_for(user_id) - 1)
+        node_id = node.id
+        # 推演入队可能较慢（写共享队列），先归还连接
+        db.close()
+        speculation_service.enqueue(session_id, node_id, depth=pre_depth)
         log.info("pregeneration speculation enqueued" + kv_text(depth=pre_depth))
 
         log.info("pregeneration done")
@@ -160,92 +250,96 @@ def _background_generate_with_pregeneration(user_id: str, wish: str, trace: str
         log.error("pregeneration failed" + kv_text(error=str(exc)))
         db.rollback()
         # 失败时清理缓存，让start接口降级到实时生成
-        cache_key = _make_cache_key(user_id, wish_norm)
-        _cache_remove(cache_key)
+        _discard_pregeneration(_make_cache_key(user_id, wish_norm))
     finally:
         # 无论成功失败都确保关闭数据库会话
         db.close()
         log.debug("pregeneration db closed")
+        _mark_pregeneration_finished(_make_cache_key(user_id, wish_norm))
+
+
+
+def _clone_opening(db: Session, session_id: int, wish: str, log):
+    """尝试从开局池克隆根节点；池未命中返回 None（后续预推演由 /start 统一入队）"""
+    entry = opening_pool.acquire(db, wish)
+    if entry is None:
+        return None
+    node = opening_pool.clone_into(db, session_id, entry)
+    log.info("start opening pool hit" + kv_text(entry=entry.id, node_id=node.id))
+    return node
+
+
+def _node_ready(node_id: int) -> bool:
+    """检查节点是否完全准备就绪（故事+图片）；配图由后台任务补齐，pending 状态下占位图即可展示。阻塞调用，需在线程中执行。"""
+    with session_scope() as db:
+        node = crud.get_node_by_id(db, node_id)
+        if node is None:
+            return False
+        db.expunge(node)
+
+    # 检查1: 故事文本是否存在
+    if not node.story_text or len(node.story_text.strip()) == 0:
+        LOGGER.debug(f"[NodeComplete] 故事文本未完成，继续等待：node_id={node.id}")
+        return False
+
+    if node_image_status(node) == IMAGE_STATUS_PENDING:
+        LOGGER.info(f"[NodeComplete] ✅ 节点文本就绪，配图后台生成中：node_id={node.id}")
+        return True
 
+    # 检查2: 图片URL是否存在
+    if not node.image_url:
+        LOGGER.debug(f"[NodeComplete] 图片URL未设置，继续等待：node_id={node.id}")
+        return False
+
+    # 检查3: 如果是AI生成的图片，检查文件是否真的存在且可访问
+    if node.image_url.startswith('/static/generated/'):
+        filename = node.image_url.replace('/static/generated/', '')
+        file_path = settings.BASE_DIR / "assets" / "generated_images" / filename
+        if not file_path.exists():
+            LOGGER.debug(f"[NodeComplete] AI生成图片文件不存在，继续等待：{file_path}")
+            return False
+        if file_path.stat().st_size == 0:
+            LOGGER.debug(f"[NodeComplete] AI生成图片文件为空，继续等待：{file_path}")
+            return False
+        # 尝试读取文件头确保文件完整
+        try:
+            with open(file_path, 'rb') as f:
+                if len(f.read(10)) == 0:
+                    LOGGER.debug(f"[NodeComplete] AI生成图片文件无法读取，继续等待：{file_path}")
+                    return False
+        except Exception as e:
+            LOGGER.debug(f"[NodeComplete] AI生成图片文件访问异常，继续等待：{e}")
+            return False
+    return True
 
 
-def _wait_for_node_complete(node, db, max_wait_seconds: int = 60) -> bool:
+async def _wait_for_node_complete(node_id: int, max_wait_seconds: int = 60) -> bool:
     """
     等待节点完全准备就绪（故事+图片都完成）
-    只有用户明确选择了该节点时才会调用此方法
+    只有用户明确选择了该节点时才会调用此方法；由配图任务的完成通知唤醒复查，不轮询数据库。
+    每次复查在线程中以独立短会话读取，等待期间不占用连接、不阻塞事件循环。
     """
-    import time
-    from pathlib import Path
-    
-    LOGGER.info(f"[NodeComplete] 开始等待节点完全准备：node_id={node.id}")
-    
+    LOGGER.info(f"[NodeComplete] 开始等待节点完全准备：node_id={node_id}")
     start_time = time.time()
-    check_interval = 0.5  # 500ms检查一次
-    
-    while time.time() - start_time < max_wait_seconds:
-        # 刷新节点状态
-        db.refresh(node)
-        
-        # 检查1: 故事文本是否存在
-        if not node.story_text or len(node.story_text.strip()) == 0:
-            LOGGER.debug(f"[NodeComplete] 故事文本未完成，继续等待：node_id={node.id}")
-            time.sleep(check_interval)
-            continue
-        
-        # 检查2: 图片URL是否存在
-        if not node.image_url:
-            LOGGER.debug(f"[NodeComplete] 图片URL未设置，继续等待：node_id={node.id}")
-            time.sleep(check_interval)
-            continue
-        
-        # 检查3: 如果是AI生成的图片，检查文件是否真的存在且可访问
-        if node.image_url.startswith('/static/generated/'):
-            # 这是AI生成的图片，需要验证文件存在性
-            filename = node.image_url.replace('/static/generated/', '')
-            file_path = settings.BASE_DIR / "assets" / "generated_images" / filename
-            
-            if not file_path.exists():
-                LOGGER.debug(f"[NodeComplete] AI生成图片文件不存在，继续等待：{file_path}")
-                time.sleep(check_interval)
-                continue
-            
-            # 检查文件大小
-            if file_path.stat().st_size == 0:
-                LOGGER.debug(f"[NodeComplete] AI生成图片文件为空，继续等待：{file_path}")
-                time.sleep(check_interval)
-                continue
-            
-            # 尝试读取文件头确保文件完整
-            try:
-                with open(file_path, 'rb') as f:
-                    header = f.read(10)
-                    if len(header) == 0:
-                        LOGGER.debug(f"[NodeComplete] AI生成图片文件无法读取，继续等待：{file_path}")
-                        time.sleep(check_interval)
-                        continue
-            except Exception as e:
-                LOGGER.debug(f"[NodeComplete] AI生成图片文件访问异常，继续等待：{e}")
-                time.sleep(check_interval)
-                continue
-        
-        # 所有检查都通过
-        elapsed = time.time() - start_time
-        LOGGER.info(f"[NodeComplete] ✅ 节点完全准备就绪：node_id={node.id} (等待了 {elapsed:.1f} 秒)")
-        return True
-    
-    # 超时
+    ready = await notify_hub.wait_for(
+        node_key(node_id), lambda: asyncio.to_thread(_node_ready, node_id), max_wait_seconds
+    )
     elapsed = time.time() - start_time
-    LOGGER.warning(f"[NodeComplete] ⏰ 节点准备等待超时：node_id={node.id} (等待了 {elapsed:.1f} 秒)")
-    return False
+    if ready:
+        LOGGER.info(f"[NodeComplete] ✅ 节点完全准备就绪：node_id={node_id} (等待了 {elapsed:.1f} 秒)")
+    else:
+        LOGGER.warning(f"[NodeComplete] ⏰ 节点准备等待超时：node_id={node_id} (等待了 {elapsed:.1f} 秒)")
+    return ready
 
 
 def _sanitize_metadata(meta: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
     """去除只供后端使用的敏感/内部字段，避免泄露到前端。
-    当前仅移除 chapter.hidden_effects_map，但保留 chapter.enabled 等前端需要的标识。
+    移除 chapter.hidden_effects_map 与预推演统计 speculation，但保留 chapter.enabled 等前端需要的标识。
     """
     if not isinstance(meta, dict):
         return meta
     clean = dict(meta)
+    clean.pop("speculation", None)
     chapter = clean.get("chapter")
     if isinstance(chapter, dict):
         chapter_clean = dict(chapter)
@@ -258,34 +352,35 @@ def _sanitize_metadata(meta: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any
     return clean
 
 
+def _log_wish_moderation(user_id: str, text: str, status: str, reason: Optional[str]) -> None:
+    """记录愿望审核结果（独立短会话，阻塞调用，需在线程中执行）；记录失败不影响审核结论。"""
+    try:
+        with session_scope() as db:
+            crud.log_wish_moderation(db, user_id, text, status, reason)
+    except Exception as exc:  # noqa: BLE001
+        LOGGER.warning(f"[moderation] log wish failed: {exc}")
+
+
 @router.post("/check_wish", response_model=schemas.story.WishCheckResponse)
 async def check_wish(
     request: schemas.story.WishCheckRequest,
-    db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """使用LLM校验用户的重生愿望是否违规"""
+    bind_usage(user_id=current_user.id)
     text = (request.wish or "").strip()
     
     # 基本长度校验
     if not text or len(text) > 100:
         reason = "愿望不能为空且不超过100字"
-        try:
-            crud.log_wish_moderation(db, current_user.id, text, "rejected", reason)
-        except Exception as exc:  # noqa: BLE001
-            LOGGER.warning(f"[moderation] log wish failed: {exc}")
+        await asyncio.to_thread(_log_wish_moderation, current_user.id, text, "rejected", reason)
         return schemas.story.WishCheckResponse(ok=False, reason=reason)
 
     # 直接使用LLM校验
     try:
-        ok, reason = check_wish_safety_llm(text)
+        ok, reason = await check_wish_safety_llm_async(text)
         status = "accepted" if ok else "rejected"
-        
-        try:
-            crud.log_wish_moderation(db, current_user.id, text, status, reason)
-        except Exception as exc:  # noqa: BLE001
-            LOGGER.warning(f"[moderation] log wish failed: {exc}")
-            
+        await asyncio.to_thread(_log_wish_moderation, current_user.id, text, status, reason)
         LOGGER.info(f"[moderation] LLM校验 user={current_user.id} ok={ok} reason={reason or '-'}")
         
         if not ok:
@@ -296,17 +391,56 @@ async def check_wish(
     except Exception as exc:  # noqa: BLE001
         LOGGER.error(f"[moderation] LLM校验失败 user={current_user.id}: {exc}")
         # 校验失败时保守处理
-        try:
-            crud.log_wish_moderation(db, current_user.id, text, "rejected", "系统校验失败")
-        except Exception:
-            pass
+        await asyncio.to_thread(_log_wish_moderation, current_user.id, text, "rejected", "系统校验失败")
         return schemas.story.WishCheckResponse(ok=False, reason="愿望校验失败，请稍后重试")
 
 
+def _parse_prepare_payload(raw: Any) -> Dict[str, Any]:
+    """解析关卡元信息的模型输出，失败时抛出异常。"""
+    s = str(raw).strip()
+    # 兼容 ```json 代码围栏
+    m = re.match(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", s, re.IGNORECASE | re.DOTALL)
+    if m:
+        s = m.group(1).strip()
+    else:
+        # 兼容前后噪声：从首个 '{' 起按括号配对截取
+        start = s.find('{')
+        if start != -1:
+            depth = 0
+            end = None
+            for i in range(start, len(s)):
+                ch = s[i]
+                if ch == '{':
+                    depth += 1
+                elif ch == '}':
+                    depth -= 1
+                    if depth == 0:
+                        end = i
+                        break
+            if end is not None:
+                s = s[start:end+1].strip()
+            else:
+                s = s[start:].strip()
+    data = json.loads(s)
+    if not isinstance(data, dict):
+        raise ValueError("关卡元信息不是JSON对象")
+    return data
+
+
+def _is_valid_prepare_payload(raw: str) -> bool:
+    try:
+        data = _parse_prepare_payload(raw)
+    except Exception:
+        return False
+    main_quest = data.get("main_quest")
+    if not main_quest and isinstance(data.get("goal"), dict):
+        main_quest = data["goal"].get("description")
+    return bool(data.get("level_title") and data.get("background") and main_quest)
+
+
 @router.post("/prepare_start", response_model=schemas.story.PrepareStartResponse)
 async def prepare_start_level(
     request: schemas.story.PrepareStartRequest,
-    db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """
@@ -322,6 +456,7 @@ async def prepare_start_level(
         task="prepare_start",
     )
     base_log.info("PrepareStart start " + kv_text(wish=request.wish.strip()))
+    bind_usage(user_id=current_user.id)
 
     base_log.debug("prepare context building")
     prompt_context = build_prompt_context(request.wish.strip())
@@ -333,34 +468,16 @@ async def prepare_start_level(
         history_context=prompt_context["context_block"],
     )
     base_log.info("prepare LLM request " + kv_text(prompt_len=len(prompt)))
-    raw = llm_client.generate(prompt)
+    # 相同愿望的关卡元信息提示词完全一致，命中缓存可省去一次模型调用
+    raw = await async_llm_client.generate(
+        prompt,
+        cache_site="prepare_level",
+        cache_validate=_is_valid_prepare_payload,
+        usage_site="prepare",
+    )
     base_log.info("prepare LLM done " + kv_text(raw_len=len(str(raw))))
     try:
-        s = str(raw).strip()
-        # 兼容 ```json 代码围栏
-        m = re.match(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", s, re.IGNORECASE | re.DOTALL)
-        if m:
-            s = m.group(1).strip()
-        else:
-            # 兼容前后噪声：从首个 '{' 起按括号配对截取
-            start = s.find('{')
-            if start != -1:
-                depth = 0
-                end = None
-                for i in range(start, len(s)):
-                    ch = s[i]
-                    if ch == '{':
-                        depth += 1
-                    elif ch == '}':
-                        depth -= 1
-                        if depth == 0:
-                            end = i
-                            break
-                if end is not None:
-                    s = s[start:end+1].strip()
-                else:
-                    s = s[start:].strip()
-        data = json.loads(s)
+        data = _parse_prepare_payload(raw)
         base_log.info("prepare json parsed " + kv_text(fields="|".join(list(map(str, data.keys())))))
     except Exception as e:
         base_log.error("prepare json parse failed " + kv_text(error=str(e), preview=str(raw)[:120]))
@@ -399,6 +516,7 @@ async def prepare_start_level(
     # 触发后台完整故事生成流程（包含session创建和speculation预生成）
     wish_norm = request.wish.strip()
     try:
+        await asyncio.to_thread(_mark_pregeneration_started, _make_cache_key(str(current_user.id), wish_norm))
         thread = threading.Thread(
             target=_background_generate_with_pregeneration,
             args=(str(current_user.id), wish_norm, trace),
@@ -408,6 +526,8 @@ async def prepare_start_level(
         base_log.info("prepare background thread started" + kv_text(user=current_user.id))
     except Exception as exc:
         base_log.warning("prepare background thread failed " + kv_text(error=str(exc)))
+        await asyncio.to_thread(_discard_pregeneration, _make_cache_key(str(current_user.id), wish_norm))
+        _mark_pregeneration_finished(_make_cache_key(str(current_user.id), wish_norm))
 
     return schemas.story.PrepareStartResponse(
         level_title=level_title,
@@ -417,10 +537,73 @@ async def prepare_start_level(
     )
 
 
+def _segment_from_node(
+    node: models.StoryNode,
+    chapter_number: int,
+    raw_data: Optional[schemas.story.RawStoryData] = None,
+    **extra_metadata: Any,
+) -> schemas.story.StorySegment:
+    """由节点（或刚生成的 raw_data）组合响应；在持有数据库会话的线程内调用。"""
+    if raw_data is not None:
+        # 实时生成的情况，使用raw_data
+        metadata = {**(raw_data.metadata or {}), **extra_metadata, "chapter_number": chapter_number}
+        # 将 ChoiceOption 实例转换为字典，避免 Pydantic 类型身份不一致导致的校验错误
+        choices_payload = [
+            c.model_dump() if hasattr(c, "model_dump") else c
+            for c in (raw_data.choices or [])
+        ]
+        story_text, image_url, success_rate = raw_data.text, raw_data.image_url, raw_data.success_rate
+    else:
+        # 使用已落库节点的情况，从node获取数据
+        metadata = {**(node.get_metadata() or {}), **extra_metadata, "chapter_number": chapter_number}
+        choices_payload = node.get_choices() or []
+        story_text, image_url, success_rate = node.story_text, node.image_url, node.success_rate
+    return schemas.story.StorySegment(
+        session_id=node.session_id,
+        node_id=node.id,
+        text=story_text,
+        choices=choices_payload,
+        image_url=image_url,
+        success_rate=success_rate,
+        metadata=_sanitize_metadata(metadata),
+    )
+
+
+def _load_start_node(session_id: int, node_id: int) -> Optional[schemas.story.StorySegment]:
+    """读取预生成的会话与根节点并组合响应；任一已不存在时返回 None（降级到实时生成）。"""
+    with session_scope() as db:
+        session = crud.get_session_by_id(db, session_id)
+        node = crud.get_node_by_id(db, node_id)
+        if not session or not node:
+            return None
+        # 配图在后台补齐（命中预生成节点时也确保任务存在）
+        image_jobs.ensure(node)
+        # 开始故事永远是第1章
+        return _segment_from_node(node, 1)
+
+
+def _create_start_session(user_id: str, wish: str, log) -> Tuple[int, Optional[schemas.story.StorySegment]]:
+    """创建（或复用）会话并尝试从开局池克隆根节点；返回 (session_id, 池命中时的响应)。"""
+    with session_scope() as db:
+        session = crud.create_game_session(db, wish=wish, user_id=user_id)
+        log.info("start session created" + kv_text(session_id=session.id))
+        node = _clone_opening(db, session.id, wish, log)
+        if node is None:
+            return session.id, None
+        image_jobs.ensure(node)
+        return session.id, _segment_from_node(node, 1)
+
+
+def _save_start_node(session_id: int, raw_data: schemas.story.RawStoryData) -> schemas.story.StorySegment:
+    with session_scope() as db:
+        node = crud.create_story_node(db, session_id=session_id, segment=raw_data)
+        image_jobs.ensure(node)
+        return _segment_from_node(node, 1, raw_data)
+
+
 @router.post("/start", response_model=schemas.story.StorySegment)
 async def start_new_story(
     request: schemas.story.StoryStartRequest,
-    db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """
@@ -428,7 +611,6 @@ async def start_new_story(
 
     Args:
         request: 包含用户重生愿望的请求
-        db: 数据库会话
         current_user: 从JWT获取的当前用户模型
 
     Returns:
@@ -445,6 +627,7 @@ async def start_new_story(
         task="start",
     )
     base_log.info("start request " + kv_text(wish=wish_norm))
+    bind_usage(user_id=user_id)
 
     # 基本验证（愿望应该已通过check_wish校验）
     base_log.debug("start wish validated")
@@ -455,10 +638,8 @@ async def start_new_story(
     
     cached_data = None
     cache_wait_seconds = getattr(settings, "start_cache_wait_seconds", 8)
-    poll_interval = 0.4
-    elapsed = 0.0
 
-    cached_data = _cache_pop(cache_key)
+    cached_data = await asyncio.to_thread(_pop_pregenerated, cache_key)
     if cached_data and cached_data.get("trace"):
         trace = cached_data["trace"]
         base_log = story_logger(
@@ -470,100 +651,54 @@ async def start_new_story(
         base_log.info("start trace resumed")
     base_log.info("start cache first hit" + kv_text(hit=bool(cached_data)))
 
-    while cached_data is None and elapsed < cache_wait_seconds:
-        remaining = cache_wait_seconds - elapsed
-        wait = poll_interval if remaining > poll_interval else remaining
-        base_log.info("start cache wait" + kv_text(wait=wait, elapsed=elapsed, limit=cache_wait_seconds))
-        threading.Event().wait(wait)
-        elapsed += wait
-        cached_data = _cache_pop(cache_key)
+    if cached_data is None and await asyncio.to_thread(_pregeneration_pending, cache_key):
+        # 预生成仍在进行：等待其完成通知，而不是定时轮询缓存
+        base_log.info("start cache wait" + kv_text(limit=cache_wait_seconds))
+        wait_started = time.perf_counter()
+
+        def _pregenerated_ready() -> bool:
+            nonlocal cached_data
+            cached_data = _pop_pregenerated(cache_key)
+            return cached_data is not None or not _pregeneration_pending(cache_key)
+
+        await notify_hub.wait_for(
+            start_key(cache_key), lambda: asyncio.to_thread(_pregenerated_ready), cache_wait_seconds
+        )
+        elapsed = round(time.perf_counter() - wait_started, 3)
         if cached_data:
             base_log.info("start cache success" + kv_text(session_id=cached_data["session_id"], node_id=cached_data["node_id"], elapsed=elapsed))
+        else:
+            base_log.info("start cache wait ended" + kv_text(elapsed=elapsed))
 
+    result = None
+    start_log = base_log
     if cached_data is not None:
         # 使用预生成的session和node
-        session_id = cached_data["session_id"]
-        node_id = cached_data["node_id"]
-        start_log = base_log.bind(session=session_id, node=node_id)
+        start_log = base_log.bind(session=cached_data["session_id"], node=cached_data["node_id"])
         start_log.info("start use pregenerated")
-        
-        session = crud.get_session_by_id(db, session_id)
-        node = crud.get_node_by_id(db, node_id)
-        
-        if not session or not node:
-            start_log.warning("start cache miss objects" + kv_text(session_exists=bool(session), node_exists=bool(node)))
-            # 降级到实时生成
-            start_log.info("start fallback create session")
-            session = crud.create_game_session(db, wish=wish_norm, user_id=user_id)
-            start_log.info("start fallback session created" + kv_text(session_id=session.id))
-            
-            start_log.info("start fallback generate story")
-            raw_data = story_engine.start_story(wish=wish_norm)
-            start_log.info("start fallback story done" + kv_text(text_len=len(raw_data.text)))
-            
-            start_log.info("start fallback save node")
-            node = crud.create_story_node(db, session_id=session.id, segment=raw_data)
-            start_log.info("start fallback node saved" + kv_text(node_id=node.id))
+        result = await asyncio.to_thread(_load_start_node, cached_data["session_id"], cached_data["node_id"])
+        if result is None:
+            start_log.warning("start cache miss objects")
         else:
-            # 使用预生成的节点，无需raw_data
-            start_log.info("start use cached node" + kv_text(session_id=session.id, node_id=node.id))
-            raw_data = None
+            start_log.info("start use cached node" + kv_text(session_id=result.session_id, node_id=result.node_id))
     else:
-        start_log = base_log
         start_log.info("start cache miss -> realtime")
+
+    if result is None:
         # 降级到实时生成
         start_log.info("start realtime create session")
-        session = crud.create_game_session(db, wish=wish_norm, user_id=user_id)
-        start_log = start_log.bind(session=session.id)
-        start_log.info("start realtime session created" + kv_text(session_id=session.id))
-
-        start_log.info("start realtime generate story")
-        raw_data = story_engine.start_story(wish=wish_norm)
-        start_log.info("start realtime story done" + kv_text(text_len=len(raw_data.text)))
-
-        start_log.info("start realtime save node")
-        node = crud.create_story_node(db, session_id=session.id, segment=raw_data)
-        start_log = start_log.bind(node=node.id)
-        start_log.info("start realtime node saved" + kv_text(node_id=node.id))
-
-    # 4. 【逻辑简化】开始故事永远是第1章
-    chapter_number = 1
-
-    # 5. 组合最终响应
-    # 【核心修改】确保 metadata 结构一致
-    if raw_data is not None:
-        # 实时生成的情况，使用raw_data
-        metadata = {
-            **(raw_data.metadata or {}),
-            "chapter_number": chapter_number
-        }
-        choices_payload = [
-            c.model_dump() if hasattr(c, "model_dump") else c
-            for c in (raw_data.choices or [])
-        ]
-        story_text = raw_data.text
-        image_url = raw_data.image_url
-        success_rate = raw_data.success_rate
-    else:
-        # 使用预生成节点的情况，从node获取数据
-        metadata = {
-            **(node.get_metadata() or {}),
-            "chapter_number": chapter_number
-        }
-        choices_payload = node.get_choices() or []
-        story_text = node.story_text  # 修正：使用正确的属性名
-        image_url = node.image_url
-        success_rate = node.success_rate
-    
-    result = schemas.story.StorySegment(
-        session_id=session.id,
-        node_id=node.id,
-        text=story_text,
-        choices=choices_payload,
-        image_url=image_url,
-        success_rate=success_rate,
-        metadata=_sanitize_metadata(metadata),
-    )
+        session_id, result = await asyncio.to_thread(_create_start_session, user_id, wish_norm, start_log)
+        start_log = start_log.bind(session=session_id)
+        bind_usage(session_id=session_id)
+        if result is None:
+            start_log.info("start realtime generate story")
+            raw_data = await story_engine.start_story_async(wish=wish_norm)
+            start_log.info("start realtime story done" + kv_text(text_len=len(raw_data.text)))
+
+            start_log.info("start realtime save node")
+            result = await asyncio.to_thread(_save_start_node, session_id, raw_data)
+        start_log = start_log.bind(node=result.node_id)
+        start_log.info("start realtime node saved" + kv_text(node_id=result.node_id))
 
     start_log = start_log.bind(session=result.session_id, node=result.node_id)
     start_log.info("start done" + kv_text(text_len=len(result.text), choice_count=len(result.choices or []), image=result.image_url))
@@ -576,17 +711,191 @@ async def start_new_story(
         start_log.info("start image file" + kv_text(file_exists=file_exists, size=file_size, path=local_file_path))
 
     # 动态窗口：无论是否命中预生成，都要从“当前节点=第一节”补齐到 max_depth 层
-    start_log.info("start speculation enqueue" + kv_text(depth=settings.speculation_max_depth))
-    with log_context(trace=trace, user=user_id, session=session.id, node=node.id, task="speculation"):
-        speculation_service.enqueue(session.id, node.id, depth=settings.speculation_max_depth)
+    depth = speculation_service.depth_for(user_id)
+    start_log.info("start speculation enqueue" + kv_text(depth=depth))
+    with log_context(trace=trace, user=user_id, session=result.session_id, node=result.node_id, task="speculation"):
+        await asyncio.to_thread(speculation_service.enqueue, result.session_id, result.node_id, depth=depth)
     start_log.info("start response ready" + kv_text(image=result.image_url))
     return result
 
 
+def _load_continue_target(
+    request: schemas.story.StoryContinueRequest,
+    current_user: models.User,
+) -> Tuple[models.GameSession, models.StoryNode, List[Dict[str, str]]]:
+    """
+    校验续写请求：选择非空、会话归属与父节点归属；返回已脱离会话的会话与父节点对象，以及父节点的对话历史。
+    在线程中以独立短会话执行，返回后不再占用连接。
+    """
+    # 验证输入
+    if not request.choice or len(request.choice.strip()) == 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="用户选择不能为空"
+        )
+
+    with session_scope() as db:
+        # 0. 权限与归属校验
+        session = crud.get_session_by_id(db, request.session_id)
+        if not session or session.user_id != current_user.id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="无权访问该游戏会话")
+
+        # 校验节点是否属于该会话
+        parent_node = crud.get_node_by_id(db, request.node_id)
+        if not parent_node or parent_node.session_id != request.session_id:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="节点不存在或不属于该会话")
+
+        # 1. 构建从根到当前父节点的路径历史
+        story_history = build_story_history(db, parent_node)
+        db.expunge(session)
+        db.expunge(parent_node)
+    return session, parent_node, story_history
+
+
+def _take_ready_child(
+    request: schemas.story.StoryContinueRequest,
+    parent_node: models.StoryNode,
+    user_id: str,
+) -> Optional[int]:
+    """取同父节点、同选择的已有子节点（预推演节点就地转正），返回其ID；不存在返回 None。"""
+    with session_scope() as db:
+        # 幂等性检查：是否已经存在同父节点、同选择的子节点（处理双击/并发重放）
+        existing_child = crud.get_child_by_parent_and_choice(
+            db, request.session_id, request.node_id, request.choice.strip()
+        )
+        if existing_child is None:
+            return None
+        if existing_child.is_speculative:
+            existing_child = crud.finalize_speculative_node(db, existing_child)
+            speculation_service.record_hit(existing_child)
+            # 选择在此真正提交（重放与重试命中的是已转正的节点，不计入）：思考时间与位置偏好决定后续预推演
+            speculation_service.observe_choice(user_id, parent_node, request.choice.strip())
+        # 预推演节点被选中：其配图任务提升为交互优先级
+        image_jobs.ensure(existing_child)
+        return existing_child.id
+
+
+async def _find_ready_child(
+    request: schemas.story.StoryContinueRequest,
+    parent_node: models.StoryNode,
+    user_id: str,
+) -> Optional[int]:
+    """返回同父节点、同选择的已有子节点ID（必要时等待推演完成并转正），不存在则返回 None。"""
+    # 选择一经提交，立即取消其余兄弟分支的预推演，把额度留给玩家实际所在的路径
+    await asyncio.to_thread(speculation_service.commit_choice, request.session_id, request.node_id, request.choice.strip())
+
+    # 竞态保护：如果该选项正在生成中，等待其完成通知（对用户无感）
+    choice = request.choice.strip()
+
+    async def _choice_settled() -> bool:
+        generating = await asyncio.to_thread(
+            speculation_service.is_choice_generating, request.session_id, request.node_id, choice
+        )
+        return not generating
+
+    finished = await notify_hub.wait_for(
+        choice_key(request.session_id, request.node_id, choice),
+        _choice_settled,
+        settings.speculation_choice_wait_seconds,
+    )
+    if not finished:
+        LOGGER.warning(
+            f"[Continue] 等待预推演超时，转为实时生成 | session={request.session_id} | parent={request.node_id} | choice={choice}"
+        )
+
+    # 动态窗口：不做过期清理，保留可复用的预推演缓存
+    return await asyncio.to_thread(_take_ready_child, request, parent_node, user_id)
+
+
+def _existing_child_payload(request: schemas.story.StoryContinueRequest, child_id: int) -> schemas.story.StorySegment:
+    # 等待结束后重新读取，带上期间回写的配图
+    with session_scope() as db:
+        node = crud.get_node_by_id(db, child_id)
+        chapter_number = crud.calculate_chapter_number(db, request.session_id, child_id)
+        return _segment_from_node(node, chapter_number, source="continue")
+
+
+async def _existing_child_segment(
+    request: schemas.story.StoryContinueRequest,
+    child_id: int,
+    base_log,
+    trace: str,
+    user_id: str,
+) -> schemas.story.StorySegment:
+    # 【节点完整性检查】确保用户选择的节点(故事+图片)都完全准备好了
+    child_log = base_log.bind(node=child_id)
+    child_log.info("continue node ready check")
+
+    if await _wait_for_node_complete(child_id):
+        child_log.info("continue node ready success")
+    else:
+        child_log.warning("continue node ready timeout")
+
+    segment = await asyncio.to_thread(_existing_child_payload, request, child_id)
+    # 补齐以“当前节点=已选择的子节点”为锚的 max_depth 窗口
+    depth = speculation_service.depth_for(user_id)
+    child_log.info("continue speculation enqueue existing" + kv_text(depth=depth))
+    with log_context(trace=trace, user=user_id, session=request.session_id, node=child_id, task="speculation"):
+        await asyncio.to_thread(speculation_service.enqueue, request.session_id, child_id, depth=depth)
+    return segment
+
+
+def _persist_continue_child(
+    request: schemas.story.StoryContinueRequest,
+    raw_data: schemas.story.RawStoryData,
+    parent_node: models.StoryNode,
+    user_id: str,
+) -> schemas.story.StorySegment:
+    """创建新的故事节点并组合响应（独立短会话内执行：加锁 -> 二次检查 -> 插入/flush -> 提交）"""
+    with session_scope() as db:
+        try:
+            # 使用会话的自动事务，避免显式 begin() 导致“已存在事务”的错误
+            # 在支持的数据库上锁定父节点，缩短锁时间窗口
+            _ = crud.lock_node_for_update(db, request.node_id)
+            # 再次检查是否已被并发请求创建（双重校验）
+            concurrent_child = crud.get_child_by_parent_and_choice(
+                db, request.session_id, request.node_id, request.choice.strip()
+            )
+            if concurrent_child:
+                new_node = concurrent_child
+            else:
+                new_node = crud.create_story_node(
+                    db,
+                    session_id=request.session_id,
+                    segment=raw_data,
+                    parent_id=request.node_id,
+                    user_choice=request.choice.strip(),
+                    commit=False,
+                )
+            # 明确提交事务
+            db.commit()
+            created = not concurrent_child
+        except IntegrityError:
+            # 可能在提交时触发唯一约束，说明并发请求已创建相同子节点
+            db.rollback()
+            new_node = crud.get_child_by_parent_and_choice(
+                db, request.session_id, request.node_id, request.choice.strip()
+            )
+            if not new_node:
+                raise
+            created = False
+        if created:
+            # 选择在此真正提交（并发重放复用已有节点，不计入）
+            speculation_service.observe_choice(user_id, parent_node, request.choice.strip())
+        image_jobs.ensure(new_node)
+
+        # 【核心修改】在这里调用一次 calculate_chapter_number 即可
+        chapter_number = crud.calculate_chapter_number(db, request.session_id, new_node.id)
+        return _segment_from_node(new_node, chapter_number, raw_data)
+
+
+def _sse_event(event: str, payload: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
 @router.post("/continue", response_model=schemas.story.StorySegment)
 async def continue_existing_story(
     request: schemas.story.StoryContinueRequest,
-    db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """
@@ -594,7 +903,6 @@ async def continue_existing_story(
 
     Args:
         request: 包含session_id、node_id和用户选择的请求
-        db: 数据库会话
 
     Returns:
         StorySegment: 包含新故事文本、选择选项和图片的响应
@@ -608,79 +916,24 @@ async def continue_existing_story(
         task="continue",
     )
     base_log.info("continue request" + kv_text(choice=request.choice))
+    bind_usage(user_id=current_user.id, session_id=request.session_id)
 
-    # 验证输入
-    if not request.choice or len(request.choice.strip()) == 0:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="用户选择不能为空"
-        )
-
-    # 0. 权限与归属校验
-    session = crud.get_session_by_id(db, request.session_id)
-    if not session or session.user_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="无权访问该游戏会话")
-
-    # 校验节点是否属于该会话
-    parent_node = crud.get_node_by_id(db, request.node_id)
-    if not parent_node or parent_node.session_id != request.session_id:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="节点不存在或不属于该会话")
-
+    # 1. 校验并构建从根到当前父节点的路径历史
+    session, parent_node, story_history = await asyncio.to_thread(_load_continue_target, request, current_user)
     base_log = base_log.bind(session=session.id, node=parent_node.id)
-
-    # 1. 构建从根到当前父节点的路径历史
-    story_history = build_story_history(db, parent_node)
     parent_chapter = extract_chapter_number(parent_node)
     current_success_rate = parent_node.success_rate
     
     # success_rate可能为None（隐藏数值），这是正常的
 
-    # 竞态保护：如果该选项正在生成中，等待其完成（对用户无感）
-    wait_interval = 0.3
-    while speculation_service.is_choice_generating(request.session_id, request.node_id, request.choice.strip()):
-        import time
-        time.sleep(wait_interval)
-
-    # 动态窗口：不做过期清理，保留可复用的预推演缓存
-
-    # 2. 幂等性检查：是否已经存在同父节点、同选择的子节点（处理双击/并发重放）
-    existing_child = crud.get_child_by_parent_and_choice(
-        db, request.session_id, request.node_id, request.choice.strip()
-    )
-    if existing_child:
-        if existing_child.is_speculative:
-            existing_child = crud.finalize_speculative_node(db, existing_child)
-        
-        # 【节点完整性检查】确保用户选择的节点(故事+图片)都完全准备好了
-        child_log = base_log.bind(node=existing_child.id)
-        child_log.info("continue node ready check")
-
-        if _wait_for_node_complete(existing_child, db):
-            child_log.info("continue node ready success")
-        else:
-            child_log.warning("continue node ready timeout")
-
-        chapter_number = crud.calculate_chapter_number(db, request.session_id, existing_child.id)
-        metadata = existing_child.get_metadata() or {}
-        metadata.update({"source": "continue", "chapter_number": chapter_number})
-        metadata = _sanitize_metadata(metadata)
-        # 补齐以“当前节点=已选择的子节点”为锚的 max_depth 窗口
-        child_log.info("continue speculation enqueue existing" + kv_text(depth=settings.speculation_max_depth))
-        with log_context(trace=trace, user=current_user.id, session=request.session_id, node=existing_child.id, task="speculation"):
-            speculation_service.enqueue(request.session_id, existing_child.id, depth=settings.speculation_max_depth)
-        return schemas.story.StorySegment(
-            session_id=request.session_id,
-            node_id=existing_child.id,
-            text=existing_child.story_text,
-            choices=existing_child.get_choices(),
-            image_url=existing_child.image_url,
-            success_rate=existing_child.success_rate,
-            metadata=metadata,
-        )
+    # 2. 已存在的子节点（预推演命中或并发重放）直接返回
+    existing_child_id = await _find_ready_child(request, parent_node, current_user.id)
+    if existing_child_id is not None:
+        return await _existing_child_segment(request, existing_child_id, base_log, trace, current_user.id)
 
     # 2b. 调用引擎生成下一段故事 (返回RawStoryData) — 在事务之外执行，避免长事务
     base_log.info("continue generate child" + kv_text(choice=request.choice.strip()))
-    raw_data = story_engine.continue_story(
+    raw_data = await story_engine.continue_story_async(
         wish=session.wish,
         story_history=story_history,
         choice=request.choice.strip(),
@@ -689,73 +942,105 @@ async def continue_existing_story(
         parent_metadata=parent_node.get_metadata(),
     )
 
-    # 3. 创建新的故事节点（短事务内执行：加锁 -> 二次检查 -> 插入/flush -> 提交）
-    try:
-        # 使用会话的自动事务，避免显式 begin() 导致“已存在事务”的错误
-        # 3a. 在支持的数据库上锁定父节点，缩短锁时间窗口
-        _ = crud.lock_node_for_update(db, request.node_id)
-        # 3b. 再次检查是否已被并发请求创建（双重校验）
-        concurrent_child = crud.get_child_by_parent_and_choice(
-            db, request.session_id, request.node_id, request.choice.strip()
-        )
-        if concurrent_child:
-            new_node = concurrent_child
-        else:
-            new_node = crud.create_story_node(
-                db,
-                session_id=request.session_id,
-                segment=raw_data,
-                parent_id=request.node_id,
-                user_choice=request.choice.strip(),
-                commit=False,
-            )
-        # 明确提交事务
-        db.commit()
-    except IntegrityError:
-        # 可能在提交时触发唯一约束，说明并发请求已创建相同子节点
-        db.rollback()
-        new_node = crud.get_child_by_parent_and_choice(
-            db, request.session_id, request.node_id, request.choice.strip()
-        )
-        if not new_node:
-            raise
-
-    new_log = base_log.bind(node=new_node.id)
+    # 3. 创建新的故事节点并组合响应
+    result = await asyncio.to_thread(_persist_continue_child, request, raw_data, parent_node, current_user.id)
+    new_log = base_log.bind(node=result.node_id)
     new_log.info("continue node created" + kv_text(parent=request.node_id))
 
-    # 4. 【核心修改】在这里调用一次 calculate_chapter_number 即可
-    chapter_number = crud.calculate_chapter_number(db, request.session_id, new_node.id)
+    new_log.info("continue response ready" + kv_text(text_len=len(raw_data.text), choices=len(result.choices)))
+    depth = speculation_service.depth_for(current_user.id)
+    new_log.info("continue speculation enqueue new" + kv_text(depth=depth))
+    with log_context(trace=trace, user=current_user.id, session=request.session_id, node=result.node_id, task="speculation"):
+        await asyncio.to_thread(speculation_service.enqueue, request.session_id, result.node_id, depth=depth)
+    return result
 
-    # 5. 组合响应
-    metadata = {
-        **(raw_data.metadata or {}),
-        "chapter_number": chapter_number
-    }
-    # 将 ChoiceOption 实例转换为字典，避免 Pydantic 类型身份不一致导致的校验错误
-    choices_payload = [
-        c.model_dump() if hasattr(c, "model_dump") else c
-        for c in (raw_data.choices or [])
-    ]
-    result = schemas.story.StorySegment(
+
+@router.post("/continue/stream")
+async def continue_existing_story_stream(
+    request: schemas.story.StoryContinueRequest,
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    继续现有故事（SSE 流式版本）
+
+    事件序列：
+    - text:   {"delta": 正文增量}，可直接拼接展示
+    - choice: {"index", "option", "summary"}，每个选项生成完毕即推送
+    - node:   与 /continue 相同结构的 StorySegment，节点落库后推送，标志本次流结束
+    - error:  {"detail": 错误说明}
+    命中已存在的子节点（预推演缓存）时直接推送 node 事件。
+    """
+    trace = make_trace_id()
+    base_log = story_logger(
+        trace=trace,
+        user_id=current_user.id,
         session_id=request.session_id,
-        node_id=new_node.id,
-        text=raw_data.text,
-        choices=choices_payload,
-        image_url=raw_data.image_url,
-        success_rate=raw_data.success_rate,
-        metadata=_sanitize_metadata(metadata)
+        node_id=request.node_id,
+        task="continue_stream",
     )
+    base_log.info("continue stream request" + kv_text(choice=request.choice))
+    bind_usage(user_id=current_user.id, session_id=request.session_id)
 
-    new_log.info("continue response ready" + kv_text(text_len=len(raw_data.text), choices=len(choices_payload)))
-    new_log.info("continue speculation enqueue new" + kv_text(depth=settings.speculation_max_depth))
-    with log_context(trace=trace, user=current_user.id, session=request.session_id, node=new_node.id, task="speculation"):
-        speculation_service.enqueue(request.session_id, new_node.id, depth=settings.speculation_max_depth)
-    return result
+    # 校验与历史构建在建立流之前完成，错误仍以 HTTP 状态码返回
+    session, parent_node, story_history = await asyncio.to_thread(_load_continue_target, request, current_user)
+    base_log = base_log.bind(session=session.id, node=parent_node.id)
+
+    existing_child_id = await _find_ready_child(request, parent_node, current_user.id)
+    if existing_child_id is not None:
+        segment = await _existing_child_segment(request, existing_child_id, base_log, trace, current_user.id)
+
+        async def _replay():
+            yield _sse_event("node", segment.model_dump())
+
+        return StreamingResponse(_replay(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+    engine_kwargs = dict(
+        wish=session.wish,
+        story_history=story_history,
+        choice=request.choice.strip(),
+        chapter_number=extract_chapter_number(parent_node),
+        current_success_rate=parent_node.success_rate,
+        parent_metadata=parent_node.get_metadata(),
+    )
+    user_id = current_user.id
+
+    async def _events():
+        raw_data = None
+        try:
+            base_log.info("continue stream generate child" + kv_text(choice=request.choice.strip()))
+            async for kind, payload in story_engine.continue_story_stream(**engine_kwargs):
+                if kind == "text":
+                    yield _sse_event("text", {"delta": payload})
+                elif kind == "choice":
+                    yield _sse_event("choice", payload)
+                elif kind == "done":
+                    raw_data = payload
+        except Exception as e:
+            base_log.error("continue stream generate failed" + kv_text(error=str(e)))
+            yield _sse_event("error", {"detail": "故事生成失败，请重试"})
+            return
+
+        try:
+            segment = await asyncio.to_thread(_persist_continue_child, request, raw_data, parent_node, user_id)
+        except Exception as e:
+            base_log.error("continue stream persist failed" + kv_text(error=str(e)))
+            yield _sse_event("error", {"detail": "故事保存失败，请重试"})
+            return
+        new_log = base_log.bind(node=segment.node_id)
+        new_log.info("continue stream node created" + kv_text(parent=request.node_id))
+
+        yield _sse_event("node", segment.model_dump())
+        depth = speculation_service.depth_for(user_id)
+        new_log.info("continue stream speculation enqueue new" + kv_text(depth=depth))
+        with log_context(trace=trace, user=user_id, session=request.session_id, node=segment.node_id, task="speculation"):
+            await asyncio.to_thread(speculation_service.enqueue, request.session_id, segment.node_id, depth=depth)
+
+    return StreamingResponse(_events(), media_type="text/event-stream", headers=_SSE_HEADERS)
 
 
 # 【核心修改】修改 /retry 端点的函数签名和请求处理
 @router.post("/retry", response_model=schemas.story.StorySegment)
-async def retry_from_node(
+def retry_from_node(
     request: schemas.story.StoryRetryRequest,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -807,10 +1092,31 @@ async def retry_from_node(
         raise HTTPException(status_code=500, detail="时空回溯时发生未知错误")
 
 
+@router.get("/nodes/{node_id}/image", response_model=schemas.story.NodeImageStatus)
+def get_node_image_status(
+    node_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """查询节点配图状态，供前端在 metadata.image.status 为 pending 时轮询"""
+    node = crud.get_node_by_id(db, node_id)
+    if not node:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="节点不存在")
+    session = crud.get_session_by_id(db, node.session_id)
+    if not session or session.user_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="无权访问该节点")
+
+    image_status = node_image_status(node)
+    if image_status == IMAGE_STATUS_PENDING:
+        # 进程重启后队列丢失时重新登记
+        image_jobs.ensure(node)
+    return schemas.story.NodeImageStatus(node_id=node.id, status=image_status, image_url=node.image_url)
+
+
 # --- 重生编年史 (Chronicle) API ---
 
 @router.get("/sessions/{session_id}/latest", response_model=schemas.story.StorySegment)
-async def get_latest_node_for_session(
+def get_latest_node_for_session(
     session_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -843,7 +1149,7 @@ async def get_latest_node_for_session(
     return segment
 
 @router.get("/sessions", response_model=List[schemas.story.GameSessionSummary])
-async def get_user_sessions(
+def get_user_sessions(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
@@ -852,7 +1158,7 @@ async def get_user_sessions(
     return sessions
 
 @router.get("/latest", response_model=schemas.story.StorySegment)
-async def get_user_latest_node(
+def get_user_latest_node(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
@@ -881,7 +1187,7 @@ async def get_user_latest_node(
     return segment
 
 @router.get("/sessions/{session_id}", response_model=schemas.story.GameSessionDetail)
-async def get_session_details(
+def get_session_details(
     session_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -915,7 +1221,7 @@ async def get_session_details(
 
 
 @router.post("/saves", response_model=schemas.story.StorySaveDetail)
-async def create_story_save_endpoint(
+def create_story_save_endpoint(
     request: schemas.story.StorySaveCreate,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -936,7 +1242,7 @@ async def create_story_save_endpoint(
 
 
 @router.get("/saves", response_model=List[schemas.story.StorySaveSummary])
-async def list_story_saves_endpoint(
+def list_story_saves_endpoint(
     status_filter: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -961,7 +1267,7 @@ async def list_story_saves_endpoint(
 
 
 @router.get("/saves/{save_id}", response_model=schemas.story.StorySaveDetail)
-async def get_story_save_detail_endpoint(
+def get_story_save_detail_endpoint(
     save_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -973,7 +1279,7 @@ async def get_story_save_detail_endpoint(
 
 
 @router.patch("/saves/{save_id}", response_model=schemas.story.StorySaveDetail)
-async def update_story_save_endpoint(
+def update_story_save_endpoint(
     save_id: int,
     request: schemas.story.StorySaveUpdate,
     db: Session = Depends(get_db),
@@ -995,7 +1301,7 @@ async def update_story_save_endpoint(
 
 
 @router.delete("/saves/{save_id}", response_model=schemas.story.StorySaveSummary)
-async def delete_story_save_endpoint(
+def delete_story_save_endpoint(
     save_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -1031,22 +1337,89 @@ async def health_check():
 
 @router.get("/metrics")
 async def get_metrics():
-    """返回服务端关键运行指标（LLM 与 推演服务）。"""
+    """返回服务端关键运行指标（LLM、推演服务与后台配图）。"""
     try:
         from core.llm_clients import llm_client
         llm_metrics = getattr(llm_client, "get_metrics", lambda: {} )()
     except Exception as e:  # noqa: BLE001
         llm_metrics = {"error": str(e)}
 
+    try:
+        llm_async_metrics = async_llm_client.get_metrics()
+    except Exception as e:  # noqa: BLE001
+        llm_async_metrics = {"error": str(e)}
+
     try:
         spec_metrics = speculation_get_metrics()
     except Exception as e:  # noqa: BLE001
         spec_metrics = {"error": str(e)}
 
+    try:
+        image_metrics = image_jobs.get_metrics()
+    except Exception as e:  # noqa: BLE001
+        image_metrics = {"error": str(e)}
+
     return {
         "llm": llm_metrics,
+        "llm_async": llm_async_metrics,
         "speculation": spec_metrics,
+        "image_jobs": image_metrics,
+        "notify": notify_hub.get_metrics(),
+        "llm_cache": llm_cache.get_metrics(),
+        "opening_pool": opening_pool.get_metrics(),
+        "llm_providers": provider_guard_metrics(),
+        "history": history_compactor.get_metrics(),
+        "llm_usage": usage_tracker.get_metrics(),
+        "node_gc": node_gc.get_metrics(),
     }
 
 
+@router.get("/metrics/usage")
+def get_usage_metrics(
+    hours: int = 24,
+    user_id: Optional[str] = None,
+    session_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    当前用户的 token 用量与成本：进程内累计值 + 数据库中最近 hours 小时（所有 worker）的汇总，
+    含按调用点/流量类别的分布与每个正式节点的平均 token 成本；可按本人的 session_id 过滤。
+    数据库部分由后台线程按 llm_usage_flush_seconds 刷新，最多滞后一个刷新周期。
+    """
+    if user_id and user_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="无权查看其他用户的用量")
+    if session_id:
+        _ensure_session_ownership(crud.get_session_by_id(db, session_id), current_user.id)
+    hours = min(max(1, hours), 24 * 90)
+    live = {"user": usage_tracker.user_usage(current_user.id)}
+    if session_id:
+        live["session"] = usage_tracker.session_usage(session_id)
+    try:
+        stored = crud.summarize_llm_usage(
+            db, hours, user_id=current_user.id, session_id=session_id, include_user_ids=False
+        )
+    except Exception as e:  # noqa: BLE001
+        db.rollback()
+        stored = {"error": str(e)}
+    return {"process": live, "window": stored}
+
+
+@router.get("/metrics/speculation")
+def get_speculation_metrics(hours: int = 24, db: Session = Depends(get_db)):
+    """
+    预推演命中率与浪费：进程内累计值 + 数据库中最近 hours 小时生成的预推演节点的结局
+    （命中/放弃/待定，按层级与选项序号分组），用于调整 speculation_max_depth 与 speculation_level_cap。
+    """
+    hours = min(max(1, hours), 24 * 90)
+    try:
+        stored = crud.summarize_speculation_outcomes(
+            db, hours, max(1, int(settings.speculation_abandon_after_minutes))
+        )
+    except Exception as e:  # noqa: BLE001
+        db.rollback()
+        stored = {"error": str(e)}
+    return {"process": speculation_get_metrics(), "window": stored}
+
+
 # 注意：异常处理器应该在主应用中定义，不是在路由器中
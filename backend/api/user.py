@@ -51,12 +51,13 @@ def _issue_access_token(response: Response, user: models.User) -> Tuple[str, int
     return access_token, expires_seconds
 
 # --- 安全依赖 ---
-async def get_current_user(
+def get_current_user(
     request: Request, db: Session = Depends(get_db)
 ) -> models.User:
     """
     解码Token，验证用户，并返回用户模型实例
     这是一个可重用的依赖，用于保护需要认证的接口
+    同步依赖由 FastAPI 在线程池中执行；返回前归还连接，异步路由在等待模型调用期间不占用连接池。
     """
     credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="无法验证凭证")
     
@@ -71,6 +72,9 @@ async def get_current_user(
     # 校验token版本，若不一致说明该账号已在其他地方登录，当前token失效
     if token_data.ver is None or user.token_version is None or int(token_data.ver) != int(user.token_version):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="登录状态已失效：你的账号在其他位置登录，当前会话已登出")
+    # 只读事务到此结束：脱离会话后属性仍可读，需要写回的路由可重新 db.add(user)
+    db.expunge(user)
+    db.rollback()
     return user
 
 # --- 认证接口 ---
@@ -0,0 +1,158 @@
+"""
+选项热度模型
+玩家在三个选项间并不均匀地选择。这里用玩家实际提交的选择（/continue）在线估计每个候选分支被选中的概率：
+- 位置先验：在 n 个选项中选中第 i 个的频率（拉普拉斯平滑）；给出玩家自身的位置计数时，
+  以全局频率为先验（_PERSONAL_PRIOR 个伪计数）与玩家计数混合，样本越多越贴近玩家自身的偏好；
+- 标签提升：选项 effects.tags（节点 metadata.chapter.hidden_effects_map）中每个标签的被选率相对整体被选率的倍数，
+  以伪计数向 1 收缩，样本少的标签几乎不起作用；多个标签取对数平均；
+- 候选分支得分 = 位置先验 × 标签提升，在兄弟之间归一化为概率。
+进程启动后首次使用时从最近的正式节点回放若干条选择作为冷启动数据。
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence
+
+from config.logging_config import LOGGER
+from config.settings import settings
+
+# 标签被选率的伪计数（向整体被选率收缩的强度）
+_TAG_PRIOR = 5.0
+# 玩家位置偏好向全局位置频率收缩的伪计数
+_PERSONAL_PRIOR = 5.0
+
+
+def option_tags(node_metadata: Optional[dict], options: Sequence[Optional[str]]) -> List[List[str]]:
+    """按选项顺序取出各选项的 effects.tags（缺失时为空列表）。"""
+    chapter = (node_metadata or {}).get("chapter") if isinstance(node_metadata, dict) else None
+    effects_map = chapter.get("hidden_effects_map") if isinstance(chapter, dict) else None
+    result: List[List[str]] = []
+    for option in options:
+        effects = effects_map.get(option) if isinstance(effects_map, dict) and option else None
+        tags = effects.get("tags") if isinstance(effects, dict) else None
+        result.append([str(tag) for tag in tags if tag] if isinstance(tags, list) else [])
+    return result
+
+
+class ChoicePopularityModel:
+    """按位置与标签在线统计选择频率，给候选分支打分。"""
+
+    def __init__(self) -> None:
+        self.warm_start_limit = max(0, int(getattr(settings, "speculation_choice_model_warm_start", 5000)))
+        self._lock = threading.Lock()
+        self._decisions: Dict[int, int] = defaultdict(int)  # 选项数 n -> 决策次数
+        self._position_chosen: Dict[tuple[int, int], int] = defaultdict(int)  # (n, i) -> 被选次数
+        self._tag_shown: Dict[str, int] = defaultdict(int)
+        self._tag_chosen: Dict[str, int] = defaultdict(int)
+        self._options_shown = 0
+        self._warm_started = False
+
+        # --- Metrics ---
+        self.observed_total = 0
+        self.warm_start_rows = 0
+        self.scored_total = 0
+
+    def observe(self, choice_index: Optional[int], tags: List[List[str]]) -> None:
+        """玩家在 len(tags) 个选项中选择了第 choice_index 个。"""
+        option_count = len(tags)
+        if choice_index is None or not 0 <= choice_index < option_count:
+            return
+        with self._lock:
+            self._observe(choice_index, tags)
+            self.observed_total += 1
+
+    def probabilities(self, tags: List[List[str]], position_counts: Optional[List[int]] = None) -> List[float]:
+        """各候选分支（按选项顺序）被选中的概率，和为 1；position_counts 为玩家在各位置上的历史选择次数。"""
+        option_count = len(tags)
+        if option_count == 0:
+            return []
+        self._ensure_warm_start()
+        with self._lock:
+            self.scored_total += 1
+            decisions = self._decisions.get(option_count, 0)
+            base_rate = (sum(self._decisions.values()) / self._options_shown) if self._options_shown else 1.0 / option_count
+            personal = list(position_counts or [])[:option_count]
+            personal += [0] * (option_count - len(personal))
+            personal_total = sum(personal)
+            scores = []
+            for index, labels in enumerate(tags):
+                prior = (self._position_chosen.get((option_count, index), 0) + 1) / (decisions + option_count)
+                if personal_total:
+                    prior = (personal[index] + _PERSONAL_PRIOR * prior) / (personal_total + _PERSONAL_PRIOR)
+                scores.append(prior * self._tag_lift(labels, base_rate))
+        total = sum(scores)
+        return [score / total for score in scores] if total > 0 else [1.0 / option_count] * option_count
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            position_rates = {}
+            for (option_count, index), chosen in sorted(self._position_chosen.items()):
+                decisions = self._decisions.get(option_count, 0)
+                if decisions:
+                    position_rates[f"{option_count}:{index}"] = round(chosen / decisions, 3)
+            base_rate = (sum(self._decisions.values()) / self._options_shown) if self._options_shown else None
+            top_tags = sorted(
+                (tag for tag in self._tag_shown if self._tag_shown[tag] >= _TAG_PRIOR),
+                key=lambda tag: -self._tag_shown[tag],
+            )[:10]
+            return {
+                "observed_total": self.observed_total,
+                "warm_start_rows": self.warm_start_rows,
+                "scored_total": self.scored_total,
+                "position_rates": position_rates,
+                "tag_lift": {tag: round(self._tag_lift([tag], base_rate), 3) for tag in top_tags} if base_rate else {},
+            }
+
+    # --- internal ---
+
+    def _observe(self, choice_index: int, tags: List[List[str]]) -> None:
+        # 调用方已持有 _lock
+        option_count = len(tags)
+        self._decisions[option_count] += 1
+        self._position_chosen[(option_count, choice_index)] += 1
+        self._options_shown += option_count
+        for index, labels in enumerate(tags):
+            for tag in set(labels):
+                self._tag_shown[tag] += 1
+                if index == choice_index:
+                    self._tag_chosen[tag] += 1
+
+    def _tag_lift(self, labels: List[str], base_rate: float) -> float:
+        # 调用方已持有 _lock
+        if not labels or base_rate <= 0:
+            return 1.0
+        logs = []
+        for tag in set(labels):
+            rate = (self._tag_chosen.get(tag, 0) + _TAG_PRIOR * base_rate) / (self._tag_shown.get(tag, 0) + _TAG_PRIOR)
+            logs.append(math.log(max(rate, 1e-6) / base_rate))
+        return math.exp(sum(logs) / len(logs))
+
+    def _ensure_warm_start(self) -> None:
+        with self._lock:
+            if self._warm_started:
+                return
+            self._warm_started = True
+        if self.warm_start_limit <= 0:
+            return
+        from database.base import session_scope
+        from database import crud
+
+        try:
+            with session_scope() as db:
+                rows = crud.list_recent_committed_choices(db, self.warm_start_limit)
+        except Exception as exc:  # noqa: BLE001
+            LOGGER.warning(f"[ChoiceModel] 冷启动数据读取失败 | error={exc}")
+            return
+        with self._lock:
+            for row in rows:
+                options = [item.get("option") or item.get("text") for item in row["choices"]]
+                if row["user_choice"] in options:
+                    self._observe(options.index(row["user_choice"]), option_tags(row["metadata"], options))
+                    self.warm_start_rows += 1
+        LOGGER.info(f"[ChoiceModel] 冷启动完成 | rows={self.warm_start_rows}")
+
+
+choice_model = ChoicePopularityModel()
@@ -5,7 +5,7 @@
 """
 from typing import Tuple, Optional, List, Dict
 import logging
-from .llm_clients import llm_client
+from .llm_clients import llm_client, async_llm_client
 
 # 基础违禁词表（示例，可扩展）
 BASIC_BANNED_WORDS: Dict[str, List[str]] = {
@@ -36,6 +36,36 @@ def check_wish_safety(wish: str) -> Tuple[bool, Optional[Dict[str, str]]]:
     return True, None
 
 
+def _build_wish_llm_prompt(text: str) -> str:
+    # LLM校验提示词：专门优化为快速判断
+    return f"""判断以下重生愿望是否合适。只能回答'true'或'false'，不要任何解释。
+
+合适标准：积极正面，不涉及违法犯罪、仇恨歧视、色情暴力、自伤他伤等内容。
+
+愿望：{text}
+
+回答（只能是true或false）："""
+
+
+def _is_decisive_wish_llm_response(response: str) -> bool:
+    # 只缓存明确给出 true/false 的判定，异常输出下次仍请求模型
+    result = str(response).strip().lower()
+    return "true" in result or "false" in result
+
+
+def _interpret_wish_llm_response(response: str) -> Tuple[bool, Optional[str]]:
+    result = str(response).strip().lower()
+
+    if "true" in result:
+        return True, None
+    elif "false" in result:
+        return False, "愿望内容不合适，请重新输入"
+    else:
+        # LLM输出异常，默认通过基础校验
+        logging.warning(f"LLM愿望校验输出异常: {response}")
+        return True, None
+
+
 def check_wish_safety_llm(wish: str) -> Tuple[bool, Optional[str]]:
     """使用LLM进行高级愿望校验，仅返回通过/不通过。
     专门优化为快速响应，只输出true/false。
@@ -49,14 +79,7 @@ def check_wish_safety_llm(wish: str) -> Tuple[bool, Optional[str]]:
     if not basic_ok:
         return False, basic_info.get("reason", "不合适的愿望")
     
-    # LLM校验提示词：专门优化为快速判断
-    prompt = f"""判断以下重生愿望是否合适。只能回答'true'或'false'，不要任何解释。
-
-合适标准：积极正面，不涉及违法犯罪、仇恨歧视、色情暴力、自伤他伤等内容。
-
-愿望：{text}
-
-回答（只能是true或false）："""
+    prompt = _build_wish_llm_prompt(text)
     
     try:
         # 使用最小token数和低温度快速判断
@@ -64,20 +87,43 @@ def check_wish_safety_llm(wish: str) -> Tuple[bool, Optional[str]]:
             prompt, 
             history=None,
             temperature=0.1,
-            max_tokens=10  # 只需要输出true/false
+            max_tokens=10,  # 只需要输出true/false
+            cache_site="wish_moderation",
+            cache_validate=_is_decisive_wish_llm_response,
+            usage_site="moderation",
         )
-        result = str(response).strip().lower()
-        
-        if "true" in result:
-            return True, None
-        elif "false" in result:
-            return False, "愿望内容不合适，请重新输入"
-        else:
-            # LLM输出异常，默认通过基础校验
-            logging.warning(f"LLM愿望校验输出异常: {response}")
-            return True, None
+        return _interpret_wish_llm_response(response)
             
     except Exception as e:
         # LLM服务异常，回退到基础校验
         logging.error(f"LLM愿望校验失败: {e}")
         return True, None
+
+
+async def check_wish_safety_llm_async(wish: str) -> Tuple[bool, Optional[str]]:
+    """check_wish_safety_llm 的异步版本，供 async 路由使用。"""
+    text = (wish or "").strip()
+    if not text:
+        return False, "愿望不能为空"
+
+    basic_ok, basic_info = check_wish_safety(text)
+    if not basic_ok:
+        return False, basic_info.get("reason", "不合适的愿望")
+
+    prompt = _build_wish_llm_prompt(text)
+
+    try:
+        response = await async_llm_client.generate(
+            prompt,
+            history=None,
+            temperature=0.1,
+            max_tokens=10,
+            cache_site="wish_moderation",
+            cache_validate=_is_decisive_wish_llm_response,
+            usage_site="moderation",
+        )
+        return _interpret_wish_llm_response(response)
+
+    except Exception as e:
+        logging.error(f"LLM愿望校验失败: {e}")
+        return True, None
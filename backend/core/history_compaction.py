@@ -0,0 +1,225 @@
+"""
+长会话历史压缩
+续写时发送的对话历史随节点数线性增长。这里只保留最近 history_keep_recent_nodes 个节点原文，
+更早的节点替换为一条「前情提要」：
+- 滚动摘要缓存在被摘要覆盖的最后一个节点的 metadata.history_summary 中（{"covered": 覆盖节点数, "text": 摘要}），
+  同一前缀的所有分支共享；
+- 构建历史时绝不同步调用模型：取路径上最深的已缓存摘要，其后尚未覆盖的节点用抽取式摘要补齐，
+  再提交后台任务把这些节点增量合并进新的滚动摘要；
+- 发送前按 history_token_budget 估算 token 数，超出时从最早的原文开始裁剪。
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from config.logging_config import LOGGER
+from config.settings import settings
+
+from . import prompt_templates
+from .json_repair import repair_json
+from .llm_usage import estimate_tokens
+
+SUMMARY_PREFIX = "【前情提要】"
+
+SUMMARY_SYSTEM_PREAMBLE = (
+    "你是JSON生成器。严格只输出一个JSON对象，不含Markdown或多余文字。"
+    "只允许输出 summary 这一个键。"
+)
+
+# 抽取式摘要中每个节点保留的正文字数
+_EXTRACT_CHARS = 60
+
+
+def history_tokens(history: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(str(message.get("content") or "")) for message in history)
+
+
+def _extract_line(row: dict) -> str:
+    text = " ".join(str(row.get("story_text") or "").split())
+    if len(text) > _EXTRACT_CHARS:
+        text = text[:_EXTRACT_CHARS] + "…"
+    choice = row.get("user_choice")
+    prefix = f"第{row.get('depth', '?')}节" + (f"（选择：{choice}）" if choice else "")
+    return f"{prefix}：{text}"
+
+
+def _valid_summary(value) -> bool:
+    return isinstance(value, dict) and isinstance(value.get("covered"), int) and isinstance(value.get("text"), str)
+
+
+def _verbatim(path: List[dict]) -> List[Dict[str, str]]:
+    history: List[Dict[str, str]] = []
+    for item in path:
+        history.append({"role": "assistant", "content": item["story_text"]})
+        if item["user_choice"]:
+            history.append({"role": "user", "content": f"我选择了：{item['user_choice']}"})
+    return history
+
+
+class HistoryCompactor:
+    """按配置压缩对话历史，并在后台增量维护滚动摘要。"""
+
+    def __init__(self) -> None:
+        self.keep_recent = max(0, int(getattr(settings, "history_keep_recent_nodes", 4)))
+        self.token_budget = max(0, int(getattr(settings, "history_token_budget", 6000)))
+        self.summary_max_chars = max(100, int(getattr(settings, "history_summary_max_chars", 600)))
+        self.llm_enabled = bool(getattr(settings, "history_summary_llm_enabled", True))
+        self._lock = threading.Lock()
+        self._inflight: set[int] = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        # --- Metrics ---
+        self.compacted_total = 0
+        self.summary_full_hits = 0
+        self.summary_partial_total = 0
+        self.refresh_scheduled_total = 0
+        self.refresh_done_total = 0
+        self.refresh_failed_total = 0
+        self.budget_trimmed_total = 0
+
+    def build(self, path: List[dict]) -> List[Dict[str, str]]:
+        """由根 -> 当前节点的路径（crud.get_node_path 的结果）构建对话历史。"""
+        if self.keep_recent <= 0 or len(path) <= self.keep_recent:
+            return _verbatim(path)
+        older, recent = path[:-self.keep_recent], path[-self.keep_recent:]
+        summary = self._summary_for(older)
+        with self._lock:
+            self.compacted_total += 1
+        return [{"role": "assistant", "content": SUMMARY_PREFIX + summary}] + _verbatim(recent)
+
+    def fit_budget(self, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        超出 token 预算时从最早的原文消息开始丢弃（前情提要与最后一条消息始终保留），
+        仍超出则从头部截短前情提要。
+        """
+        if self.token_budget <= 0 or history_tokens(history) <= self.token_budget:
+            return history
+        with self._lock:
+            self.budget_trimmed_total += 1
+        trimmed = list(history)
+        head = 1 if trimmed and str(trimmed[0].get("content") or "").startswith(SUMMARY_PREFIX) else 0
+        while len(trimmed) > head + 1 and history_tokens(trimmed) > self.token_budget:
+            trimmed.pop(head)
+        overflow = history_tokens(trimmed) - self.token_budget
+        if overflow > 0 and head:
+            content = trimmed[0]["content"][len(SUMMARY_PREFIX):]
+            trimmed[0] = {"role": trimmed[0]["role"], "content": SUMMARY_PREFIX + "…" + content[min(len(content), overflow):]}
+        LOGGER.info(f"[History] token 预算裁剪 | before={len(history)} | after={len(trimmed)} | budget={self.token_budget}")
+        return trimmed
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {
+                "keep_recent_nodes": self.keep_recent,
+                "token_budget": self.token_budget,
+                "llm_enabled": self.llm_enabled,
+                "compacted_total": self.compacted_total,
+                "summary_full_hits": self.summary_full_hits,
+                "summary_partial_total": self.summary_partial_total,
+                "refresh_scheduled_total": self.refresh_scheduled_total,
+                "refresh_inflight": len(self._inflight),
+                "refresh_done_total": self.refresh_done_total,
+                "refresh_failed_total": self.refresh_failed_total,
+                "budget_trimmed_total": self.budget_trimmed_total,
+            }
+
+    # --- internal ---
+
+    @staticmethod
+    def _deepest_cached(older: List[dict]) -> tuple[int, str]:
+        """返回 (已覆盖节点数, 摘要)；路径上没有缓存摘要时返回 (0, "")。"""
+        for index in range(len(older) - 1, -1, -1):
+            cached = older[index].get("history_summary")
+            if _valid_summary(cached) and cached["covered"] == index + 1:
+                return index + 1, cached["text"]
+        return 0, ""
+
+    def _summary_for(self, older: List[dict]) -> str:
+        covered, text = self._deepest_cached(older)
+        if covered == len(older):
+            with self._lock:
+                self.summary_full_hits += 1
+            return text
+        with self._lock:
+            self.summary_partial_total += 1
+        if self.llm_enabled:
+            self._schedule_refresh(older)
+        lines = [text] if text else []
+        lines.extend(_extract_line(row) for row in older[covered:])
+        return "\n".join(lines)
+
+    def _schedule_refresh(self, older: List[dict]) -> None:
+        node_id = older[-1]["id"]
+        with self._lock:
+            if node_id in self._inflight:
+                return
+            self._inflight.add(node_id)
+            self.refresh_scheduled_total += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history_summary")
+        # 复制上下文，使摘要调用的用量计入触发它的用户与会话
+        self._executor.submit(contextvars.copy_context().run, self._refresh, [dict(row) for row in older])
+
+    def _refresh(self, older: List[dict]) -> None:
+        """把最深的已缓存摘要与其后的节点原文合并为新摘要，缓存到 older[-1]。"""
+        from database.base import SessionLocal
+        from database import crud
+        from .llm_clients import llm_client, llm_traffic, TRAFFIC_SPECULATIVE
+
+        node_id = older[-1]["id"]
+        covered, previous = self._deepest_cached(older)
+        segments = "\n\n".join(
+            (f"（玩家选择：{row['user_choice']}）\n" if row.get("user_choice") else "") + str(row.get("story_text") or "")
+            for row in older[covered:]
+        )
+        prompt = prompt_templates.HISTORY_SUMMARY_PROMPT.format(
+            previous_summary=previous or "（无）",
+            new_segments=segments,
+            max_chars=self.summary_max_chars,
+        )
+        db = SessionLocal()
+        try:
+            # 摘要是可延后的后台工作，限流时与预推演一起让路
+            with llm_traffic(TRAFFIC_SPECULATIVE):
+                raw = llm_client.generate(
+                    prompt,
+                    system_preamble_override=SUMMARY_SYSTEM_PREAMBLE,
+                    temperature=0.3,
+                    max_tokens=1200,
+                    usage_site="history_summary",
+                )
+            data = _load_summary(raw)
+            if not data:
+                raise ValueError("摘要输出缺少 summary 字段")
+            crud.set_node_history_summary(db, node_id, {"covered": len(older), "text": data[: self.summary_max_chars * 2]})
+            with self._lock:
+                self.refresh_done_total += 1
+            LOGGER.info(f"[History] 滚动摘要已更新 | node={node_id} | covered={len(older)} | from={covered}")
+        except Exception as exc:  # noqa: BLE001
+            db.rollback()
+            with self._lock:
+                self.refresh_failed_total += 1
+            LOGGER.warning(f"[History] 滚动摘要更新失败 | node={node_id} | error={exc}")
+        finally:
+            db.close()
+            with self._lock:
+                self._inflight.discard(node_id)
+
+
+def _load_summary(raw: str) -> Optional[str]:
+    text = str(raw or "").strip()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = repair_json(text[text.find("{"):] if "{" in text else text)
+    if isinstance(data, dict) and isinstance(data.get("summary"), str):
+        return data["summary"].strip() or None
+    return None
+
+
+history_compactor = HistoryCompactor()
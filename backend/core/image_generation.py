@@ -8,6 +8,7 @@ import requests
 from typing import Dict, Any, Optional, List
 from config.logging_config import LOGGER
 from config.settings import settings
+from .mock_provider import MockImageBackend
 
 
 class ImageGenerationError(Exception):
@@ -21,6 +22,7 @@ class UniversalImageClient:
     def __init__(self):
         self.current_provider = settings.image_provider
         self.config = self._get_current_config()
+        self._mock = MockImageBackend(self.config) if self.config["provider_type"] == "mock" else None
         LOGGER.info(f"图像生成客户端初始化完成，使用提供商: {self.current_provider}")
 
     def _get_current_config(self) -> Dict[str, Any]:
@@ -56,6 +58,9 @@ class UniversalImageClient:
         try:
             if self.config["provider_type"] == "oneapi":
                 return self._generate_oneapi(prompt, model, **kwargs)
+            elif self._mock is not None:
+                LOGGER.info(f"发送图像生成请求（离线模拟），提示词: {prompt[:100]}...")
+                return self._mock.generate(prompt)
             else:
                 raise ImageGenerationError(f"不支持的图像提供商类型: {self.config['provider_type']}")
         
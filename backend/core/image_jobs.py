@@ -0,0 +1,210 @@
+"""
+后台配图任务
+节点文本先落库（图库图片占位，metadata.image.status=pending），
+真实AI配图由固定大小的 worker 池异步生成并回写，文本延迟不再包含图片延迟。
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from config.logging_config import LOGGER
+from config.settings import settings
+from database.base import SessionLocal
+from database import crud
+from database.models import StoryNode
+from .image_service import image_service
+from .notify import notify_hub, node_key
+
+# 任务优先级：数值越小越先执行
+PRIORITY_INTERACTIVE = 0
+PRIORITY_SPECULATIVE = 1
+
+IMAGE_STATUS_PENDING = "pending"
+IMAGE_STATUS_READY = "ready"
+IMAGE_STATUS_FAILED = "failed"
+
+
+def node_image_status(node: StoryNode) -> str:
+    """读取节点的配图状态；历史节点没有 image 元数据，视为已就绪。"""
+    meta = node.get_metadata() or {}
+    image_meta = meta.get("image") if isinstance(meta, dict) else None
+    if isinstance(image_meta, dict) and image_meta.get("status"):
+        return str(image_meta["status"])
+    return IMAGE_STATUS_READY
+
+
+class ImageJobService:
+    """带优先级的有界配图队列：交互节点优先于预推演节点，同一节点只生成一次。"""
+
+    def __init__(self) -> None:
+        self.worker_count = max(1, int(getattr(settings, "image_worker_count", 4)))
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[int, int, int, str]] = []  # (priority, seq, node_id, story_text)
+        self._seq = itertools.count()
+        self._queued: Dict[int, int] = {}  # node_id -> 当前有效的排队优先级
+        self._running: set[int] = set()
+        self._threads: List[threading.Thread] = []
+
+        # --- Metrics ---
+        self.submitted_total = 0
+        self.cancelled_total = 0
+        self.completed_total = 0
+        self.failed_total = 0
+        self.ai_total = 0
+        self.library_total = 0
+        self.total_latency_ms = 0.0
+        self.last_latency_ms = 0.0
+
+    def submit(self, node_id: int, story_text: str, *, priority: int = PRIORITY_INTERACTIVE) -> bool:
+        """登记节点配图任务；已在执行或已以更高优先级排队时忽略，返回是否入队。"""
+        with self._cond:
+            if node_id in self._running:
+                return False
+            queued = self._queued.get(node_id)
+            if queued is not None and queued <= priority:
+                return False
+            # 优先级提升时直接压入新条目，旧条目出队时按 _queued 判定为过期并跳过
+            self._queued[node_id] = priority
+            heapq.heappush(self._heap, (priority, next(self._seq), node_id, story_text))
+            if queued is None:
+                self.submitted_total += 1
+            self._ensure_workers()
+            self._cond.notify()
+        LOGGER.debug(f"[ImageJobs] submit | node={node_id} | priority={priority}")
+        return True
+
+    def ensure(self, node: Optional[StoryNode], *, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """节点配图仍为 pending 时确保有任务在跑（进程重启后的补偿，或预推演节点被选中时提升优先级）。"""
+        if node is None or node_image_status(node) != IMAGE_STATUS_PENDING:
+            return
+        self.submit(node.id, node.story_text or "", priority=priority)
+
+    def has_speculative_queued(self) -> bool:
+        with self._cond:
+            return any(priority == PRIORITY_SPECULATIVE for priority in self._queued.values())
+
+    def cancel(self, node_ids: List[int]) -> int:
+        """撤销这些节点仍在排队的预推演配图任务（执行中的不受影响），返回撤销数；节点之后被选中时由 ensure 重新登记。"""
+        cancelled = 0
+        with self._cond:
+            for node_id in node_ids:
+                if self._queued.get(node_id) == PRIORITY_SPECULATIVE:
+                    # 堆中条目出队时按 _queued 判定为过期并跳过
+                    del self._queued[node_id]
+                    cancelled += 1
+            self.cancelled_total += cancelled
+        return cancelled
+
+    def is_pending(self, node_id: int) -> bool:
+        with self._cond:
+            return node_id in self._queued or node_id in self._running
+
+    # --- internal ---
+
+    def _ensure_workers(self) -> None:
+        # 调用方已持有 _cond
+        while len(self._threads) < self.worker_count:
+            t = threading.Thread(
+                target=self._worker_loop,
+                name=f"image_job_{len(self._threads)}",
+                daemon=True,
+            )
+            self._threads.append(t)
+            t.start()
+
+    def _next_job(self) -> Tuple[int, str]:
+        with self._cond:
+            while True:
+                while not self._heap:
+                    self._cond.wait()
+                priority, _, node_id, story_text = heapq.heappop(self._heap)
+                if self._queued.get(node_id) != priority:
+                    continue  # 已被更高优先级条目取代
+                self._queued.pop(node_id, None)
+                self._running.add(node_id)
+                return node_id, story_text
+
+    def _worker_loop(self) -> None:
+        while True:
+            node_id, story_text = self._next_job()
+            try:
+                self._run_job(node_id, story_text)
+            except Exception as exc:  # noqa: BLE001
+                LOGGER.error(f"[ImageJobs] worker error | node={node_id} | error={exc}", exc_info=True)
+            finally:
+                with self._cond:
+                    self._running.discard(node_id)
+
+    def _run_job(self, node_id: int, story_text: str) -> None:
+        start = time.perf_counter()
+        try:
+            image_url = image_service.get_image_for_story(story_text)
+            source = "ai" if "/static/generated/" in image_url else "library"
+            image_meta: Dict[str, Any] = {"status": IMAGE_STATUS_READY, "source": source}
+        except Exception as exc:  # noqa: BLE001
+            LOGGER.warning(f"[ImageJobs] generate failed | node={node_id} | error={exc}")
+            image_url = None
+            image_meta = {"status": IMAGE_STATUS_FAILED, "error": str(exc)}
+        latency_ms = (time.perf_counter() - start) * 1000.0
+        image_meta["finished_at"] = datetime.utcnow().isoformat()
+
+        db = SessionLocal()
+        try:
+            if image_url is None:
+                # 失败时保留占位图，仅更新状态
+                node = crud.get_node_by_id(db, node_id)
+                image_url = node.image_url if node else None
+            node = crud.update_node_image(db, node_id, image_url, image_meta) if image_url else None
+        except Exception as exc:  # noqa: BLE001
+            db.rollback()
+            LOGGER.error(f"[ImageJobs] update failed | node={node_id} | error={exc}")
+            node = None
+        finally:
+            db.close()
+
+        with self._cond:
+            self.last_latency_ms = latency_ms
+            self.total_latency_ms += latency_ms
+            if image_meta["status"] == IMAGE_STATUS_READY:
+                self.completed_total += 1
+                if image_meta.get("source") == "ai":
+                    self.ai_total += 1
+                else:
+                    self.library_total += 1
+            else:
+                self.failed_total += 1
+
+        if node is None:
+            LOGGER.info(f"[ImageJobs] node gone, result dropped | node={node_id}")
+            return
+        notify_hub.notify(node_key(node_id))
+        LOGGER.info(
+            f"[ImageJobs] done | node={node_id} | status={image_meta['status']} | url={image_url} | latency_ms={latency_ms:.0f}"
+        )
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            finished = self.completed_total + self.failed_total
+            avg_latency_ms = (self.total_latency_ms / finished) if finished else None
+            return {
+                "worker_count": self.worker_count,
+                "queue_depth": len(self._queued),
+                "running": len(self._running),
+                "submitted_total": self.submitted_total,
+                "cancelled_total": self.cancelled_total,
+                "completed_total": self.completed_total,
+                "failed_total": self.failed_total,
+                "ai_total": self.ai_total,
+                "library_total": self.library_total,
+                "last_latency_ms": round(self.last_latency_ms, 2) if self.last_latency_ms else None,
+                "avg_latency_ms": round(avg_latency_ms, 2) if avg_latency_ms else None,
+            }
+
+
+image_jobs = ImageJobService()
@@ -115,7 +115,9 @@ class ImageStorageService:
     
     
     def _is_external_url(self, url: str) -> bool:
-        """判断是否为外部URL"""
+        """判断是否为外部URL（指向本服务的地址视为本地，例如离线模拟提供商返回的预置图片）"""
+        if url.startswith(f"{self.backend_base_url}/"):
+            return False
         return url.startswith('http://') or url.startswith('https://')
     
     def _generate_filename(self, image_url: str, story_context: str) -> str:
@@ -0,0 +1,176 @@
+"""
+本地 JSON 修复
+json.loads 失败时先在本地做一轮结构修复，修不好才交给模型修复器（一次完整的 LLM 往返）。
+覆盖模型输出中常见的几类问题：
+- 尾随逗号：{"a": 1,} / [1, 2,]
+- 字符串内未转义的英文双引号："text": "他喊道"快走"然后……"
+- 输出被截断：补齐未闭合的字符串与括号，必要时回退到最后一个完整元素
+- 全角标点充当结构符：“text”：“……”，｛｝［］
+- choices 以对象的对象给出：{"A": {...}, "B": {...}}（见 coerce_choices）
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, List, Optional, Tuple
+
+# 字符串外出现时视为结构符的全角字符
+_FULLWIDTH_STRUCT = {
+    "｛": "{",
+    "｝": "}",
+    "［": "[",
+    "］": "]",
+    "：": ":",
+    "，": ",",
+}
+_CLOSERS = {"{": "}", "[": "]"}
+_LITERALS = ("true", "false", "null")
+
+
+def _skip_ws(s: str, i: int) -> int:
+    n = len(s)
+    while i < n and s[i] in " \t\r\n":
+        i += 1
+    return i
+
+
+def _starts_value(s: str, i: int) -> bool:
+    """位置 i 处（已跳过空白）是否像一个 JSON 值或容器结束的开头。"""
+    if i >= len(s):
+        return True
+    ch = _FULLWIDTH_STRUCT.get(s[i], s[i])
+    if ch in '"“{[]}-' or ch.isdigit():
+        return True
+    return s.startswith(_LITERALS, i)
+
+
+def _closes_string(s: str, i: int) -> bool:
+    """
+    判断位于 i-1 的英文双引号是否真的结束了字符串：
+    其后（跳过空白）必须是结构符，逗号之后还得紧跟一个值，否则视为正文中的引号。
+    """
+    j = _skip_ws(s, i)
+    if j >= len(s):
+        return True
+    ch = _FULLWIDTH_STRUCT.get(s[j], s[j])
+    if ch in "}]:":
+        return True
+    if ch == ",":
+        return _starts_value(s, _skip_ws(s, j + 1))
+    return False
+
+
+def _close_tail(text: str, stack: List[str]) -> str:
+    """去掉截断处悬空的逗号/冒号，再按栈逆序补齐括号。"""
+    body = text.rstrip()
+    if body.endswith(","):
+        body = body[:-1]
+    elif body.endswith(":"):
+        body += "null"
+    return body + "".join(_CLOSERS[c] for c in reversed(stack))
+
+
+def _rewrite(s: str) -> Tuple[str, List[str], bool, List[Tuple[int, List[str]]]]:
+    """
+    单遍扫描改写：返回 (改写结果, 未闭合容器栈, 是否停在字符串内部, 逗号断点)。
+    逗号断点记录每个结构逗号前的输出长度与当时的容器栈，截断修复失败时回退到这些位置。
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    commas: List[Tuple[int, List[str]]] = []
+    in_str = False
+    close_quote = '"'
+    i, n = 0, len(s)
+    while i < n:
+        ch = s[i]
+        if in_str:
+            if ch == "\\" and i + 1 < n:
+                out.append(s[i:i + 2])
+                i += 2
+                continue
+            if ch == close_quote and (ch != '"' or _closes_string(s, i + 1)):
+                out.append('"')
+                in_str = False
+            elif ch == '"':
+                out.append('\\"')
+            elif ch == "\n":
+                out.append("\\n")
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        ch = _FULLWIDTH_STRUCT.get(ch, ch)
+        if ch == '"' or ch == "“":
+            in_str = True
+            close_quote = '"' if ch == '"' else "”"
+            out.append('"')
+        elif ch in "{[":
+            stack.append(ch)
+            out.append(ch)
+        elif ch in "}]":
+            # 尾随逗号
+            while out and out[-1] in (" ", "\t", "\r", "\n"):
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if stack and _CLOSERS[stack[-1]] == ch:
+                stack.pop()
+                out.append(ch)
+        elif ch == ",":
+            commas.append((len(out), list(stack)))
+            out.append(ch)
+        else:
+            out.append(ch)
+        i += 1
+        if not stack and out and out[-1] in "}]":
+            break
+    return "".join(out), stack, in_str, commas
+
+
+def _loads(text: str) -> Optional[Any]:
+    try:
+        return json.loads(text, strict=False)
+    except ValueError:
+        return None
+
+
+def repair_json(raw: str) -> Optional[Any]:
+    """
+    尝试在本地把近似 JSON 的文本修复为合法 JSON 并解析；无法修复时返回 None。
+    输入应为 StoryEngine._extract_json 的输出（已去掉代码围栏与前后噪声）。
+    """
+    if not raw:
+        return None
+    text, stack, in_str, commas = _rewrite(str(raw).strip())
+    if not stack and not in_str:
+        return _loads(text)
+
+    # 截断：先原地补齐；若悬空的是半个键值对，则回退到最近的结构逗号再补齐
+    if in_str:
+        text += '"'
+    data = _loads(_close_tail(text, stack))
+    if data is not None:
+        return data
+    for pos, snapshot in reversed(commas):
+        data = _loads(_close_tail(text[:pos], snapshot))
+        if data is not None:
+            return data
+    return None
+
+
+def coerce_choices(choices: Any) -> Any:
+    """
+    将对象形式的 choices（{"A": {...}, "B": {...}}）展开为列表；缺少 option 时以键名补齐。
+    其余形态原样返回，交由调用方校验。
+    """
+    if not isinstance(choices, dict) or not choices:
+        return choices
+    if not all(isinstance(item, dict) for item in choices.values()):
+        return choices
+    coerced = []
+    for key, item in choices.items():
+        if "option" not in item:
+            item = {"option": str(key), **item}
+        coerced.append(item)
+    return coerced
@@ -0,0 +1,179 @@
+"""
+增量 JSON 解析
+在流式生成节点时逐块喂入模型输出，边收边解析：
+- 顶层 text 字段的字符串内容随到随发（已完成转义解码）；
+- 顶层 choices 数组中的每个对象闭合时立即整体发出。
+完整输出仍交由 StoryEngine 的常规解析流程做最终校验。
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+# 事件类型：("text", 增量文本) / ("choice", (序号, 选项对象))
+StreamEvent = Tuple[str, Any]
+
+_SIMPLE_ESCAPES = {
+    '"': '"',
+    '\\': '\\',
+    '/': '/',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+}
+
+
+class IncrementalNodeParser:
+    """面向节点 JSON（text + choices）的增量解析器，容忍前置的代码围栏或噪声。"""
+
+    def __init__(self, text_key: str = "text", choices_key: str = "choices") -> None:
+        self.text_key = text_key
+        self.choices_key = choices_key
+        self._buf: List[str] = []
+        self._pos = 0
+        self._started = False
+        # 容器栈：每项为 [类型('obj'|'arr'), 父级中的键, 对象内"下一个字符串是键"标记, 起始偏移]
+        self._stack: List[List[Any]] = []
+        self._last_key: Optional[str] = None
+        self._in_string = False
+        self._string_is_key = False
+        self._string_streams_text = False
+        self._escape = False
+        self._unicode_digits: Optional[str] = None
+        self._key_chars: List[str] = []
+        self._choice_index = 0
+        self.text = ""
+
+    @property
+    def raw(self) -> str:
+        return "".join(self._buf)
+
+    def feed(self, chunk: str) -> List[StreamEvent]:
+        """喂入一段新输出，返回本段触发的事件列表。"""
+        if not chunk:
+            return []
+        self._buf.append(chunk)
+        events: List[StreamEvent] = []
+        text_delta: List[str] = []
+        offset = self._pos
+        for ch in chunk:
+            self._step(ch, offset, text_delta, events)
+            offset += 1
+        self._pos = offset
+        if text_delta:
+            delta = "".join(text_delta)
+            self.text += delta
+            # 文本增量放在本段其它事件之前，保证顺序与原文一致
+            events.insert(0, ("text", delta))
+        return events
+
+    # --- internal ---
+
+    def _step(self, ch: str, offset: int, text_delta: List[str], events: List[StreamEvent]) -> None:
+        if not self._started:
+            if ch != '{':
+                return
+            self._started = True
+
+        if self._in_string:
+            self._step_string(ch, text_delta)
+            return
+
+        if ch == '"':
+            top = self._stack[-1] if self._stack else None
+            self._in_string = True
+            self._string_is_key = bool(top and top[0] == 'obj' and top[2])
+            self._string_streams_text = (
+                not self._string_is_key
+                and len(self._stack) == 1
+                and self._last_key == self.text_key
+            )
+            self._key_chars = []
+            return
+
+        if ch == '{' or ch == '[':
+            parent_key = self._last_key if self._stack and self._stack[-1][0] == 'obj' else None
+            self._stack.append(['obj' if ch == '{' else 'arr', parent_key, ch == '{', offset])
+            return
+
+        if ch == '}' or ch == ']':
+            if not self._stack:
+                return
+            closed = self._stack.pop()
+            if (
+                closed[0] == 'obj'
+                and len(self._stack) == 2
+                and self._stack[-1][0] == 'arr'
+                and self._stack[-1][1] == self.choices_key
+            ):
+                self._emit_choice(closed[3], offset, events)
+            if self._stack and self._stack[-1][0] == 'obj':
+                self._stack[-1][2] = False
+            return
+
+        if ch == ',':
+            if self._stack and self._stack[-1][0] == 'obj':
+                self._stack[-1][2] = True
+            return
+
+        if ch == ':':
+            if self._stack and self._stack[-1][0] == 'obj':
+                self._stack[-1][2] = False
+
+    def _step_string(self, ch: str, text_delta: List[str]) -> None:
+        decoded: Optional[str] = None
+        if self._unicode_digits is not None:
+            self._unicode_digits += ch
+            if len(self._unicode_digits) == 4:
+                try:
+                    decoded = chr(int(self._unicode_digits, 16))
+                except ValueError:
+                    decoded = ""
+                self._unicode_digits = None
+        elif self._escape:
+            self._escape = False
+            if ch == 'u':
+                self._unicode_digits = ""
+            else:
+                decoded = _SIMPLE_ESCAPES.get(ch, ch)
+        elif ch == '\\':
+            self._escape = True
+        elif ch == '"':
+            self._in_string = False
+            if self._string_is_key:
+                self._last_key = "".join(self._key_chars)
+            elif self._stack and self._stack[-1][0] == 'obj':
+                self._stack[-1][2] = False
+            self._string_streams_text = False
+            return
+        else:
+            decoded = ch
+
+        if decoded is None:
+            return
+        if self._string_is_key:
+            self._key_chars.append(decoded)
+        elif self._string_streams_text:
+            text_delta.append(decoded)
+
+    def _emit_choice(self, start: int, end: int, events: List[StreamEvent]) -> None:
+        fragment = self.raw[start:end + 1]
+        try:
+            payload = json.loads(fragment)
+        except Exception:
+            payload = None
+        index = self._choice_index
+        self._choice_index += 1
+        if isinstance(payload, dict):
+            events.append(("choice", (index, payload)))
+
+
+def display_choice(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """只保留可对前端展示的选项字段，隐藏 effects 等内部数值。"""
+    return {
+        "option": str(payload.get("option", "")).strip(),
+        "summary": str(payload.get("summary", "")).strip(),
+    }
@@ -0,0 +1,153 @@
+"""
+LLM 响应缓存
+对确定性较强的子调用（愿望审核、关卡元信息、JSON 修复）按内容寻址复用模型输出：
+key = sha256(provider, model, messages(含系统预置), temperature, max_tokens)。
+两级存储：
+- 进程内 LRU + TTL（始终启用）；
+- llm_cache_backend=postgres 时叠加 llm_response_cache 表，供多个 gunicorn worker 共享。
+调用方通过 generate(..., cache_site="xxx") 显式开启，未指定 cache_site 的调用不受影响。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config.logging_config import LOGGER
+from config.settings import settings
+
+# 每写入若干次顺带清理一次数据库中的过期条目
+_PURGE_EVERY_WRITES = 200
+
+
+def make_cache_key(provider: str, completion_params: Dict[str, Any]) -> str:
+    payload = {
+        "provider": provider,
+        "model": completion_params.get("model"),
+        "messages": completion_params.get("messages"),
+        "temperature": completion_params.get("temperature"),
+        "max_tokens": completion_params.get("max_tokens"),
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """进程内 LRU + TTL，可选 PostgreSQL 共享层；所有异常都只记录日志，缓存不可用时退化为直连模型。"""
+
+    def __init__(self) -> None:
+        self.enabled = bool(getattr(settings, "llm_cache_enabled", True))
+        self.ttl_seconds = max(1, int(getattr(settings, "llm_cache_ttl_seconds", 86400)))
+        self.max_entries = max(1, int(getattr(settings, "llm_cache_max_entries", 1000)))
+        self.backend = str(getattr(settings, "llm_cache_backend", "memory") or "memory").lower()
+        self.uses_db = self.backend == "postgres"
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()  # key -> (过期时间 monotonic, 响应)
+        self._db_writes = 0
+
+        # --- Metrics ---
+        self.evictions_total = 0
+        self.expired_total = 0
+        self.db_errors_total = 0
+
+    def get(self, key: str) -> Tuple[Optional[str], Optional[str]]:
+        """返回 (响应, 命中层级 memory/db)；未命中返回 (None, None)。"""
+        if not self.enabled:
+            return None, None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    return value, "memory"
+                self._entries.pop(key, None)
+                self.expired_total += 1
+
+        if not self.uses_db:
+            return None, None
+        value, remaining = self._db_get(key)
+        if value is None:
+            return None, None
+        # 回填进程内层，剩余 TTL 与数据库保持一致
+        self._memory_put(key, value, remaining)
+        return value, "db"
+
+    def put(self, key: str, value: str, call_site: str, model: Optional[str]) -> None:
+        if not self.enabled or not value:
+            return
+        self._memory_put(key, value, self.ttl_seconds)
+        if self.uses_db:
+            self._db_put(key, value, call_site, model)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "backend": self.backend,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "evictions_total": self.evictions_total,
+                "expired_total": self.expired_total,
+                "db_errors_total": self.db_errors_total,
+            }
+
+    # --- internal ---
+
+    def _memory_put(self, key: str, value: str, ttl_seconds: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions_total += 1
+
+    def _db_get(self, key: str) -> Tuple[Optional[str], float]:
+        from database.base import SessionLocal
+        from database import crud
+
+        db = SessionLocal()
+        try:
+            row = crud.get_llm_cache_entry(db, key)
+            if row is None:
+                return None, 0.0
+            return row
+        except Exception as exc:  # noqa: BLE001
+            db.rollback()
+            with self._lock:
+                self.db_errors_total += 1
+            LOGGER.warning(f"[LLMCache] db read failed: {exc}")
+            return None, 0.0
+        finally:
+            db.close()
+
+    def _db_put(self, key: str, value: str, call_site: str, model: Optional[str]) -> None:
+        from database.base import SessionLocal
+        from database import crud
+
+        db = SessionLocal()
+        try:
+            crud.put_llm_cache_entry(db, key, call_site=call_site, model=model, response=value, ttl_seconds=self.ttl_seconds)
+            with self._lock:
+                self._db_writes += 1
+                purge = self._db_writes % _PURGE_EVERY_WRITES == 0
+            if purge:
+                removed = crud.purge_expired_llm_cache(db)
+                if removed:
+                    LOGGER.info(f"[LLMCache] purged expired entries={removed}")
+        except Exception as exc:  # noqa: BLE001
+            db.rollback()
+            with self._lock:
+                self.db_errors_total += 1
+            LOGGER.warning(f"[LLMCache] db write failed: {exc}")
+        finally:
+            db.close()
+
+
+llm_cache = LLMResponseCache()
@@ -4,10 +4,19 @@
 """
 
 from abc import ABC, abstractmethod
-from typing import List, Dict, Optional, Any
-from .model_config import get_current_config
+from typing import List, Dict, Optional, Any, Tuple, AsyncIterator, Callable
+from .model_config import get_current_config, get_model_config
+from .llm_cache import llm_cache, make_cache_key
+from .llm_hedge import LatencyHistogram, hedge_delay_seconds, hedge_executor, is_valid_response
+from .llm_usage import estimate_tokens, usage_scope, usage_tracker
+from .mock_provider import MockChatClient, AsyncMockChatClient
 from config.logging_config import LOGGER
 from config.settings import settings
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import json
 import time
 import random
 import threading
@@ -15,9 +24,10 @@ import httpx
 
 # 动态导入，避免在不需要时报错
 try:
-    from volcenginesdkarkruntime import Ark
+    from volcenginesdkarkruntime import Ark, AsyncArk
 except ImportError:
     Ark = None
+    AsyncArk = None
 
 try:
     import openai
@@ -25,6 +35,293 @@ except ImportError:
     openai = None
 
 
+# 预置系统提示：强制纯 JSON 输出
+DEFAULT_SYSTEM_PREAMBLE = (
+    "你是一个专用于生成游戏剧情的AI，你的唯一任务是输出严格的JSON格式。\n"
+    "# 绝对规则:\n"
+    "1. **必须**只输出一个JSON对象，禁止任何JSON之外的文本、注释或Markdown标记。\n"
+    "2. **必须**确保JSON语法完全正确，所有字符串都用双引号包裹，对象和数组正确闭合。\n"
+    "3. **必须**包含以下所有字段，且类型完全匹配:\n"
+    "   - `text`: (String) 故事的当前段落。\n"
+    "   - `success_rate`: (Integer) 主线任务的成功率，范围0-100。\n"
+    "   - `choices`: (Array) 一个包含3个选项对象的数组。如果故事自然结束，则返回一个空数组 `[]`。\n"
+    "4. `choices`数组中的每个对象**必须**包含以下字段:\n"
+    "   - `option`: (String) 玩家的选择项文本。\n"
+    "   - `summary`: (String) 对该选项的简短描述。\n"
+    "   - `success_rate_delta`: (Integer) 选择此项后，主线成功率的变化值，可以是正数、负数或0。\n"
+    "# 完整示例:\n"
+    "```json\n"
+    "{\n"
+    '  "text": "你站在分岔路口，左边是阴森的森林，右边是阳光明媚的小径。",\n'
+    '  "success_rate": 50,\n'
+    '  "choices": [\n'
+    '    {\n'
+    '      "option": "走进森林",\n'
+    '      "summary": "充满未知危险，但可能藏有宝藏。",\n'
+    '      "success_rate_delta": -10\n'
+    '    },\n'
+    '    {\n'
+    '      "option": "踏上小径",\n'
+    '      "summary": "看似安全，但可能平淡无奇。",\n'
+    '      "success_rate_delta": 5\n'
+    '    },\n'
+    '    {\n'
+    '      "option": "原地等待",\n'
+    '      "summary": "也许会有其他人经过。",\n'
+    '      "success_rate_delta": 0\n'
+    '    }\n'
+    '  ]\n'
+    "}\n"
+    "```\n"
+    "# 错误处理: 如果你因任何原因无法生成剧情，也**必须**返回一个结构合法的JSON，可在text字段中说明错误，例如: `{\"text\":\"内部错误，无法生成剧情。\", \"success_rate\":0, \"choices\":[]}`"
+)
+
+# OpenAI 兼容层的默认请求头
+_OPENAI_DEFAULT_HEADERS = {
+    "User-Agent": "PostmanRuntime/7.47.1",
+    "Accept": "*/*",
+    "Cache-Control": "no-cache",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Connection": "keep-alive",
+}
+
+# 流量类别：预推演（speculative）在限流时最先被舍弃，交互请求（interactive）保留配额
+TRAFFIC_INTERACTIVE = "interactive"
+TRAFFIC_SPECULATIVE = "speculative"
+_traffic_class: contextvars.ContextVar[str] = contextvars.ContextVar("llm_traffic_class", default=TRAFFIC_INTERACTIVE)
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+
+class LLMUnavailableError(RuntimeError):
+    """提供商处于熔断或令牌不足，请求未发出。"""
+
+
+@contextlib.contextmanager
+def llm_traffic(traffic_class: str):
+    """在该上下文内发出的模型调用按 traffic_class 计入限流优先级。"""
+    token = _traffic_class.set(traffic_class)
+    try:
+        yield
+    finally:
+        _traffic_class.reset(token)
+
+
+def _is_rate_limited(exc: Exception) -> bool:
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    if status == 429:
+        return True
+    msg = str(exc).lower()
+    return "rate limit" in msg or "too many requests" in msg or "429" in msg
+
+
+class _CircuitBreaker:
+    """
+    熔断器：连续失败 failure_threshold 次后打开，冷却期内请求直接失败；
+    冷却结束进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, failure_threshold: int, cooldown_seconds: float) -> None:
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown_seconds = max(0.0, float(cooldown_seconds))
+        self._lock = threading.Lock()
+        self.state = BREAKER_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.opened_total = 0
+        self.rejected_total = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == BREAKER_CLOSED:
+                return True
+            if self.state == BREAKER_OPEN and time.monotonic() - self._opened_at >= self.cooldown_seconds:
+                self.state = BREAKER_HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == BREAKER_HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected_total += 1
+            return False
+
+    def release_probe(self) -> None:
+        """放行的探测请求最终没有发出（例如被限流舍弃）时归还探测名额。"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = BREAKER_CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == BREAKER_HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != BREAKER_OPEN:
+                    self.opened_total += 1
+                self.state = BREAKER_OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self._failures,
+                "opened_total": self.opened_total,
+                "rejected_total": self.rejected_total,
+            }
+
+
+class _TokenBucket:
+    """
+    自适应令牌桶：按 rate 每秒补充、容量 burst。
+    预推演请求只能使用高于 speculative_reserve 比例的令牌，余量留给交互请求；
+    收到 429 时速率减半，此后每次成功按配置速率的 5% 逐步恢复（AIMD）。
+    rate <= 0 表示不限流。
+    """
+
+    def __init__(self, rate: float, burst: int, speculative_reserve: float) -> None:
+        self.max_rate = max(0.0, float(rate))
+        self.rate = self.max_rate
+        self.burst = max(1.0, float(burst))
+        self.reserve = min(max(float(speculative_reserve), 0.0), 1.0) * self.burst
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self.throttled_total = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_rate > 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, speculative: bool) -> float:
+        """取到令牌返回 0；否则返回预计需要等待的秒数。"""
+        if not self.enabled:
+            return 0.0
+        floor = self.reserve if speculative else 0.0
+        with self._lock:
+            self._refill()
+            if self._tokens - 1.0 >= floor:
+                self._tokens -= 1.0
+                return 0.0
+            return (floor + 1.0 - self._tokens) / max(self.rate, 1e-6)
+
+    def on_success(self) -> None:
+        if self.enabled:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def on_throttled(self) -> None:
+        if self.enabled:
+            with self._lock:
+                self.throttled_total += 1
+                self.rate = max(self.max_rate * 0.05, self.rate * 0.5)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            if self.enabled:
+                self._refill()
+            return {
+                "enabled": self.enabled,
+                "rate_per_second": round(self.rate, 3),
+                "max_rate_per_second": self.max_rate,
+                "burst": self.burst,
+                "tokens": round(self._tokens, 2),
+                "speculative_reserve": round(self.reserve, 2),
+                "throttled_total": self.throttled_total,
+            }
+
+
+class _ProviderGuard:
+    """单个提供商的熔断器 + 令牌桶；同步与异步客户端共享同一实例。"""
+
+    def __init__(self, provider_name: str) -> None:
+        provider_cfg = settings.LLM_PROVIDERS.get(provider_name) or {}
+        self.provider_name = provider_name
+        self.breaker = _CircuitBreaker(
+            provider_cfg.get("breaker_failure_threshold", settings.llm_breaker_failure_threshold),
+            provider_cfg.get("breaker_cooldown_seconds", settings.llm_breaker_cooldown_seconds),
+        )
+        self.bucket = _TokenBucket(
+            provider_cfg.get("rate_limit_per_second", settings.llm_rate_limit_per_second),
+            provider_cfg.get("rate_limit_burst", settings.llm_rate_limit_burst),
+            settings.llm_rate_limit_speculative_reserve,
+        )
+        self._lock = threading.Lock()
+        self.shed_total = {TRAFFIC_INTERACTIVE: 0, TRAFFIC_SPECULATIVE: 0}
+
+    def admit(self) -> float:
+        """
+        放行返回 0；熔断中直接抛出 LLMUnavailableError；
+        令牌不足时预推演请求直接抛出（最先舍弃），交互请求返回需等待的秒数由调用方等待后重试。
+        """
+        traffic = _traffic_class.get()
+        if not self.breaker.allow():
+            self._shed(traffic)
+            raise LLMUnavailableError(f"提供商 {self.provider_name} 熔断中")
+        wait = self.bucket.try_acquire(speculative=traffic == TRAFFIC_SPECULATIVE)
+        if wait <= 0:
+            return 0.0
+        self.breaker.release_probe()
+        if traffic == TRAFFIC_SPECULATIVE:
+            self._shed(traffic)
+            raise LLMUnavailableError(f"提供商 {self.provider_name} 令牌不足，预推演请求让路")
+        return wait
+
+    def shed_interactive(self) -> None:
+        self._shed(TRAFFIC_INTERACTIVE)
+        raise LLMUnavailableError(f"提供商 {self.provider_name} 令牌等待超时")
+
+    def record_success(self) -> None:
+        self.breaker.record_success()
+        self.bucket.on_success()
+
+    def record_failure(self, exc: Exception) -> None:
+        self.breaker.record_failure()
+        if _is_rate_limited(exc):
+            self.bucket.on_throttled()
+
+    def _shed(self, traffic: str) -> None:
+        with self._lock:
+            self.shed_total[traffic] = self.shed_total.get(traffic, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            shed = dict(self.shed_total)
+        return {"breaker": self.breaker.snapshot(), "rate_limit": self.bucket.snapshot(), "shed_total": shed}
+
+
+_provider_guards: Dict[str, _ProviderGuard] = {}
+_provider_guards_lock = threading.Lock()
+
+
+def _provider_guard(provider_name: str) -> _ProviderGuard:
+    with _provider_guards_lock:
+        guard = _provider_guards.get(provider_name)
+        if guard is None:
+            guard = _ProviderGuard(provider_name)
+            _provider_guards[provider_name] = guard
+        return guard
+
+
+def provider_guard_metrics() -> Dict[str, Any]:
+    """各提供商熔断与限流状态，供 /api/story/metrics 输出。"""
+    with _provider_guards_lock:
+        guards = list(_provider_guards.values())
+    return {guard.provider_name: guard.snapshot() for guard in guards}
+
+
 class BaseLLMClient(ABC):
     """LLM客户端基类"""
 
@@ -34,61 +331,16 @@ class BaseLLMClient(ABC):
         pass
 
 
-class UniversalLLMClient(BaseLLMClient):
+class _UniversalClientMixin:
     """
-    通用LLM客户端
-    根据配置自动适配不同的模型供应商（豆包、OpenAI、Gemini等）
+    同步/异步通用客户端共享的逻辑：消息构建、参数覆写、重试策略、
+    response_format 回退判定、响应后处理与运行期指标。
     """
 
-    def __init__(self):
-        # 获取当前模型配置
-        self.model_config = get_current_config()
-        self.client: Any = None
-
-        if self.model_config.provider_type == "doubao":
-            if Ark is None:
-                raise ImportError("豆包SDK未安装，请运行: pip install 'volcengine-python-sdk[ark]'")
-            self.client = Ark(
-                base_url=self.model_config.base_url,
-                api_key=self.model_config.api_key,
-                timeout=settings.llm_timeout_seconds
-            )
-            LOGGER.info(f"LLM客户端初始化成功 - 提供商: 豆包 (原生SDK)")
-        
-        elif self.model_config.provider_type == "openai":
-            if openai is None:
-                raise ImportError("OpenAI SDK未安装，请运行: pip install openai")
-            
-            client_params = self.model_config.get_client_params()
-            default_headers = {
-                "User-Agent": "PostmanRuntime/7.47.1",
-                "Accept": "*/*",
-                "Cache-Control": "no-cache",
-                "Accept-Encoding": "gzip, deflate, br",
-                "Connection": "keep-alive",
-            }
-            client_params["default_headers"] = default_headers
-
-            http_client = httpx.Client(
-                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
-                # 增加读取超时，应对大文本生成时服务器响应慢的问题
-                timeout=httpx.Timeout(settings.llm_timeout_seconds, connect=5.0, read=60.0)
-            )
-            client_params["http_client"] = http_client
-
-            if settings.debug:
-                loggable_params = {k: v for k, v in client_params.items() if k != 'http_client'}
-                LOGGER.debug(f"[CLIENT PARAMS] {loggable_params}")
-            
-            self.client = openai.OpenAI(**client_params)
-            LOGGER.info(f"LLM客户端初始化成功 - 提供商: OpenAI (兼容层)")
-        
-        else:
-            raise ValueError(f"不支持的 provider_type: {self.model_config.provider_type}")
-
-        LOGGER.info(f"模型: {self.model_config.model_name}")
-        LOGGER.info(f"API地址: {self.model_config.base_url}")
+    model_config: Any
+    client: Any
 
+    def _init_metrics(self) -> None:
         # 简单的运行期指标
         self._lock = threading.Lock()
         self.calls_total = 0
@@ -98,84 +350,65 @@ class UniversalLLMClient(BaseLLMClient):
         self.last_latency_ms = 0.0
         self._latency_count = 0
         self.last_error: Optional[str] = None
+        # 响应缓存按调用点统计：site -> {"hits", "db_hits", "misses", "stores"}
+        self._cache_stats: Dict[str, Dict[str, int]] = {}
+        # 可对冲调用（节点生成）的成功延迟分布，驱动对冲延迟；审核、修复、摘要等短调用不计入
+        self.latency_histogram = LatencyHistogram()
+        # 对冲：备用提供商客户端惰性创建；fired=发出对冲，hedge_won/primary_won=对冲后谁先给出有效结果
+        self._hedge_client: Any = None
+        self._hedge_disabled = False
+        self.hedge_stats = {"fired": 0, "hedge_won": 0, "primary_won": 0, "invalid": 0, "failed": 0, "failover": 0}
 
-    def generate(
+    def _openai_client_params(self) -> Dict[str, Any]:
+        client_params = self.model_config.get_client_params()
+        client_params["default_headers"] = dict(_OPENAI_DEFAULT_HEADERS)
+        return client_params
+
+    def _http_limits_and_timeout(self) -> Tuple[httpx.Limits, httpx.Timeout]:
+        limits = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        # 增加读取超时，应对大文本生成时服务器响应慢的问题
+        timeout = httpx.Timeout(settings.llm_timeout_seconds, connect=5.0, read=60.0)
+        return limits, timeout
+
+    def _build_messages(
         self,
         prompt: str,
-        history: Optional[List[Dict[str, str]]] = None,
-        *,
-        model: Optional[str] = None,
-        temperature: Optional[float] = None,
-        max_tokens: Optional[int] = None,
-        system_preamble_override: Optional[str] = None,
-    ) -> str:
-        """生成文本（支持按调用覆写模型/采样参数）"""
-        messages: List[Dict[str, str]] = []
-
-        # 预置系统提示：强制纯 JSON 输出
-        system_preamble = (
-            "你是一个专用于生成游戏剧情的AI，你的唯一任务是输出严格的JSON格式。\n"
-            "# 绝对规则:\n"
-            "1. **必须**只输出一个JSON对象，禁止任何JSON之外的文本、注释或Markdown标记。\n"
-            "2. **必须**确保JSON语法完全正确，所有字符串都用双引号包裹，对象和数组正确闭合。\n"
-            "3. **必须**包含以下所有字段，且类型完全匹配:\n"
-            "   - `text`: (String) 故事的当前段落。\n"
-            "   - `success_rate`: (Integer) 主线任务的成功率，范围0-100。\n"
-            "   - `choices`: (Array) 一个包含3个选项对象的数组。如果故事自然结束，则返回一个空数组 `[]`。\n"
-            "4. `choices`数组中的每个对象**必须**包含以下字段:\n"
-            "   - `option`: (String) 玩家的选择项文本。\n"
-            "   - `summary`: (String) 对该选项的简短描述。\n"
-            "   - `success_rate_delta`: (Integer) 选择此项后，主线成功率的变化值，可以是正数、负数或0。\n"
-            "# 完整示例:\n"
-            "```json\n"
-            "{\n"
-            '  "text": "你站在分岔路口，左边是阴森的森林，右边是阳光明媚的小径。",\n'
-            '  "success_rate": 50,\n'
-            '  "choices": [\n'
-            '    {\n'
-            '      "option": "走进森林",\n'
-            '      "summary": "充满未知危险，但可能藏有宝藏。",\n'
-            '      "success_rate_delta": -10\n'
-            '    },\n'
-            '    {\n'
-            '      "option": "踏上小径",\n'
-            '      "summary": "看似安全，但可能平淡无奇。",\n'
-            '      "success_rate_delta": 5\n'
-            '    },\n'
-            '    {\n'
-            '      "option": "原地等待",\n'
-            '      "summary": "也许会有其他人经过。",\n'
-            '      "success_rate_delta": 0\n'
-            '    }\n'
-            '  ]\n'
-            "}\n"
-            "```\n"
-            "# 错误处理: 如果你因任何原因无法生成剧情，也**必须**返回一个结构合法的JSON，可在text字段中说明错误，例如: `{\"text\":\"内部错误，无法生成剧情。\", \"success_rate\":0, \"choices\":[]}`"
-        )
-        if system_preamble_override:
-            system_preamble = system_preamble_override
-        
+        history: Optional[List[Dict[str, str]]],
+        system_preamble_override: Optional[str],
+    ) -> List[Dict[str, str]]:
+        system_preamble = system_preamble_override or DEFAULT_SYSTEM_PREAMBLE
+
         # 根据提供商构建 messages
         if self.model_config.provider_type == 'doubao':
             # 豆包原生SDK支持将 system prompt 放在第一条 user message 中
-            messages = []
+            messages: List[Dict[str, str]] = []
             if history:
                 messages.extend(history)
             messages.append({"role": "user", "content": f"{system_preamble}\n\n{prompt}"})
-        else: # openai
-            messages = []
-            messages.append({"role": "system", "content": system_preamble})
-            if history:
-                for message in history:
-                    if isinstance(message, dict) and 'role' in message and 'content' in message:
-                        messages.append(message)
-                    elif isinstance(message, str):
-                        messages.append({"role": "assistant", "content": message})
-            messages.append({"role": "user", "content": prompt})
+            return messages
 
+        # openai
+        messages = [{"role": "system", "content": system_preamble}]
+        if history:
+            for message in history:
+                if isinstance(message, dict) and 'role' in message and 'content' in message:
+                    messages.append(message)
+                elif isinstance(message, str):
+                    messages.append({"role": "assistant", "content": message})
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    def _build_completion_params(
+        self,
+        messages: List[Dict[str, str]],
+        *,
+        model: Optional[str],
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+    ) -> Dict[str, Any]:
         # 获取模型特定的参数
         completion_params = self.model_config.get_completion_params()
-        
+
         # JSON模式等参数已由 model_config 从 settings.py 中加载，此处无需额外处理
         # 覆写参数（若指定）
         if model is not None:
@@ -193,99 +426,197 @@ class UniversalLLMClient(BaseLLMClient):
                 LOGGER.critical(f"[CURL COMMAND] {curl_cmd}")
             except Exception as e:
                 LOGGER.error(f"构建 cURL 命令失败: {e}")
+        return completion_params
 
+    def _retry_policy(self) -> Tuple[int, int, int]:
         max_tries = max(1, int(settings.llm_max_retries) + 1)
         backoff_min = max(0, int(settings.llm_retry_backoff_min_ms))
         backoff_max = max(backoff_min, int(settings.llm_retry_backoff_max_ms))
+        return max_tries, backoff_min, backoff_max
 
-        attempt = 0
-        last_exc: Optional[Exception] = None
-        while attempt < max_tries:
-            attempt += 1
-            start = time.perf_counter()
+    def _response_format_fallback_params(self, completion_params: Dict[str, Any], exc: Exception) -> Optional[Dict[str, Any]]:
+        """若异常表明代理不支持 response_format，返回移除该参数后的请求参数；否则返回 None。"""
+        has_rf = "response_format" in completion_params
+        msg = str(exc)
+        if has_rf and ("response_format" in msg or "not support" in msg.lower() or "unsupported" in msg.lower()):
+            LOGGER.warning("代理可能不支持 response_format，正在移除该参数后重试（同一次尝试内）…")
+            retry_params = dict(completion_params)
+            retry_params.pop("response_format", None)
+            return retry_params
+        return None
+
+    def _extract_result(self, response: Any, completion_params: Dict[str, Any]) -> str:
+        raw_content = response.choices[0].message.content
+
+        # [终极修复] 应对 SiliconFlow 返回 "JSON in JSON" 的情况
+        # 模型将我们要求的JSON对象，作为字符串塞进了它自己的content字段里
+        if raw_content and raw_content.strip().startswith('{'):
             try:
-                # 根据客户端类型调用
-                if self.model_config.provider_type == 'doubao':
-                    # 豆包原生SDK调用
-                    response = self.client.chat.completions.create(**completion_params)
-                else: # openai
-                    # OpenAI 兼容层调用，带 response_format 回退逻辑
-                    try:
-                        response = self.client.chat.completions.create(**completion_params)
-                    except Exception as e:
-                        has_rf = "response_format" in completion_params
-                        msg = str(e)
-                        if has_rf and ("response_format" in msg or "not support" in msg.lower() or "unsupported" in msg.lower()):
-                            LOGGER.warning("代理可能不支持 response_format，正在移除该参数后重试（同一次尝试内）…")
-                            retry_params = dict(completion_params)
-                            retry_params.pop("response_format", None)
-                            response = self.client.chat.completions.create(**retry_params)
-                        else:
-                            raise
+                # 尝试将这个字符串再次解析为JSON对象
+                nested_json = json.loads(raw_content.strip())
+                # 如果成功，就将这个内部的JSON对象重新序列化为字符串返回
+                # 这确保了 story_engine 收到的是一个纯净的、它期望的JSON字符串
+                result = json.dumps(nested_json, ensure_ascii=False)
+                LOGGER.info("[JSON-in-JSON] 检测到并成功解析了嵌套的JSON响应。")
+            except json.JSONDecodeError:
+                # 如果再次解析失败，说明它不是一个完整的JSON，按原样返回
+                result = raw_content
+        else:
+            # 如果不是以'{'开头，说明是普通文本，按原样返回
+            result = raw_content
 
-                # 成功
-                latency_ms = (time.perf_counter() - start) * 1000.0
-                import json
-                raw_content = response.choices[0].message.content
+        # 使用情况日志
+        if hasattr(response, 'usage') and response.usage:
+            LOGGER.info(
+                f"模型生成成功 - 模型: {completion_params.get('model')}, tokens使用: {response.usage.total_tokens}"
+            )
+        else:
+            LOGGER.info(f"模型生成成功 - 模型: {completion_params.get('model')}")
+        self._record_usage(completion_params, getattr(response, 'usage', None), result)
+
+        # 尝试输出原始响应（仅 debug 模式）
+        if settings.debug and hasattr(response, 'http_response') and hasattr(response.http_response, 'text'):
+            LOGGER.debug(f"[RAW RESPONSE] {response.http_response.text}")
 
-                # [终极修复] 应对 SiliconFlow 返回 "JSON in JSON" 的情况
-                # 模型将我们要求的JSON对象，作为字符串塞进了它自己的content字段里
-                if raw_content and raw_content.strip().startswith('{'):
+        return result
+
+    def _cache_lookup(self, cache_site: str, completion_params: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+        """返回 (缓存 key, 命中的响应或 None)，并记录调用点命中情况。"""
+        key = make_cache_key(self.model_config.provider_type, completion_params)
+        value, tier = llm_cache.get(key)
+        with self._lock:
+            stats = self._cache_stats.setdefault(cache_site, {"hits": 0, "db_hits": 0, "misses": 0, "stores": 0})
+            if value is None:
+                stats["misses"] += 1
+            else:
+                stats["hits"] += 1
+                if tier == "db":
+                    stats["db_hits"] += 1
+        if value is not None:
+            LOGGER.info(f"[LLMCache] hit | site={cache_site} | tier={tier}")
+        return key, value
+
+    def _cache_store(
+        self,
+        cache_site: str,
+        key: str,
+        result: str,
+        completion_params: Dict[str, Any],
+        cache_validate: Optional[Callable[[str], bool]],
+    ) -> None:
+        # 仅缓存调用方认可的结果，避免把一次异常输出固化到 TTL 结束
+        if cache_validate is not None:
+            try:
+                if not cache_validate(result):
+                    return
+            except Exception:  # noqa: BLE001
+                return
+        llm_cache.put(key, result, cache_site, completion_params.get("model"))
+        with self._lock:
+            self._cache_stats.setdefault(cache_site, {"hits": 0, "db_hits": 0, "misses": 0, "stores": 0})["stores"] += 1
+
+    def _admit(self) -> None:
+        """同步等待限流令牌；熔断或等待超时抛出 LLMUnavailableError。"""
+        deadline = time.monotonic() + max(0.0, float(settings.llm_rate_limit_wait_seconds))
+        while True:
+            wait = self.guard.admit()
+            if wait <= 0:
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.guard.shed_interactive()
+            time.sleep(min(wait, remaining))
+
+    async def _admit_async(self) -> None:
+        """_admit 的异步版本。"""
+        deadline = time.monotonic() + max(0.0, float(settings.llm_rate_limit_wait_seconds))
+        while True:
+            wait = self.guard.admit()
+            if wait <= 0:
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.guard.shed_interactive()
+            await asyncio.sleep(min(wait, remaining))
+
+    def _record_success(self, latency_ms: float, observe_latency: bool = False) -> None:
+        self.guard.record_success()
+        with self._lock:
+            self.calls_total += 1
+            self.last_latency_ms = latency_ms
+            self.total_latency_ms += latency_ms
+            self._latency_count += 1
+            self.last_error = None
+        if observe_latency:
+            self.latency_histogram.observe(latency_ms)
+
+    def _record_usage(
+        self,
+        completion_params: Dict[str, Any],
+        usage: Any,
+        result: Optional[str],
+        call_site: Optional[str] = None,
+    ) -> None:
+        """计入用量统计；提供商未返回 usage 时按消息与输出文本估算。"""
+        prompt_tokens = getattr(usage, 'prompt_tokens', None) if usage else None
+        completion_tokens = getattr(usage, 'completion_tokens', None) if usage else None
+        estimated = prompt_tokens is None or completion_tokens is None
+        if prompt_tokens is None:
+            prompt_tokens = sum(
+                estimate_tokens(str(message.get("content") or "")) for message in completion_params.get("messages", [])
+            )
+        if completion_tokens is None:
+            completion_tokens = estimate_tokens(result or "")
+        usage_tracker.record(
+            model=completion_params.get("model"),
+            traffic=_traffic_class.get(),
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            call_site=call_site,
+            estimated=estimated,
+        )
+
+    def _hedge_target(self) -> Any:
+        """返回备用提供商客户端；未配置、与主提供商相同或初始化失败时返回 None。"""
+        provider = (getattr(settings, "llm_hedge_provider", "") or "").strip().lower()
+        if not provider or self._hedge_disabled:
+            return None
+        if provider == (settings.llm_provider or "").strip().lower():
+            return None
+        if self._hedge_client is None:
+            with self._lock:
+                if self._hedge_client is None and not self._hedge_disabled:
                     try:
-                        # 尝试将这个字符串再次解析为JSON对象
-                        nested_json = json.loads(raw_content.strip())
-                        # 如果成功，就将这个内部的JSON对象重新序列化为字符串返回
-                        # 这确保了 story_engine 收到的是一个纯净的、它期望的JSON字符串
-                        result = json.dumps(nested_json, ensure_ascii=False)
-                        LOGGER.info("[JSON-in-JSON] 检测到并成功解析了嵌套的JSON响应。")
-                    except json.JSONDecodeError:
-                        # 如果再次解析失败，说明它不是一个完整的JSON，按原样返回
-                        result = raw_content
-                else:
-                    # 如果不是以'{'开头，说明是普通文本，按原样返回
-                    result = raw_content
-
-                # 使用情况日志
-                if hasattr(response, 'usage') and response.usage:
-                    LOGGER.info(
-                        f"模型生成成功 - 模型: {completion_params.get('model')}, tokens使用: {response.usage.total_tokens}"
-                    )
-                else:
-                    LOGGER.info(f"模型生成成功 - 模型: {completion_params.get('model')}")
-
-                # 指标更新
-                with self._lock:
-                    self.calls_total += 1
-                    self.last_latency_ms = latency_ms
-                    self.total_latency_ms += latency_ms
-                    self._latency_count += 1
-                    self.last_error = None
-
-                # 尝试输出原始响应（仅 debug 模式）
-                if settings.debug and hasattr(response, 'http_response') and hasattr(response.http_response, 'text'):
-                    LOGGER.debug(f"[RAW RESPONSE] {response.http_response.text}")
+                        self._hedge_client = type(self)(provider_name=provider)
+                    except Exception as exc:  # noqa: BLE001
+                        self._hedge_disabled = True
+                        LOGGER.warning(f"[Hedge] 备用提供商 {provider} 初始化失败，已停用对冲: {exc}")
+                        return None
+        return self._hedge_client
 
-                return result
+    def _hedge_params(self, hedge_client: Any, prompt: str, history, system_preamble_override, temperature, max_tokens):
+        # 模型名覆写只对主提供商有意义，备用提供商使用其自身配置的模型
+        messages = hedge_client._build_messages(prompt, history, system_preamble_override)
+        return hedge_client._build_completion_params(
+            messages, model=None, temperature=temperature, max_tokens=max_tokens
+        )
 
-            except Exception as e:
-                last_exc = e
-                # 最后一轮直接抛出
-                if attempt >= max_tries:
-                    with self._lock:
-                        self.failures_total += 1
-                        self.last_error = str(e)
-                    raise
+    def _record_hedge(self, key: str) -> None:
+        with self._lock:
+            self.hedge_stats[key] += 1
 
-                # 退避等待后重试
-                with self._lock:
-                    self.retries_total += 1
-                delay_ms = random.randint(backoff_min, backoff_max)
-                time.sleep(delay_ms / 1000.0)
+    def _record_retry(self) -> None:
+        with self._lock:
+            self.retries_total += 1
 
-        # 理论上不会到达这里
-        if last_exc:
-            raise last_exc
-        raise RuntimeError("LLM 调用失败（未知错误）")
+    def _record_attempt_failure(self, exc: Exception) -> None:
+        """每次调用尝试失败都计入熔断器（重试前），429 同时收紧令牌桶速率。"""
+        self.guard.record_failure(exc)
+
+    def _record_failure(self, exc: Exception) -> None:
+        with self._lock:
+            self.failures_total += 1
+            self.last_error = str(exc)
 
     def get_metrics(self) -> Dict[str, object]:
         with self._lock:
@@ -300,11 +631,18 @@ class UniversalLLMClient(BaseLLMClient):
                 "last_error": self.last_error,
                 "timeout_seconds": settings.llm_timeout_seconds,
                 "max_retries": settings.llm_max_retries,
+                "cache": {site: dict(stats) for site, stats in self._cache_stats.items()},
+                "latency_ms": self.latency_histogram.snapshot(),
+                "hedge": {
+                    "model": self._hedge_client.model_config.model_name if self._hedge_client else None,
+                    "delay_ms": round(hedge_delay_seconds(self.latency_histogram) * 1000.0, 1),
+                    **self.hedge_stats,
+                    "hedge_latency_ms": self._hedge_client.latency_histogram.snapshot() if self._hedge_client else None,
+                },
             }
 
     def _build_curl_command(self, params: Dict) -> str:
         """根据请求参数动态构建一个可执行的 curl 命令字符串，并写入日志文件"""
-        import json
         import os
         import shlex
 
@@ -328,7 +666,7 @@ class UniversalLLMClient(BaseLLMClient):
         for key, value in headers.items():
             # 使用 -H 'Key: Value' 格式，这是 curl 的标准做法
             header_parts.append(f"-H {shlex.quote(f'{key}: {value}')}")
-        
+
         header_str = ' '.join(header_parts)
 
         # 3. 构建请求体
@@ -352,7 +690,7 @@ class UniversalLLMClient(BaseLLMClient):
             f"{header_str} "
             f"--data-raw {safe_data_str}"
         )
-        
+
         # 5. 将 cURL 命令写入调试日志文件
         try:
             log_dir = os.path.join(settings.BASE_DIR, 'logs')
@@ -367,9 +705,466 @@ class UniversalLLMClient(BaseLLMClient):
         return curl_command
 
 
+class UniversalLLMClient(_UniversalClientMixin, BaseLLMClient):
+    """
+    通用LLM客户端
+    根据配置自动适配不同的模型供应商（豆包、OpenAI、Gemini等）
+    """
+
+    def __init__(self, provider_name: Optional[str] = None):
+        # 获取模型配置：默认为当前提供商，对冲时按名称创建备用提供商
+        self.model_config = get_model_config(provider_name) if provider_name else get_current_config()
+        self.provider_name = provider_name or (settings.llm_provider or "").strip().lower() or "doubao"
+        self.guard = _provider_guard(self.provider_name)
+        self.client: Any = None
+
+        if self.model_config.provider_type == "doubao":
+            if Ark is None:
+                raise ImportError("豆包SDK未安装，请运行: pip install 'volcengine-python-sdk[ark]'")
+            self.client = Ark(
+                base_url=self.model_config.base_url,
+                api_key=self.model_config.api_key,
+                timeout=settings.llm_timeout_seconds
+            )
+            LOGGER.info(f"LLM客户端初始化成功 - 提供商: 豆包 (原生SDK)")
+
+        elif self.model_config.provider_type == "openai":
+            if openai is None:
+                raise ImportError("OpenAI SDK未安装，请运行: pip install openai")
+
+            client_params = self._openai_client_params()
+            limits, timeout = self._http_limits_and_timeout()
+            client_params["http_client"] = httpx.Client(limits=limits, timeout=timeout)
+
+            if settings.debug:
+                loggable_params = {k: v for k, v in client_params.items() if k != 'http_client'}
+                LOGGER.debug(f"[CLIENT PARAMS] {loggable_params}")
+
+            self.client = openai.OpenAI(**client_params)
+            LOGGER.info(f"LLM客户端初始化成功 - 提供商: OpenAI (兼容层)")
+
+        elif self.model_config.provider_type == "mock":
+            self.client = MockChatClient(self.model_config.raw_config)
+            LOGGER.info(f"LLM客户端初始化成功 - 提供商: 离线模拟 (mock)")
+
+        else:
+            raise ValueError(f"不支持的 provider_type: {self.model_config.provider_type}")
+
+        LOGGER.info(f"模型: {self.model_config.model_name}")
+        LOGGER.info(f"API地址: {self.model_config.base_url}")
+
+        self._init_metrics()
+
+    def generate(
+        self,
+        prompt: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        *,
+        model: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        system_preamble_override: Optional[str] = None,
+        cache_site: Optional[str] = None,
+        cache_validate: Optional[Callable[[str], bool]] = None,
+        hedge_validate: Optional[Callable[[str], bool]] = None,
+        usage_site: Optional[str] = None,
+    ) -> str:
+        """
+        生成文本（支持按调用覆写模型/采样参数）
+        cache_site 非空时启用响应缓存并按该调用点统计命中；cache_validate 返回 False 的结果不写入缓存。
+        hedge_validate 非空且配置了 llm_hedge_provider 时允许对冲；返回 False 的响应不算有效结果。
+        usage_site 为用量统计中的调用点（start / continue / settlement 等），对冲请求的用量一并计入。
+        """
+        messages = self._build_messages(prompt, history, system_preamble_override)
+        completion_params = self._build_completion_params(
+            messages, model=model, temperature=temperature, max_tokens=max_tokens
+        )
+        cache_key: Optional[str] = None
+        if cache_site and llm_cache.enabled:
+            cache_key, cached = self._cache_lookup(cache_site, completion_params)
+            if cached is not None:
+                return cached
+
+        hedge_client = self._hedge_target() if hedge_validate is not None else None
+        with usage_scope(call_site=usage_site):
+            if hedge_client is not None:
+                hedge_params = self._hedge_params(hedge_client, prompt, history, system_preamble_override, temperature, max_tokens)
+                result = self._generate_hedged(completion_params, hedge_client, hedge_params, hedge_validate)
+            else:
+                result = self._generate_once(completion_params, observe_latency=hedge_validate is not None)
+        if cache_key:
+            self._cache_store(cache_site, cache_key, result, completion_params, cache_validate)
+        return result
+
+    def _generate_hedged(
+        self,
+        completion_params: Dict[str, Any],
+        hedge_client: "UniversalLLMClient",
+        hedge_params: Dict[str, Any],
+        validate: Callable[[str], bool],
+    ) -> str:
+        """
+        主请求在对冲延迟内返回则直接采用；否则向备用提供商并发同一请求，取先返回的有效结果。
+        同步 HTTP 调用无法中途中断，落败的一方在线程池中跑完后结果被丢弃。
+        """
+        executor = hedge_executor()
+        # 线程池不会继承调用方上下文，显式复制以保留流量类别
+        primary = executor.submit(contextvars.copy_context().run, self._generate_once, completion_params, True)
+        delay = hedge_delay_seconds(self.latency_histogram)
+        try:
+            return primary.result(timeout=delay)
+        except concurrent.futures.TimeoutError:
+            pass
+        except LLMUnavailableError:
+            # 主提供商熔断或限流：直接改走备用提供商
+            self._record_hedge("failover")
+            return hedge_client._generate_once(hedge_params, observe_latency=True)
+
+        LOGGER.info(f"[Hedge] 主请求 {delay:.2f}s 未返回，向备用提供商发出对冲 | model={hedge_client.model_config.model_name}")
+        self._record_hedge("fired")
+        hedge = executor.submit(contextvars.copy_context().run, hedge_client._generate_once, hedge_params, True)
+        pending = {primary: "primary_won", hedge: "hedge_won"}
+        fallback: Optional[str] = None
+        first_exc: Optional[BaseException] = None
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for fut in done:
+                outcome = pending.pop(fut)
+                exc = fut.exception()
+                if exc is not None:
+                    first_exc = first_exc or exc
+                    continue
+                result = fut.result()
+                if is_valid_response(validate, result):
+                    for other in pending:
+                        other.cancel()
+                    self._record_hedge(outcome)
+                    return result
+                self._record_hedge("invalid")
+                fallback = fallback if fallback is not None else result
+        # 两路都没有有效结果：退回任一原始响应交由调用方的修复流程，全部失败则抛出首个异常
+        if fallback is not None:
+            return fallback
+        self._record_hedge("failed")
+        raise first_exc
+
+    def _generate_once(self, completion_params: Dict[str, Any], observe_latency: bool = False) -> str:
+        """按重试策略完成一次模型调用（不经过缓存与对冲）；observe_latency 为真时计入对冲延迟分布。"""
+        max_tries, backoff_min, backoff_max = self._retry_policy()
+
+        attempt = 0
+        last_exc: Optional[Exception] = None
+        while attempt < max_tries:
+            attempt += 1
+            self._admit()
+            start = time.perf_counter()
+            try:
+                # 根据客户端类型调用
+                if self.model_config.provider_type == 'doubao':
+                    # 豆包原生SDK调用
+                    response = self.client.chat.completions.create(**completion_params)
+                else: # openai
+                    # OpenAI 兼容层调用，带 response_format 回退逻辑
+                    try:
+                        response = self.client.chat.completions.create(**completion_params)
+                    except Exception as e:
+                        retry_params = self._response_format_fallback_params(completion_params, e)
+                        if retry_params is None:
+                            raise
+                        response = self.client.chat.completions.create(**retry_params)
+
+                # 成功
+                latency_ms = (time.perf_counter() - start) * 1000.0
+                result = self._extract_result(response, completion_params)
+                self._record_success(latency_ms, observe_latency)
+                return result
+
+            except Exception as e:
+                last_exc = e
+                self._record_attempt_failure(e)
+                # 最后一轮直接抛出
+                if attempt >= max_tries:
+                    self._record_failure(e)
+                    raise
+
+                # 退避等待后重试
+                self._record_retry()
+                delay_ms = random.randint(backoff_min, backoff_max)
+                time.sleep(delay_ms / 1000.0)
+
+        # 理论上不会到达这里
+        if last_exc:
+            raise last_exc
+        raise RuntimeError("LLM 调用失败（未知错误）")
+
+
+class AsyncUniversalLLMClient(_UniversalClientMixin):
+    """
+    通用LLM客户端的 asyncio 版本
+    与 UniversalLLMClient 共享重试、退避、response_format 回退与指标语义，
+    供 async 路由在不阻塞事件循环的前提下等待模型返回。
+    """
+
+    def __init__(self, provider_name: Optional[str] = None):
+        self.model_config = get_model_config(provider_name) if provider_name else get_current_config()
+        self.provider_name = provider_name or (settings.llm_provider or "").strip().lower() or "doubao"
+        self.guard = _provider_guard(self.provider_name)
+        self.client: Any = None
+
+        if self.model_config.provider_type == "doubao":
+            if AsyncArk is None:
+                raise ImportError("豆包SDK未安装，请运行: pip install 'volcengine-python-sdk[ark]'")
+            self.client = AsyncArk(
+                base_url=self.model_config.base_url,
+                api_key=self.model_config.api_key,
+                timeout=settings.llm_timeout_seconds
+            )
+            LOGGER.info(f"异步LLM客户端初始化成功 - 提供商: 豆包 (原生SDK)")
+
+        elif self.model_config.provider_type == "openai":
+            if openai is None:
+                raise ImportError("OpenAI SDK未安装，请运行: pip install openai")
+
+            client_params = self._openai_client_params()
+            limits, timeout = self._http_limits_and_timeout()
+            client_params["http_client"] = httpx.AsyncClient(limits=limits, timeout=timeout)
+            self.client = openai.AsyncOpenAI(**client_params)
+            LOGGER.info(f"异步LLM客户端初始化成功 - 提供商: OpenAI (兼容层)")
+
+        elif self.model_config.provider_type == "mock":
+            self.client = AsyncMockChatClient(self.model_config.raw_config)
+            LOGGER.info(f"异步LLM客户端初始化成功 - 提供商: 离线模拟 (mock)")
+
+        else:
+            raise ValueError(f"不支持的 provider_type: {self.model_config.provider_type}")
+
+        self._init_metrics()
+
+    async def generate(
+        self,
+        prompt: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        *,
+        model: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        system_preamble_override: Optional[str] = None,
+        cache_site: Optional[str] = None,
+        cache_validate: Optional[Callable[[str], bool]] = None,
+        hedge_validate: Optional[Callable[[str], bool]] = None,
+        usage_site: Optional[str] = None,
+    ) -> str:
+        """异步生成文本（参数与 UniversalLLMClient.generate 一致）"""
+        messages = self._build_messages(prompt, history, system_preamble_override)
+        completion_params = self._build_completion_params(
+            messages, model=model, temperature=temperature, max_tokens=max_tokens
+        )
+        cache_key: Optional[str] = None
+        if cache_site and llm_cache.enabled:
+            # 共享层需访问数据库，放到线程中避免阻塞事件循环
+            if llm_cache.uses_db:
+                cache_key, cached = await asyncio.to_thread(self._cache_lookup, cache_site, completion_params)
+            else:
+                cache_key, cached = self._cache_lookup(cache_site, completion_params)
+            if cached is not None:
+                return cached
+
+        hedge_client = self._hedge_target() if hedge_validate is not None else None
+        with usage_scope(call_site=usage_site):
+            if hedge_client is not None:
+                hedge_params = self._hedge_params(hedge_client, prompt, history, system_preamble_override, temperature, max_tokens)
+                result = await self._generate_hedged(completion_params, hedge_client, hedge_params, hedge_validate)
+            else:
+                result = await self._generate_once(completion_params, observe_latency=hedge_validate is not None)
+        if cache_key:
+            if llm_cache.uses_db:
+                await asyncio.to_thread(
+                    self._cache_store, cache_site, cache_key, result, completion_params, cache_validate
+                )
+            else:
+                self._cache_store(cache_site, cache_key, result, completion_params, cache_validate)
+        return result
+
+    async def _generate_hedged(
+        self,
+        completion_params: Dict[str, Any],
+        hedge_client: "AsyncUniversalLLMClient",
+        hedge_params: Dict[str, Any],
+        validate: Callable[[str], bool],
+    ) -> str:
+        """UniversalLLMClient._generate_hedged 的异步版本：落败的一方直接取消。"""
+        started = time.perf_counter()
+        primary = asyncio.create_task(self._generate_once(completion_params, observe_latency=True))
+        pending = {primary: "primary_won"}
+        try:
+            delay = hedge_delay_seconds(self.latency_histogram)
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                pending.pop(primary)
+                if isinstance(primary.exception(), LLMUnavailableError):
+                    self._record_hedge("failover")
+                    return await hedge_client._generate_once(hedge_params, observe_latency=True)
+                return primary.result()
+
+            LOGGER.info(f"[Hedge] 主请求 {delay:.2f}s 未返回，向备用提供商发出对冲 | model={hedge_client.model_config.model_name}")
+            self._record_hedge("fired")
+            pending[asyncio.create_task(hedge_client._generate_once(hedge_params, observe_latency=True))] = "hedge_won"
+            fallback: Optional[str] = None
+            first_exc: Optional[BaseException] = None
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    outcome = pending.pop(task)
+                    exc = task.exception()
+                    if exc is not None:
+                        first_exc = first_exc or exc
+                        continue
+                    result = task.result()
+                    if is_valid_response(validate, result):
+                        self._record_hedge(outcome)
+                        return result
+                    self._record_hedge("invalid")
+                    fallback = fallback if fallback is not None else result
+            if fallback is not None:
+                return fallback
+            self._record_hedge("failed")
+            raise first_exc
+        finally:
+            for task in pending:
+                task.cancel()
+            if primary in pending:
+                # 被取消的主请求以已等待时长作为延迟下界记入直方图，避免慢请求从分布中消失而压低阈值
+                self.latency_histogram.observe((time.perf_counter() - started) * 1000.0)
+
+    async def _generate_once(self, completion_params: Dict[str, Any], observe_latency: bool = False) -> str:
+        """按重试策略完成一次模型调用（不经过缓存与对冲）；observe_latency 为真时计入对冲延迟分布。"""
+        max_tries, backoff_min, backoff_max = self._retry_policy()
+
+        attempt = 0
+        last_exc: Optional[Exception] = None
+        while attempt < max_tries:
+            attempt += 1
+            await self._admit_async()
+            start = time.perf_counter()
+            try:
+                if self.model_config.provider_type == 'doubao':
+                    response = await self.client.chat.completions.create(**completion_params)
+                else: # openai
+                    try:
+                        response = await self.client.chat.completions.create(**completion_params)
+                    except Exception as e:
+                        retry_params = self._response_format_fallback_params(completion_params, e)
+                        if retry_params is None:
+                            raise
+                        response = await self.client.chat.completions.create(**retry_params)
+
+                latency_ms = (time.perf_counter() - start) * 1000.0
+                result = self._extract_result(response, completion_params)
+                self._record_success(latency_ms, observe_latency)
+                return result
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                last_exc = e
+                self._record_attempt_failure(e)
+                if attempt >= max_tries:
+                    self._record_failure(e)
+                    raise
+
+                self._record_retry()
+                delay_ms = random.randint(backoff_min, backoff_max)
+                await asyncio.sleep(delay_ms / 1000.0)
+
+        if last_exc:
+            raise last_exc
+        raise RuntimeError("LLM 调用失败（未知错误）")
+
+    async def _open_stream(self, completion_params: Dict[str, Any]) -> Any:
+        stream_params = dict(completion_params)
+        stream_params["stream"] = True
+        if self.model_config.provider_type == 'doubao':
+            return await self.client.chat.completions.create(**stream_params)
+        try:
+            return await self.client.chat.completions.create(**stream_params)
+        except Exception as e:
+            retry_params = self._response_format_fallback_params(stream_params, e)
+            if retry_params is None:
+                raise
+            return await self.client.chat.completions.create(**retry_params)
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        *,
+        model: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        system_preamble_override: Optional[str] = None,
+        usage_site: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """
+        流式生成文本，逐段产出模型返回的增量内容。
+        仅在收到首个增量之前按重试策略重试；一旦开始产出，中途失败直接抛出，由调用方决定回退。
+        流式响应通常不带 usage，用量按输入消息与已产出文本估算。
+        """
+        messages = self._build_messages(prompt, history, system_preamble_override)
+        completion_params = self._build_completion_params(
+            messages, model=model, temperature=temperature, max_tokens=max_tokens
+        )
+        max_tries, backoff_min, backoff_max = self._retry_policy()
+
+        attempt = 0
+        while True:
+            attempt += 1
+            await self._admit_async()
+            start = time.perf_counter()
+            emitted = False
+            parts: List[str] = []
+            usage = None
+            try:
+                stream = await self._open_stream(completion_params)
+                async for chunk in stream:
+                    usage = getattr(chunk, "usage", None) or usage
+                    choices = getattr(chunk, "choices", None)
+                    if not choices:
+                        continue
+                    delta = getattr(choices[0], "delta", None)
+                    content = getattr(delta, "content", None) if delta is not None else None
+                    if content:
+                        emitted = True
+                        parts.append(content)
+                        yield content
+
+                latency_ms = (time.perf_counter() - start) * 1000.0
+                LOGGER.info(f"模型流式生成完成 - 模型: {completion_params.get('model')}")
+                self._record_success(latency_ms)
+                self._record_usage(completion_params, usage, "".join(parts), call_site=usage_site)
+                return
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._record_attempt_failure(e)
+                if emitted or attempt >= max_tries:
+                    self._record_failure(e)
+                    raise
+
+                self._record_retry()
+                delay_ms = random.randint(backoff_min, backoff_max)
+                await asyncio.sleep(delay_ms / 1000.0)
+
+
  # 全局客户端实例
 llm_client = UniversalLLMClient()
+async_llm_client = AsyncUniversalLLMClient()
 
 def generate_text(prompt: str, history: Optional[List[Dict[str, str]]] = None, **kwargs) -> str:
     """统一便捷入口：返回字符串文本。可通过kwargs覆写 model/temperature/max_tokens。"""
     return llm_client.generate(prompt, history=history, **kwargs)
+
+
+async def agenerate_text(prompt: str, history: Optional[List[Dict[str, str]]] = None, **kwargs) -> str:
+    """generate_text 的异步版本。"""
+    return await async_llm_client.generate(prompt, history=history, **kwargs)
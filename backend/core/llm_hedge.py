@@ -0,0 +1,104 @@
+"""
+LLM 对冲请求（hedged request）
+主提供商在延迟阈值内未返回时，向备用提供商并发同一请求，取先返回的有效结果，降低尾延迟（P99）。
+延迟阈值取主提供商近期延迟直方图的分位数（默认 p95），样本不足时使用固定默认值；
+因此只有最慢的约 5% 请求会触发对冲，额外成本有限。
+"""
+
+from __future__ import annotations
+
+import bisect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from config.settings import settings
+
+# 直方图桶上界（毫秒）：10ms 起按 1.25 倍递增至约 5 分钟
+_BUCKET_BOUNDS: List[float] = []
+_bound = 10.0
+while _bound < 300_000.0:
+    _BUCKET_BOUNDS.append(round(_bound, 1))
+    _bound *= 1.25
+_BUCKET_BOUNDS.append(float("inf"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+class LatencyHistogram:
+    """
+    固定对数分桶的延迟直方图，线程安全。
+    样本数超过 max_samples 时所有桶计数减半，使分位数逐步跟随近期延迟变化。
+    """
+
+    def __init__(self, max_samples: int = 2000) -> None:
+        self.max_samples = max(10, int(max_samples))
+        self._lock = threading.Lock()
+        self._counts = [0] * len(_BUCKET_BOUNDS)
+        self._total = 0
+
+    def observe(self, latency_ms: float) -> None:
+        index = bisect.bisect_left(_BUCKET_BOUNDS, max(0.0, float(latency_ms)))
+        with self._lock:
+            self._counts[index] += 1
+            self._total += 1
+            if self._total > self.max_samples:
+                self._counts = [c // 2 for c in self._counts]
+                self._total = sum(self._counts)
+
+    @property
+    def count(self) -> int:
+        with self._lock:
+            return self._total
+
+    def quantile(self, q: float) -> Optional[float]:
+        """返回分位数所在桶的上界（毫秒）；没有样本时返回 None。"""
+        with self._lock:
+            if not self._total:
+                return None
+            target = max(1, int(q * self._total + 0.999999))
+            cumulative = 0
+            for bound, count in zip(_BUCKET_BOUNDS, self._counts):
+                cumulative += count
+                if cumulative >= target:
+                    return bound if bound != float("inf") else _BUCKET_BOUNDS[-2]
+        return None
+
+    def snapshot(self) -> Dict[str, Optional[float]]:
+        return {
+            "count": self.count,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+def hedge_delay_seconds(histogram: LatencyHistogram) -> float:
+    """按主提供商延迟分位数计算对冲延迟，并限制在 [min, max] 区间内。"""
+    delay_ms = float(getattr(settings, "llm_hedge_default_delay_ms", 8000))
+    if histogram.count >= int(getattr(settings, "llm_hedge_min_samples", 20)):
+        observed = histogram.quantile(float(getattr(settings, "llm_hedge_quantile", 0.95)))
+        if observed is not None:
+            delay_ms = observed
+    lo = float(getattr(settings, "llm_hedge_min_delay_ms", 500))
+    hi = max(lo, float(getattr(settings, "llm_hedge_max_delay_ms", 30000)))
+    return min(max(delay_ms, lo), hi) / 1000.0
+
+
+def is_valid_response(validate: Callable[[str], bool], result: str) -> bool:
+    try:
+        return bool(validate(result))
+    except Exception:  # noqa: BLE001
+        return False
+
+
+def hedge_executor() -> ThreadPoolExecutor:
+    """同步客户端对冲时使用的共享线程池（惰性创建）。"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = max(2, int(getattr(settings, "llm_hedge_max_workers", 64)))
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm_hedge")
+    return _executor
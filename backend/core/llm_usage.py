@@ -0,0 +1,233 @@
+"""
+LLM 用量统计
+每次模型调用成功后按 (调用点, 流量类别, 模型, 用户, 会话) 记录提示/生成 token 数：
+- 调用点由 generate(usage_site=...) 指定，用户与会话由路由或后台任务通过 usage_scope / bind_usage 绑定到上下文；
+- 进程内保留累计值（按调用点/流量类别汇总，按用户/会话各保留最近若干个），供 /api/story/metrics 查看；
+- 增量按小时分桶定期刷入 llm_usage 表（upsert 累加），多 worker 的数据在库里汇总，
+  用于计算每个正式节点的 token 成本，据此调整预推演深度与 level_cap。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+from config.logging_config import LOGGER
+from config.settings import settings
+
+# 进程内按用户/会话保留的条目上限，超出时淘汰最久未更新的
+_MAX_TRACKED = 5000
+
+_scope: ContextVar[Dict[str, Any]] = ContextVar("llm_usage_scope", default={})
+# 当前上下文的计量器（usage_meter），用于统计单个任务消耗的 token
+_meter: ContextVar[Optional[Dict[str, int]]] = ContextVar("llm_usage_meter", default=None)
+
+_UsageKey = Tuple[str, int, str, str, str]  # (user_id, session_id, call_site, traffic, model)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：CJK 字符按 1 个计，其余字符按 4 个 1 token 计。"""
+    cjk = sum(1 for ch in text if ord(ch) > 0x2E80)
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _merged_scope(fields: Dict[str, Any]) -> Dict[str, Any]:
+    merged = dict(_scope.get())
+    merged.update({key: value for key, value in fields.items() if value is not None})
+    return merged
+
+
+def bind_usage(**fields: Any) -> None:
+    """
+    把 user_id / session_id 等绑定到当前上下文，直到上下文结束。
+    适用于 async 路由（每个请求独立的任务上下文）与专用后台线程的入口；复用的线程池线程请使用 usage_scope。
+    """
+    _scope.set(_merged_scope(fields))
+
+
+@contextmanager
+def usage_scope(**fields: Any):
+    """在该上下文内发出的模型调用计入给定的 user_id / session_id / call_site。"""
+    token = _scope.set(_merged_scope(fields))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+@contextmanager
+def usage_meter():
+    """统计该上下文内所有模型调用的用量，返回的计数器在上下文结束后仍可读取（含复制上下文的对冲线程）。"""
+    meter = _empty_counter()
+    token = _meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _meter.reset(token)
+
+
+def current_scope() -> Dict[str, Any]:
+    return dict(_scope.get())
+
+
+def _empty_counter() -> Dict[str, int]:
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+
+def _add(counter: Dict[str, int], prompt_tokens: int, completion_tokens: int) -> None:
+    counter["calls"] += 1
+    counter["prompt_tokens"] += prompt_tokens
+    counter["completion_tokens"] += completion_tokens
+
+
+class UsageTracker:
+    """进程内 token 用量聚合，并按 llm_usage_flush_seconds 周期刷入数据库。"""
+
+    def __init__(self) -> None:
+        self.enabled = bool(getattr(settings, "llm_usage_enabled", True))
+        self.flush_seconds = max(5.0, float(getattr(settings, "llm_usage_flush_seconds", 60)))
+        self._lock = threading.Lock()
+        self._by_site: Dict[str, Dict[str, int]] = {}
+        self._by_traffic: Dict[str, Dict[str, int]] = {}
+        self._by_user: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+        self._by_session: "OrderedDict[int, Dict[str, int]]" = OrderedDict()
+        self._pending: Dict[_UsageKey, Dict[str, int]] = {}
+        self._flusher: Optional[threading.Thread] = None
+
+        # --- Metrics ---
+        self.estimated_total = 0
+        self.flushed_rows_total = 0
+        self.flush_failed_total = 0
+        self.last_flush_at: Optional[float] = None
+
+    def record(
+        self,
+        *,
+        model: Optional[str],
+        traffic: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        call_site: Optional[str] = None,
+        estimated: bool = False,
+    ) -> None:
+        """记录一次成功的模型调用；call_site 为空时取上下文中绑定的调用点。"""
+        prompt_tokens = max(0, int(prompt_tokens or 0))
+        completion_tokens = max(0, int(completion_tokens or 0))
+        meter = _meter.get()
+        if meter is not None:
+            with self._lock:
+                _add(meter, prompt_tokens, completion_tokens)
+        if not self.enabled:
+            return
+        scope = _scope.get()
+        site = call_site or scope.get("call_site") or "other"
+        user_id = str(scope.get("user_id") or "")
+        session_id = int(scope.get("session_id") or 0)
+        key: _UsageKey = (user_id, session_id, site, traffic, (model or "")[:100])
+        with self._lock:
+            _add(self._by_site.setdefault(site, _empty_counter()), prompt_tokens, completion_tokens)
+            _add(self._by_traffic.setdefault(traffic, _empty_counter()), prompt_tokens, completion_tokens)
+            if user_id:
+                _add(self._touch(self._by_user, user_id), prompt_tokens, completion_tokens)
+            if session_id:
+                _add(self._touch(self._by_session, session_id), prompt_tokens, completion_tokens)
+            _add(self._pending.setdefault(key, _empty_counter()), prompt_tokens, completion_tokens)
+            if estimated:
+                self.estimated_total += 1
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="llm_usage_flush", daemon=True)
+                self._flusher.start()
+
+    def session_usage(self, session_id: int) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._by_session.get(int(session_id)) or _empty_counter())
+
+    def user_usage(self, user_id: str) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._by_user.get(str(user_id)) or _empty_counter())
+
+    def flush(self) -> int:
+        """把未落库的增量写入 llm_usage 表（数据库当前小时桶），返回写入的行数；失败时增量保留到下次。"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        from database.base import SessionLocal
+        from database import crud
+
+        rows = [
+            {
+                "user_id": user_id,
+                "session_id": session_id,
+                "call_site": site,
+                "traffic": traffic,
+                "model": model,
+                **counter,
+            }
+            for (user_id, session_id, site, traffic, model), counter in pending.items()
+        ]
+        db = SessionLocal()
+        try:
+            crud.add_llm_usage(db, rows)
+        except Exception as exc:  # noqa: BLE001
+            db.rollback()
+            with self._lock:
+                self.flush_failed_total += 1
+                for key, counter in pending.items():
+                    target = self._pending.setdefault(key, _empty_counter())
+                    for field, value in counter.items():
+                        target[field] += value
+            LOGGER.warning(f"[Usage] 用量落库失败，将在下次重试 | rows={len(rows)} | error={exc}")
+            return 0
+        finally:
+            db.close()
+        with self._lock:
+            self.flushed_rows_total += len(rows)
+            self.last_flush_at = time.time()
+        return len(rows)
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            totals = _empty_counter()
+            for counter in self._by_site.values():
+                for field, value in counter.items():
+                    totals[field] += value
+            return {
+                "enabled": self.enabled,
+                "flush_seconds": self.flush_seconds,
+                **totals,
+                "by_call_site": {site: dict(counter) for site, counter in sorted(self._by_site.items())},
+                "by_traffic": {traffic: dict(counter) for traffic, counter in sorted(self._by_traffic.items())},
+                "tracked_users": len(self._by_user),
+                "tracked_sessions": len(self._by_session),
+                "estimated_total": self.estimated_total,
+                "pending_rows": len(self._pending),
+                "flushed_rows_total": self.flushed_rows_total,
+                "flush_failed_total": self.flush_failed_total,
+                "last_flush_at": self.last_flush_at,
+            }
+
+    # --- internal ---
+
+    @staticmethod
+    def _touch(table: "OrderedDict", key: Any) -> Dict[str, int]:
+        counter = table.pop(key, None) or _empty_counter()
+        table[key] = counter
+        while len(table) > _MAX_TRACKED:
+            table.popitem(last=False)
+        return counter
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as exc:  # noqa: BLE001
+                LOGGER.warning(f"[Usage] 用量刷新线程异常 | error={exc}")
+
+
+usage_tracker = UsageTracker()
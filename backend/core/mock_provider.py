@@ -0,0 +1,229 @@
+"""
+离线模拟提供商（provider_type: "mock"）
+不访问网络，按提示词内容返回结构合法的输出，供压测与基准在本机复现完整链路：
+- LLM：节点 / 结算 / 愿望审核 / 关卡元信息 / 滚动摘要的 JSON（或 true），同一提示词输出固定；
+- 图像：返回本服务 /static 下预置图片的地址，无需下载；
+- 延迟服从对数正态分布（latency_ms.median / sigma / max），按 failure_rate 返回 503、throttle_rate 返回 429，
+  seed 固定时延迟与故障注入序列可复现。
+以上参数均在 LLM_PROVIDERS / IMAGE_PROVIDERS 的 mock 条目中配置。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+
+from config.settings import settings, resolve_public_base_url
+
+from .llm_usage import estimate_tokens
+
+_SCENES = [
+    "夜色渐深，营帐外的号角声此起彼伏，你握紧手中的军报，意识到局势远比想象中凶险。",
+    "朝堂之上群臣噤声，老臣的目光在你与丞相之间游移，所有人都在等你先开口。",
+    "城门口的商队带来了北方的消息：边军粮草告急，流民已逼近关隘。",
+    "密信上只有寥寥数语，字迹却是你再熟悉不过的那位故人。",
+    "暴雨冲垮了驿道，援军迟迟未至，帐下诸将的耐心正在一点点耗尽。",
+    "市井间的流言愈演愈烈，有人说你早已暗中投靠了敌国。",
+    "你在旧档案中发现了一处被刻意抹去的记录，它或许能改变整场棋局。",
+    "晨雾未散，敌军的斥候已出现在对岸的山脊上。",
+]
+_ACTIONS = ["固守待援", "连夜突围", "遣使议和", "暗中联络旧部", "散布疑兵", "亲赴前线", "整顿内务", "收买人心", "按兵不动"]
+_SUMMARIES = ["稳妥但错失良机", "收益大而风险高", "以退为进换取时间", "暗处布局等待时机"]
+
+
+class MockProviderError(RuntimeError):
+    """模拟的提供商错误；status_code 供熔断/限流逻辑识别（429 视为限流）。"""
+
+    def __init__(self, status_code: int, message: str) -> None:
+        super().__init__(f"Error code: {status_code} - {message}")
+        self.status_code = status_code
+
+
+class _FaultModel:
+    """按配置采样延迟与故障；多个客户端共享同一提供商条目时各自持有独立的随机序列。"""
+
+    def __init__(self, config: Dict[str, Any]) -> None:
+        latency = config.get("latency_ms") or {}
+        self.median_ms = max(0.0, float(latency.get("median", 800)))
+        self.sigma = max(0.0, float(latency.get("sigma", 0.5)))
+        self.max_ms = max(self.median_ms, float(latency.get("max", 30000)))
+        self.failure_rate = min(1.0, max(0.0, float(config.get("failure_rate", 0.0))))
+        self.throttle_rate = min(1.0, max(0.0, float(config.get("throttle_rate", 0.0))))
+        seed = config.get("seed")
+        self._rng = random.Random(seed) if seed is not None else random.Random()
+        self._lock = threading.Lock()
+
+    def sample(self) -> tuple[float, Optional[MockProviderError]]:
+        """返回 (延迟秒数, 需抛出的错误或 None)。"""
+        with self._lock:
+            delay_ms = self.median_ms * math.exp(self._rng.gauss(0.0, self.sigma)) if self.median_ms else 0.0
+            roll = self._rng.random()
+        error: Optional[MockProviderError] = None
+        if roll < self.throttle_rate:
+            error = MockProviderError(429, "Too Many Requests (mock)")
+        elif roll < self.throttle_rate + self.failure_rate:
+            error = MockProviderError(503, "Service Unavailable (mock)")
+        return min(delay_ms, self.max_ms) / 1000.0, error
+
+
+def _rng_for(text: str) -> random.Random:
+    return random.Random(int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big"))
+
+
+def _node(rng: random.Random) -> Dict[str, Any]:
+    scenes = rng.sample(_SCENES, 3)
+    actions = rng.sample(_ACTIONS, 3)
+    return {
+        "text": "".join(scenes),
+        "choices": [
+            {
+                "option": action,
+                "summary": rng.choice(_SUMMARIES),
+                "effects": {
+                    "delta_progress": rng.randint(-2, 12),
+                    "delta_risk": rng.randint(-3, 10),
+                    "delta_exposure": rng.randint(-2, 8),
+                    "tags": [rng.choice(["military", "politics", "intrigue", "economy"])],
+                },
+            }
+            for action in actions
+        ],
+        "image_prompts": ["写实风 " + scenes[0][:20]],
+        "image_continuity_token": f"mock-{rng.randint(1000, 9999)}",
+    }
+
+
+def mock_completion_text(messages: List[Dict[str, Any]]) -> str:
+    """按提示词类型生成固定的模拟输出；识别规则与各调用点的提示词模板保持一致。"""
+    joined = "\n".join(str(m.get("content") or "") for m in messages)
+    rng = _rng_for(joined)
+    if "只能回答'true'或'false'" in joined:
+        return "true"
+    if "chapter_summary" in joined:
+        return json.dumps({
+            "chapter_summary": "本章在权衡与取舍中落幕，你的决定改变了众人的命运。",
+            "timeline": [],
+            "key_impacts": ["局势趋稳", "旧部归心"],
+            "next_chapter_hook": "远方传来的一封急报，预示着新的风暴。",
+            "cover_image_prompt": "写实风 章末总结 构图严谨 光影凝重",
+        }, ensure_ascii=False)
+    if "只允许输出 summary 这一个键" in joined:
+        return json.dumps({"summary": "".join(rng.sample(_SCENES, 2))}, ensure_ascii=False)
+    if "level_title" in joined:
+        return json.dumps({
+            "level_title": "风起之时",
+            "background": "".join(rng.sample(_SCENES, 3)),
+            "main_quest": "在各方势力察觉之前稳住局面",
+        }, ensure_ascii=False)
+    return json.dumps(_node(rng), ensure_ascii=False)
+
+
+def _response(params: Dict[str, Any]) -> Any:
+    content = mock_completion_text(params.get("messages") or [])
+    prompt_tokens = sum(estimate_tokens(str(m.get("content") or "")) for m in params.get("messages") or [])
+    completion_tokens = estimate_tokens(content)
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        ),
+    )
+
+
+def _chunks(content: str, size: int) -> Iterator[Any]:
+    for start in range(0, len(content), size):
+        delta = SimpleNamespace(content=content[start:start + size])
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+
+class _Completions:
+    def __init__(self, faults: _FaultModel) -> None:
+        self._faults = faults
+
+    def create(self, **params: Any) -> Any:
+        delay, error = self._faults.sample()
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return _response(params)
+
+
+class _AsyncCompletions:
+    def __init__(self, faults: _FaultModel, chunk_chars: int) -> None:
+        self._faults = faults
+        self._chunk_chars = chunk_chars
+
+    async def create(self, **params: Any) -> Any:
+        delay, error = self._faults.sample()
+        if not params.get("stream"):
+            await asyncio.sleep(delay)
+            if error is not None:
+                raise error
+            return _response(params)
+        # 流式：首包等待约三分之一的延迟，其余均摊到各段增量之间
+        await asyncio.sleep(delay / 3.0)
+        if error is not None:
+            raise error
+        content = mock_completion_text(params.get("messages") or [])
+        pieces = list(_chunks(content, self._chunk_chars))
+        gap = (delay * 2.0 / 3.0) / max(1, len(pieces))
+
+        async def _stream():
+            for piece in pieces:
+                await asyncio.sleep(gap)
+                yield piece
+
+        return _stream()
+
+
+class MockChatClient:
+    """与 OpenAI SDK 同形的同步客户端：client.chat.completions.create(**params)。"""
+
+    def __init__(self, config: Dict[str, Any]) -> None:
+        self.base_url = config.get("base_url", "mock://local")
+        self.chat = SimpleNamespace(completions=_Completions(_FaultModel(config)))
+
+
+class AsyncMockChatClient:
+    """MockChatClient 的异步版本，支持 stream=True。"""
+
+    def __init__(self, config: Dict[str, Any]) -> None:
+        self.base_url = config.get("base_url", "mock://local")
+        chunk_chars = max(1, int(config.get("stream_chunk_chars", 12)))
+        self.chat = SimpleNamespace(completions=_AsyncCompletions(_FaultModel(config), chunk_chars))
+
+
+class MockImageBackend:
+    """模拟图像生成：按提示词固定挑选一张预置图片，返回其在本服务 /static 下的地址。"""
+
+    def __init__(self, config: Dict[str, Any]) -> None:
+        self._faults = _FaultModel(config)
+        images_dir = settings.BASE_DIR / "assets" / "images"
+        try:
+            names = sorted(
+                name for name in os.listdir(images_dir)
+                if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")) and "placeholder" not in name
+            )
+        except OSError:
+            names = []
+        self._images = names
+
+    def generate(self, prompt: str) -> str:
+        delay, error = self._faults.sample()
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        if not self._images:
+            raise MockProviderError(500, "assets/images 中没有可用的预置图片 (mock)")
+        name = self._images[_rng_for(prompt).randrange(len(self._images))]
+        return f"![image]({resolve_public_base_url()}/static/{name})"
@@ -61,6 +61,13 @@ class OpenAIConfig(ModelConfig):
         super().__init__("openai")
 
 
+class MockConfig(ModelConfig):
+    """离线模拟提供商配置（压测/基准用，不访问网络）"""
+    def __init__(self):
+        super().__init__("mock")
+        self.raw_config = settings.LLM_PROVIDERS["mock"]
+
+
 
 
 # 模型配置映射
@@ -68,6 +75,7 @@ MODEL_CONFIGS = {
     "doubao": DoubaoConfig,
     "openai": OpenAIConfig,
     "dashscope": SiliconFlowConfig, # 复用OpenAI兼容配置类
+    "mock": MockConfig,
 }
 
 
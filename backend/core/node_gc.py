@@ -0,0 +1,169 @@
+"""
+预推演节点回收
+预推演与回溯（prune_story_after_node）会留下大量从未被选中的推演节点及其配图。这里按保留期定期回收：
+- 推演节点生成或被回溯重新标记时写入 speculative_expires_at（speculation_gc_retention_days 天后），被选中时清空；
+- 后台线程每 speculation_gc_interval_seconds 秒运行一轮，每批在一个短事务里删除至多 speculation_gc_batch_size 个
+  过期的推演叶子节点，子树自底向上逐批回收（每批删去当前的叶子层），直到没有可删节点；批间停顿 speculation_gc_batch_pause_ms，每轮至多 speculation_gc_max_batches 批；
+- 被删节点引用的本地生成配图（assets/generated_images）在确认不再被其它节点或开局池快照引用后删除。
+多个 worker 同时运行时以 SKIP LOCKED 分摊同一批候选，不会互相等待。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Iterable, Optional
+
+from config.logging_config import LOGGER
+from config.settings import settings
+
+_GENERATED_PREFIX = "/static/generated/"
+
+
+class SpeculativeNodeCollector:
+    """按保留期分批删除过期的推演节点，并释放其配图文件。"""
+
+    def __init__(self) -> None:
+        self.retention_days = max(0, int(getattr(settings, "speculation_gc_retention_days", 7)))
+        self.interval_seconds = max(60.0, float(getattr(settings, "speculation_gc_interval_seconds", 3600)))
+        self.batch_size = max(1, int(getattr(settings, "speculation_gc_batch_size", 500)))
+        self.max_batches = max(1, int(getattr(settings, "speculation_gc_max_batches", 50)))
+        self.batch_pause = max(0.0, float(getattr(settings, "speculation_gc_batch_pause_ms", 50)) / 1000.0)
+        self.images_dir = settings.BASE_DIR / "assets" / "generated_images"
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        # --- Metrics ---
+        self.runs_total = 0
+        self.batches_total = 0
+        self.nodes_deleted_total = 0
+        self.images_deleted_total = 0
+        self.image_bytes_freed_total = 0
+        self.failed_total = 0
+        self.last_run_at: Optional[float] = None
+        self.last_run_ms: Optional[float] = None
+        self.last_run_nodes = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.retention_days > 0
+
+    def start(self) -> None:
+        """启动后台回收线程（每个 worker 进程一个）。"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="speculation_gc", daemon=True)
+            self._thread.start()
+        LOGGER.info(
+            f"[NodeGC] started | retention_days={self.retention_days} | interval={self.interval_seconds:.0f}s "
+            f"| batch_size={self.batch_size}"
+        )
+
+    def run_once(self) -> dict:
+        """执行一轮回收，返回 {batches, nodes, images, bytes}。同一进程内不会并发执行。"""
+        if not self.enabled:
+            return {"batches": 0, "nodes": 0, "images": 0, "bytes": 0}
+        from database.base import session_scope
+        from database import crud
+
+        with self._run_lock:
+            started = time.perf_counter()
+            batches = nodes = images = freed = 0
+            try:
+                for _ in range(self.max_batches):
+                    with session_scope() as db:
+                        rows = crud.delete_expired_speculative_leaves(db, self.retention_days, self.batch_size)
+                        released = self._release_images(db, [row["image_url"] for row in rows])
+                    batches += 1
+                    nodes += len(rows)
+                    images += released[0]
+                    freed += released[1]
+                    if not rows:
+                        break
+                    time.sleep(self.batch_pause)
+            except Exception as exc:  # noqa: BLE001
+                with self._lock:
+                    self.failed_total += 1
+                    self.last_error = str(exc)
+                LOGGER.warning(f"[NodeGC] run failed | batches={batches} | nodes={nodes} | error={exc}")
+            elapsed_ms = round((time.perf_counter() - started) * 1000.0, 1)
+            with self._lock:
+                self.runs_total += 1
+                self.batches_total += batches
+                self.nodes_deleted_total += nodes
+                self.images_deleted_total += images
+                self.image_bytes_freed_total += freed
+                self.last_run_at = time.time()
+                self.last_run_ms = elapsed_ms
+                self.last_run_nodes = nodes
+            if nodes:
+                LOGGER.info(
+                    f"[NodeGC] collected | nodes={nodes} | images={images} | bytes={freed} "
+                    f"| batches={batches} | ms={elapsed_ms}"
+                )
+            return {"batches": batches, "nodes": nodes, "images": images, "bytes": freed}
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "retention_days": self.retention_days,
+                "interval_seconds": self.interval_seconds,
+                "batch_size": self.batch_size,
+                "runs_total": self.runs_total,
+                "batches_total": self.batches_total,
+                "nodes_deleted_total": self.nodes_deleted_total,
+                "images_deleted_total": self.images_deleted_total,
+                "image_bytes_freed_total": self.image_bytes_freed_total,
+                "failed_total": self.failed_total,
+                "last_run_at": self.last_run_at,
+                "last_run_ms": self.last_run_ms,
+                "last_run_nodes": self.last_run_nodes,
+                "last_error": self.last_error,
+            }
+
+    # --- internal ---
+
+    def _release_images(self, db, image_urls: Iterable[Optional[str]]) -> tuple[int, int]:
+        """删除不再被引用的本地生成配图，返回 (文件数, 字节数)。"""
+        from database import crud
+
+        candidates = sorted({url for url in image_urls if url and _GENERATED_PREFIX in url})
+        if not candidates:
+            return 0, 0
+        referenced = crud.referenced_image_urls(db, candidates)
+        removed = freed = 0
+        for url in candidates:
+            if url in referenced:
+                continue
+            name = url.split(_GENERATED_PREFIX, 1)[1].split("?", 1)[0]
+            if not name or "/" in name or "\\" in name or name.startswith("."):
+                continue
+            path = self.images_dir / name
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            except OSError as exc:
+                LOGGER.warning(f"[NodeGC] 删除配图失败 | file={name} | error={exc}")
+                continue
+            removed += 1
+            freed += size
+        return removed, freed
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.interval_seconds)
+            try:
+                self.run_once()
+            except Exception as exc:  # noqa: BLE001
+                LOGGER.warning(f"[NodeGC] 回收线程异常 | error={exc}")
+
+
+node_gc = SpeculativeNodeCollector()
@@ -0,0 +1,210 @@
+"""
+完成通知中心
+替代路由中的 sleep 轮询：等待方按 key 注册 asyncio Future，工作线程完成时 notify(key) 精确唤醒。
+notify_backend=postgres 时通过 LISTEN/NOTIFY 跨进程广播，使其它 worker 上的等待方同样被唤醒。
+
+key 约定：
+- start:{cache_key}                     首节预生成完成（或失败）
+- choice:{session_id}:{parent_id}:{choice}  预推演子节点生成结束
+- node:{node_id}                        节点配图回写完成
+"""
+
+from __future__ import annotations
+
+import asyncio
+import inspect
+import select
+import threading
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from sqlalchemy import text
+
+from config.logging_config import LOGGER
+from config.settings import settings
+from database.base import engine
+
+_PG_CHANNEL = "rebirth_events"
+# NOTIFY 负载上限为 8000 字节，超长 key 只做本进程分发
+_PG_PAYLOAD_MAX = 7900
+
+
+def start_key(cache_key: str) -> str:
+    return f"start:{cache_key}"
+
+
+def choice_key(session_id: int, parent_id: int, choice: str) -> str:
+    return f"choice:{session_id}:{parent_id}:{(choice or '').strip()}"
+
+
+def node_key(node_id: int) -> str:
+    return f"node:{node_id}"
+
+
+def _resolve(fut: asyncio.Future) -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+class NotifyHub:
+    """按 key 唤醒异步等待方；notify 可在任意线程调用。"""
+
+    def __init__(self) -> None:
+        self.backend = str(getattr(settings, "notify_backend", "memory") or "memory").lower()
+        self._use_pg = self.backend == "postgres"
+        self._lock = threading.Lock()
+        self._waiters: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = defaultdict(list)
+        self._listener: Optional[threading.Thread] = None
+
+        # --- Metrics ---
+        self.notified_total = 0
+        self.woken_total = 0
+        self.waits_total = 0
+        self.wait_timeouts_total = 0
+        self.pg_published_total = 0
+        self.pg_received_total = 0
+        self.pg_errors_total = 0
+
+    def notify(self, key: str) -> None:
+        """唤醒本进程内该 key 的全部等待方，并在 postgres 模式下广播给其它进程。"""
+        with self._lock:
+            self.notified_total += 1
+        self._dispatch(key)
+        if self._use_pg:
+            self._publish(key)
+
+    async def wait_for(
+        self,
+        key: str,
+        predicate: Callable[[], Union[bool, Awaitable[bool]]],
+        timeout: Optional[float],
+        *,
+        recheck_seconds: float = 5.0,
+    ) -> bool:
+        """
+        等待 predicate() 为真：先注册再检查，避免检查与通知之间的竞态丢失唤醒。
+        仅在被通知时重新检查；recheck_seconds 为兜底复查间隔（进程崩溃等导致通知丢失时）。
+        predicate 在事件循环上调用，需访问数据库的判定应返回可等待对象（如 asyncio.to_thread(...)）。
+        返回 predicate 是否在超时前成立。
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        self._ensure_listener()
+        with self._lock:
+            self.waits_total += 1
+        while True:
+            fut = loop.create_future()
+            with self._lock:
+                self._waiters[key].append((loop, fut))
+            try:
+                ready = predicate()
+                if inspect.isawaitable(ready):
+                    ready = await ready
+                if ready:
+                    return True
+                wait = recheck_seconds
+                if deadline is not None:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        with self._lock:
+                            self.wait_timeouts_total += 1
+                        return False
+                    wait = min(wait, remaining)
+                await asyncio.wait({fut}, timeout=wait)
+            finally:
+                self._discard(key, fut)
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "waiting_keys": len(self._waiters),
+                "waiters": sum(len(v) for v in self._waiters.values()),
+                "notified_total": self.notified_total,
+                "woken_total": self.woken_total,
+                "waits_total": self.waits_total,
+                "wait_timeouts_total": self.wait_timeouts_total,
+                "pg_published_total": self.pg_published_total,
+                "pg_received_total": self.pg_received_total,
+                "pg_errors_total": self.pg_errors_total,
+            }
+
+    # --- internal ---
+
+    def _discard(self, key: str, fut: asyncio.Future) -> None:
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if not waiters:
+                return
+            waiters[:] = [item for item in waiters if item[1] is not fut]
+            if not waiters:
+                self._waiters.pop(key, None)
+
+    def _dispatch(self, key: str) -> None:
+        with self._lock:
+            waiters = self._waiters.pop(key, [])
+            self.woken_total += len(waiters)
+        for loop, fut in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, fut)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+    def _publish(self, key: str) -> None:
+        if len(key.encode("utf-8")) > _PG_PAYLOAD_MAX:
+            return
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": _PG_CHANNEL, "payload": key})
+                conn.commit()
+            with self._lock:
+                self.pg_published_total += 1
+        except Exception as exc:  # noqa: BLE001
+            with self._lock:
+                self.pg_errors_total += 1
+            LOGGER.warning(f"[Notify] publish failed | key={key} | error={exc}")
+
+    def _ensure_listener(self) -> None:
+        if not self._use_pg or self._listener is not None:
+            return
+        with self._lock:
+            if self._listener is not None:
+                return
+            self._listener = threading.Thread(target=self._listen_loop, name="notify_listener", daemon=True)
+            self._listener.start()
+
+    def _listen_loop(self) -> None:
+        while True:
+            conn = None
+            try:
+                # 专用连接脱离连接池，常驻 LISTEN
+                pooled = engine.raw_connection()
+                conn = pooled.driver_connection
+                pooled.detach()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {_PG_CHANNEL}")
+                LOGGER.info(f"[Notify] listening on channel={_PG_CHANNEL}")
+                while True:
+                    if select.select([conn], [], [], 30)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            message = conn.notifies.pop(0)
+                            with self._lock:
+                                self.pg_received_total += 1
+                            self._dispatch(message.payload)
+            except Exception as exc:  # noqa: BLE001
+                with self._lock:
+                    self.pg_errors_total += 1
+                LOGGER.error(f"[Notify] listener error, reconnecting: {exc}")
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:  # noqa: BLE001
+                        pass
+                time.sleep(1.0)
+
+
+notify_hub = NotifyHub()
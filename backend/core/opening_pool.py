@@ -0,0 +1,121 @@
+"""
+开局池（跨用户复用）
+同一愿望的第一节故事与其第一层推演分支对所有玩家几乎相同，却每次都要重新调用模型。
+开局池按规范化愿望保存若干份已完成的开局快照（根节点 + 第一层子节点），新会话直接克隆其中一份：
+- 快照从其它玩家已推演完毕的会话中收录，填充池子本身不产生额外的模型调用；
+- 池中新鲜快照不足 opening_pool_size 份时不提供复用，保证同一愿望至少有这么多种开局随机分配；
+- 超过 opening_pool_max_age_hours 的快照不再使用，并在后续收录时顺带清理。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import random
+import threading
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from config.logging_config import LOGGER
+from config.settings import settings
+from database import crud, models
+
+# 每获取若干次顺带清理一次过期快照
+_PURGE_EVERY_ACQUIRES = 100
+
+
+def normalize_wish(wish: str) -> str:
+    return " ".join((wish or "").split()).casefold()
+
+
+def wish_digest(wish: str) -> str:
+    return hashlib.sha256(normalize_wish(wish).encode("utf-8")).hexdigest()
+
+
+class OpeningPool:
+    """按愿望共享开局快照；所有异常只记录日志，池不可用时调用方退化为实时生成。"""
+
+    def __init__(self) -> None:
+        self.enabled = bool(getattr(settings, "opening_pool_enabled", False))
+        self.pool_size = max(1, int(getattr(settings, "opening_pool_size", 3)))
+        self.max_age_hours = max(1, int(getattr(settings, "opening_pool_max_age_hours", 72)))
+        self._lock = threading.Lock()
+        self._acquires = 0
+
+        # --- Metrics ---
+        self.hits_total = 0
+        self.misses_total = 0
+        self.harvested_total = 0
+        self.errors_total = 0
+
+    def acquire(self, db: Session, wish: str) -> Optional[models.OpeningPoolEntry]:
+        """返回一份可克隆的开局快照；池未填满（或未启用）时返回 None。"""
+        if not self.enabled:
+            return None
+        digest = wish_digest(wish)
+        try:
+            entries = crud.list_opening_pool_entries(db, digest, self.max_age_hours)
+            if len(entries) < self.pool_size:
+                entries.extend(self._harvest(db, wish, digest, self.pool_size - len(entries)))
+            self._maybe_purge(db)
+        except Exception as exc:  # noqa: BLE001
+            db.rollback()
+            with self._lock:
+                self.errors_total += 1
+            LOGGER.warning(f"[OpeningPool] acquire failed | wish={wish} | error={exc}")
+            return None
+
+        if len(entries) < self.pool_size:
+            with self._lock:
+                self.misses_total += 1
+            LOGGER.debug(f"[OpeningPool] miss | wish={wish} | entries={len(entries)}/{self.pool_size}")
+            return None
+        with self._lock:
+            self.hits_total += 1
+        return random.choice(entries)
+
+    def clone_into(self, db: Session, session_id: int, entry: models.OpeningPoolEntry) -> models.StoryNode:
+        """将快照克隆为会话的根节点；第一层子节点按预推演节点写入，深度与实时推演保持一致。"""
+        speculative_depth = max(0, int(getattr(settings, "speculation_max_depth", 0)) - 1)
+        root = crud.clone_opening_into_session(db, session_id, entry, speculative_depth=speculative_depth)
+        LOGGER.info(f"[OpeningPool] served | entry={entry.id} | session={session_id} | node={root.id}")
+        return root
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "pool_size": self.pool_size,
+                "max_age_hours": self.max_age_hours,
+                "hits_total": self.hits_total,
+                "misses_total": self.misses_total,
+                "harvested_total": self.harvested_total,
+                "errors_total": self.errors_total,
+            }
+
+    # --- internal ---
+
+    def _harvest(self, db: Session, wish: str, digest: str, limit: int) -> list:
+        harvested = []
+        for root in crud.find_opening_harvest_candidates(db, wish, self.max_age_hours, limit):
+            entry = crud.create_opening_pool_entry(db, wish=wish, wish_digest=digest, root=root)
+            if entry is None:
+                continue
+            harvested.append(entry)
+            LOGGER.info(f"[OpeningPool] harvested | entry={entry.id} | source_session={root.session_id}")
+        if harvested:
+            with self._lock:
+                self.harvested_total += len(harvested)
+        return harvested
+
+    def _maybe_purge(self, db: Session) -> None:
+        with self._lock:
+            self._acquires += 1
+            purge = self._acquires % _PURGE_EVERY_ACQUIRES == 0
+        if purge:
+            removed = crud.purge_stale_opening_pool(db, self.max_age_hours)
+            if removed:
+                LOGGER.info(f"[OpeningPool] purged stale entries={removed}")
+
+
+opening_pool = OpeningPool()
@@ -274,3 +274,24 @@ SETTLEMENT_PROMPT = """
 }}
 """
 
+
+
+# 长会话历史压缩：把旧摘要与新增的剧情段落合并为新的滚动摘要（输出严格 JSON）
+HISTORY_SUMMARY_PROMPT = """
+你是一个剧情压缩器。请把【已有摘要】与【新增剧情】合并为一份新的前情提要，供后续续写参考。
+
+【已有摘要】
+{previous_summary}
+
+【新增剧情（从早到晚）】
+{new_segments}
+
+【输出要求】
+1. 仅输出一个 JSON 对象，不要包含任何多余文字或 Markdown 代码块。
+2. 不超过 {max_chars} 字，按时间顺序保留人物关系、关键抉择及其后果、尚未解决的伏笔，删去景物描写与对白细节。
+
+【输出 JSON 模板】
+{{
+  "summary": "合并后的前情提要"
+}}
+"""
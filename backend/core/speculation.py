@@ -1,39 +1,124 @@
 from __future__ import annotations
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from collections import deque, defaultdict
+import heapq
+import itertools
+import os
+import socket
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Optional, Any, Callable
-
-from sqlalchemy.exc import IntegrityError
+from typing import Optional, Any
 
 from config.logging_config import LOGGER
 from config.settings import settings
-from database.base import SessionLocal
+from database.base import SessionLocal, session_scope
 from database import crud
-from database.models import StoryNode
 from .story_engine import story_engine
+from .llm_clients import llm_traffic, TRAFFIC_SPECULATIVE
+from .llm_usage import usage_scope, usage_meter
+from .image_jobs import image_jobs, PRIORITY_SPECULATIVE
+from .notify import notify_hub, choice_key
+from .speculation_policy import AdaptiveSpeculationPolicy
+from .choice_model import choice_model, option_tags
 from .story_state import build_story_history, extract_chapter_number
 import threading
 
 
+class _BranchToken:
+    """分支取消令牌：按 (session, parent, choice) 形成树，祖先被取消即整棵子树失效。"""
+
+    __slots__ = ("parent", "cancelled")
+
+    def __init__(self, parent: Optional["_BranchToken"] = None) -> None:
+        self.parent = parent
+        self.cancelled = False
+
+    def is_cancelled(self) -> bool:
+        token: Optional[_BranchToken] = self
+        while token is not None:
+            if token.cancelled:
+                return True
+            token = token.parent
+        return False
+
+
+@dataclass
+class _SpecJob:
+    """调度器中的单个任务：expand 为节点登记子选项任务，child 为单个选项生成子节点。"""
+    kind: str
+    session_id: int
+    node_id: int  # expand: 待扩展节点；child: 父节点
+    depth: int  # 剩余深度（含本层）
+    level: int  # 距离用户当前节点的层数，0 即用户下一步可直接选到的子节点
+    choice: Optional[str] = None
+    user_id: Optional[str] = None
+    context: Optional[dict] = None  # child: 父节点上下文（wish/history/章节/metadata），由 expand 一次性构建
+    token: Optional[_BranchToken] = None  # 所属分支；None 表示由用户当前节点直接发起，不可取消
+    lineage: tuple = ()  # 分支路径（"父节点ID:选项"），postgres 队列据此跨进程取消
+    job_id: Optional[int] = None  # postgres 队列中的任务ID
+    probability: float = 1.0  # 从用户当前节点走到该任务所在分支的预测概率，同层内概率高者优先
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class _SiblingBatch:
+    """同一父节点下在窗口期内完成生成、等待一次批量落库的兄弟节点。"""
+
+    __slots__ = ("items", "results", "ready", "done")
+
+    def __init__(self) -> None:
+        self.items: list[tuple[str, Any]] = []  # (选项, RawStoryData)
+        self.results: dict[str, Any] = {}  # 选项 -> 落库后的节点
+        self.ready = threading.Event()  # 本进程内该父节点已没有正在生成的兄弟
+        self.done = threading.Event()
+
+
 class SpeculationService:
+    """
+    全局预推演调度器：单一优先级队列 + 固定数量的常驻 worker（speculation_max_workers）。
+    层级越浅优先级越高，保证用户下一步可见的子节点先于更深层的推演完成；同层内按选项热度模型预测的分支概率排序，
+    speculation_level_cap 限制每层新建节点数，超出时最不可能被选中的分支最先被舍弃。
+    队列后端由 speculation_queue_backend 决定：memory 为进程内堆；postgres 为 speculation_jobs 表，
+    多个 gunicorn worker / 主机以 FOR UPDATE SKIP LOCKED 共同消费，并以租约回收崩溃进程的任务。
+    """
+
     def __init__(self) -> None:
         self.enabled = settings.speculation_enabled
         self.max_depth = max(0, settings.speculation_max_depth)
-        max_workers = max(1, settings.speculation_max_workers)
+        self.max_workers = max(1, settings.speculation_max_workers)
         self.level_cap = max(0, getattr(settings, 'speculation_level_cap', 0))
-        self.choice_workers = max(1, getattr(settings, 'speculation_choice_workers', 3))
-        self.executor: Optional[ThreadPoolExecutor] = None
+        self.queue_backend = str(getattr(settings, 'speculation_queue_backend', 'memory') or 'memory').lower()
+        self._use_db = self.queue_backend == "postgres"
+        self.lease_seconds = max(10, int(getattr(settings, 'speculation_job_lease_seconds', 120)))
+        self.poll_interval = max(0.05, float(getattr(settings, 'speculation_job_poll_interval_seconds', 0.5)))
+        self.max_attempts = max(1, int(getattr(settings, 'speculation_job_max_attempts', 3)))
+        self.retention_hours = max(1, int(getattr(settings, 'speculation_job_retention_hours', 24)))
+        self.insert_window = max(0.0, float(getattr(settings, 'speculation_insert_batch_ms', 100))) / 1000.0
+        # 按玩家节奏决定深度与展开的选项；未启用时即 max_depth + 全部选项
+        self.policy = AdaptiveSpeculationPolicy(self.max_depth)
+        # 租约持有者标识：主机 + 进程 + 随机后缀，进程重启后不会误认旧租约
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
         if self.enabled and self.max_depth > 0:
             LOGGER.info(
-                f"[Speculation] enabled depth={self.max_depth} choice_workers={self.choice_workers} mode=thread-per-enqueue (no global pool)"
+                f"[Speculation] enabled depth={self.max_depth} max_workers={self.max_workers} mode=global-priority-scheduler backend={self.queue_backend}"
             )
         else:
             LOGGER.info("[Speculation] service disabled")
 
-        # --- Metrics ---
+        # --- Scheduler ---
         self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._heap: list[tuple[int, float, int, _SpecJob]] = []  # (level, -probability, seq, job)
+        self._seq = itertools.count()
+        self._workers: list[threading.Thread] = []
+        self._deferred: dict[str, list[_SpecJob]] = defaultdict(list)  # 超出每用户并发上限而暂缓的 child 任务
+        # postgres 后端：本进程内同一时刻只由一个空闲 worker 轮询领取，本地入队时立即唤醒
+        self._poll_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._maintenance_thread: Optional[threading.Thread] = None
+
+        # --- Metrics ---
         self.enqueued_total = 0
         self.started_total = 0
         self.finished_total = 0
@@ -42,329 +127,761 @@ class SpeculationService:
         self.nodes_generated_total = 0
         self.nodes_failed_total = 0
         self.dropped_total = 0
-        # 运行态跟踪：记录每个 (session_id, node_id) 的“最新请求深度”用于补齐窗口
-        self._pending_jobs: dict[tuple[int, int], int] = {}  # (session_id, node_id) -> max requested depth
+        self.deferred_total = 0
+        self.cancelled_branches_total = 0
+        self.cancelled_jobs_skipped_total = 0
+        self.cancelled_inflight_total = 0
+        self.cancelled_images_skipped_total = 0
+        self.insert_batches_total = 0
+        self.level_cap_dropped_total = 0
+        self.insert_batched_nodes_total = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.wait_ms_last = 0.0
+        self._wait_count = 0
+        self._wait_by_level: dict[int, list[float]] = defaultdict(lambda: [0.0, 0])  # level -> [总等待ms, 次数]
+        # 命中：预推演节点被 /continue 选中转正；按层级/选项序号统计，saved_ms 为省去的生成耗时
+        self.hits_total = 0
+        self.hit_saved_ms_total = 0.0
+        self.generated_tokens_total = 0
+        self._hits_by_level: dict[int, int] = defaultdict(int)
+        self._hits_by_choice: dict[int, int] = defaultdict(int)
+        self._generated_by_level: dict[int, int] = defaultdict(int)
+        self._generated_by_choice: dict[int, int] = defaultdict(int)
+        # 排队中的 expand 任务：(session_id, node_id) -> (请求深度, 层级, 分支令牌, 概率)，重复入队时取更深/更浅/更大
+        self._pending_jobs: dict[tuple[int, int], tuple[int, int, Optional[_BranchToken], float]] = {}
+        # 当前窗口（自上次提交选择起）每个会话各层已开始生成的节点数，用于 speculation_level_cap
+        self._level_started: dict[tuple[int, int], int] = defaultdict(int)
+        # 分支令牌登记：(session_id, parent_id) -> {choice: token}，用户提交选择时据此取消兄弟分支
+        self._branch_tokens: dict[tuple[int, int], dict[str, _BranchToken]] = {}
         self._user_active: dict[str, int] = {}
-        # 流水线模式新增：追踪正在生成的任务
+        # 排队或执行中的 child 任务 -> 期望深度（执行期间可被抬升）
+        self._inflight_children: dict[tuple[int, int, str], int] = {}
+        # 正在执行生成的 child 任务（不含排队中的）
         self._generating_nodes: set[tuple[int, int, str]] = set()  # (session_id, parent_id, choice)
-        # 图像并发优化：追踪正在进行图像生成的节点
-        self._image_generating_nodes: set[int] = set()  # node_id
+        # 兄弟节点批量落库：(session_id, parent_id) -> 正在调用模型的子任务数 / 等待落库的批次
+        self._siblings_generating: dict[tuple[int, int], int] = defaultdict(int)
+        self._sibling_batches: dict[tuple[int, int], _SiblingBatch] = {}
 
-    def enqueue(self, session_id: int, node_id: int, depth: Optional[int] = None) -> None:
-        """启动流水线式预推演：A节点完成后立即触发A的所有子节点生成"""
+    def start(self) -> None:
+        """启动常驻 worker；postgres 后端下每个进程启动即参与消费共享队列。"""
+        if not self.enabled or self.max_depth <= 0:
+            return
+        with self._lock:
+            self._ensure_workers()
+
+    def enqueue(self, session_id: int, node_id: int, depth: Optional[int] = None, *, level: int = 0) -> None:
+        """登记以 node_id 为锚的预推演窗口：为其子选项排队生成，完成后逐层向下补齐至 depth 层"""
+        self._enqueue(session_id, node_id, depth, level=level, token=None)
+
+    def depth_for(self, user_id: Optional[str]) -> int:
+        """以玩家当前节点为锚的预推演深度（自适应策略；未启用时为 speculation_max_depth）。"""
+        return self.policy.depth_for(str(user_id) if user_id else None)
+
+    def observe_choice(self, user_id: Optional[str], parent_node: Any, choice: str) -> None:
+        """记录玩家在 parent_node 上的选择：思考时间与选项位置供自适应策略，选项位置与标签供热度模型。"""
+        options = [item.get("option") or item.get("text") for item in parent_node.get_choices()]
+        index = options.index(choice) if choice in options else None
+        self.policy.observe_choice(str(user_id) if user_id else None, index, len(options))
+        choice_model.observe(index, option_tags(parent_node.get_metadata(), options))
+
+    def branch_probabilities(self, user_id: Optional[str], parent_node: Any, options: list) -> list[float]:
+        """parent_node 各选项被该玩家选中的预测概率：热度模型的标签提升 × 以玩家自身计数修正过的位置先验。"""
+        return choice_model.probabilities(
+            option_tags(parent_node.get_metadata(), options),
+            self.policy.position_counts(user_id, len(options)),
+        )
+
+    def commit_choice(self, session_id: int, parent_id: int, choice: str) -> int:
+        """
+        用户在 parent_id 上提交了 choice：取消其余兄弟分支及其整棵推演子树。
+        排队中的任务出队时直接丢弃；已在生成中的任务完成后保留节点，但不再配图、不再向下扩展；
+        兄弟分支下已落库节点仍在排队的配图任务一并撤销。返回本次取消的分支数。
+        """
+        with self._lock:
+            # 新窗口：各层的新建节点配额重新计算
+            for key in [key for key in self._level_started if key[0] == session_id]:
+                del self._level_started[key]
+        self._cancel_sibling_images(session_id, parent_id, choice)
+        if self._use_db:
+            db = SessionLocal()
+            try:
+                cancelled = crud.cancel_speculation_branches(db, session_id, parent_id, choice)
+            except Exception as exc:  # noqa: BLE001
+                db.rollback()
+                LOGGER.error(f"[Speculation] cancel failed | session={session_id} | parent={parent_id} | error={exc}")
+                cancelled = 0
+            finally:
+                db.close()
+            with self._lock:
+                self.cancelled_branches_total += cancelled
+            if cancelled:
+                LOGGER.info(f"[Speculation] commit | session={session_id} | parent={parent_id} | choice=\"{choice}\" | cancelled_jobs={cancelled}")
+            return cancelled
+
+        with self._lock:
+            branches = self._branch_tokens.pop((session_id, parent_id), None) or {}
+            cancelled = 0
+            for choice_text, token in branches.items():
+                if choice_text != choice and not token.cancelled:
+                    token.cancelled = True
+                    cancelled += 1
+            self.cancelled_branches_total += cancelled
+        if cancelled:
+            LOGGER.info(f"[Speculation] commit | session={session_id} | parent={parent_id} | choice=\"{choice}\" | cancelled_branches={cancelled}")
+        return cancelled
+
+    def _cancel_sibling_images(self, session_id: int, parent_id: int, choice: str) -> None:
+        # 配图队列在进程内，两种队列后端都需要；没有排队中的预推演配图时不查库
+        if not image_jobs.has_speculative_queued():
+            return
+        try:
+            with session_scope() as db:
+                node_ids = crud.list_cancelled_sibling_nodes(db, session_id, parent_id, choice)
+        except Exception as exc:  # noqa: BLE001
+            LOGGER.error(f"[Speculation] image cancel lookup failed | session={session_id} | parent={parent_id} | error={exc}")
+            return
+        cancelled = image_jobs.cancel(node_ids)
+        if cancelled:
+            LOGGER.info(f"[Speculation] commit | session={session_id} | parent={parent_id} | cancelled_images={cancelled}")
+
+    def _enqueue(
+        self,
+        session_id: int,
+        node_id: int,
+        depth: Optional[int],
+        *,
+        level: int,
+        token: Optional[_BranchToken],
+        lineage: tuple = (),
+        probability: float = 1.0,
+    ) -> None:
         if not self.enabled:
             return
         target_depth = depth if depth is not None else self.max_depth
         if target_depth <= 0:
             return
-        LOGGER.debug(f"[Speculation] enqueue PIPELINE session={session_id} node={node_id} depth={target_depth}")
-        with self._lock:
-            key = (session_id, node_id)
-            if key in self._pending_jobs:
-                # 若任务已在进行，仅抬升其期望深度（取较大值）；不重复启动线程
-                prev = self._pending_jobs[key]
-                if target_depth > prev:
-                    self._pending_jobs[key] = target_depth
-                    LOGGER.debug(f"[Speculation] raise pending depth session={session_id} node={node_id} {prev} -> {target_depth}")
-                else:
-                    LOGGER.debug(f"[Speculation] duplicate enqueue ignored session={session_id} node={node_id} depth={target_depth} (pending={prev})")
+        if self._use_db:
+            db = SessionLocal()
+            try:
+                crud.enqueue_speculation_expand(db, session_id, node_id, target_depth, level, list(lineage), probability)
+            except Exception as exc:  # noqa: BLE001
+                db.rollback()
+                LOGGER.error(f"[Speculation] enqueue failed session={session_id} node={node_id}: {exc}")
                 return
-            # 新任务：登记请求深度并启动线程
-            self._pending_jobs[key] = target_depth
-            self.enqueued_total += 1
-        threading.Thread(target=self._run_pipeline, args=(session_id, node_id, target_depth), daemon=True).start()
-    
+            finally:
+                db.close()
+            with self._lock:
+                self.enqueued_total += 1
+                self._ensure_workers()
+            self._wakeup.set()
+            LOGGER.debug(f"[Speculation] enqueue(db) session={session_id} node={node_id} depth={target_depth} level={level}")
+            return
+        if token is not None and token.is_cancelled():
+            return
+        key = (session_id, node_id)
+        with self._cond:
+            queued = self._pending_jobs.get(key)
+            if queued is not None:
+                prev_depth, prev_level, prev_token, prev_probability = queued
+                if (
+                    target_depth <= prev_depth and level >= prev_level and probability <= prev_probability
+                    and (token is not None or prev_token is None)
+                ):
+                    LOGGER.debug(f"[Speculation] duplicate enqueue ignored session={session_id} node={node_id} depth={target_depth} (pending={prev_depth})")
+                    return
+                # 抬升深度或优先级：压入新条目，旧条目出队时因 pending 已被取走而自然作废
+                target_depth = max(prev_depth, target_depth)
+                level = min(prev_level, level)
+                probability = max(prev_probability, probability)
+                # 由用户当前节点直接发起的请求不可取消，优先保留
+                token = None if (token is None or prev_token is None) else token
+                LOGGER.debug(f"[Speculation] raise pending session={session_id} node={node_id} depth {prev_depth} -> {target_depth} level {prev_level} -> {level}")
+            else:
+                self.enqueued_total += 1
+            self._pending_jobs[key] = (target_depth, level, token, probability)
+            self._push(_SpecJob(
+                "expand", session_id, node_id, depth=target_depth, level=level, token=token, probability=probability,
+            ))
+        LOGGER.debug(f"[Speculation] enqueue session={session_id} node={node_id} depth={target_depth} level={level}")
+
+    def _branch_token(self, session_id: int, parent_id: int, choice: str, parent_token: Optional[_BranchToken]) -> _BranchToken:
+        # 调用方已持有 _lock
+        branches = self._branch_tokens.setdefault((session_id, parent_id), {})
+        token = branches.get(choice)
+        if token is None or token.cancelled:
+            token = _BranchToken(parent_token)
+            branches[choice] = token
+        return token
+
+    def _forget_branch(self, session_id: int, parent_id: int, choice: str, token: Optional[_BranchToken]) -> None:
+        # 调用方已持有 _lock
+        branches = self._branch_tokens.get((session_id, parent_id))
+        if branches and token is not None and branches.get(choice) is token:
+            branches.pop(choice, None)
+            if not branches:
+                self._branch_tokens.pop((session_id, parent_id), None)
+
     def is_choice_generating(self, session_id: int, parent_id: int, choice: str) -> bool:
-        """检查某个选项是否正在生成中（竞态保护）"""
+        """检查某个选项是否正在生成中（竞态保护；仅排队未开始的任务不计入）"""
+        if self._use_db:
+            db = SessionLocal()
+            try:
+                return crud.is_speculation_child_running(db, session_id, parent_id, choice)
+            finally:
+                db.close()
         with self._lock:
             return (session_id, parent_id, choice) in self._generating_nodes
-    
-    def is_node_image_generating(self, node_id: int) -> bool:
-        """检查某个节点是否正在进行图像生成（竞态保护）"""
-        with self._lock:
-            return node_id in self._image_generating_nodes
-
-    # --- internal helpers ---
 
-    def _run_pipeline(self, session_id: int, node_id: int, depth: int) -> None:
-        """流水线模式：为指定节点启动其所有子选项的并发生成"""
-        db = SessionLocal()
+    # --- scheduler internals ---
+
+    def _push(self, job: _SpecJob) -> None:
+        # 调用方已持有 _cond
+        heapq.heappush(self._heap, (job.level, -job.probability, next(self._seq), job))
+        self._ensure_workers()
+        self._cond.notify()
+
+    def _ensure_workers(self) -> None:
+        # 调用方已持有 _lock
+        while len(self._workers) < self.max_workers:
+            t = threading.Thread(
+                target=self._worker_loop,
+                name=f"spec_worker_{len(self._workers)}",
+                daemon=True,
+            )
+            self._workers.append(t)
+            t.start()
+        if self._use_db and self._maintenance_thread is None:
+            self._maintenance_thread = threading.Thread(
+                target=self._maintenance_loop, name="spec_lease", daemon=True
+            )
+            self._maintenance_thread.start()
+
+    def _maintenance_loop(self) -> None:
+        """postgres 后端：续租本进程持有的任务、回收耗尽重试的过期任务、定期清理已结束记录。"""
+        interval = max(1.0, self.lease_seconds / 3.0)
+        last_purge = 0.0
+        while True:
+            time.sleep(interval)
+            db = SessionLocal()
+            try:
+                crud.heartbeat_speculation_jobs(db, self._owner, self.lease_seconds)
+                exhausted = crud.fail_exhausted_speculation_jobs(db, self.max_attempts)
+                if exhausted:
+                    LOGGER.warning(f"[Speculation] lease expired jobs failed={exhausted}")
+                if time.monotonic() - last_purge > 600:
+                    purged = crud.purge_finished_speculation_jobs(db, self.retention_hours)
+                    last_purge = time.monotonic()
+                    if purged:
+                        LOGGER.info(f"[Speculation] purged finished jobs={purged}")
+            except Exception as exc:  # noqa: BLE001
+                db.rollback()
+                LOGGER.error(f"[Speculation] maintenance failed: {exc}")
+            finally:
+                db.close()
+
+    def _record_start(self, job: _SpecJob, wait_ms: float) -> None:
+        # 调用方已持有 _lock
+        self.wait_ms_last = wait_ms
+        self.wait_ms_total += wait_ms
+        self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+        self._wait_count += 1
+        by_level = self._wait_by_level[job.level]
+        by_level[0] += wait_ms
+        by_level[1] += 1
+        self.started_total += 1
+        self.active_workers += 1
+
+    def _next_db_job(self) -> _SpecJob:
+        limit = max(0, getattr(settings, 'speculation_max_concurrency_per_user', 0))
+        with self._poll_lock:
+            while True:
+                db = SessionLocal()
+                try:
+                    row = crud.claim_speculation_job(
+                        db,
+                        self._owner,
+                        lease_seconds=self.lease_seconds,
+                        max_attempts=self.max_attempts,
+                        user_limit=limit,
+                    )
+                except Exception as exc:  # noqa: BLE001
+                    db.rollback()
+                    LOGGER.error(f"[Speculation] claim failed: {exc}")
+                    row = None
+                finally:
+                    db.close()
+                if row:
+                    break
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+        job = _SpecJob(
+            row["kind"],
+            row["session_id"],
+            row["parent_id"],
+            depth=row["depth"],
+            level=row["level"],
+            choice=row["choice"] or None,
+            user_id=str(row["user_id"]) if row["user_id"] else None,
+            lineage=tuple(row["lineage"] or ()),
+            job_id=row["id"],
+            probability=float(row["score"] if row["score"] is not None else 1.0),
+        )
         with self._lock:
-            self.started_total += 1
-            self.active_workers += 1
-        try:
-            # 基于用户的并发限制：超过限制则丢弃本次任务
-            session = crud.get_session_by_id(db, session_id)
-            user_id = getattr(session, 'user_id', None) if session else None
-            limit = max(0, getattr(settings, 'speculation_max_concurrency_per_user', 0))
-            if user_id and limit > 0:
-                with self._lock:
-                    cur = self._user_active.get(str(user_id), 0)
-                    if cur >= limit:
-                        LOGGER.info(f"[Speculation] drop job due to per-user concurrency limit user={user_id} session={session_id} node={node_id}")
-                        self.dropped_total += 1
-                        return
-                    self._user_active[str(user_id)] = cur + 1
-
-            # 轮询：若执行期间外界抬升了目标深度，则在本轮完成后继续补齐
+            self._record_start(job, float(row["wait_ms"] or 0.0))
+        return job
+
+    def _next_job(self) -> _SpecJob:
+        if self._use_db:
+            return self._next_db_job()
+        with self._cond:
             while True:
+                while not self._heap:
+                    self._cond.wait()
+                *_, job = heapq.heappop(self._heap)
+                if job.kind == "expand":
+                    pending = self._pending_jobs.pop((job.session_id, job.node_id), None)
+                    if pending is None:
+                        continue  # 已被同节点的其它条目处理
+                    job.depth, job.level, job.token, job.probability = pending
+                if job.token is not None and job.token.is_cancelled():
+                    # 所属分支已被用户放弃：直接丢弃
+                    self.cancelled_jobs_skipped_total += 1
+                    if job.kind == "child":
+                        self._inflight_children.pop((job.session_id, job.node_id, job.choice), None)
+                        self._forget_branch(job.session_id, job.node_id, job.choice, job.token)
+                    continue
+                if job.kind == "child" and self.level_cap and self._level_started[(job.session_id, job.level)] >= self.level_cap:
+                    # 本层配额已满：同层按概率出队，被舍弃的总是剩余分支中最不可能被选中的
+                    self.level_cap_dropped_total += 1
+                    self._inflight_children.pop((job.session_id, job.node_id, job.choice), None)
+                    self._forget_branch(job.session_id, job.node_id, job.choice, job.token)
+                    continue
+                if job.kind == "child":
+                    if job.user_id:
+                        limit = max(0, getattr(settings, 'speculation_max_concurrency_per_user', 0))
+                        cur = self._user_active.get(job.user_id, 0)
+                        if limit > 0 and cur >= limit:
+                            # 同一用户的生成并发已满：暂缓，待其任务完成后放回队列
+                            self._deferred[job.user_id].append(job)
+                            self.deferred_total += 1
+                            continue
+                        self._user_active[job.user_id] = cur + 1
+                    self._generating_nodes.add((job.session_id, job.node_id, job.choice))
+                    self._level_started[(job.session_id, job.level)] += 1
+
+                self._record_start(job, (time.monotonic() - job.enqueued_at) * 1000.0)
+                return job
+
+    def _worker_loop(self) -> None:
+        while True:
+            job = self._next_job()
+            error: Optional[str] = None
+            try:
+                if job.kind == "expand":
+                    self._run_expand(job)
+                else:
+                    self._run_child(job)
+            except Exception as exc:  # noqa: BLE001
+                error = str(exc)
+                LOGGER.error(
+                    f"[Speculation] job failed kind={job.kind} session={job.session_id} node={job.node_id} choice={job.choice!r}: {exc}",
+                    exc_info=True,
+                )
                 with self._lock:
-                    key = (session_id, node_id)
-                    requested = self._pending_jobs.get(key, depth)
-                # 为当前节点生成所有子节点，完成后为每个子节点递归触发，直到 requested 深度
-                self._generate_children_pipeline(db, session, node_id, requested)
-                # 检查是否需要进一步加深（在本轮执行期间被抬升）
-                with self._lock:
-                    latest = self._pending_jobs.get(key, 0)
-                    if latest > requested:
-                        LOGGER.debug(f"[Speculation] depth top-up detected session={session_id} node={node_id} {requested} -> {latest}")
-                        continue
-                    # 无更大需求，清理 pending 并退出
-                    if key in self._pending_jobs:
-                        self._pending_jobs.pop(key, None)
-                    break
+                    self.failed_total += 1
+            finally:
+                if self._use_db and job.kind == "expand":
+                    self._finish_db_job(job, "failed" if error else "done", error)
+                with self._cond:
+                    self.finished_total += 1
+                    self.active_workers = max(0, self.active_workers - 1)
+                    if job.kind == "child" and not self._use_db:
+                        self._release_child(job)
+                if job.kind == "child":
+                    # 唤醒等待该选项的 /continue 请求
+                    notify_hub.notify(choice_key(job.session_id, job.node_id, job.choice))
+
+    def _finish_db_job(self, job: _SpecJob, status: str, error: Optional[str] = None) -> Optional[int]:
+        db = SessionLocal()
+        try:
+            return crud.finish_speculation_job(db, job.job_id, self._owner, status, error)
         except Exception as exc:  # noqa: BLE001
-            LOGGER.error(
-                f"[Speculation] pipeline failed session={session_id} node={node_id} depth={depth}: {exc}",
-                exc_info=True,
-            )
-            with self._lock:
-                self.failed_total += 1
+            db.rollback()
+            LOGGER.error(f"[Speculation] finish failed job={job.job_id}: {exc}")
+            return None
         finally:
-            with self._lock:
-                self.finished_total += 1
-                self.active_workers = max(0, self.active_workers - 1)
-                # pending 标记在执行循环内根据需要清理
-            # 减少用户活跃计数
-            try:
-                if session and getattr(session, 'user_id', None):
-                    uid = str(session.user_id)
-                    with self._lock:
-                        if uid in self._user_active:
-                            self._user_active[uid] = max(0, self._user_active[uid] - 1)
-                            if self._user_active[uid] == 0:
-                                self._user_active.pop(uid, None)
-            except Exception:
-                pass
             db.close()
 
-    def _run(self, session_id: int, node_id: int, depth: int) -> None:
-        """旧版BFS模式（保留用于兼容）"""
-        return self._run_pipeline(session_id, node_id, depth)
+    def _is_branch_cancelled(self, job: _SpecJob) -> bool:
+        if not self._use_db:
+            return job.token is not None and job.token.is_cancelled()
+        if job.job_id is None:
+            return False
+        db = SessionLocal()
+        try:
+            return crud.get_speculation_job_status(db, job.job_id) == "cancelled"
+        finally:
+            db.close()
 
-    def _generate_children_pipeline(self, db: Any, session: Any, parent_node_id: int, remaining_depth: int) -> None:
-        """
-        流水线模式的核心：为父节点的所有选项并发生成子节点，
-        每个子节点完成后立即递归触发其下一层的生成。
-        """
-        # depth semantics: remaining_depth==1 still generates one layer; stop only when <=0
-        if remaining_depth <= 0:
-            return  # 无需继续扩展
+    def _build_child_context(self, db: Any, session: Any, parent_node: Any) -> dict:
+        # 同一父节点的所有选项共享一次构建的上下文
+        return {
+            "wish": session.wish,
+            "history": build_story_history(db, parent_node),
+            "chapter_number": extract_chapter_number(parent_node),
+            "success_rate": parent_node.success_rate if parent_node.success_rate is not None else 50,
+            "parent_metadata": parent_node.get_metadata(),
+            "parent_speculative_depth": parent_node.speculative_depth,
+            "choice_options": [
+                choice.get("option") or choice.get("text") for choice in parent_node.get_choices()
+            ],
+        }
 
-        parent_node: Optional[StoryNode] = crud.get_node_by_id(db, parent_node_id)
-        if not parent_node:
+    def _release_child(self, job: _SpecJob) -> None:
+        # 调用方已持有 _cond
+        self._generating_nodes.discard((job.session_id, job.node_id, job.choice))
+        if not job.user_id:
             return
+        uid = job.user_id
+        if uid in self._user_active:
+            self._user_active[uid] = max(0, self._user_active[uid] - 1)
+            if self._user_active[uid] == 0:
+                self._user_active.pop(uid, None)
+        deferred = self._deferred.get(uid)
+        if deferred:
+            job = deferred.pop(0)
+            heapq.heappush(self._heap, (job.level, -job.probability, next(self._seq), job))
+            if not deferred:
+                self._deferred.pop(uid, None)
+            self._cond.notify()
+
+    def _run_expand(self, job: _SpecJob) -> None:
+        """为节点的每个选项登记 child 任务；已存在的子节点直接向下一层补齐。"""
+        db = SessionLocal()
+        try:
+            session = crud.get_session_by_id(db, job.session_id)
+            parent_node = crud.get_node_by_id(db, job.node_id)
+            if not session or not parent_node:
+                return
+
+            choices = parent_node.get_choices()
+            if not choices:
+                LOGGER.debug(f"[Speculation] node={job.node_id} has no choices; pipeline ends")
+                return
 
-        # Do not cleanup speculative children; keep caches for reuse
-        db.refresh(parent_node)
+            existing_children = {child.user_choice: child for child in parent_node.children}
+            user_id = str(session.user_id) if session.user_id else None
+            options = [item.get("option") or item.get("text") for item in choices]
+            probabilities = self.branch_probabilities(user_id, parent_node, options)
+            allowed = self.policy.allowed_positions(user_id, job.level, probabilities)
+            context: Optional[dict] = None
+            new_jobs: list[_SpecJob] = []
+            for index, choice_payload in enumerate(choices):
+                choice_text = choice_payload.get("option") or choice_payload.get("text")
+                if not choice_text or index not in allowed:
+                    continue
+
+                # 检查是否已存在
+                branch_lineage = job.lineage + (f"{parent_node.id}:{choice_text}",)
+                child = existing_children.get(choice_text)
+                if child is not None:
+                    if job.depth > 1:
+                        token = None
+                        if not self._use_db:
+                            with self._lock:
+                                token = self._branch_token(session.id, parent_node.id, choice_text, job.token)
+                        self._enqueue(
+                            session.id, child.id, job.depth - 1,
+                            level=job.level + 1, token=token, lineage=branch_lineage,
+                            probability=job.probability * probabilities[index],
+                        )
+                    continue
+
+                if context is None and not self._use_db:
+                    # postgres 后端的 child 任务可能由其它进程领取，届时自行构建上下文
+                    context = self._build_child_context(db, session, parent_node)
+                new_jobs.append(_SpecJob(
+                    "child",
+                    session.id,
+                    parent_node.id,
+                    depth=job.depth,
+                    level=job.level,
+                    choice=choice_text,
+                    user_id=user_id,
+                    context=context,
+                    token=job.token,  # 入队时替换为该选项自身的分支令牌
+                    lineage=branch_lineage,
+                    probability=job.probability * probabilities[index],
+                ))
+        finally:
+            db.close()
 
-        choices = parent_node.get_choices()
-        if not choices:
-            LOGGER.debug(f"[Speculation] node={parent_node_id} has no choices; pipeline ends")
+        if not new_jobs:
+            LOGGER.debug(f"[Speculation] no new choices to generate for node={job.node_id}")
             return
 
-        history = build_story_history(db, parent_node)
-        existing_children = {child.user_choice: child for child in parent_node.children}
-        
-        # Disable expiry: keep speculative nodes indefinitely for reuse
-        expiry_at = None
-
-        # 收集需要生成的选项
-        tasks_to_run = []
-        for choice_payload in choices:
-            choice_text = choice_payload.get("option") or choice_payload.get("text")
-            if not choice_text:
-                continue
-            
-            # 检查是否已存在
-            if choice_text in existing_children:
-                child = existing_children[choice_text]
-                if child and remaining_depth > 1:
-                    self.enqueue(session.id, child.id, remaining_depth - 1)
-                continue
-            
-            # 检查是否正在生成中（竞态保护）
-            if self.is_choice_generating(session.id, parent_node_id, choice_text):
-                LOGGER.debug(f"[Speculation] choice '{choice_text}' already generating, skip")
-                continue
-                
-            # 添加到并发任务队列
-            tasks_to_run.append((choice_text, parent_node, history, expiry_at, remaining_depth))
-
-        if not tasks_to_run:
-            LOGGER.debug(f"[Speculation] no new choices to generate for node={parent_node_id}")
+        if self._use_db:
+            db = SessionLocal()
+            try:
+                crud.enqueue_speculation_children(db, [
+                    {
+                        "session_id": j.session_id,
+                        "parent_id": j.node_id,
+                        "choice": j.choice,
+                        "depth": j.depth,
+                        "level": j.level,
+                        "lineage": list(j.lineage),
+                        "user_id": j.user_id,
+                        "score": j.probability,
+                    }
+                    for j in new_jobs
+                ])
+            finally:
+                db.close()
+            self._wakeup.set()
+            LOGGER.debug(f"[Speculation] expand(db) node={job.node_id} queued={len(new_jobs)} level={job.level}")
             return
 
-        # 标记正在生成的任务
-        with self._lock:
-            for choice_text, *_ in tasks_to_run:
-                self._generating_nodes.add((session.id, parent_node_id, choice_text))
-
-        LOGGER.debug(f"[Speculation] pipeline generating {len(tasks_to_run)} children for node={parent_node_id}")
-        
-        # 并发生成所有新子节点
-        with ThreadPoolExecutor(max_workers=self.choice_workers, thread_name_prefix="pipeline_choice") as executor:
-            future_to_task = {}
-            for choice_text, parent_node, history, expiry_at, next_depth in tasks_to_run:
-                future = executor.submit(self._generate_child_node, db, session, parent_node, choice_text, history, expiry_at)
-                future_to_task[future] = (choice_text, next_depth)
-
-            # 收集结果，对于每个成功的子节点立即触发下一层
-            for future in as_completed(future_to_task):
-                choice_text, next_depth = future_to_task[future]
-                try:
-                    child_node = future.result()
-                    if child_node and next_depth > 1:
-                        # 每个子节点完成后立即触发其下一层生成（流水线）
-                        self.enqueue(session.id, child_node.id, next_depth - 1)
-                        LOGGER.debug(f"[Speculation] child node={child_node.id} completed, triggered next level depth={next_depth-1}")
-                except Exception as exc:
-                    LOGGER.error(f"[Speculation] pipeline child generation failed for choice '{choice_text}': {exc}")
-                finally:
-                    # 清理生成中标记
-                    with self._lock:
-                        self._generating_nodes.discard((session.id, parent_node_id, choice_text))
+        with self._cond:
+            for child_job in new_jobs:
+                key = (child_job.session_id, child_job.node_id, child_job.choice)
+                if key in self._inflight_children:
+                    # 已在排队或生成中：仅抬升其完成后需要补齐的深度
+                    self._inflight_children[key] = max(self._inflight_children[key], child_job.depth)
+                    continue
+                self._inflight_children[key] = child_job.depth
+                child_job.token = self._branch_token(*key, child_job.token)
+                self._push(child_job)
+        LOGGER.debug(f"[Speculation] expand node={job.node_id} queued={len(new_jobs)} level={job.level}")
+
+    def _produce_child(self, job: _SpecJob) -> Optional[int]:
+        """生成（或复用已存在的）子节点，返回其ID；失败返回 None。"""
+        # 读取阶段使用短时会话，模型调用开始前归还连接
+        with session_scope() as db:
+            # 排队期间可能已被 /continue 实时生成
+            existing = crud.get_child_by_parent_and_choice(db, job.session_id, job.node_id, job.choice)
+            if existing is not None:
+                return existing.id
+            if job.context is None:
+                session = crud.get_session_by_id(db, job.session_id)
+                parent_node = crud.get_node_by_id(db, job.node_id)
+                if not session or not parent_node:
+                    return None
+                job.context = self._build_child_context(db, session, parent_node)
+        # 工作线程复用，用量归属只在本任务内生效
+        with usage_scope(user_id=job.user_id, session_id=job.session_id):
+            return self._generate_child_node(job)
+
+    def _run_db_child(self, job: _SpecJob) -> None:
+        child_id: Optional[int] = None
+        error: Optional[str] = None
+        try:
+            child_id = self._produce_child(job)
+        except Exception as exc:  # noqa: BLE001
+            error = str(exc)
+            raise
+        finally:
+            status = "done" if child_id is not None else "failed"
+            target_depth = self._finish_db_job(job, status, error)
+
+        if target_depth is None:
+            # 任务已被取消（或租约已被其它进程接管）：不再向下扩展
+            with self._lock:
+                self.cancelled_inflight_total += 1
+            LOGGER.debug(f"[Speculation] job {job.job_id} no longer owned; stop descending parent={job.node_id} choice=\"{job.choice}\"")
+            return
+        if child_id is not None and target_depth > 1:
+            self._enqueue(
+                job.session_id, child_id, target_depth - 1,
+                level=job.level + 1, token=None, lineage=job.lineage, probability=job.probability,
+            )
 
-    def _generate_child_node(self, db: Any, session: Any, parent_node: StoryNode, choice_text: str, history: list, expiry_at: Optional[datetime]) -> Optional[StoryNode]:
-        """为单个选项生成子节点的独立任务单元（故事+图像串行块）"""
+    def _run_child(self, job: _SpecJob) -> None:
+        if self._use_db:
+            self._run_db_child(job)
+            return
+        key = (job.session_id, job.node_id, job.choice)
+        child_id: Optional[int] = None
+        try:
+            child_id = self._produce_child(job)
+        finally:
+            with self._lock:
+                target_depth = self._inflight_children.pop(key, job.depth)
+                cancelled = job.token is not None and job.token.is_cancelled()
+                if cancelled:
+                    self.cancelled_inflight_total += 1
+                if cancelled or target_depth <= 1:
+                    # 无后续扩展需要该令牌
+                    self._forget_branch(job.session_id, job.node_id, job.choice, job.token)
+
+        if cancelled:
+            LOGGER.debug(f"[Speculation] branch cancelled while generating; stop descending parent={job.node_id} choice=\"{job.choice}\"")
+            return
+        if child_id is not None and target_depth > 1:
+            # 子节点完成后立即触发其下一层生成（流水线）
+            self._enqueue(
+                job.session_id, child_id, target_depth - 1,
+                level=job.level + 1, token=job.token, probability=job.probability,
+            )
+            LOGGER.debug(f"[Speculation] child node={child_id} completed, triggered next level depth={target_depth - 1}")
+
+    def _leave_siblings(self, key: tuple[int, int]) -> None:
+        # 调用方已持有 _lock：一个兄弟任务结束模型调用（完成或失败）
+        remaining = self._siblings_generating[key] - 1
+        if remaining > 0:
+            self._siblings_generating[key] = remaining
+            return
+        self._siblings_generating.pop(key, None)
+        batch = self._sibling_batches.get(key)
+        if batch is not None:
+            batch.ready.set()
+
+    def _insert_with_siblings(self, job: _SpecJob, raw: Any, *, speculative_depth: int) -> Optional[Any]:
+        """
+        把生成完毕的子节点并入同父节点的落库批次。首个到达者为批次负责人：
+        等待其余正在生成的兄弟（至多 insert_window），再以一条多行 INSERT 写入整批；其余任务等待结果。
+        """
+        key = (job.session_id, job.node_id)
+        with self._lock:
+            batch = self._sibling_batches.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._sibling_batches[key] = _SiblingBatch()
+            batch.items.append((job.choice, raw))
+            self._leave_siblings(key)
+        if not leader:
+            if not batch.done.wait(max(30.0, self.insert_window * 10)):
+                LOGGER.error(f"[Speculation] sibling batch timeout | parent={job.node_id} | choice=\"{job.choice}\"")
+            return batch.results.get(job.choice)
+
+        batch.ready.wait(self.insert_window)
+        with self._lock:
+            # 此后到达的兄弟另起一批
+            self._sibling_batches.pop(key, None)
+            items = list(batch.items)
+        try:
+            with session_scope() as db:
+                batch.results = crud.create_story_nodes_bulk(
+                    db,
+                    job.session_id,
+                    job.node_id,
+                    items,
+                    is_speculative=True,
+                    speculative_depth=speculative_depth,
+                    speculative_expires_at=crud.speculative_expiry(),
+                )
+        except Exception as exc:  # noqa: BLE001
+            LOGGER.error(f"[Speculation] bulk insert failed | parent={job.node_id} | nodes={len(items)} | error={exc}")
+        finally:
+            batch.done.set()
+        with self._lock:
+            self.insert_batches_total += 1
+            self.insert_batched_nodes_total += len(items)
+        LOGGER.debug(f"[Speculation] bulk insert | parent={job.node_id} | nodes={len(items)}")
+        return batch.results.get(job.choice)
+
+    def record_hit(self, node: Any) -> None:
+        """/continue 选中并转正了一个预推演节点：按其生成时记录的层级/选项序号计入命中。"""
+        info = node.get_metadata().get("speculation")
+        if not isinstance(info, dict):
+            return
+        with self._lock:
+            self.hits_total += 1
+            self.hit_saved_ms_total += float(info.get("gen_ms") or 0.0)
+            if isinstance(info.get("level"), int):
+                self._hits_by_level[info["level"]] += 1
+            if isinstance(info.get("choice_index"), int):
+                self._hits_by_choice[info["choice_index"]] += 1
+
+    def _generate_child_node(self, job: _SpecJob) -> Optional[int]:
+        """
+        为单个选项生成子节点的独立任务单元，返回节点ID（故事落库，配图交由后台任务）。
+        模型调用期间不持有数据库会话，落库时另开短时会话。
+        """
 
         def _compact(text: str, limit: int = 400) -> str:
             single_line = " ".join(text.split())
             return single_line if len(single_line) <= limit else f"{single_line[:limit]}…"
 
+        ctx = job.context or {}
+        parent_id = job.node_id
+        choice_text = job.choice
         LOGGER.info(
-            f"[Speculation] start | parent={parent_node.id} | choice=\"{choice_text}\""
+            f"[Speculation] start | parent={parent_id} | choice=\"{choice_text}\" | level={job.level}"
         )
 
+        sibling_key = (job.session_id, parent_id)
+        with self._lock:
+            self._siblings_generating[sibling_key] += 1
+        started = time.perf_counter()
         try:
-            chapter_number = extract_chapter_number(parent_node)
-            base_success_rate = parent_node.success_rate if parent_node.success_rate is not None else 50
-
-            raw = story_engine.continue_story(
-                wish=session.wish,
-                story_history=history,
-                choice=choice_text,
-                chapter_number=chapter_number,
-                current_success_rate=base_success_rate,
-                parent_metadata=parent_node.get_metadata(),
-            )
+            # 预推演流量在提供商限流时最先让路
+            with llm_traffic(TRAFFIC_SPECULATIVE), usage_meter() as meter:
+                raw = story_engine.continue_story(
+                    wish=ctx["wish"],
+                    story_history=ctx["history"],
+                    choice=choice_text,
+                    chapter_number=ctx["chapter_number"],
+                    current_success_rate=ctx["success_rate"],
+                    parent_metadata=ctx["parent_metadata"],
+                )
             LOGGER.info(
-                f"[Speculation] story | parent={parent_node.id} | choice=\"{choice_text}\" | text_len={len(raw.text)} | text=\"{_compact(raw.text, 2000)}\""
+                f"[Speculation] story | parent={parent_id} | choice=\"{choice_text}\" | text_len={len(raw.text)} | text=\"{_compact(raw.text, 2000)}\""
             )
 
         except Exception as exc:
             LOGGER.warning(
-                f"[Speculation] story_failed | parent={parent_node.id} | choice=\"{choice_text}\" | error={exc}"
+                f"[Speculation] story_failed | parent={parent_id} | choice=\"{choice_text}\" | error={exc}"
             )
             with self._lock:
                 self.nodes_failed_total += 1
+                self._leave_siblings(sibling_key)
             return None
 
-        try:
-            child = crud.create_story_node(
-                db,
-                session_id=session.id,
-                segment=raw,
-                parent_id=parent_node.id,
-                user_choice=choice_text,
-                is_speculative=True,
-                speculative_depth=(parent_node.speculative_depth or self.max_depth) - 1,
-            )
+        # 命中/浪费统计的依据：生成耗时（命中即省去的等待）、token 消耗与该节点在树中的位置
+        options = ctx.get("choice_options") or []
+        choice_index = options.index(choice_text) if choice_text in options else None
+        tokens = meter["prompt_tokens"] + meter["completion_tokens"]
+        gen_ms = round((time.perf_counter() - started) * 1000.0, 1)
+        self.policy.observe_generation(job.user_id, gen_ms, tokens)
+        raw.metadata = dict(raw.metadata or {})
+        raw.metadata["speculation"] = {
+            "level": job.level,
+            "choice_index": choice_index,
+            "probability": round(job.probability, 4),
+            "gen_ms": gen_ms,
+            "tokens": tokens,
+        }
 
-        except IntegrityError:
-            db.rollback()
-            child = crud.get_child_by_parent_and_choice(db, session.id, parent_node.id, choice_text)
-            if not child:
-                LOGGER.error(
-                    f"[Speculation] node_missing | parent={parent_node.id} | choice=\"{choice_text}\""
-                )
-                return None
-        except Exception as exc:
+        child = self._insert_with_siblings(
+            job, raw, speculative_depth=(ctx.get("parent_speculative_depth") or self.max_depth) - 1
+        )
+        if child is None:
             LOGGER.error(
-                f"[Speculation] node_failed | parent={parent_node.id} | choice=\"{choice_text}\" | error={exc}"
+                f"[Speculation] node_failed | parent={parent_id} | choice=\"{choice_text}\""
             )
-            db.rollback()
             return None
-
         LOGGER.info(
-            f"[Speculation] complete | parent={parent_node.id} | choice=\"{choice_text}\" | node={child.id} | text_len={len(raw.text)} | image={child.image_url}"
+            f"[Speculation] complete | parent={parent_id} | choice=\"{choice_text}\" | node={child.id} | text_len={len(raw.text)} | image={child.image_url}"
         )
 
+        # child 为已脱离会话的快照
+        if self._is_branch_cancelled(job):
+            # 分支已被放弃：节点保留供回溯复用，配图留待真正被访问时再补
+            with self._lock:
+                self.cancelled_images_skipped_total += 1
+        else:
+            image_jobs.ensure(child, priority=PRIORITY_SPECULATIVE)
+
         with self._lock:
             self.nodes_generated_total += 1
-        return child
-
-    def _speculate_bfs(self, db: Any, session_id: int, root_node_id: int, depth: int) -> None:
-        """按层（BFS）并发预推演"""
-        if depth <= 0: return
-        session = crud.get_session_by_id(db, session_id)
-        if not session: return
-
-        # Disable expiry in BFS fallback as well
-        expiry_at = None
-        level_cap = max(0, self.level_cap)
-        choice_workers = max(1, getattr(settings, 'speculation_choice_workers', 1))
-
-        q = deque([(root_node_id, depth, 0)])
-        visited = {root_node_id}
-
-        while q:
-            node_id, remaining, level = q.popleft()
-            if remaining <= 0: continue
-
-            node: Optional[StoryNode] = crud.get_node_by_id(db, node_id)
-            if not node: continue
-
-            # Do not cleanup caches
-            db.refresh(node)
-
-            choices = node.get_choices()
-            if not choices: continue
-
-            history = build_story_history(db, node)
-            existing_children = {child.user_choice: child for child in node.children}
-            tasks_to_run: list[tuple[Callable, list[Any]]] = []
-
-            created_this_level = 0
-
-            for choice_payload in choices:
-                choice_text = choice_payload.get("option") or choice_payload.get("text")
-                if not choice_text: continue
-
-                if choice_text in existing_children:
-                    child = existing_children[choice_text]
-                    if child and (remaining - 1) > 0 and child.id not in visited:
-                        q.append((child.id, remaining - 1, level + 1))
-                        visited.add(child.id)
-                else:
-                    if level_cap > 0 and created_this_level >= level_cap:
-                        continue
-                    tasks_to_run.append((self._generate_child_node, [db, session, node, choice_text, history, expiry_at]))
-                    created_this_level += 1
-            
-            if not tasks_to_run: continue
-
-            with ThreadPoolExecutor(max_workers=choice_workers, thread_name_prefix="spec_choice") as executor:
-                futures = {executor.submit(func, *args): (func, args) for func, args in tasks_to_run}
-                for future in as_completed(futures):
-                    try:
-                        child_node = future.result()
-                        if child_node and (remaining - 1) > 0 and child_node.id not in visited:
-                            q.append((child_node.id, remaining - 1, level + 1))
-                            visited.add(child_node.id)
-                    except Exception as exc:
-                        func, args = futures[future]
-                        LOGGER.error(f"[Speculation] future failed for {func.__name__} with args {args[:4]}: {exc}")
+            self.generated_tokens_total += tokens
+            self._generated_by_level[job.level] += 1
+            if choice_index is not None:
+                self._generated_by_choice[choice_index] += 1
+        return child.id
 
 
 speculation_service = SpeculationService()
@@ -392,7 +909,7 @@ def _utcnow_iso() -> str:
 def speculation_get_metrics() -> dict:
     svc = speculation_service
     with svc._lock:
-        return {
+        metrics = {
             "enabled": _safe_bool(svc.enabled),
             "max_depth": _safe_int(svc.max_depth),
             "active_workers": _safe_int(svc.active_workers),
@@ -404,5 +921,50 @@ def speculation_get_metrics() -> dict:
             "nodes_failed_total": _safe_int(svc.nodes_failed_total),
             "dropped_total": _safe_int(svc.dropped_total),
             "pending_jobs": len(svc._pending_jobs),
+            "max_workers": _safe_int(svc.max_workers),
+            "queue_depth": len(svc._heap) + sum(len(v) for v in svc._deferred.values()),
+            "queued_children": max(0, len(svc._inflight_children) - len(svc._generating_nodes)),
+            "generating_children": len(svc._generating_nodes),
+            "deferred_total": _safe_int(svc.deferred_total),
+            "cancelled_branches_total": _safe_int(svc.cancelled_branches_total),
+            "cancelled_jobs_skipped_total": _safe_int(svc.cancelled_jobs_skipped_total),
+            "cancelled_inflight_total": _safe_int(svc.cancelled_inflight_total),
+            "cancelled_images_skipped_total": _safe_int(svc.cancelled_images_skipped_total),
+            "queue_wait_ms_last": round(svc.wait_ms_last, 2),
+            "queue_wait_ms_avg": round(svc.wait_ms_total / svc._wait_count, 2) if svc._wait_count else None,
+            "queue_wait_ms_max": round(svc.wait_ms_max, 2),
+            "queue_wait_ms_avg_by_level": {
+                str(level): round(total / count, 2)
+                for level, (total, count) in sorted(svc._wait_by_level.items())
+                if count
+            },
+            "level_cap": _safe_int(svc.level_cap),
+            "level_cap_dropped_total": _safe_int(svc.level_cap_dropped_total),
+            "insert_batches_total": _safe_int(svc.insert_batches_total),
+            "insert_nodes_per_batch": round(svc.insert_batched_nodes_total / svc.insert_batches_total, 2) if svc.insert_batches_total else None,
+            "generated_tokens_total": _safe_int(svc.generated_tokens_total),
+            "hits_total": _safe_int(svc.hits_total),
+            "hit_saved_ms_avg": round(svc.hit_saved_ms_total / svc.hits_total, 1) if svc.hits_total else None,
+            "hits_by_level": {
+                str(level): {"generated": svc._generated_by_level.get(level, 0), "hits": svc._hits_by_level.get(level, 0)}
+                for level in sorted(set(svc._generated_by_level) | set(svc._hits_by_level))
+            },
+            "hits_by_choice_index": {
+                str(index): {"generated": svc._generated_by_choice.get(index, 0), "hits": svc._hits_by_choice.get(index, 0)}
+                for index in sorted(set(svc._generated_by_choice) | set(svc._hits_by_choice))
+            },
+            "queue_backend": svc.queue_backend,
             "timestamp": _utcnow_iso(),
         }
+    metrics["adaptive"] = svc.policy.get_metrics()
+    metrics["choice_model"] = choice_model.get_metrics()
+    if svc._use_db:
+        # 共享队列的全局视图（所有进程）
+        db = SessionLocal()
+        try:
+            metrics["db_jobs_by_status"] = crud.count_speculation_jobs_by_status(db)
+        except Exception as exc:  # noqa: BLE001
+            metrics["db_jobs_by_status"] = {"error": str(exc)}
+        finally:
+            db.close()
+    return metrics
@@ -0,0 +1,263 @@
+"""
+自适应预推演策略
+按玩家的游玩节奏决定预推演的深度与展开哪些选项，替代对所有会话一视同仁的 speculation_max_depth：
+- 思考时间：同一玩家相邻两次选择真正提交（预推演节点转正或新节点落库）的间隔
+  （指数平滑；短于 _MIN_THINK_SECONDS 视为重试/双击，超过 _MAX_THINK_SECONDS 视为离开，均不计入）；
+- 选项位置偏好：玩家实际选择的是第几个选项（拉普拉斯平滑的频率）；
+- 深度：思考时间短于一层生成耗时的玩家会追上预推演，按两者之比向更深层推演（不超过 speculation_adaptive_max_depth）；
+  思考时间远长于生成耗时（speculation_adaptive_slow_factor 倍）的玩家只展开最可能的选项；
+- 更深层只展开累计概率达到 speculation_adaptive_branch_coverage 的选项（概率由调用方给出，见 choice_model）；
+- 每用户每小时的预推演 token 预算（speculation_user_token_budget_per_hour），计划成本超出剩余预算时先减深度再减分支，耗尽后停止。
+样本不足 speculation_adaptive_min_samples 时沿用 speculation_max_depth 且展开全部选项。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from config.settings import settings
+
+# 进程内保留画像的玩家数上限，超出时淘汰最久未活动的
+_MAX_PROFILES = 5000
+# 相邻两次选择间隔超过该值视为离开，不计入思考时间
+_MAX_THINK_SECONDS = 600.0
+# 相邻两次选择间隔短于该值视为重试或双击，不计入思考时间
+_MIN_THINK_SECONDS = 1.0
+# 指数平滑系数
+_EWMA_ALPHA = 0.3
+
+
+def _ewma(previous: Optional[float], value: float) -> float:
+    return value if previous is None else previous + _EWMA_ALPHA * (value - previous)
+
+
+@dataclass
+class _PlayerProfile:
+    think_ms: Optional[float] = None
+    samples: int = 0
+    last_choice_at: Optional[float] = None
+    position_counts: list[int] = field(default_factory=list)
+    budget_window: int = 0  # 预算所属的小时（epoch 小时数）
+    budget_spent: int = 0
+
+
+class AdaptiveSpeculationPolicy:
+    """按玩家画像给出预推演深度与各层要展开的选项位置。"""
+
+    def __init__(self, base_depth: int) -> None:
+        self.enabled = bool(getattr(settings, "speculation_adaptive_enabled", True))
+        self.base_depth = max(0, base_depth)
+        self.max_depth = max(self.base_depth, int(getattr(settings, "speculation_adaptive_max_depth", 3)))
+        self.min_samples = max(1, int(getattr(settings, "speculation_adaptive_min_samples", 2)))
+        self.slow_factor = max(1.0, float(getattr(settings, "speculation_adaptive_slow_factor", 3.0)))
+        self.coverage = min(1.0, max(0.0, float(getattr(settings, "speculation_adaptive_branch_coverage", 0.8))))
+        self.token_budget = max(0, int(getattr(settings, "speculation_user_token_budget_per_hour", 0)))
+        self._lock = threading.Lock()
+        self._profiles: "OrderedDict[str, _PlayerProfile]" = OrderedDict()
+        # 全局估计：一层预推演节点的生成耗时与 token 成本
+        self.gen_ms: Optional[float] = None
+        self.tokens_per_node: Optional[float] = None
+
+        # --- Metrics ---
+        self.depth_decisions: dict[int, int] = {}
+        self.slow_decisions_total = 0
+        self.branches_skipped_total = 0
+        self.budget_limited_total = 0
+        self.budget_exhausted_total = 0
+
+    # --- observations ---
+
+    def observe_choice(self, user_id: Optional[str], choice_index: Optional[int], option_count: int) -> None:
+        """玩家在 option_count 个选项中选择了第 choice_index 个（选择真正提交时调用，重放不调用）。"""
+        if not self.enabled or not user_id:
+            return
+        now = time.monotonic()
+        with self._lock:
+            profile = self._touch(user_id)
+            if profile.last_choice_at is not None:
+                elapsed = now - profile.last_choice_at
+                if _MIN_THINK_SECONDS <= elapsed <= _MAX_THINK_SECONDS:
+                    profile.think_ms = _ewma(profile.think_ms, elapsed * 1000.0)
+                    profile.samples += 1
+            profile.last_choice_at = now
+            if choice_index is not None and 0 <= choice_index < max(option_count, 1):
+                if len(profile.position_counts) < option_count:
+                    profile.position_counts.extend([0] * (option_count - len(profile.position_counts)))
+                profile.position_counts[choice_index] += 1
+
+    def observe_generation(self, user_id: Optional[str], gen_ms: float, tokens: int) -> None:
+        """一个预推演节点生成完毕：更新全局耗时/成本估计，并计入该玩家本小时的预算。"""
+        with self._lock:
+            self.gen_ms = _ewma(self.gen_ms, gen_ms)
+            if tokens > 0:
+                self.tokens_per_node = _ewma(self.tokens_per_node, float(tokens))
+            if user_id and self.token_budget:
+                profile = self._touch(user_id)
+                self._roll_budget(profile)
+                profile.budget_spent += max(0, tokens)
+
+    # --- decisions ---
+
+    def depth_for(self, user_id: Optional[str]) -> int:
+        """以玩家当前节点为锚的预推演深度（层数）。"""
+        if not self.enabled or not user_id:
+            return self.base_depth
+        with self._lock:
+            profile = self._profiles.get(user_id)
+            depth = self._paced_depth(profile)
+            if profile is not None and self.token_budget:
+                remaining = self._remaining_budget(profile)
+                fitted = self._fit_budget(profile, depth, remaining)
+                if fitted < depth:
+                    self.budget_limited_total += 1
+                    if fitted == 0:
+                        self.budget_exhausted_total += 1
+                depth = fitted
+            self.depth_decisions[depth] = self.depth_decisions.get(depth, 0) + 1
+            return depth
+
+    def allowed_positions(self, user_id: Optional[str], level: int, probabilities: list[float]) -> set[int]:
+        """level 层（0 为玩家下一步可选的子节点）上需要展开的选项位置；probabilities 为各选项被选中的预测概率。"""
+        option_count = len(probabilities)
+        everything = set(range(option_count))
+        if not self.enabled or not user_id or option_count <= 1:
+            return everything
+        with self._lock:
+            profile = self._profiles.get(user_id)
+            if profile is None:
+                return everything
+            if self.token_budget and self._remaining_budget(profile) <= 0:
+                self.branches_skipped_total += option_count
+                return set()
+            ranked = self._ranked(probabilities)
+            if profile.samples < self.min_samples:
+                keep = option_count
+            elif self._is_slow(profile):
+                keep = 1
+            elif level == 0:
+                keep = option_count
+            else:
+                keep = self._coverage_count(probabilities, ranked)
+            if self.token_budget and level == 0:
+                keep = min(keep, self._affordable_branches(profile, option_count))
+            allowed = set(ranked[:max(1, keep)])
+            self.branches_skipped_total += option_count - len(allowed)
+            return allowed
+
+    def position_counts(self, user_id: Optional[str], option_count: int) -> list[int]:
+        """玩家在 option_count 个选项中选择各位置的次数；无画像时全为 0。"""
+        if option_count <= 0:
+            return []
+        with self._lock:
+            profile = self._profiles.get(user_id) if user_id else None
+            counts = (profile.position_counts if profile else [])[:option_count]
+            return counts + [0] * (option_count - len(counts))
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            think = [p.think_ms for p in self._profiles.values() if p.think_ms is not None]
+            return {
+                "enabled": self.enabled,
+                "base_depth": self.base_depth,
+                "max_depth": self.max_depth,
+                "tracked_users": len(self._profiles),
+                "gen_ms_estimate": round(self.gen_ms, 1) if self.gen_ms is not None else None,
+                "tokens_per_node_estimate": round(self.tokens_per_node, 1) if self.tokens_per_node is not None else None,
+                "think_ms_median": round(sorted(think)[len(think) // 2], 1) if think else None,
+                "depth_decisions": {str(depth): count for depth, count in sorted(self.depth_decisions.items())},
+                "slow_decisions_total": self.slow_decisions_total,
+                "branches_skipped_total": self.branches_skipped_total,
+                "token_budget_per_hour": self.token_budget,
+                "budget_limited_total": self.budget_limited_total,
+                "budget_exhausted_total": self.budget_exhausted_total,
+            }
+
+    # --- internal（调用方已持有 _lock） ---
+
+    def _touch(self, user_id: str) -> _PlayerProfile:
+        profile = self._profiles.pop(user_id, None) or _PlayerProfile()
+        self._profiles[user_id] = profile
+        while len(self._profiles) > _MAX_PROFILES:
+            self._profiles.popitem(last=False)
+        return profile
+
+    def _is_slow(self, profile: _PlayerProfile) -> bool:
+        return (
+            profile.samples >= self.min_samples
+            and self.gen_ms is not None
+            and profile.think_ms is not None
+            and profile.think_ms >= self.gen_ms * self.slow_factor
+        )
+
+    def _paced_depth(self, profile: Optional[_PlayerProfile]) -> int:
+        if profile is None or profile.samples < self.min_samples or not self.gen_ms or not profile.think_ms:
+            return self.base_depth
+        if self._is_slow(profile):
+            self.slow_decisions_total += 1
+            return min(1, self.max_depth)
+        # 每层生成耗时内玩家会前进 gen_ms / think_ms 层，预推演需领先这么多层才能持续命中
+        ahead = int(self.gen_ms / max(profile.think_ms, 1.0) + 0.49)
+        return max(1, min(self.max_depth, 1 + ahead))
+
+    def _probabilities(self, profile: Optional[_PlayerProfile], option_count: int) -> list[float]:
+        counts = (profile.position_counts if profile else [])[:option_count]
+        counts = counts + [0] * (option_count - len(counts))
+        total = sum(counts) + option_count
+        return [(count + 1) / total for count in counts]
+
+    @staticmethod
+    def _ranked(probabilities: list[float]) -> list[int]:
+        return sorted(range(len(probabilities)), key=lambda index: (-probabilities[index], index))
+
+    def _coverage_count(self, probabilities: list[float], ranked: list[int]) -> int:
+        covered = 0.0
+        for count, index in enumerate(ranked, start=1):
+            covered += probabilities[index]
+            if covered >= self.coverage:
+                return count
+        return len(probabilities)
+
+    def _roll_budget(self, profile: _PlayerProfile) -> None:
+        window = int(time.time() // 3600)
+        if profile.budget_window != window:
+            profile.budget_window = window
+            profile.budget_spent = 0
+
+    def _remaining_budget(self, profile: _PlayerProfile) -> int:
+        self._roll_budget(profile)
+        return self.token_budget - profile.budget_spent
+
+    def _plan_nodes(self, profile: _PlayerProfile, depth: int, option_count: int = 3) -> int:
+        """按当前画像估算 depth 层计划需要生成的节点数（选项数按常见的 3 个估算）。"""
+        slow = self._is_slow(profile)
+        probabilities = self._probabilities(profile, option_count)
+        ranked = self._ranked(probabilities)
+        nodes, frontier = 0, 1
+        for level in range(depth):
+            if slow:
+                width = 1
+            elif level == 0 or profile.samples < self.min_samples:
+                width = option_count
+            else:
+                width = self._coverage_count(probabilities, ranked)
+            frontier *= width
+            nodes += frontier
+        return nodes
+
+    def _fit_budget(self, profile: _PlayerProfile, depth: int, remaining: int) -> int:
+        if remaining <= 0:
+            return 0
+        if not self.tokens_per_node:
+            return depth
+        while depth > 1 and self._plan_nodes(profile, depth) * self.tokens_per_node > remaining:
+            depth -= 1
+        return depth
+
+    def _affordable_branches(self, profile: _PlayerProfile, option_count: int) -> int:
+        if not self.tokens_per_node:
+            return option_count
+        return max(1, min(option_count, int(self._remaining_budget(profile) // self.tokens_per_node)))
@@ -6,18 +6,34 @@
 import json
 import re
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 from config.logging_config import LOGGER
 from config.settings import settings
 
 from . import prompt_templates
+from .history_compaction import history_compactor
 from .history_context import build_prompt_context
 from .image_service import image_service
-from .llm_clients import llm_client
+from .json_repair import coerce_choices, repair_json
+from .json_stream import IncrementalNodeParser, display_choice
+from .llm_clients import llm_client, async_llm_client
 from backend.schemas.story import ChoiceOption, RawStoryData
 
 
+NODE_SYSTEM_PREAMBLE = (
+    "你是交互叙事引擎。严格只输出一个JSON对象，不含任何Markdown或额外文字。"
+    "本次允许的顶层键：text, choices, image_prompts, image_continuity_token。"
+    "其中 choices 为长度3的数组，每项仅包含 option, summary, effects(含 delta_progress, delta_risk, delta_exposure, 可选tags)。"
+    "禁止输出 success_rate 或 success_rate_delta 等任何评分相关字段。"
+)
+
+SETTLEMENT_SYSTEM_PREAMBLE = (
+    "你是JSON生成器。严格只输出一个JSON对象，不含Markdown或多余文字。"
+    "只允许输出：chapter_summary, timeline, key_impacts, next_chapter_hook, cover_image_prompt 这些键。"
+)
+
+
 class StoryEngine:
     """故事生成引擎"""
 
@@ -114,19 +130,66 @@ class StoryEngine:
         base = re.sub(r"\s+", "-", str(wish))[:24]
         return f"{base}-{datetime.now().strftime('%H%M%S')}"
 
+    def _initial_image(self) -> Tuple[str, Dict[str, Any]]:
+        """
+        文本先行：返回节点落库时使用的配图及其状态。
+        开启AI生图时先用图库图片占位并标记 pending，由 image_jobs 后台补齐真实图片。
+        """
+        image_url = image_service.get_random_image_from_library()
+        if settings.enable_ai_image_generation:
+            return image_url, {"status": "pending"}
+        return image_url, {"status": "ready", "source": "library"}
+
     def _parse_node(self, raw_response: str) -> Dict[str, Any]:
         """解析NODE_PROMPT返回：text、choices(含 effects)、image_prompts、image_continuity_token。"""
+        data = self._load_node_json(raw_response)
+        if data is None:
+            # 尝试修复
+            data = self._attempt_json_fix(raw_response)
+        return self._normalize_node(data)
+
+    async def _parse_node_async(self, raw_response: str) -> Dict[str, Any]:
+        """_parse_node 的异步版本：修复阶段改为 await 异步客户端。"""
+        data = self._load_node_json(raw_response)
+        if data is None:
+            data = await self._attempt_json_fix_async(raw_response)
+        return self._normalize_node(data)
+
+    def _load_node_json(self, raw_response: str) -> Optional[Any]:
+        """直接解析节点JSON，失败时返回 None 交由修复流程处理。"""
         json_str = self._extract_json(raw_response)
         try:
-            data = json.loads(json_str)
+            return json.loads(json_str)
         except Exception as e:
             LOGGER.error(f"解析节点JSON失败: {e}; 预览={json_str[:200]!r}")
-            # 尝试修复
-            fixed = self._attempt_json_fix(raw_response)
-            data = fixed
+        return self._repair_json_locally(json_str, raw_response)
+
+    def _is_parseable_node(self, raw_response: str) -> bool:
+        """对冲判定：响应能否（含本地修复）解析出 text 与 choices，不记录日志。"""
+        try:
+            json_str = self._extract_json(raw_response)
+            try:
+                data = json.loads(json_str)
+            except ValueError:
+                data = repair_json(json_str)
+        except Exception:
+            return False
+        return isinstance(data, dict) and "text" in data and "choices" in data
+
+    def _repair_json_locally(self, json_str: str, raw_response: str) -> Optional[Dict[str, Any]]:
+        """本地修复 JSON；结果须含 text 与 choices，否则返回 None 交由模型修复。"""
+        data = repair_json(json_str)
+        if isinstance(data, dict) and "text" in data and "choices" in data:
+            LOGGER.info("[JSON-REPAIR] 本地修复成功，跳过模型修复")
+            return data
+        # 完整记录原始输出，供 bench_json_repair 积累真实失败样本
+        LOGGER.warning(f"[JSON-REPAIR] 本地修复失败，回退模型修复 原始={str(raw_response)!r}")
+        return None
+
+    def _normalize_node(self, data: Any) -> Dict[str, Any]:
         if not isinstance(data, dict) or "text" not in data or "choices" not in data:
             raise ValueError("节点缺少必要字段 'text' 或 'choices'")
-        choices = data.get("choices")
+        choices = coerce_choices(data.get("choices"))
         if not isinstance(choices, list) or len(choices) != 3:
             raise ValueError("节点必须返回3个choices")
         hidden_map: Dict[str, Dict[str, Any]] = {}
@@ -156,40 +219,6 @@ class StoryEngine:
             "image_token": data.get("image_continuity_token") or None,
         }
 
-    def _attempt_json_fix(self, raw_response: str) -> Dict[str, Any]:
-        """当节点解析失败时，请模型修复为严格的JSON结构。"""
-        try:
-            if not raw_response or len(str(raw_response).strip()) < 10:
-                raise ValueError("LLM 原始响应为空，无法修复")
-            fixer_body = (
-                "请将以下内容转换为严格的JSON对象，键只允许：text, choices, image_prompts, image_continuity_token。\n"
-                "要求：\n"
-                "- choices 必须是长度为3的数组；\n"
-                "- 每个choice对象必须包含 option(字符串)、summary(字符串)、effects(对象)；\n"
-                "- effects 对象必须包含 delta_progress(int)、delta_risk(int)、delta_exposure(int)，可选 tags(string[])；\n"
-                "- 仅输出纯JSON，不要Markdown代码块、不要额外文字。\n\n"
-                "原始内容如下：\n<<<\n" + str(raw_response) + "\n>>>\n"
-            )
-            preamble = (
-                "你是交互叙事引擎。严格只输出一个JSON对象，不含任何Markdown或额外文字。"
-                "本次允许的顶层键：text, choices, image_prompts, image_continuity_token。"
-                "其中 choices 为长度3的数组，每项仅包含 option, summary, effects(含 delta_progress, delta_risk, delta_exposure, 可选tags)。"
-                "禁止输出 success_rate 或 success_rate_delta 等任何评分相关字段。"
-            )
-            fixed = llm_client.generate(
-                fixer_body,
-                history=None,
-                model=None,
-                temperature=0.1,
-                max_tokens=2000,
-                system_preamble_override=preamble,
-            )
-            fixed_json = self._extract_json(fixed)
-            return json.loads(fixed_json)
-        except Exception as e:
-            LOGGER.error(f"[JSON-FIX] 修复失败: {e}; 原始预览={str(raw_response)[:200]!r}")
-            raise
-    
     def _extract_json(self, raw_response: str) -> str:
         """
         从原始模型输出中提取 JSON 字符串：
@@ -250,6 +279,7 @@ class StoryEngine:
         return frag
 
     def _normalize_choices(self, choices_payload: Any) -> List[ChoiceOption]:
+        choices_payload = coerce_choices(choices_payload)
         if not isinstance(choices_payload, list):
             raise ValueError("choices 字段必须是包含选项对象的列表")
 
@@ -311,7 +341,9 @@ class StoryEngine:
                 data = json.loads(json_str)
             except Exception as e:
                 LOGGER.error(f"[JSON] 直接解析失败: {e}; json_str预览={json_str[:200]!r}")
-                data = self._attempt_json_fix(raw_response)
+                data = self._repair_json_locally(json_str, raw_response)
+                if data is None:
+                    data = self._attempt_json_fix(raw_response)
 
         # 验证必要字段
         if "text" not in data or "choices" not in data:
@@ -346,21 +378,41 @@ class StoryEngine:
             "extra": extra_payload,
         }
 
+    def _build_json_fix_prompt(self, raw_response: str) -> str:
+        """节点修复提示词（同步与异步修复共用）：与 NODE_PROMPT 相同的节点结构，不含评分字段。"""
+        if not raw_response or len(str(raw_response).strip()) < 10:
+            raise ValueError("LLM 原始响应为空，无法修复")
+        return (
+            "请将以下内容转换为严格的JSON对象，键只允许：text, choices, image_prompts, image_continuity_token。\n"
+            "要求：\n"
+            "- choices 必须是长度为3的数组；\n"
+            "- 每个choice对象必须包含 option(字符串)、summary(字符串)、effects(对象)；\n"
+            "- effects 对象必须包含 delta_progress(int)、delta_risk(int)、delta_exposure(int)，可选 tags(string[])；\n"
+            "- 仅输出纯JSON，不要Markdown代码块、不要额外文字。\n\n"
+            "原始内容如下：\n<<<\n" + str(raw_response) + "\n>>>\n"
+        )
+
+    def _load_fixed_json(self, fixed: str) -> Dict:
+        LOGGER.debug(f"[JSON-FIX] 修复返回长度={len(str(fixed))} 预览={str(fixed)[:200]!r}")
+
+        # 再次检查修复后的响应
+        if not fixed or len(str(fixed).strip()) < 10:
+            raise ValueError("LLM 修复响应为空，无法解析")
+
+        fixed_json = self._extract_json(fixed)
+        return json.loads(fixed_json)
+
+    def _is_valid_fix(self, fixed: str) -> bool:
+        try:
+            data = self._load_fixed_json(fixed)
+        except Exception:
+            return False
+        return isinstance(data, dict) and "text" in data and "choices" in data
+
     def _attempt_json_fix(self, raw_response: str) -> Dict:
-        """当直接解析失败时，请模型将输出转换为严格JSON，仅尝试一次。"""
+        """当节点解析失败时，请模型修复为严格的节点JSON结构，仅尝试一次。"""
         try:
-            # 检查原始响应是否为空或太短
-            if not raw_response or len(str(raw_response).strip()) < 10:
-                raise ValueError("LLM 原始响应为空，无法修复")
-            
-            fixer_prompt = (
-                "你是一个严格的JSON修复器。请将以下内容转换为一个严格的JSON对象，"
-                "必须包含键 'text' (字符串)、'success_rate' (0-100 的整数)、'choices' (长度为3的对象数组)。\n"
-                "其中每个 choice 对象必须包含 'option'(字符串)、'summary'(字符串)、'success_rate_delta'(整数，-100~100)，"
-                "可选 'risk_level'(字符串) 和 'tags'(字符串数组)。\n"
-                "输出要求：仅输出JSON本体，不要使用Markdown代码块或任何额外文字。\n\n"
-                "原始内容如下：\n<<<\n" + str(raw_response) + "\n>>>\n"
-            )
+            fixer_prompt = self._build_json_fix_prompt(raw_response)
             # 避免递归：本方法不再递归调用自身
             fixed = llm_client.generate(
                 fixer_prompt,
@@ -368,21 +420,39 @@ class StoryEngine:
                 model=None,
                 temperature=0.1,
                 max_tokens=2000, # 提高修复任务的令牌限制
+                system_preamble_override=NODE_SYSTEM_PREAMBLE,
+                cache_site="json_fix",
+                cache_validate=self._is_valid_fix,
+                usage_site="json_fix",
             )
-            LOGGER.debug(f"[JSON-FIX] 修复返回长度={len(str(fixed))} 预览={str(fixed)[:200]!r}")
-            
-            # 再次检查修复后的响应
-            if not fixed or len(str(fixed).strip()) < 10:
-                raise ValueError("LLM 修复响应为空，无法解析")
-
-            fixed_json = self._extract_json(fixed)
-            return json.loads(fixed_json)
+            return self._load_fixed_json(fixed)
         except Exception as e:
             LOGGER.error(f"[JSON-FIX] 修复失败: {e}; 原始预览={str(raw_response)[:200]!r}")
             raise
 
-    def start_story(self, wish: str) -> RawStoryData:
-        """开始新的故事"""
+    async def _attempt_json_fix_async(self, raw_response: str) -> Dict:
+        """_attempt_json_fix 的异步版本。"""
+        try:
+            fixer_prompt = self._build_json_fix_prompt(raw_response)
+            fixed = await async_llm_client.generate(
+                fixer_prompt,
+                history=None,
+                model=None,
+                temperature=0.1,
+                max_tokens=2000,
+                system_preamble_override=NODE_SYSTEM_PREAMBLE,
+                cache_site="json_fix",
+                cache_validate=self._is_valid_fix,
+                usage_site="json_fix",
+            )
+            return self._load_fixed_json(fixed)
+        except Exception as e:
+            LOGGER.error(f"[JSON-FIX] 修复失败: {e}; 原始预览={str(raw_response)[:200]!r}")
+            raise
+
+    # ---------------- 开局 ----------------
+    def _prepare_start(self, wish: str) -> Dict[str, Any]:
+        """构建开局请求：提示词上下文、ChapterFlow 配置与图像连续性token。"""
         LOGGER.info(f"收到新的故事开始请求，愿望是: '{wish}'")
         prompt_context = build_prompt_context(wish)
         # 使用 ChapterFlow 流程
@@ -392,17 +462,15 @@ class StoryEngine:
                 history_context=prompt_context["context_block"],
                 image_token=image_token,
             )
-        preamble = (
-            "你是交互叙事引擎。严格只输出一个JSON对象，不含任何Markdown或额外文字。"
-            "本次允许的顶层键：text, choices, image_prompts, image_continuity_token。"
-            "其中 choices 为长度3的数组，每项仅包含 option, summary, effects(含 delta_progress, delta_risk, delta_exposure, 可选tags)。"
-            "禁止输出 success_rate 或 success_rate_delta 等任何评分相关字段。"
-        )
-        raw_response = llm_client.generate(prompt, system_preamble_override=preamble)
-        LOGGER.info(f"[LLM raw][start] 长度={len(str(raw_response))} 预览={str(raw_response)[:300]!r}")
-        parsed = self._parse_node(raw_response)
-        story_text = parsed["text"]
-        
+        return {
+            "wish": wish,
+            "prompt_context": prompt_context,
+            "cfg": cfg,
+            "image_token": image_token,
+            "prompt": prompt,
+        }
+
+    def _display_choices(self, parsed: Dict[str, Any]) -> List[ChoiceOption]:
         # 构造展示choices（隐藏effects不外露）
         display_choices = []
         for ch in parsed["choices_display"]:
@@ -415,31 +483,39 @@ class StoryEngine:
                     tags=None,
                 )
             )
-        
-        # 【图像生成】直接使用主要的图像服务逻辑：AI优先，失败则随机图库
-        image_url = image_service.get_image_for_story(story_text)
+        return display_choices
+
+    def _build_start_result(
+        self,
+        req: Dict[str, Any],
+        parsed: Dict[str, Any],
+        image_url: str,
+        image_meta: Dict[str, Any],
+    ) -> RawStoryData:
+        prompt_context = req["prompt_context"]
         chapter_meta = {
             "enabled": True,
-            "config": cfg,
+            "config": req["cfg"],
             "state": {"progress": 0, "risk": 0, "exposure": 0},
             "timeline": [],
             "node_index": 1,
-            "image_token": parsed.get("image_token") or image_token,
+            "image_token": parsed.get("image_token") or req["image_token"],
             "hidden_effects_map": parsed["hidden_effects_map"],  # 仅供后续引擎读取
         }
         metadata = {
             "generated_at": datetime.now().isoformat(),
-            "wish": wish,
+            "wish": req["wish"],
             "type": "start",
             "chapter_number": 1,
             "history_profile": prompt_context["profile_dict"],
             "recommended_chapter_count": prompt_context["recommended_chapter_count"],
             "anchor_events": prompt_context["anchor_events"],
             "chapter": chapter_meta,
+            "image": image_meta,
         }
         result = RawStoryData(
-            text=story_text,
-            choices=display_choices,
+            text=parsed["text"],
+            choices=self._display_choices(parsed),
             image_url=image_url,
             success_rate=None,  # 完全移除成功率
             metadata=metadata,
@@ -447,18 +523,36 @@ class StoryEngine:
         LOGGER.info("新故事生成成功")
         return result
 
-    
-    def continue_story(
+    def start_story(self, wish: str) -> RawStoryData:
+        """开始新的故事"""
+        req = self._prepare_start(wish)
+        raw_response = llm_client.generate(req["prompt"], system_preamble_override=NODE_SYSTEM_PREAMBLE, hedge_validate=self._is_parseable_node, usage_site="start")
+        LOGGER.info(f"[LLM raw][start] 长度={len(str(raw_response))} 预览={str(raw_response)[:300]!r}")
+        parsed = self._parse_node(raw_response)
+
+        image_url, image_meta = self._initial_image()
+        return self._build_start_result(req, parsed, image_url, image_meta)
+
+    async def start_story_async(self, wish: str) -> RawStoryData:
+        """start_story 的异步版本：LLM 调用走异步客户端。"""
+        req = self._prepare_start(wish)
+        raw_response = await async_llm_client.generate(req["prompt"], system_preamble_override=NODE_SYSTEM_PREAMBLE, hedge_validate=self._is_parseable_node, usage_site="start")
+        LOGGER.info(f"[LLM raw][start] 长度={len(str(raw_response))} 预览={str(raw_response)[:300]!r}")
+        parsed = await self._parse_node_async(raw_response)
+
+        image_url, image_meta = self._initial_image()
+        return self._build_start_result(req, parsed, image_url, image_meta)
+
+    # ---------------- 续写 ----------------
+    def _prepare_continue(
         self,
         wish: str,
         story_history: List[Dict[str, str]],
         choice: str,
-        *,
         chapter_number: int,
-        current_success_rate: Optional[int],
-        parent_metadata: Optional[Dict[str, Any]] = None,
-    ) -> RawStoryData:
-        """继续故事"""
+        parent_metadata: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """构建续写请求：继承父节点的章节状态并生成提示词。"""
         LOGGER.info(f"继续故事，用户选择: {choice}")
 
         # success_rate可能为None（隐藏数值），这是正常的
@@ -482,16 +576,26 @@ class StoryEngine:
             history_context=prompt_context["context_block"],
             image_token=image_token,
         )
-        preamble = (
-            "你是交互叙事引擎。严格只输出一个JSON对象，不含任何Markdown或额外文字。"
-            "本次允许的顶层键：text, choices, image_prompts, image_continuity_token。"
-            "其中 choices 为长度3的数组，每项仅包含 option, summary, effects(含 delta_progress, delta_risk, delta_exposure, 可选tags)。"
-            "禁止输出 success_rate 或 success_rate_delta 等任何评分相关字段。"
-        )
-        raw_response = llm_client.generate(prompt, history=story_history, system_preamble_override=preamble)
-        LOGGER.info(f"[LLM raw][continue] 长度={len(str(raw_response))} 预览={str(raw_response)[:300]!r}")
-        parsed = self._parse_node(raw_response)
-        story_text = parsed["text"]
+        return {
+            "wish": wish,
+            # 发送前强制执行历史 token 预算
+            "story_history": history_compactor.fit_budget(story_history),
+            "choice": choice,
+            "chapter_number": chapter_number,
+            "prompt_context": prompt_context,
+            "cfg": cfg,
+            "state_prev": state_prev,
+            "node_index_prev": node_index_prev,
+            "image_token": image_token,
+            "timeline_prev": timeline_prev,
+            "prompt": prompt,
+        }
+
+    def _advance_chapter(self, req: Dict[str, Any], parsed: Dict[str, Any]) -> Dict[str, Any]:
+        """应用所选项的隐藏影响，更新时间线并做结算判定。"""
+        choice = req["choice"]
+        state_prev = req["state_prev"]
+        node_index_prev = req["node_index_prev"]
 
         # 应用选择的隐藏影响
         heff_map = parsed["hidden_effects_map"]
@@ -505,66 +609,63 @@ class StoryEngine:
             if ch.get("option") == choice:
                 chosen_summary = ch.get("summary")
                 break
-        timeline = timeline_prev + [{
+        timeline = req["timeline_prev"] + [{
             "node": node_index_prev,
             "choice": choice,
             "impact": chosen_summary or "",
         }]
 
         # 结算判定
-        settle = self._should_settle(state_cur, nodes_count=node_index_prev, cfg=cfg, deadlock=False)
-        settlement_payload: Optional[Dict[str, Any]] = None
+        settle = self._should_settle(state_cur, nodes_count=node_index_prev, cfg=req["cfg"], deadlock=False)
         grade = self._compute_grade(state_cur)
         result_tag = None
         if settle is not None:
             result_tag = "success" if settle == "success" else ("fail" if settle == "fail" else "auto")
-            settlement_payload = self._generate_settlement(
-                wish=wish,
-                timeline=timeline,
-                result=result_tag,
-                grade=grade,
-            )
-
-        # 构造展示choices（隐藏effects不外露），若结算则可返回空choices
-        display_choices = []
-        if settlement_payload is None:
-            for ch in parsed["choices_display"]:
-                display_choices.append(
-                    ChoiceOption(
-                        option=ch["option"],
-                        summary=ch["summary"],
-                        success_rate_delta=None,
-                        risk_level=None,
-                        tags=None,
-                    )
-                )
+        return {
+            "state": state_cur,
+            "micro": micro,
+            "timeline": timeline,
+            "grade": grade,
+            "result_tag": result_tag,
+        }
 
-        # 【图像生成】直接使用主要的图像服务逻辑：AI优先，失败则随机图库
-        image_url = image_service.get_image_for_story(story_text)
+    def _build_continue_result(
+        self,
+        req: Dict[str, Any],
+        parsed: Dict[str, Any],
+        progress: Dict[str, Any],
+        settlement_payload: Optional[Dict[str, Any]],
+        image_url: str,
+        image_meta: Dict[str, Any],
+    ) -> RawStoryData:
+        prompt_context = req["prompt_context"]
+        # 若结算则可返回空choices
+        display_choices = self._display_choices(parsed) if settlement_payload is None else []
         chapter_meta = {
             "enabled": True,
-            "config": cfg,
-            "state": state_cur,
-            "timeline": timeline,
-            "node_index": node_index_prev + 1,
-            "image_token": parsed.get("image_token") or image_token,
-            "micro_feedback": micro,
+            "config": req["cfg"],
+            "state": progress["state"],
+            "timeline": progress["timeline"],
+            "node_index": req["node_index_prev"] + 1,
+            "image_token": parsed.get("image_token") or req["image_token"],
+            "micro_feedback": progress["micro"],
             "settlement": settlement_payload,
-            "hidden_effects_map": heff_map,
+            "hidden_effects_map": parsed["hidden_effects_map"],
         }
         metadata = {
             "generated_at": datetime.now().isoformat(),
-            "user_choice": choice,
+            "user_choice": req["choice"],
             "type": "continue",
-            "history_length": len(story_history),
-            "chapter_number": chapter_number + 1,
+            "history_length": len(req["story_history"]),
+            "chapter_number": req["chapter_number"] + 1,
             "history_profile": prompt_context["profile_dict"],
             "recommended_chapter_count": prompt_context["recommended_chapter_count"],
             "anchor_events": prompt_context["anchor_events"],
             "chapter": chapter_meta,
+            "image": image_meta,
         }
         result = RawStoryData(
-            text=story_text,
+            text=parsed["text"],
             choices=display_choices,
             image_url=image_url,
             success_rate=None,  # 完全移除成功率
@@ -573,8 +674,103 @@ class StoryEngine:
         LOGGER.info("故事继续生成成功")
         return result
 
-    def _generate_settlement(self, *, wish: str, timeline: List[Dict[str, Any]], result: str, grade: str) -> Dict[str, Any]:
-        """调用LLM生成章末结算描述（复盘+引子）。"""
+    def continue_story(
+        self,
+        wish: str,
+        story_history: List[Dict[str, str]],
+        choice: str,
+        *,
+        chapter_number: int,
+        current_success_rate: Optional[int],
+        parent_metadata: Optional[Dict[str, Any]] = None,
+    ) -> RawStoryData:
+        """继续故事"""
+        req = self._prepare_continue(wish, story_history, choice, chapter_number, parent_metadata)
+        raw_response = llm_client.generate(req["prompt"], history=req["story_history"], system_preamble_override=NODE_SYSTEM_PREAMBLE, hedge_validate=self._is_parseable_node, usage_site="continue")
+        LOGGER.info(f"[LLM raw][continue] 长度={len(str(raw_response))} 预览={str(raw_response)[:300]!r}")
+        parsed = self._parse_node(raw_response)
+        progress = self._advance_chapter(req, parsed)
+
+        settlement_payload: Optional[Dict[str, Any]] = None
+        if progress["result_tag"] is not None:
+            settlement_payload = self._generate_settlement(
+                wish=wish,
+                timeline=progress["timeline"],
+                result=progress["result_tag"],
+                grade=progress["grade"],
+            )
+
+        image_url, image_meta = self._initial_image()
+        return self._build_continue_result(req, parsed, progress, settlement_payload, image_url, image_meta)
+
+    async def continue_story_async(
+        self,
+        wish: str,
+        story_history: List[Dict[str, str]],
+        choice: str,
+        *,
+        chapter_number: int,
+        current_success_rate: Optional[int],
+        parent_metadata: Optional[Dict[str, Any]] = None,
+    ) -> RawStoryData:
+        """continue_story 的异步版本。"""
+        req = self._prepare_continue(wish, story_history, choice, chapter_number, parent_metadata)
+        raw_response = await async_llm_client.generate(req["prompt"], history=req["story_history"], system_preamble_override=NODE_SYSTEM_PREAMBLE, hedge_validate=self._is_parseable_node, usage_site="continue")
+        LOGGER.info(f"[LLM raw][continue] 长度={len(str(raw_response))} 预览={str(raw_response)[:300]!r}")
+        return await self._finish_continue_async(req, raw_response)
+
+    async def continue_story_stream(
+        self,
+        wish: str,
+        story_history: List[Dict[str, str]],
+        choice: str,
+        *,
+        chapter_number: int,
+        current_success_rate: Optional[int],
+        parent_metadata: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        流式续写：边生成边产出事件。
+        - ("text", 增量文本)：正文片段，已解码可直接拼接展示；
+        - ("choice", {"index", "option", "summary"})：某个选项闭合后立即产出；
+        - ("done", RawStoryData)：完整输出经常规解析/修复/结算/配图后的最终结果。
+        """
+        req = self._prepare_continue(wish, story_history, choice, chapter_number, parent_metadata)
+        parser = IncrementalNodeParser()
+        async for delta in async_llm_client.generate_stream(
+            req["prompt"], history=req["story_history"], system_preamble_override=NODE_SYSTEM_PREAMBLE, usage_site="continue"
+        ):
+            for kind, payload in parser.feed(delta):
+                if kind == "choice":
+                    index, choice_payload = payload
+                    yield "choice", {"index": index, **display_choice(choice_payload)}
+                else:
+                    yield kind, payload
+
+        raw_response = parser.raw
+        LOGGER.info(f"[LLM raw][continue-stream] 长度={len(raw_response)} 预览={raw_response[:300]!r}")
+        result = await self._finish_continue_async(req, raw_response)
+        yield "done", result
+
+    async def _finish_continue_async(self, req: Dict[str, Any], raw_response: str) -> RawStoryData:
+        """解析续写输出并完成章节推进、结算与配图。"""
+        parsed = await self._parse_node_async(raw_response)
+        progress = self._advance_chapter(req, parsed)
+
+        settlement_payload: Optional[Dict[str, Any]] = None
+        if progress["result_tag"] is not None:
+            settlement_payload = await self._generate_settlement_async(
+                wish=req["wish"],
+                timeline=progress["timeline"],
+                result=progress["result_tag"],
+                grade=progress["grade"],
+            )
+
+        image_url, image_meta = self._initial_image()
+        return self._build_continue_result(req, parsed, progress, settlement_payload, image_url, image_meta)
+
+    # ---------------- 章末结算 ----------------
+    def _build_settlement_prompt(self, timeline: List[Dict[str, Any]], result: str, grade: str) -> str:
         # 组织时间线块
         lines = []
         for item in timeline:
@@ -583,16 +779,13 @@ class StoryEngine:
             imp = item.get("impact") or ""
             lines.append(f"- 第{n}步：选择《{c}》，影响：{imp}")
         timeline_block = "\n".join(lines) or "- （时间线极短）"
-        prompt = prompt_templates.SETTLEMENT_PROMPT.format(
+        return prompt_templates.SETTLEMENT_PROMPT.format(
             timeline_block=timeline_block,
             result=result,
             grade=grade,
         )
-        settle_preamble = (
-            "你是JSON生成器。严格只输出一个JSON对象，不含Markdown或多余文字。"
-            "只允许输出：chapter_summary, timeline, key_impacts, next_chapter_hook, cover_image_prompt 这些键。"
-        )
-        raw = llm_client.generate(prompt, system_preamble_override=settle_preamble)
+
+    def _parse_settlement(self, raw: str, timeline: List[Dict[str, Any]], result: str, grade: str) -> Dict[str, Any]:
         try:
             data = json.loads(self._extract_json(raw))
         except Exception as e:
@@ -608,5 +801,17 @@ class StoryEngine:
         data["grade"] = grade
         return data
 
+    def _generate_settlement(self, *, wish: str, timeline: List[Dict[str, Any]], result: str, grade: str) -> Dict[str, Any]:
+        """调用LLM生成章末结算描述（复盘+引子）。"""
+        prompt = self._build_settlement_prompt(timeline, result, grade)
+        raw = llm_client.generate(prompt, system_preamble_override=SETTLEMENT_SYSTEM_PREAMBLE, usage_site="settlement")
+        return self._parse_settlement(raw, timeline, result, grade)
+
+    async def _generate_settlement_async(self, *, wish: str, timeline: List[Dict[str, Any]], result: str, grade: str) -> Dict[str, Any]:
+        """_generate_settlement 的异步版本。"""
+        prompt = self._build_settlement_prompt(timeline, result, grade)
+        raw = await async_llm_client.generate(prompt, system_preamble_override=SETTLEMENT_SYSTEM_PREAMBLE, usage_site="settlement")
+        return self._parse_settlement(raw, timeline, result, grade)
+
 # 全局故事引擎实例
 story_engine = StoryEngine()
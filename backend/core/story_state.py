@@ -5,30 +5,19 @@ from typing import Dict, List, Optional
 from database import crud
 from database.models import StoryNode
 from backend import schemas
+from .history_compaction import history_compactor
 
 
 def build_story_history(db, node: StoryNode) -> List[Dict[str, str]]:
-    """重建从根节点到指定节点的对话历史, 用于提示词上下文."""
-    path_nodes: List[StoryNode] = []
-    cursor = node
-    visited = set()
-
-    while cursor is not None:
-        if cursor.id in visited:
-            break
-        visited.add(cursor.id)
-        path_nodes.append(cursor)
-        if cursor.parent_id is None:
-            break
-        cursor = crud.get_node_by_id(db, cursor.parent_id)
-
-    path_nodes.reverse()
-    history: List[Dict[str, str]] = []
-    for item in path_nodes:
-        history.append({"role": "assistant", "content": item.story_text})
-        if item.user_choice:
-            history.append({"role": "user", "content": f"我选择了：{item.user_choice}"})
-    return history
+    """
+    重建从根节点到指定节点的对话历史, 用于提示词上下文（单次递归查询取回整条路径）.
+    超过 history_keep_recent_nodes 的早期节点由 history_compactor 替换为前情提要.
+    """
+    path = crud.get_node_path(db, node.id)
+    if not path:
+        # 节点尚未落库时仅含自身
+        path = [{"id": node.id, "story_text": node.story_text, "user_choice": node.user_choice, "depth": 1}]
+    return history_compactor.build(path)
 
 
 def extract_chapter_number(node: StoryNode) -> int:
@@ -1,3 +1,6 @@
+import os
+from contextlib import contextmanager
+
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -23,11 +26,34 @@ if vendor != expect or vendor != "postgresql":
 
 LOGGER.info(f"数据库配置: vendor={vendor}, url={DATABASE_URL}")
 
+
+def _pool_limits() -> tuple[int, int]:
+    """
+    连接池按短时会话的实际并发推导：请求路径与后台 worker 都只在读取与写入时短暂持有连接（模型调用、
+    通知等待期间不占用），因此不按请求数或 worker 总数预留，而是取请求处理的并发数据库段（10）、
+    配图 worker 数与预推演 worker 的十分之一（同批完成时的落库突发）之和；
+    再用 db_connection_budget 除以 Gunicorn worker 数封顶，保证整机连接数不超过预算。
+    """
+    workers = os.getenv("GUNICORN_WORKERS", "")
+    workers = int(workers) if workers.isdigit() and int(workers) > 0 else 1
+    image_workers = max(1, int(getattr(settings, "image_worker_count", 4)))
+    speculation_writers = -(-max(1, int(getattr(settings, "speculation_max_workers", 60))) // 10)
+    demand = 10 + image_workers + speculation_writers
+    total = max(2, min(demand, int(settings.db_connection_budget) // workers))
+    default_pool = (total + 1) // 2
+    pool_size = settings.db_pool_size if settings.db_pool_size is not None else default_pool
+    max_overflow = settings.db_max_overflow if settings.db_max_overflow is not None else total - default_pool
+    return max(1, pool_size), max(0, max_overflow)
+
+
+POOL_SIZE, POOL_MAX_OVERFLOW = _pool_limits()
+LOGGER.info(f"数据库连接池: pool_size={POOL_SIZE}, max_overflow={POOL_MAX_OVERFLOW}")
+
 # Create PostgreSQL engine
 engine = create_engine(
     DATABASE_URL,
-    pool_size=10,
-    max_overflow=20,
+    pool_size=POOL_SIZE,
+    max_overflow=POOL_MAX_OVERFLOW,
     pool_pre_ping=True,
     pool_recycle=1800,
 )
@@ -44,6 +70,21 @@ def get_db():
     finally:
         db.close()
 
+@contextmanager
+def session_scope():
+    """
+    后台线程使用的短时会话：每个任务/每次写入各自创建，用完即关闭（异常时先回滚）。
+    Session 不是线程安全的，不要跨线程共享，也不要在模型调用期间持有。
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
 def init_db():
     """Deprecated: Alembic manages schema for PostgreSQL; no-op."""
     return
@@ -1,10 +1,12 @@
 # backend/database/crud.py
-from datetime import datetime
-from typing import List, Optional
+import json
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
 
-from sqlalchemy import func
+from sqlalchemy import and_, case, func, literal, or_, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, aliased
 
 from backend.core import security
 from backend.schemas import user as user_schema
@@ -93,7 +95,9 @@ def create_story_node(
     speculative_depth: int | None = None,
     speculative_expires_at = None,
 ) -> models.StoryNode:
-    # 【新增逻辑】验证父节点
+    # 【新增逻辑】验证父节点，并据此计算物化路径
+    depth = 1
+    path: List[int] = []
     if parent_id:
         parent_node = db.query(models.StoryNode).filter(
             models.StoryNode.id == parent_id,
@@ -103,6 +107,8 @@ def create_story_node(
             LOGGER.error(f"尝试创建节点时，找不到有效的父节点。Session ID: {session_id}, Parent ID: {parent_id}")
             # 在开发阶段，直接抛出异常而不是返回None
             raise ValueError(f"父节点 (id={parent_id}) 不存在或不属于会话 (session_id={session_id})")
+        depth = (parent_node.depth or 1) + 1
+        path = [*(parent_node.path or []), parent_node.id]
 
     db_node = models.StoryNode(
         session_id=session_id,
@@ -114,6 +120,8 @@ def create_story_node(
         is_speculative=is_speculative,
         speculative_depth=speculative_depth,
         speculative_expires_at=speculative_expires_at,
+        depth=depth,
+        path=path,
     )
     db_node.set_choices(segment.choices)
     db_node.set_metadata(segment.metadata or {})
@@ -127,6 +135,82 @@ def create_story_node(
         db.refresh(db_node)
     return db_node
 
+def create_story_nodes_bulk(
+    db: Session,
+    session_id: int,
+    parent_id: int,
+    children: List[tuple],
+    *,
+    is_speculative: bool = False,
+    speculative_depth: int | None = None,
+    speculative_expires_at = None,
+) -> Dict[str, models.StoryNode]:
+    """
+    一次写入同一父节点下的多个子节点：父节点只校验一次，随后单条多行
+    INSERT ... ON CONFLICT (session_id, parent_id, user_choice) DO NOTHING RETURNING。
+
+    Args:
+        children: [(user_choice, RawStoryData), ...]
+
+    Returns:
+        Dict[str, StoryNode]: user_choice -> 节点（已脱离会话的只读快照）；与已有节点冲突的选择返回已有节点
+    """
+    parent_node = db.query(models.StoryNode.depth, models.StoryNode.path).filter(
+        models.StoryNode.id == parent_id,
+        models.StoryNode.session_id == session_id,
+    ).first()
+    if not parent_node:
+        LOGGER.error(f"尝试批量创建节点时，找不到有效的父节点。Session ID: {session_id}, Parent ID: {parent_id}")
+        raise ValueError(f"父节点 (id={parent_id}) 不存在或不属于会话 (session_id={session_id})")
+    depth = (parent_node.depth or 1) + 1
+    path = [*(parent_node.path or []), parent_id]
+
+    rows = []
+    for user_choice, segment in children:
+        # 复用模型上的序列化规则
+        draft = models.StoryNode()
+        draft.set_choices(segment.choices)
+        draft.set_metadata(segment.metadata or {})
+        rows.append({
+            "session_id": session_id,
+            "parent_id": parent_id,
+            "story_text": segment.text,
+            "image_url": segment.image_url,
+            "choices": draft.choices,
+            "user_choice": user_choice,
+            "node_metadata": draft.node_metadata,
+            "success_rate": segment.success_rate,
+            "is_speculative": is_speculative,
+            "speculative_depth": speculative_depth,
+            "speculative_expires_at": speculative_expires_at,
+            "depth": depth,
+            "path": path,
+        })
+    if not rows:
+        return {}
+
+    stmt = (
+        pg_insert(models.StoryNode)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=["session_id", "parent_id", "user_choice"])
+        .returning(models.StoryNode)
+    )
+    created = {node.user_choice: node for node in db.scalars(stmt)}
+    missing = [row["user_choice"] for row in rows if row["user_choice"] not in created]
+    if missing:
+        # 并发写入（如 /continue 实时生成）先占用了这些选择
+        for node in db.query(models.StoryNode).filter(
+            models.StoryNode.session_id == session_id,
+            models.StoryNode.parent_id == parent_id,
+            models.StoryNode.user_choice.in_(missing),
+        ):
+            created[node.user_choice] = node
+    # 提交前脱离会话，避免提交后逐个节点重新 SELECT
+    for node in created.values():
+        db.expunge(node)
+    db.commit()
+    return created
+
 def get_session_by_id(db: Session, session_id: int) -> models.GameSession:
     """根据ID获取游戏会话"""
     return db.query(models.GameSession).filter(models.GameSession.id == session_id).first()
@@ -177,6 +261,12 @@ def get_children_for_parent(db: Session, parent_id: int, *, include_speculative:
     return query.order_by(models.StoryNode.id.asc()).all()
 
 
+def speculative_expiry() -> Optional[datetime]:
+    """新生成或被回溯重新标记的推演节点的回收期限（UTC）；未启用回收时为 None。"""
+    days = max(0, int(getattr(settings, "speculation_gc_retention_days", 0)))
+    return datetime.utcnow() + timedelta(days=days) if days else None
+
+
 def cleanup_expired_speculative_children(db: Session, parent_id: int) -> int:
     now = datetime.utcnow()
     q = (
@@ -198,6 +288,15 @@ def finalize_speculative_node(db: Session, node: models.StoryNode, *, commit: bo
     node.is_speculative = False
     node.speculative_depth = None
     node.speculative_expires_at = None
+    # 记录命中时间（原子写入 metadata.speculation.hit_at），之后被回溯重新标记为预推演也不丢失命中
+    db.execute(
+        text(
+            "UPDATE story_nodes "
+            "SET metadata = jsonb_set(metadata::jsonb, '{speculation,hit_at}', to_jsonb(now()))::json "
+            "WHERE id = :node_id AND metadata::jsonb ? 'speculation'"
+        ),
+        {"node_id": node.id},
+    )
     if commit:
         db.commit()
         db.refresh(node)
@@ -227,9 +326,93 @@ def update_story_node_from_segment(
         db.refresh(node)
     return node
 
+
+def update_node_image(db: Session, node_id: int, image_url: str, image_meta: dict) -> Optional[models.StoryNode]:
+    """后台配图完成后回写节点图片及 metadata.image 状态；节点已被删除时返回 None。"""
+    node = lock_node_for_update(db, node_id)
+    if not node:
+        db.rollback()
+        return None
+    node.image_url = image_url
+    # 整体替换 metadata，确保 JSON 列变更被检测到
+    node.set_metadata({**node.get_metadata(), "image": image_meta})
+    db.commit()
+    db.refresh(node)
+    return node
+
+# 祖先链递归上限，防御 parent_id 异常成环
+_MAX_PATH_HOPS = 10000
+
+
+def get_node_path(db: Session, node_id: int) -> List[dict]:
+    """
+    单次 WITH RECURSIVE 查询取回从根节点到指定节点的完整路径
+
+    Returns:
+        List[dict]: 按根 -> 当前节点排序，每项含 id / parent_id / session_id / story_text / user_choice / depth（根为1）
+        以及 history_summary（metadata 中缓存的滚动摘要，可能为 None）；节点不存在时返回空列表
+    """
+    node = models.StoryNode
+    ancestry = (
+        select(
+            node.id,
+            node.parent_id,
+            node.session_id,
+            node.story_text,
+            node.user_choice,
+            node.node_metadata["history_summary"].label("history_summary"),
+            literal(0).label("hops"),
+        )
+        .where(node.id == node_id)
+        .cte("ancestry", recursive=True)
+    )
+    parent = aliased(node)
+    ancestry = ancestry.union_all(
+        select(
+            parent.id,
+            parent.parent_id,
+            parent.session_id,
+            parent.story_text,
+            parent.user_choice,
+            parent.node_metadata["history_summary"],
+            ancestry.c.hops + 1,
+        )
+        .where(parent.id == ancestry.c.parent_id)
+        .where(ancestry.c.hops < _MAX_PATH_HOPS)
+    )
+    rows = db.execute(select(ancestry).order_by(ancestry.c.hops.desc())).mappings().all()
+    if rows and rows[-1]["hops"] >= _MAX_PATH_HOPS:
+        LOGGER.warning(f"检测到循环引用或路径过深，节点 {node_id}")
+    return [
+        {
+            "id": row["id"],
+            "parent_id": row["parent_id"],
+            "session_id": row["session_id"],
+            "story_text": row["story_text"],
+            "user_choice": row["user_choice"],
+            "history_summary": row["history_summary"],
+            "depth": index + 1,
+        }
+        for index, row in enumerate(rows)
+    ]
+
+
+def set_node_history_summary(db: Session, node_id: int, summary: dict) -> None:
+    """原子地写入 metadata.history_summary，不覆盖并发写入的其它 metadata 键（如配图状态）"""
+    db.execute(
+        text(
+            "UPDATE story_nodes "
+            "SET metadata = (COALESCE(metadata::jsonb, '{}'::jsonb) || jsonb_build_object('history_summary', CAST(:summary AS jsonb)))::json "
+            "WHERE id = :node_id"
+        ),
+        {"node_id": node_id, "summary": json.dumps(summary, ensure_ascii=False)},
+    )
+    db.commit()
+
+
 def calculate_chapter_number(db: Session, session_id: int, node_id: int) -> int:
     """
-    计算指定节点在其故事中的章节号，基于从根节点到当前节点的路径深度
+    计算指定节点在其故事中的章节号，即节点的物化深度（story_nodes.depth）
 
     Args:
         db: 数据库会话
@@ -239,30 +422,15 @@ def calculate_chapter_number(db: Session, session_id: int, node_id: int) -> int:
     Returns:
         int: 章节号（从1开始）
     """
-    # 获取目标节点
-    target_node = get_node_by_id(db, node_id)
-    if not target_node or target_node.session_id != session_id:
+    row = (
+        db.query(models.StoryNode.session_id, models.StoryNode.depth)
+        .filter(models.StoryNode.id == node_id)
+        .first()
+    )
+    if not row or row.session_id != session_id:
         LOGGER.warning(f"节点 {node_id} 不存在或不属于会话 {session_id}")
         return 1
-    
-    # 从目标节点向上追溯到根节点，计算深度
-    depth = 1
-    current = target_node
-    visited = set()
-    
-    while current.parent_id is not None:
-        if current.id in visited:
-            LOGGER.warning(f"检测到循环引用，节点 {current.id}")
-            break
-        visited.add(current.id)
-        
-        parent = get_node_by_id(db, current.parent_id)
-        if not parent:
-            break
-        current = parent
-        depth += 1
-    
-    return depth
+    return row.depth or 1
 
 def get_latest_node_by_session(db: Session, session_id: int, user_id: str) -> Optional[models.StoryNode]:
     """获取指定会话的最新节点，并验证所有权"""
@@ -292,29 +460,37 @@ def get_latest_node_for_user(db: Session, user_id: str) -> Optional[models.Story
     )
 
 def get_deepest_node_for_user(db: Session, user_id: str) -> Optional[models.StoryNode]:
-    """获取某个用户在所有会话中推进最深（章节数最多）的那个会话的最新节点。"""
-    # 统计每个会话的节点数量，选择最多的那个会话
-    sub = (
-        db.query(models.StoryNode.session_id, func.count(models.StoryNode.id).label('cnt'))
-        .join(models.GameSession, models.StoryNode.session_id == models.GameSession.id)
-        .filter(models.GameSession.user_id == user_id)
-        .group_by(models.StoryNode.session_id)
-        .order_by(func.count(models.StoryNode.id).desc())
-        .first()
-    )
-    if not sub:
-        return None
-    session_id = sub[0]
-
-    # 返回该会话中的最新节点
+    """获取某个用户在所有会话中推进最深（章节数最多）的节点；推演缓存节点不计入玩家进度。"""
     return (
         db.query(models.StoryNode)
-        .filter(models.StoryNode.session_id == session_id)
-        .order_by(models.StoryNode.id.desc())
+        .join(models.GameSession, models.StoryNode.session_id == models.GameSession.id)
+        .filter(
+            models.GameSession.user_id == user_id,
+            models.StoryNode.is_speculative.is_(False),
+        )
+        .order_by(models.StoryNode.depth.desc(), models.StoryNode.id.desc())
         .first()
     )
 
 # 【核心修改】重命名并重写此函数
+def mark_descendants_speculative(db: Session, node_id: int, speculative_depth: Optional[int]) -> List[int]:
+    """
+    单条 UPDATE ... RETURNING 将节点的全部子孙标记为推演缓存（不提交，并重新计算回收期限），返回被标记的节点ID。
+    借助物化路径 path @> ARRAY[node_id] 命中 GIN 索引，无需逐层加载 children。
+    """
+    return db.execute(
+        update(models.StoryNode)
+        .where(models.StoryNode.path.contains([node_id]))
+        .values(
+            is_speculative=True,
+            speculative_depth=speculative_depth,
+            speculative_expires_at=speculative_expiry(),
+        )
+        .returning(models.StoryNode.id)
+        .execution_options(synchronize_session="fetch")
+    ).scalars().all()
+
+
 def prune_story_after_node(db: Session, node_id: int) -> models.StoryNode:
     """
     从指定节点之后开始修剪故事树（删除此节点的所有后代）。
@@ -336,35 +512,37 @@ def prune_story_after_node(db: Session, node_id: int) -> models.StoryNode:
 
     LOGGER.info(f"正在从节点 {target_node.id} 之后进行时空回溯...")
 
-    # 遍历目标节点的所有子孙节点，统一标记为可复用的推演缓存，避免删除任何已生成内容
-    descendants: list[models.StoryNode] = []
-    stack = list(target_node.children)
-    while stack:
-        node = stack.pop()
-        descendants.append(node)
-        stack.extend(list(node.children))
-
+    # 将所有子孙节点统一标记为可复用的推演缓存，避免删除任何已生成内容
     fallback_depth = max(0, getattr(settings, "speculation_max_depth", 0) - 1)
-    for node in descendants:
-        node.is_speculative = True
-        node.speculative_depth = fallback_depth if fallback_depth > 0 else None
-        node.speculative_expires_at = None
+    descendant_ids = mark_descendants_speculative(
+        db, target_node.id, fallback_depth if fallback_depth > 0 else None
+    )
 
     db.commit()
 
     # 刷新目标节点的状态，确保其 'children' 集合指向最新数据
     db.refresh(target_node)
 
-    if descendants:
+    if descendant_ids:
         LOGGER.info(
-            f"已完成回溯：保留并标记节点 {target_node.id} 的子孙节点 {[n.id for n in descendants]} 为推演缓存。"
+            f"已完成回溯：保留并标记节点 {target_node.id} 的 {len(descendant_ids)} 个子孙节点为推演缓存。"
         )
+        LOGGER.debug(f"回溯标记的子孙节点: {sorted(descendant_ids)}")
     else:
         LOGGER.info(f"已完成回溯：节点 {target_node.id} 无子孙节点需要处理。")
 
     return target_node
 
-# ... (rest of the code remains the same)
+
+# ===== 存档 =====
+
+def create_story_save(
+    db: Session,
+    session_id: int,
+    node_id: int,
+    title: str,
+    status: str = "active",
+) -> models.StorySave:
     save = models.StorySave(session_id=session_id, node_id=node_id, title=title.strip(), status=status)
     db.add(save)
     db.commit()
@@ -490,3 +668,850 @@ def get_session_details(db: Session, session_id: int, user_id: str) -> Optional[
         models.GameSession.id == session_id,
         models.GameSession.user_id == user_id
     ).first()
+
+# ===== 预推演任务队列（跨进程，PostgreSQL） =====
+
+_ACTIVE_CHILD_WHERE = text("kind = 'child' AND status IN ('queued', 'running')")
+_QUEUED_EXPAND_WHERE = text("kind = 'expand' AND status = 'queued'")
+
+
+def enqueue_speculation_expand(
+    db: Session,
+    session_id: int,
+    node_id: int,
+    depth: int,
+    level: int,
+    lineage: List[str],
+    score: float = 1.0,
+) -> None:
+    """登记节点扩展任务；同节点已有排队任务时合并为更深的深度、更浅的层级、更高的分支概率。
+    由用户当前节点直接发起（lineage 为空）的请求会清空分支路径，使其不可被取消。"""
+    job = models.SpeculationJob
+    stmt = pg_insert(job).values(
+        kind="expand",
+        session_id=session_id,
+        parent_id=node_id,
+        choice="",
+        depth=depth,
+        level=level,
+        lineage=list(lineage),
+        score=score,
+        status="queued",
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["session_id", "parent_id"],
+        index_where=_QUEUED_EXPAND_WHERE,
+        set_={
+            "depth": func.greatest(job.depth, stmt.excluded.depth),
+            "level": func.least(job.level, stmt.excluded.level),
+            "score": func.greatest(job.score, stmt.excluded.score),
+            "lineage": case(
+                (func.cardinality(stmt.excluded.lineage) == 0, stmt.excluded.lineage),
+                else_=job.lineage,
+            ),
+        },
+    )
+    db.execute(stmt)
+    db.commit()
+
+
+def enqueue_speculation_children(db: Session, rows: List[dict]) -> None:
+    """批量登记子节点生成任务；已在排队/执行中的同一选项只抬升其深度与分支概率，实现跨进程去重。"""
+    if not rows:
+        return
+    job = models.SpeculationJob
+    stmt = pg_insert(job).values([{**row, "kind": "child", "status": "queued"} for row in rows])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["session_id", "parent_id", "choice"],
+        index_where=_ACTIVE_CHILD_WHERE,
+        set_={
+            "depth": func.greatest(job.depth, stmt.excluded.depth),
+            "level": func.least(job.level, stmt.excluded.level),
+            "score": func.greatest(job.score, stmt.excluded.score),
+        },
+    )
+    db.execute(stmt)
+    db.commit()
+
+
+def claim_speculation_job(
+    db: Session,
+    owner: str,
+    *,
+    lease_seconds: int,
+    max_attempts: int,
+    user_limit: int,
+) -> Optional[dict]:
+    """
+    以 FOR UPDATE SKIP LOCKED 领取一个任务（层级优先，同层按分支概率从高到低，其次先到先得）。
+    租约过期的 running 任务视为所属进程已崩溃，可被重新领取；
+    user_limit > 0 时跳过该用户已有足够 child 任务在执行的条目。
+    """
+    row = db.execute(
+        text(
+            """
+            WITH candidate AS (
+                SELECT j.id
+                FROM speculation_jobs j
+                WHERE (
+                    j.status = 'queued'
+                    OR (j.status = 'running' AND j.lease_expires_at < now() AND j.attempts < :max_attempts)
+                )
+                AND (
+                    :user_limit <= 0 OR j.kind = 'expand' OR j.user_id IS NULL OR (
+                        SELECT count(*) FROM speculation_jobs r
+                        WHERE r.user_id = j.user_id
+                          AND r.kind = 'child'
+                          AND r.status = 'running'
+                          AND r.lease_expires_at >= now()
+                    ) < :user_limit
+                )
+                ORDER BY j.level, j.score DESC, j.id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            UPDATE speculation_jobs s
+            SET status = 'running',
+                lease_owner = :owner,
+                lease_expires_at = now() + make_interval(secs => :lease_seconds),
+                attempts = s.attempts + 1,
+                started_at = now()
+            FROM candidate
+            WHERE s.id = candidate.id
+            RETURNING s.id, s.kind, s.session_id, s.parent_id, s.choice, s.depth, s.level,
+                      s.score, s.lineage, s.user_id, s.attempts,
+                      EXTRACT(EPOCH FROM (now() - s.enqueued_at)) * 1000.0 AS wait_ms
+            """
+        ),
+        {"owner": owner, "lease_seconds": lease_seconds, "max_attempts": max_attempts, "user_limit": user_limit},
+    ).mappings().first()
+    db.commit()
+    return dict(row) if row else None
+
+
+def finish_speculation_job(
+    db: Session,
+    job_id: int,
+    owner: str,
+    status: str,
+    error: Optional[str] = None,
+) -> Optional[int]:
+    """结束自己持有的任务并返回其最新深度；任务已被取消或租约已被他人接管时返回 None。"""
+    depth = db.execute(
+        text(
+            """
+            UPDATE speculation_jobs
+            SET status = :status, finished_at = now(), lease_owner = NULL, last_error = :error
+            WHERE id = :job_id AND lease_owner = :owner AND status = 'running'
+            RETURNING depth
+            """
+        ),
+        {"job_id": job_id, "owner": owner, "status": status, "error": error},
+    ).scalar()
+    db.commit()
+    return depth
+
+
+def get_speculation_job_status(db: Session, job_id: int) -> Optional[str]:
+    return db.query(models.SpeculationJob.status).filter(models.SpeculationJob.id == job_id).scalar()
+
+
+def heartbeat_speculation_jobs(db: Session, owner: str, lease_seconds: int) -> int:
+    """续租本进程持有的全部 running 任务。"""
+    result = db.execute(
+        text(
+            """
+            UPDATE speculation_jobs
+            SET lease_expires_at = now() + make_interval(secs => :lease_seconds)
+            WHERE lease_owner = :owner AND status = 'running'
+            """
+        ),
+        {"owner": owner, "lease_seconds": lease_seconds},
+    )
+    db.commit()
+    return result.rowcount or 0
+
+
+def fail_exhausted_speculation_jobs(db: Session, max_attempts: int) -> int:
+    """租约过期且已达最大尝试次数的任务标记为失败，释放其去重占位。"""
+    result = db.execute(
+        text(
+            """
+            UPDATE speculation_jobs
+            SET status = 'failed', finished_at = now(), lease_owner = NULL, last_error = 'lease expired'
+            WHERE status = 'running' AND lease_expires_at < now() AND attempts >= :max_attempts
+            """
+        ),
+        {"max_attempts": max_attempts},
+    )
+    db.commit()
+    return result.rowcount or 0
+
+
+def cancel_speculation_branches(db: Session, session_id: int, parent_id: int, chosen: str) -> int:
+    """用户在 parent_id 上提交 chosen 后，取消分支路径经过其余兄弟选项的全部排队/执行中任务。"""
+    result = db.execute(
+        text(
+            """
+            UPDATE speculation_jobs
+            SET status = 'cancelled', finished_at = now()
+            WHERE session_id = :session_id
+              AND status IN ('queued', 'running')
+              AND EXISTS (
+                  SELECT 1 FROM unnest(lineage) AS branch
+                  WHERE branch LIKE :prefix AND branch <> :chosen
+              )
+            """
+        ),
+        {"session_id": session_id, "prefix": f"{parent_id}:%", "chosen": f"{parent_id}:{chosen}"},
+    )
+    db.commit()
+    return result.rowcount or 0
+
+
+def list_cancelled_sibling_nodes(db: Session, session_id: int, parent_id: int, chosen: str) -> List[int]:
+    """用户在 parent_id 上提交 chosen 后，其余兄弟选项下已落库的推演节点（含整棵子树）的ID。"""
+    return db.execute(
+        text(
+            """
+            SELECT id FROM story_nodes
+            WHERE session_id = :session_id
+              AND is_speculative
+              AND (
+                  (parent_id = :parent_id AND user_choice <> :chosen)
+                  OR path && ARRAY(
+                      SELECT id FROM story_nodes
+                      WHERE parent_id = :parent_id AND user_choice <> :chosen
+                  )
+              )
+            """
+        ),
+        {"session_id": session_id, "parent_id": parent_id, "chosen": chosen},
+    ).scalars().all()
+
+
+def is_speculation_child_running(db: Session, session_id: int, parent_id: int, choice: str) -> bool:
+    job = models.SpeculationJob
+    return db.query(
+        db.query(job.id)
+        .filter(
+            job.kind == "child",
+            job.session_id == session_id,
+            job.parent_id == parent_id,
+            job.choice == choice,
+            job.status == "running",
+        )
+        .exists()
+    ).scalar()
+
+
+def purge_finished_speculation_jobs(db: Session, older_than_hours: int) -> int:
+    result = db.execute(
+        text(
+            """
+            DELETE FROM speculation_jobs
+            WHERE status IN ('done', 'failed', 'cancelled')
+              AND finished_at < now() - make_interval(hours => :hours)
+            """
+        ),
+        {"hours": older_than_hours},
+    )
+    db.commit()
+    return result.rowcount or 0
+
+
+def count_speculation_jobs_by_status(db: Session) -> dict:
+    job = models.SpeculationJob
+    rows = db.query(job.status, func.count(job.id)).group_by(job.status).all()
+    return {status: count for status, count in rows}
+
+
+# ===== 预推演节点回收 =====
+
+def delete_expired_speculative_leaves(db: Session, retention_days: int, limit: int) -> List[dict]:
+    """
+    删除一批过期的推演叶子节点并提交，返回被删节点的 [{id, image_url}]。
+    过期：speculative_expires_at 已过；早于回收功能写入的节点（该列为空）按 created_at + retention_days 计。
+    只删除没有子节点、未被存档引用的节点，整棵子树由多批自底向上逐层回收，单个事务的规模与锁持有时间有上限；
+    已被其它事务锁定的节点（正在被命中、插入子节点或存档）跳过，留给下一轮。
+    """
+    rows = db.execute(
+        text(
+            """
+            WITH doomed AS (
+                SELECT n.id
+                FROM story_nodes n
+                WHERE n.is_speculative
+                  AND (
+                      n.speculative_expires_at < :now
+                      OR (n.speculative_expires_at IS NULL AND n.created_at < now() - make_interval(days => :days))
+                  )
+                  AND NOT EXISTS (SELECT 1 FROM story_nodes c WHERE c.parent_id = n.id)
+                  AND NOT EXISTS (SELECT 1 FROM story_saves s WHERE s.node_id = n.id)
+                ORDER BY n.speculative_expires_at NULLS FIRST
+                LIMIT :limit
+                FOR UPDATE OF n SKIP LOCKED
+            )
+            DELETE FROM story_nodes d
+            USING doomed
+            WHERE d.id = doomed.id
+              AND d.is_speculative
+              AND NOT EXISTS (SELECT 1 FROM story_nodes c WHERE c.parent_id = d.id)
+            RETURNING d.id, d.image_url
+            """
+        ),
+        {"now": datetime.utcnow(), "days": retention_days, "limit": limit},
+    ).mappings().all()
+    db.commit()
+    return [dict(row) for row in rows]
+
+
+def referenced_image_urls(db: Session, image_urls: List[str]) -> set:
+    """给定的本地生成配图地址（/static/generated/）中仍被故事节点或开局池快照引用的部分（这些文件不能删除）。"""
+    if not image_urls:
+        return set()
+    referenced = set(
+        db.execute(
+            text(
+                "SELECT DISTINCT image_url FROM story_nodes "
+                "WHERE image_url = ANY(:urls) AND image_url LIKE '%/static/generated/%'"
+            ),
+            {"urls": list(image_urls)},
+        ).scalars()
+    )
+    remaining = [url for url in image_urls if url not in referenced]
+    if remaining:
+        referenced.update(
+            db.execute(
+                text(
+                    """
+                    SELECT u.url
+                    FROM unnest(CAST(:urls AS text[])) AS u(url)
+                    WHERE EXISTS (
+                        SELECT 1 FROM opening_pool p
+                        WHERE strpos(p.root::text, u.url) > 0 OR strpos(p.children::text, u.url) > 0
+                    )
+                    """
+                ),
+                {"urls": remaining},
+            ).scalars()
+        )
+    return referenced
+
+
+# ===== LLM 响应缓存（共享层） =====
+
+def get_llm_cache_entry(db: Session, key: str) -> Optional[tuple]:
+    """返回 (响应文本, 剩余有效秒数)；不存在或已过期返回 None"""
+    row = db.execute(
+        text(
+            """
+            SELECT response, EXTRACT(EPOCH FROM (expires_at - now())) AS remaining
+            FROM llm_response_cache
+            WHERE key = :key AND expires_at > now()
+            """
+        ),
+        {"key": key},
+    ).first()
+    if row is None:
+        return None
+    return row.response, float(row.remaining)
+
+
+def put_llm_cache_entry(
+    db: Session,
+    key: str,
+    *,
+    call_site: str,
+    model: Optional[str],
+    response: str,
+    ttl_seconds: int,
+) -> None:
+    entry = models.LLMCacheEntry
+    expires_at = func.now() + func.make_interval(0, 0, 0, 0, 0, 0, ttl_seconds)
+    stmt = pg_insert(entry).values(
+        key=key,
+        call_site=call_site[:50],
+        model=model[:100] if model else None,
+        response=response,
+        expires_at=expires_at,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[entry.key],
+        set_={
+            "call_site": stmt.excluded.call_site,
+            "model": stmt.excluded.model,
+            "response": stmt.excluded.response,
+            "created_at": func.now(),
+            "expires_at": stmt.excluded.expires_at,
+        },
+    )
+    db.execute(stmt)
+    db.commit()
+
+
+def purge_expired_llm_cache(db: Session) -> int:
+    result = db.execute(text("DELETE FROM llm_response_cache WHERE expires_at <= now()"))
+    db.commit()
+    return result.rowcount or 0
+
+
+# ===== 第一节预生成（多 worker 共享） =====
+
+def mark_start_pregeneration(
+    db: Session,
+    cache_key: str,
+    status: str,
+    *,
+    session_id: Optional[int] = None,
+    node_id: Optional[int] = None,
+    trace: Optional[str] = None,
+) -> None:
+    """写入预生成状态：running（开始，清空上一次的结果）或 ready（完成，记录会话与根节点）"""
+    entry = models.StartPregeneration
+    stmt = pg_insert(entry).values(
+        cache_key=cache_key,
+        status=status,
+        session_id=session_id,
+        node_id=node_id,
+        trace=trace,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[entry.cache_key],
+        set_={
+            "status": stmt.excluded.status,
+            "session_id": stmt.excluded.session_id,
+            "node_id": stmt.excluded.node_id,
+            "trace": stmt.excluded.trace,
+            "updated_at": func.now(),
+        },
+    )
+    db.execute(stmt)
+    db.commit()
+
+
+def delete_start_pregeneration(db: Session, cache_key: str) -> None:
+    db.execute(text("DELETE FROM start_pregenerations WHERE cache_key = :key"), {"key": cache_key})
+    db.commit()
+
+
+def is_start_pregeneration_running(db: Session, cache_key: str, max_age_seconds: int) -> bool:
+    """是否有 worker 正在为该 key 预生成；超过 max_age_seconds 未完成的记录视为已中断（进程崩溃）"""
+    row = db.execute(
+        text(
+            """
+            SELECT 1 FROM start_pregenerations
+            WHERE cache_key = :key AND status = 'running'
+              AND updated_at > now() - make_interval(secs => :max_age)
+            """
+        ),
+        {"key": cache_key, "max_age": max_age_seconds},
+    ).first()
+    return row is not None
+
+
+def take_start_pregeneration(db: Session, cache_key: str) -> Optional[dict]:
+    """领取已完成的预生成：原子删除 ready 记录并返回 {session_id, node_id, trace}，并发领取只有一方成功"""
+    row = db.execute(
+        text(
+            """
+            DELETE FROM start_pregenerations
+            WHERE cache_key = :key AND status = 'ready' AND node_id IS NOT NULL
+            RETURNING session_id, node_id, trace
+            """
+        ),
+        {"key": cache_key},
+    ).first()
+    db.commit()
+    if row is None:
+        return None
+    return {"session_id": row.session_id, "node_id": row.node_id, "trace": row.trace}
+
+
+# ===== 开局池（跨用户复用） =====
+
+# 只属于来源会话的元数据（预推演统计、滚动摘要、克隆来源），不随快照带入其它玩家的会话
+_OPENING_SESSION_METADATA = ("speculation", "history_summary", "opening_pool_entry")
+
+
+def _opening_snapshot(node: models.StoryNode) -> dict:
+    metadata = node.get_metadata()
+    if isinstance(metadata, dict):
+        metadata = {k: v for k, v in metadata.items() if k not in _OPENING_SESSION_METADATA}
+    return {
+        "user_choice": node.user_choice,
+        "text": node.story_text,
+        "image_url": node.image_url,
+        "choices": node.get_choices(),
+        "success_rate": node.success_rate,
+        "metadata": metadata,
+    }
+
+
+def list_opening_pool_entries(db: Session, wish_digest: str, max_age_hours: int) -> List[models.OpeningPoolEntry]:
+    entry = models.OpeningPoolEntry
+    return (
+        db.query(entry)
+        .filter(
+            entry.wish_digest == wish_digest,
+            entry.created_at > func.now() - func.make_interval(0, 0, 0, 0, max_age_hours),
+        )
+        .order_by(entry.id)
+        .all()
+    )
+
+
+def find_opening_harvest_candidates(
+    db: Session, wish: str, max_age_hours: int, limit: int
+) -> List[models.StoryNode]:
+    """
+    查找可收录进开局池的根节点：同愿望、足够新鲜、未被收录、本身不是克隆，且第一层子节点已全部生成
+    """
+    node = models.StoryNode
+    child = aliased(node, name="child_node")
+    # 配图仍在生成的节点不收录，否则克隆出的 pending 状态永远不会被回写
+    ready_child_count = (
+        select(func.count(child.id))
+        .where(
+            child.parent_id == node.id,
+            text("(child_node.metadata -> 'image' ->> 'status') IS DISTINCT FROM 'pending'"),
+        )
+        .correlate(node)
+        .scalar_subquery()
+    )
+    harvested = select(models.OpeningPoolEntry.source_session_id).where(
+        models.OpeningPoolEntry.source_session_id.isnot(None)
+    )
+    choice_count = func.json_array_length(func.cast(node.choices, models.JSON))
+    return (
+        db.query(node)
+        .join(models.GameSession, node.session_id == models.GameSession.id)
+        .filter(
+            models.GameSession.wish == wish,
+            node.parent_id.is_(None),
+            node.created_at > func.now() - func.make_interval(0, 0, 0, 0, max_age_hours),
+            models.GameSession.id.notin_(harvested),
+            text("(story_nodes.metadata ->> 'opening_pool_entry') IS NULL"),
+            text("(story_nodes.metadata -> 'image' ->> 'status') IS DISTINCT FROM 'pending'"),
+            choice_count > 0,
+            ready_child_count >= choice_count,
+        )
+        .order_by(node.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def create_opening_pool_entry(
+    db: Session, *, wish: str, wish_digest: str, root: models.StoryNode
+) -> Optional[models.OpeningPoolEntry]:
+    """
+    将根节点及其第一层预推演子节点快照收录进开局池；来源会话已被收录时返回 None。
+    来源玩家已选中（转正）的子节点不收录，克隆会话缺少的该分支由 /start 入队的预推演补齐。
+    """
+    children = [
+        _opening_snapshot(c)
+        for c in db.query(models.StoryNode)
+        .filter(models.StoryNode.parent_id == root.id, models.StoryNode.is_speculative.is_(True))
+        .order_by(models.StoryNode.id)
+    ]
+    entry = models.OpeningPoolEntry
+    stmt = (
+        pg_insert(entry)
+        .values(
+            wish_digest=wish_digest,
+            wish=wish,
+            source_session_id=root.session_id,
+            root=_opening_snapshot(root),
+            children=children,
+        )
+        .on_conflict_do_nothing(index_elements=[entry.source_session_id])
+        .returning(entry.id)
+    )
+    entry_id = db.execute(stmt).scalar()
+    db.commit()
+    if entry_id is None:
+        return None
+    return db.query(entry).filter(entry.id == entry_id).first()
+
+
+def clone_opening_into_session(
+    db: Session,
+    session_id: int,
+    entry: models.OpeningPoolEntry,
+    *,
+    speculative_depth: Optional[int],
+) -> models.StoryNode:
+    """将开局池快照克隆为会话的根节点，第一层子节点作为推演缓存一并写入"""
+    root_payload = entry.root or {}
+    root = models.StoryNode(
+        session_id=session_id,
+        parent_id=None,
+        story_text=root_payload.get("text") or "",
+        image_url=root_payload.get("image_url") or "",
+        success_rate=root_payload.get("success_rate"),
+        depth=1,
+        path=[],
+    )
+    root.set_choices(root_payload.get("choices") or [])
+    root.set_metadata({**(root_payload.get("metadata") or {}), "opening_pool_entry": entry.id})
+    db.add(root)
+    db.flush()
+
+    for payload in entry.children or []:
+        child = models.StoryNode(
+            session_id=session_id,
+            parent_id=root.id,
+            story_text=payload.get("text") or "",
+            image_url=payload.get("image_url") or "",
+            user_choice=payload.get("user_choice"),
+            success_rate=payload.get("success_rate"),
+            is_speculative=True,
+            speculative_depth=speculative_depth,
+            speculative_expires_at=speculative_expiry(),
+            depth=2,
+            path=[root.id],
+        )
+        child.set_choices(payload.get("choices") or [])
+        child.set_metadata(payload.get("metadata") or {})
+        db.add(child)
+
+    db.query(models.OpeningPoolEntry).filter(models.OpeningPoolEntry.id == entry.id).update(
+        {models.OpeningPoolEntry.served_count: models.OpeningPoolEntry.served_count + 1},
+        synchronize_session=False,
+    )
+    db.commit()
+    db.refresh(root)
+    return root
+
+
+def purge_stale_opening_pool(db: Session, max_age_hours: int) -> int:
+    result = db.execute(
+        text("DELETE FROM opening_pool WHERE created_at <= now() - make_interval(hours => :hours)"),
+        {"hours": max_age_hours},
+    )
+    db.commit()
+    return result.rowcount or 0
+
+
+# ===== LLM 用量统计 =====
+def add_llm_usage(db: Session, rows: List[dict]) -> None:
+    """按数据库当前小时分桶累加用量；rows 每项含 user_id/session_id/call_site/traffic/model 与 calls/prompt_tokens/completion_tokens。"""
+    if not rows:
+        return
+    usage = models.LLMUsage
+    bucket = func.date_trunc("hour", func.now())
+    stmt = pg_insert(usage).values([
+        {
+            "bucket_start": bucket,
+            "user_id": str(row.get("user_id") or "")[:36],
+            "session_id": int(row.get("session_id") or 0),
+            "call_site": str(row["call_site"])[:32],
+            "traffic": str(row["traffic"])[:16],
+            "model": str(row.get("model") or "")[:100],
+            "calls": int(row.get("calls") or 0),
+            "prompt_tokens": int(row.get("prompt_tokens") or 0),
+            "completion_tokens": int(row.get("completion_tokens") or 0),
+        }
+        for row in rows
+    ])
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_llm_usage_bucket",
+        set_={
+            "calls": usage.calls + stmt.excluded.calls,
+            "prompt_tokens": usage.prompt_tokens + stmt.excluded.prompt_tokens,
+            "completion_tokens": usage.completion_tokens + stmt.excluded.completion_tokens,
+            "updated_at": func.now(),
+        },
+    )
+    db.execute(stmt)
+    db.commit()
+
+
+def summarize_llm_usage(
+    db: Session,
+    hours: int,
+    *,
+    user_id: Optional[str] = None,
+    session_id: Optional[int] = None,
+    top_sessions: int = 10,
+    include_user_ids: bool = True,
+) -> dict:
+    """
+    汇总最近 hours 小时（按小时桶）的用量，并与同期新建的正式/预推演节点数对照，
+    得出每个正式节点的平均 token 成本。include_user_ids 为 False 时 top_sessions 不含 user_id。
+    """
+    usage = models.LLMUsage
+    since = func.date_trunc("hour", func.now()) - func.make_interval(0, 0, 0, 0, hours)
+    filters = [usage.bucket_start >= since]
+    if user_id:
+        filters.append(usage.user_id == str(user_id))
+    if session_id:
+        filters.append(usage.session_id == int(session_id))
+
+    sums = (
+        func.coalesce(func.sum(usage.calls), 0).label("calls"),
+        func.coalesce(func.sum(usage.prompt_tokens), 0).label("prompt_tokens"),
+        func.coalesce(func.sum(usage.completion_tokens), 0).label("completion_tokens"),
+    )
+    by_site = [
+        {
+            "call_site": row.call_site,
+            "traffic": row.traffic,
+            "calls": int(row.calls),
+            "prompt_tokens": int(row.prompt_tokens),
+            "completion_tokens": int(row.completion_tokens),
+        }
+        for row in db.query(usage.call_site, usage.traffic, *sums)
+        .filter(*filters)
+        .group_by(usage.call_site, usage.traffic)
+        .order_by(usage.call_site, usage.traffic)
+    ]
+    totals = db.query(*sums).filter(*filters).one()
+
+    node = models.StoryNode
+    node_query = db.query(
+        func.count(case((node.is_speculative.is_(False), 1))).label("committed"),
+        func.count(case((node.is_speculative.is_(True), 1))).label("speculative"),
+    ).filter(node.created_at >= since)
+    if session_id:
+        node_query = node_query.filter(node.session_id == int(session_id))
+    if user_id:
+        node_query = node_query.join(models.GameSession, models.GameSession.id == node.session_id).filter(
+            models.GameSession.user_id == user_id
+        )
+    nodes = node_query.one()
+
+    total_tokens = int(totals.prompt_tokens) + int(totals.completion_tokens)
+    result = {
+        "hours": hours,
+        "calls": int(totals.calls),
+        "prompt_tokens": int(totals.prompt_tokens),
+        "completion_tokens": int(totals.completion_tokens),
+        "by_call_site": by_site,
+        "committed_nodes": int(nodes.committed),
+        "speculative_nodes": int(nodes.speculative),
+        "tokens_per_committed_node": round(total_tokens / nodes.committed, 1) if nodes.committed else None,
+    }
+    if not session_id and top_sessions > 0:
+        token_sum = func.sum(usage.prompt_tokens + usage.completion_tokens)
+        rows = (
+            db.query(usage.session_id, usage.user_id, token_sum.label("tokens"))
+            .filter(*filters, usage.session_id != 0)
+            .group_by(usage.session_id, usage.user_id)
+            .order_by(token_sum.desc())
+            .limit(top_sessions)
+        )
+        top = []
+        for row in rows:
+            entry = {"session_id": row.session_id, "tokens": int(row.tokens)}
+            if include_user_ids:
+                entry["user_id"] = row.user_id or None
+            top.append(entry)
+        result["top_sessions"] = top
+    return result
+
+
+def list_recent_committed_choices(db: Session, limit: int) -> List[dict]:
+    """
+    最近 limit 个由玩家实际选择产生的正式节点：父节点的 choices（已解析）与 metadata，以及所选的 user_choice。
+    供选项热度模型冷启动。
+    """
+    child = models.StoryNode
+    parent = aliased(models.StoryNode, name="parent_node")
+    rows = (
+        db.query(parent.choices, parent.node_metadata, child.user_choice)
+        .join(parent, parent.id == child.parent_id)
+        .filter(child.is_speculative.is_(False), child.user_choice.isnot(None))
+        .order_by(child.id.desc())
+        .limit(limit)
+        .all()
+    )
+    result = []
+    for choices, metadata, user_choice in rows:
+        try:
+            parsed = json.loads(choices or "[]")
+        except ValueError:
+            continue
+        if isinstance(parsed, list):
+            result.append({"choices": [item for item in parsed if isinstance(item, dict)], "metadata": metadata, "user_choice": user_choice})
+    return result
+
+
+def summarize_speculation_outcomes(db: Session, hours: int, abandon_after_minutes: int) -> dict:
+    """
+    统计最近 hours 小时内生成的预推演节点（metadata.speculation）的结局，按层级与选项序号分组：
+    hit 为被玩家选中转正；abandoned 为仍未被访问且已超过 abandon_after_minutes；其余为 pending。
+    wasted_tokens 为 abandoned 节点消耗的 token，saved_ms_avg 为每次命中省去的平均生成耗时。
+    """
+    node = models.StoryNode
+    spec = node.node_metadata["speculation"]
+    level = spec["level"].as_integer()
+    choice_index = spec["choice_index"].as_integer()
+    tokens = func.coalesce(spec["tokens"].as_integer(), 0)
+    gen_ms = func.coalesce(spec["gen_ms"].as_float(), 0.0)
+    is_hit = or_(spec["hit_at"].as_string().isnot(None), node.is_speculative.is_(False))
+    is_abandoned = and_(
+        ~is_hit,
+        node.created_at < func.now() - func.make_interval(0, 0, 0, 0, 0, abandon_after_minutes),
+    )
+    outcome = case((is_hit, "hit"), (is_abandoned, "abandoned"), else_="pending").label("outcome")
+    rows = (
+        db.query(
+            level.label("level"),
+            choice_index.label("choice_index"),
+            outcome,
+            func.count().label("nodes"),
+            func.sum(tokens).label("tokens"),
+            func.sum(gen_ms).label("gen_ms"),
+        )
+        .filter(
+            node.created_at >= func.now() - func.make_interval(0, 0, 0, 0, hours),
+            spec.as_string().isnot(None),
+        )
+        .group_by(level, choice_index, outcome)
+        .all()
+    )
+
+    def _bucket() -> dict:
+        return {"generated": 0, "hit": 0, "abandoned": 0, "pending": 0, "tokens": 0, "wasted_tokens": 0}
+
+    totals = _bucket()
+    by_level: Dict[Optional[int], dict] = {}
+    by_choice: Dict[Optional[int], dict] = {}
+    saved_ms = 0.0
+    for row in rows:
+        count, spent = int(row.nodes), int(row.tokens or 0)
+        if row.outcome == "hit":
+            saved_ms += float(row.gen_ms or 0.0)
+        for bucket in (
+            totals,
+            by_level.setdefault(row.level, _bucket()),
+            by_choice.setdefault(row.choice_index, _bucket()),
+        ):
+            bucket["generated"] += count
+            bucket[row.outcome] += count
+            bucket["tokens"] += spent
+            if row.outcome == "abandoned":
+                bucket["wasted_tokens"] += spent
+
+    def _with_rate(bucket: dict) -> dict:
+        decided = bucket["hit"] + bucket["abandoned"]
+        bucket["hit_rate"] = round(bucket["hit"] / decided, 3) if decided else None
+        return bucket
+
+    def _grouped(groups: Dict[Optional[int], dict]) -> dict:
+        return {
+            str(key): _with_rate(value)
+            for key, value in sorted(groups.items(), key=lambda item: (item[0] is None, item[0] or 0))
+        }
+
+    return {
+        "hours": hours,
+        "abandon_after_minutes": abandon_after_minutes,
+        **_with_rate(totals),
+        "saved_ms_avg": round(saved_ms / totals["hit"], 1) if totals["hit"] else None,
+        "tokens_per_hit": round(totals["tokens"] / totals["hit"], 1) if totals["hit"] else None,
+        "by_level": _grouped(by_level),
+        "by_choice_index": _grouped(by_choice),
+    }
@@ -1,7 +1,9 @@
 # backend/database/models.py
 # 【新增导入】
 from sqlalchemy import (
+    BigInteger,
     Column,
+    Float,
     Integer,
     String,
     Text,
@@ -11,8 +13,10 @@ from sqlalchemy import (
     UniqueConstraint,
     Boolean,
     JSON,
+    Index,
+    text,
 )
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import UUID, ARRAY
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .base import Base, DATABASE_URL
@@ -68,7 +72,7 @@ class GameSession(Base):
         nullable=False,  # 【从 True 改为 False】强制新数据的正确性
         index=True
     )
-    wish = Column(String(100), nullable=False)
+    wish = Column(String(100), nullable=False, index=True)
     created_at = Column(DateTime, server_default=func.now())
 
     user = relationship("User", back_populates="game_sessions")
@@ -93,6 +97,9 @@ class StoryNode(Base):
     is_speculative = Column(Boolean, nullable=False, default=False)
     speculative_depth = Column(Integer, nullable=True)
     speculative_expires_at = Column(DateTime, nullable=True)
+    # 物化路径：depth 为章节号（根为1），path 为根到父节点的祖先ID列表（不含自身）
+    depth = Column(Integer, nullable=False, server_default='1')
+    path = Column(ARRAY(Integer), nullable=False, server_default='{}')
     created_at = Column(DateTime, server_default=func.now())
 
     session = relationship("GameSession", back_populates="story_nodes")
@@ -109,6 +116,21 @@ class StoryNode(Base):
         CheckConstraint('parent_id != id', name='check_no_self_parent'),
         # 防止同一父节点下同一选择被重复创建（并发/重复点击保护）
         UniqueConstraint('session_id', 'parent_id', 'user_choice', name='uq_storynode_parent_choice'),
+        # 子树查询（path @> ARRAY[id]）与按深度取最深节点
+        Index('ix_story_nodes_path', 'path', postgresql_using='gin'),
+        Index('ix_story_nodes_session_depth', 'session_id', 'depth'),
+        # 推演节点回收：只索引推演节点，按回收期限扫描
+        Index(
+            'ix_story_nodes_speculative_expiry',
+            'speculative_expires_at',
+            postgresql_where=text('is_speculative'),
+        ),
+        # 回收配图文件前检查本地生成的配图是否仍被其它节点引用
+        Index(
+            'ix_story_nodes_generated_image',
+            'image_url',
+            postgresql_where=text("image_url LIKE '%/static/generated/%'"),
+        ),
     )
 
     def get_choices(self) -> list:
@@ -172,3 +194,112 @@ class WishModerationRecord(Base):
     created_at = Column(DateTime, server_default=func.now())
 
     user = relationship("User")
+
+
+class SpeculationJob(Base):
+    """跨进程共享的预推演任务队列（speculation_queue_backend=postgres 时使用）"""
+    __tablename__ = "speculation_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(10), nullable=False)  # expand / child
+    session_id = Column(Integer, ForeignKey("game_sessions.id", ondelete="CASCADE"), nullable=False, index=True)
+    parent_id = Column(Integer, ForeignKey("story_nodes.id", ondelete="CASCADE"), nullable=False)
+    choice = Column(String, nullable=False, default="")  # expand 任务为空串
+    depth = Column(Integer, nullable=False)
+    level = Column(Integer, nullable=False, default=0)
+    # 从用户当前节点走到该分支的预测概率，同层内高者先领取
+    score = Column(Float, nullable=False, default=1.0, server_default="1")
+    # 分支路径："父节点ID:选项" 列表；任一元素被用户放弃即整条任务失效
+    lineage = Column(ARRAY(String), nullable=False, default=list)
+    user_id = Column(get_uuid_column(), nullable=True)
+    status = Column(String(20), nullable=False, default="queued")  # queued / running / done / failed / cancelled
+    attempts = Column(Integer, nullable=False, default=0)
+    lease_owner = Column(String(64), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    enqueued_at = Column(DateTime, nullable=False, server_default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    __table_args__ = (
+        # 跨进程去重：同一 (会话, 父节点, 选项) 同时只允许一个排队/执行中的生成任务
+        Index(
+            "uq_specjob_active_child",
+            "session_id", "parent_id", "choice",
+            unique=True,
+            postgresql_where=text("kind = 'child' AND status IN ('queued', 'running')"),
+        ),
+        Index(
+            "uq_specjob_queued_expand",
+            "session_id", "parent_id",
+            unique=True,
+            postgresql_where=text("kind = 'expand' AND status = 'queued'"),
+        ),
+        Index("ix_specjob_claim", "status", "level", "id"),
+    )
+
+
+class StartPregeneration(Base):
+    """
+    /prepare_start 触发的第一节预生成记录，多 worker 共享（预推演队列或通知后端为 postgres 时使用）：
+    running 表示仍在生成，ready 表示已完成、可被 /start 领取一次（领取即删除）
+    """
+    __tablename__ = "start_pregenerations"
+
+    cache_key = Column(String(128), primary_key=True)  # f"{user_id}:{sha256(愿望)}"
+    status = Column(String(10), nullable=False, default="running")  # running / ready
+    session_id = Column(Integer, ForeignKey("game_sessions.id", ondelete="CASCADE"), nullable=True)
+    node_id = Column(Integer, ForeignKey("story_nodes.id", ondelete="CASCADE"), nullable=True)
+    trace = Column(String(64), nullable=True)
+    updated_at = Column(DateTime, nullable=False, server_default=func.now())
+
+
+class LLMCacheEntry(Base):
+    """LLM 响应缓存的共享层（llm_cache_backend=postgres 时使用），key 为请求内容的 sha256"""
+    __tablename__ = "llm_response_cache"
+
+    key = Column(String(64), primary_key=True)
+    call_site = Column(String(50), nullable=False)
+    model = Column(String(100), nullable=True)
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class OpeningPoolEntry(Base):
+    """跨用户共享的开局池：同一愿望的根节点及其第一层子节点快照，新会话可直接克隆"""
+    __tablename__ = "opening_pool"
+
+    id = Column(Integer, primary_key=True, index=True)
+    wish_digest = Column(String(64), nullable=False, index=True)  # sha256(规范化愿望)
+    wish = Column(String(100), nullable=False)
+    # 快照来源会话，保证同一会话只被收录一次；来源会话删除后快照仍然有效
+    source_session_id = Column(Integer, nullable=True, unique=True)
+    root = Column(JSON, nullable=False)  # {text, image_url, choices, success_rate, metadata}
+    children = Column(JSON, nullable=False, default=list)  # [{user_choice, text, image_url, choices, success_rate, metadata}]
+    served_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
+
+class LLMUsage(Base):
+    """LLM token 用量按小时分桶的汇总，由各 worker 定期 upsert 累加；无归属的调用 user_id 为空串、session_id 为 0"""
+    __tablename__ = "llm_usage"
+
+    id = Column(Integer, primary_key=True)
+    bucket_start = Column(DateTime, nullable=False, index=True)
+    user_id = Column(String(36), nullable=False, default="")
+    session_id = Column(Integer, nullable=False, default=0, index=True)
+    call_site = Column(String(32), nullable=False)
+    traffic = Column(String(16), nullable=False)
+    model = Column(String(100), nullable=False, default="")
+    calls = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(BigInteger, nullable=False, default=0)
+    completion_tokens = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint(
+            "bucket_start", "user_id", "session_id", "call_site", "traffic", "model",
+            name="uq_llm_usage_bucket",
+        ),
+    )
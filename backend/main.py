@@ -244,10 +244,22 @@ async def startup_event():
     LOGGER.info(f"当前使用模型: {current_config.model_name}")
     LOGGER.info(f"模型API地址: {current_config.base_url}")
 
+    # postgres 预推演队列：每个 worker 进程启动即参与消费共享任务
+    if settings.speculation_queue_backend == "postgres":
+        from core.speculation import speculation_service
+        speculation_service.start()
+
+    # 按保留期回收从未被选中的推演节点及其配图
+    from core.node_gc import node_gc
+    node_gc.start()
+
 # 关闭事件
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭时的清理"""
+    # 落库尚未刷新的 LLM 用量增量
+    from core.llm_usage import usage_tracker
+    usage_tracker.flush()
     LOGGER.info("重生之我是……API服务关闭")
 
 # 开发服务器启动
@@ -85,6 +85,8 @@ def main():
         "--timeout", str(timeout),
         "backend.main:app",
     ]
+    # worker 进程据此把 db_connection_budget 平分为各自的连接池
+    os.environ["GUNICORN_WORKERS"] = str(workers)
     LOGGER.info(f"Starting Gunicorn with {workers} workers and timeout={timeout}s ...")
     os.execvp(cmd[0], cmd)
 
@@ -66,6 +66,13 @@ class StorySegment(BaseModel):
     )
 
 
+class NodeImageStatus(BaseModel):
+    """节点配图状态（后台配图完成前为 pending，前端可轮询）"""
+    node_id: int = Field(..., description="节点ID")
+    status: Literal["pending", "ready", "failed"] = Field(..., description="配图状态")
+    image_url: str = Field(..., description="当前可展示的图片URL（pending 时为占位图）")
+
+
 class StoryRetryRequest(BaseModel):
     """从指定节点重来的请求"""
     node_id: int = Field(..., description="玩家后悔的那个选择所产生的节点ID")
@@ -0,0 +1,143 @@
+"""
+历史压缩基准：续写提示词中历史部分的大小（及可选的真实模型延迟）随深度的变化，压缩前 vs 压缩后
+
+使用方式（在项目根目录执行，需可写的 PostgreSQL，DATABASE_URL 指向它）：
+  python -m backend.scripts.bench_history --depths 2 5 10 15 22
+  python -m backend.scripts.bench_history --depths 5 22 --live   # 额外调用当前模型提供商测量续写延迟（产生费用）
+
+脚本会临时创建一个用户、会话和一条线性故事链（每节约 --chars 字），结束后全部删除。
+- full:    旧行为，整条路径原文
+- cold:    压缩后、尚无缓存摘要（早期节点为抽取式摘要）
+- warm:    压缩后、滚动摘要已缓存（非 --live 时以截断到上限的抽取式摘要模拟，--live 时由模型实际生成）
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+import time
+import uuid
+
+# Add project root to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, 'backend'))
+
+from backend.database.base import SessionLocal
+from backend.database import crud, models
+from backend.core.history_compaction import history_compactor, history_tokens, _verbatim, _extract_line
+from schemas.story import RawStoryData
+
+_SENTENCE = "夜色如墨，营外篝火在寒风中摇曳，你按剑立于高处，望着远处敌军连绵的灯火，心中权衡着每一步的代价。"
+
+
+def build_chain(db, session_id: int, length: int, chars: int) -> list[int]:
+    body = (_SENTENCE * (chars // len(_SENTENCE) + 1))[:chars]
+    ids = []
+    parent_id = None
+    for index in range(length):
+        segment = RawStoryData(
+            text=f"第{index + 1}节。" + body,
+            choices=[{"option": f"选项{i}", "summary": ""} for i in range(3)],
+            image_url="/static/placeholder.png",
+            success_rate=50,
+            metadata={},
+        )
+        node = crud.create_story_node(
+            db,
+            session_id=session_id,
+            segment=segment,
+            parent_id=parent_id,
+            user_choice="选项0" if parent_id else None,
+            commit=False,
+        )
+        parent_id = node.id
+        ids.append(node.id)
+    db.commit()
+    return ids
+
+
+def warm_summaries(db, path: list[dict], live: bool) -> None:
+    keep = history_compactor.keep_recent
+    for end in range(1, len(path) - keep + 1):
+        older = crud.get_node_path(db, path[end - 1]["id"])
+        if live:
+            history_compactor._refresh(older)
+        else:
+            text = "\n".join(_extract_line(row) for row in older)[-history_compactor.summary_max_chars:]
+            crud.set_node_history_summary(db, older[-1]["id"], {"covered": len(older), "text": text})
+
+
+def measure_live(history: list[dict], *, enforce_budget: bool) -> float:
+    from backend.core.story_engine import NODE_SYSTEM_PREAMBLE, story_engine
+    from backend.core.llm_clients import llm_client
+
+    budget = history_compactor.token_budget
+    if not enforce_budget:
+        history_compactor.token_budget = 0
+    try:
+        req = story_engine._prepare_continue("项羽", history, "选项0", 1, None)
+    finally:
+        history_compactor.token_budget = budget
+    start = time.perf_counter()
+    llm_client.generate(req["prompt"], history=req["story_history"], system_preamble_override=NODE_SYSTEM_PREAMBLE)
+    return (time.perf_counter() - start) * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="历史压缩基准")
+    parser.add_argument("--depths", type=int, nargs="+", default=[2, 5, 10, 15, 22])
+    parser.add_argument("--chars", type=int, default=450, help="每节正文字数")
+    parser.add_argument("--live", action="store_true", help="调用当前模型提供商测量续写延迟")
+    args = parser.parse_args()
+
+    # 基准本身负责生成缓存，避免后台刷新干扰计数
+    history_compactor.llm_enabled = False
+
+    db = SessionLocal()
+    user = models.User(
+        email=f"bench-{uuid.uuid4().hex[:8]}@example.com",
+        hashed_password="x",
+        nickname="bench",
+    )
+    db.add(user)
+    db.commit()
+    session = models.GameSession(wish="bench-history", user_id=user.id)
+    db.add(session)
+    db.commit()
+    try:
+        ids = build_chain(db, session.id, max(args.depths), args.chars)
+        print(f"keep_recent={history_compactor.keep_recent} token_budget={history_compactor.token_budget} chars/node={args.chars}")
+        header = f"{'depth':>5} | {'full tok':>8} | {'cold tok':>8} | {'warm tok':>8}"
+        if args.live:
+            header += f" | {'full ms':>8} | {'warm ms':>8}"
+        print(header)
+
+        rows = []
+        for depth in sorted(args.depths):
+            path = crud.get_node_path(db, ids[depth - 1])
+            full = _verbatim(path)
+            cold = history_compactor.fit_budget(history_compactor.build(path))
+            rows.append((depth, path, full, cold))
+
+        warm_summaries(db, crud.get_node_path(db, ids[max(args.depths) - 1]), args.live)
+        for depth, _, full, cold in rows:
+            path = crud.get_node_path(db, ids[depth - 1])
+            warm = history_compactor.fit_budget(history_compactor.build(path))
+            line = f"{depth:>5} | {history_tokens(full):>8} | {history_tokens(cold):>8} | {history_tokens(warm):>8}"
+            if args.live:
+                line += f" | {measure_live(full, enforce_budget=False):>8.0f} | {measure_live(warm, enforce_budget=True):>8.0f}"
+            print(line)
+    finally:
+        db.rollback()
+        db.query(models.StoryNode).filter(models.StoryNode.session_id == session.id).update(
+            {models.StoryNode.parent_id: None}, synchronize_session=False
+        )
+        db.query(models.StoryNode).filter(models.StoryNode.session_id == session.id).delete(synchronize_session=False)
+        db.delete(session)
+        db.delete(user)
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
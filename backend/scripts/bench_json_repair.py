@@ -0,0 +1,146 @@
+"""
+本地 JSON 修复基准：统计能省掉多少次模型修复调用
+
+使用方式（在项目根目录执行，不需要数据库与模型）：
+  python -m backend.scripts.bench_json_repair --log rebirth_game.log backend/rebirth_game.log
+
+语料取自日志中的真实模型输出：
+- [JSON-REPAIR] 本地修复失败 原始=...    完整原始输出（本地修复上线后积累的真实失败样本）
+- [LLM raw][...] 长度=N 预览=...         长度与 N 一致时为完整输出；否则为被截断的预览
+对每条样本的正文再派生出尾随逗号、未转义引号、截断、全角结构符、对象形式 choices 等变体。
+每条样本依次走：直接 json.loads -> 本地修复 -> 需要模型修复，输出各阶段计数与本地修复耗时。
+"""
+from __future__ import annotations
+import argparse
+import ast
+import json
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+
+# Add project root to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, 'backend'))
+
+from backend.core.json_repair import repair_json
+from backend.core.story_engine import StoryEngine
+
+_REPR = r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")"
+_RAW_PREVIEW = re.compile(r"\[LLM raw\]\[[\w-]+\] 长度=(\d+) 预览=" + _REPR)
+_RAW_FAILED = re.compile(r"\[JSON-REPAIR\] 本地修复失败，回退模型修复 原始=" + _REPR)
+
+
+def load_corpus(paths: list[str]) -> list[tuple[str, str]]:
+    """返回 [(来源类型, 原始输出)]，同一内容只保留一次"""
+    samples: "OrderedDict[str, str]" = OrderedDict()
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8", errors="replace") as fh:
+            content = fh.read()
+        for match in _RAW_FAILED.finditer(content):
+            samples.setdefault(ast.literal_eval(match.group(1)), "logged-failure")
+        for match in _RAW_PREVIEW.finditer(content):
+            raw = ast.literal_eval(match.group(2))
+            kind = "logged-complete" if len(raw) == int(match.group(1)) else "logged-truncated"
+            samples.setdefault(raw, kind)
+    return [(kind, raw) for raw, kind in samples.items()]
+
+
+def base_node(raw: str) -> dict | None:
+    """从真实输出中取回正文，拼成一个结构完整的节点作为变体母本"""
+    data = repair_json(raw)
+    if not isinstance(data, dict) or not isinstance(data.get("text"), str) or len(data["text"]) < 20:
+        return None
+    choices = data.get("choices")
+    if not isinstance(choices, list) or len(choices) != 3 or not all(isinstance(c, dict) for c in choices):
+        choices = [
+            {
+                "option": f"选项{i + 1}",
+                "summary": "摘要",
+                "effects": {"delta_progress": 5, "delta_risk": 1, "delta_exposure": 0, "tags": ["t"]},
+            }
+            for i in range(3)
+        ]
+    return {"text": data["text"], "choices": choices}
+
+
+def variants(node: dict) -> list[tuple[str, str]]:
+    dumped = json.dumps(node, ensure_ascii=False, indent=2)
+    text = node["text"]
+    quoted = dict(node, text=text[:8] + '"' + text[8:16] + '"' + text[16:])
+    keyed = dict(node, choices={chr(ord("A") + i): c for i, c in enumerate(node["choices"])})
+    last_choice = dumped.rfind('"summary"')
+    return [
+        ("trailing-comma", re.sub(r"(\S)(\s*[}\]])", r"\1,\2", dumped, count=3)),
+        ("inner-quotes", json.dumps(quoted, ensure_ascii=False).replace('\\"', '"')),
+        ("truncated-brackets", dumped.rstrip()[:-4]),
+        ("truncated-mid-choice", dumped[:last_choice + 14]),
+        ("fullwidth-keys", dumped.replace('"text": ', "“text”：").replace('"choices": ', "“choices”：")),
+        ("choices-object", json.dumps(keyed, ensure_ascii=False)),
+        ("fenced-prose", "好的，以下是结果：\n```json\n" + dumped + "\n```"),
+    ]
+
+
+def classify(engine: StoryEngine, raw: str) -> tuple[str, float]:
+    """返回 (direct/local/fixer, 本地修复耗时ms)"""
+    json_str = engine._extract_json(raw)
+    try:
+        engine._normalize_node(json.loads(json_str))
+        return "direct", 0.0
+    except Exception:
+        pass
+    start = time.perf_counter()
+    data = repair_json(json_str)
+    elapsed = (time.perf_counter() - start) * 1000.0
+    try:
+        engine._normalize_node(data)
+        return "local", elapsed
+    except Exception:
+        return "fixer", elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 JSON 修复基准")
+    parser.add_argument("--log", nargs="+", default=["rebirth_game.log", os.path.join("backend", "rebirth_game.log")])
+    parser.add_argument("--limit", type=int, default=0, help="最多使用的日志样本数，0 为不限")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.log)
+    if args.limit:
+        corpus = corpus[:args.limit]
+    if not corpus:
+        print("日志中未找到模型原始输出样本")
+        return
+
+    cases: list[tuple[str, str]] = list(corpus)
+    for _, raw in corpus:
+        node = base_node(raw)
+        if node is not None:
+            cases.extend(variants(node))
+
+    engine = StoryEngine()
+    stats: "OrderedDict[str, dict]" = OrderedDict()
+    for kind, raw in cases:
+        outcome, ms = classify(engine, raw)
+        row = stats.setdefault(kind, {"cases": 0, "direct": 0, "local": 0, "fixer": 0, "ms": 0.0})
+        row["cases"] += 1
+        row[outcome] += 1
+        row["ms"] += ms
+
+    print(f"log samples: {len(corpus)}  total cases: {len(cases)}")
+    print(f"{'kind':>22} | {'cases':>5} | {'direct':>6} | {'local':>5} | {'fixer':>5} | {'repair ms':>9}")
+    for kind, row in stats.items():
+        repaired = row["local"] + row["fixer"]
+        avg_ms = row["ms"] / repaired if repaired else 0.0
+        print(f"{kind:>22} | {row['cases']:>5} | {row['direct']:>6} | {row['local']:>5} | {row['fixer']:>5} | {avg_ms:>9.3f}")
+    failed = sum(row["local"] + row["fixer"] for row in stats.values())
+    avoided = sum(row["local"] for row in stats.values())
+    print(f"fixer calls avoided: {avoided}/{failed}" + (f" ({avoided * 100.0 / failed:.1f}%)" if failed else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+"""
+端到端压测：N 个合成玩家按真实节奏并发走完一局，输出可对比的 JSON
+
+使用方式（在项目根目录执行，需可写的 PostgreSQL，DATABASE_URL 指向它）：
+  python -m backend.scripts.bench_load --users 20 --continues 6 --out load.json
+  python -m backend.scripts.bench_load --users 20 --compare load.json --max-regression 0.15   # 回归门禁
+  python -m backend.scripts.bench_load --base-url http://127.0.0.1:8000 --users 5           # 压已运行的服务
+
+默认在本进程内以 uvicorn 启动服务，并强制使用离线模拟提供商（llm_provider=mock / image_provider=mock），
+不访问网络；--base-url 指向外部服务时只做客户端测量（不含 SQL 语句数与线程数）。
+每个玩家：注册登录 -> /prepare_start -> /start -> /continue × k -> /retry（回到中途某节点），
+两次操作之间按对数正态分布的思考时间等待（--think-ms 为中位数）。
+
+输出字段：
+- endpoints:   各接口的请求数、错误数与 p50/p90/p99/max 延迟（毫秒）
+- speculation: /continue 命中已存在子节点（预推演缓存，响应 metadata.source == "continue"）的比例
+- db:          压测期间执行的 SQL 语句总数与每个请求的平均值（仅进程内模式）
+- threads:     进程线程数的峰值与结束值（仅进程内模式）
+- pool:        连接池容量与签出连接数峰值（仅进程内模式）；峰值达到容量说明有线程在排队等待连接
+- throughput:  每秒完成的请求数
+- server:      结束时 /api/story/metrics 中的推演、配图与 LLM 用量快照
+--compare 与基线 JSON 对比吞吐、/continue p90 与命中率，任一退化超过 --max-regression 时以状态码 1 退出。
+"""
+from __future__ import annotations
+import argparse
+import json
+import math
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Add project root to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, 'backend'))
+
+import httpx
+
+WISHES = ["项羽", "刘邦", "曹操", "诸葛亮", "李世民", "武则天", "朱元璋", "岳飞"]
+PASSWORD = "bench-pass-123"
+
+
+class QueryCounter:
+    """统计 engine 上执行的 SQL 语句数（多线程安全）"""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        with self._lock:
+            self.count += 1
+
+
+class PoolMonitor:
+    """通过连接池 checkout/checkin 事件统计同时签出的连接数（多线程安全）"""
+
+    def __init__(self, pool_size: int, max_overflow: int) -> None:
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.capacity = pool_size + max_overflow
+        self.in_use = 0
+        self.peak = 0
+        self.checkouts = 0
+        self.at_capacity = 0
+        self._lock = threading.Lock()
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.peak = max(self.peak, self.in_use)
+            if self.in_use >= self.capacity:
+                self.at_capacity += 1
+
+    def on_checkin(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "max_overflow": self.max_overflow,
+                "capacity": self.capacity,
+                "peak_checked_out": self.peak,
+                "checkouts_total": self.checkouts,
+                "checkouts_at_capacity": self.at_capacity,
+            }
+
+
+class Recorder:
+    """按接口收集延迟与错误"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.latency: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.continue_total = 0
+        self.continue_hits = 0
+
+    def observe(self, endpoint: str, ms: float, ok: bool) -> None:
+        with self._lock:
+            self.latency.setdefault(endpoint, []).append(ms)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def observe_continue(self, hit: bool) -> None:
+        with self._lock:
+            self.continue_total += 1
+            self.continue_hits += int(hit)
+
+    def requests_total(self) -> int:
+        with self._lock:
+            return sum(len(v) for v in self.latency.values())
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return round(ordered[index], 1)
+
+
+class Player:
+    """一个合成玩家的完整一局"""
+
+    def __init__(self, base_url: str, index: int, run_id: str, args, recorder: Recorder) -> None:
+        self.rng = random.Random(f"{args.seed}-{index}")
+        self.args = args
+        self.recorder = recorder
+        self.email = f"bench-load-{run_id}-{index}@example.com"
+        self.wish = WISHES[index % len(WISHES)]
+        self.client = httpx.Client(base_url=base_url, timeout=args.timeout)
+
+    def call(self, endpoint: str, method: str, path: str, **kwargs) -> httpx.Response | None:
+        start = time.perf_counter()
+        try:
+            response = self.client.request(method, path, **kwargs)
+        except httpx.HTTPError:
+            self.recorder.observe(endpoint, (time.perf_counter() - start) * 1000.0, False)
+            return None
+        self.recorder.observe(endpoint, (time.perf_counter() - start) * 1000.0, response.status_code < 400)
+        return response if response.status_code < 400 else None
+
+    def think(self) -> None:
+        if self.args.think_ms <= 0:
+            return
+        delay_ms = self.args.think_ms * math.exp(self.rng.gauss(0.0, 0.5))
+        time.sleep(delay_ms / 1000.0)
+
+    def play(self) -> None:
+        try:
+            if self.call("register", "POST", "/api/auth/register", json={"email": self.email, "password": PASSWORD}) is None:
+                return
+            token = self.call("token", "POST", "/api/auth/token", data={"username": self.email, "password": PASSWORD})
+            if token is None:
+                return
+            self.client.headers["Authorization"] = f"Bearer {token.json()['access_token']}"
+
+            if self.call("prepare_start", "POST", "/api/story/prepare_start", json={"wish": self.wish}) is None:
+                return
+            self.think()
+            response = self.call("start", "POST", "/api/story/start", json={"wish": self.wish})
+            if response is None:
+                return
+            segment = response.json()
+            visited = [segment["node_id"]]
+            for _ in range(self.args.continues):
+                self.think()
+                choices = segment.get("choices") or []
+                if not choices:
+                    break
+                choice = self.rng.choice(choices)["option"]
+                response = self.call(
+                    "continue",
+                    "POST",
+                    "/api/story/continue",
+                    json={"session_id": segment["session_id"], "node_id": segment["node_id"], "choice": choice},
+                )
+                if response is None:
+                    break
+                segment = response.json()
+                self.recorder.observe_continue((segment.get("metadata") or {}).get("source") == "continue")
+                visited.append(segment["node_id"])
+            if len(visited) > 2:
+                # 后悔中途的某个选择：回到它产生的节点之前
+                self.think()
+                self.call("retry", "POST", "/api/story/retry", json={"node_id": self.rng.choice(visited[1:-1])})
+        finally:
+            self.client.close()
+
+
+def sample_threads(stop: threading.Event, peak: list[int]) -> None:
+    while not stop.is_set():
+        peak[0] = max(peak[0], threading.active_count())
+        stop.wait(0.2)
+
+
+def start_server(args):
+    """进程内启动服务（模拟提供商），返回 (base_url, server, engine)。"""
+    os.environ["LLM_PROVIDER"] = "mock"
+    os.environ["IMAGE_PROVIDER"] = "mock"
+    from config.settings import settings
+
+    latency = settings.LLM_PROVIDERS["mock"]["latency_ms"]
+    latency["median"] = args.llm_latency_ms
+    settings.IMAGE_PROVIDERS["mock"]["latency_ms"]["median"] = args.image_latency_ms
+    settings.LLM_PROVIDERS["mock"]["failure_rate"] = args.llm_failure_rate
+
+    import uvicorn
+    import main as app_module
+    # 与服务使用同一份模块实例（服务以 backend 目录为根导入 database.*）
+    from database.base import engine
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app_module.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="bench_server", daemon=True).start()
+    deadline = time.time() + 60
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("服务启动超时")
+        time.sleep(0.1)
+    return f"http://127.0.0.1:{port}", server, engine
+
+
+def drain(base_url: str, limit_seconds: float) -> dict:
+    """等待推演与配图队列清空，返回最后一次 /metrics 快照。"""
+    deadline = time.time() + limit_seconds
+    metrics: dict = {}
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        while True:
+            metrics = client.get("/api/story/metrics").json()
+            spec = metrics.get("speculation") or {}
+            images = metrics.get("image_jobs") or {}
+            idle = (
+                not spec.get("active_workers")
+                and not spec.get("queue_depth")
+                and not spec.get("generating_children")
+                and not images.get("queue_depth")
+                and not images.get("running")
+            )
+            if idle or time.time() > deadline:
+                return metrics
+            time.sleep(0.5)
+
+
+def cleanup(run_id: str) -> None:
+    from database.base import SessionLocal
+    from database import models
+
+    db = SessionLocal()
+    try:
+        users = db.query(models.User).filter(models.User.email.like(f"bench-load-{run_id}-%")).all()
+        user_ids = [user.id for user in users]
+        if not user_ids:
+            return
+        session_ids = [
+            row.id for row in db.query(models.GameSession.id).filter(models.GameSession.user_id.in_(user_ids))
+        ]
+        if session_ids:
+            nodes = db.query(models.StoryNode).filter(models.StoryNode.session_id.in_(session_ids))
+            nodes.update({models.StoryNode.parent_id: None}, synchronize_session=False)
+            nodes.delete(synchronize_session=False)
+            db.query(models.StorySave).filter(models.StorySave.session_id.in_(session_ids)).delete(synchronize_session=False)
+            db.query(models.GameSession).filter(models.GameSession.id.in_(session_ids)).delete(synchronize_session=False)
+        db.query(models.WishModerationRecord).filter(models.WishModerationRecord.user_id.in_(user_ids)).delete(
+            synchronize_session=False
+        )
+        db.query(models.User).filter(models.User.id.in_(user_ids)).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def summarize(
+    args,
+    recorder: Recorder,
+    elapsed: float,
+    queries: int | None,
+    threads: dict | None,
+    metrics: dict,
+    pool: dict | None = None,
+) -> dict:
+    endpoints = {}
+    for name, values in sorted(recorder.latency.items()):
+        endpoints[name] = {
+            "count": len(values),
+            "errors": recorder.errors.get(name, 0),
+            "p50_ms": percentile(values, 0.50),
+            "p90_ms": percentile(values, 0.90),
+            "p99_ms": percentile(values, 0.99),
+            "max_ms": round(max(values), 1),
+        }
+    total = recorder.requests_total()
+    spec = metrics.get("speculation") or {}
+    return {
+        "config": {
+            "users": args.users,
+            "continues": args.continues,
+            "think_ms": args.think_ms,
+            "llm_latency_ms": args.llm_latency_ms,
+            "mode": "external" if args.base_url else "in-process",
+        },
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+        "endpoints": endpoints,
+        "speculation": {
+            "continue_total": recorder.continue_total,
+            "continue_hits": recorder.continue_hits,
+            "hit_rate": round(recorder.continue_hits / recorder.continue_total, 3) if recorder.continue_total else None,
+            "nodes_generated_total": spec.get("nodes_generated_total"),
+        },
+        "db": None if queries is None else {
+            "queries_total": queries,
+            "queries_per_request": round(queries / total, 1) if total else None,
+        },
+        "threads": threads,
+        "pool": pool,
+        "server": {
+            "speculation": spec,
+            "image_jobs": metrics.get("image_jobs"),
+            "llm_usage": {k: v for k, v in (metrics.get("llm_usage") or {}).items() if k in ("calls", "prompt_tokens", "completion_tokens", "by_call_site")},
+        },
+    }
+
+
+def compare(result: dict, baseline_path: str, max_regression: float) -> list[str]:
+    """返回退化项说明；空列表表示通过。"""
+    with open(baseline_path, encoding="utf-8") as fh:
+        baseline = json.load(fh)
+    failures = []
+    base_rps, rps = baseline.get("throughput_rps"), result.get("throughput_rps")
+    if base_rps and rps is not None and rps < base_rps * (1 - max_regression):
+        failures.append(f"throughput {rps} < baseline {base_rps}")
+    base_p90 = ((baseline.get("endpoints") or {}).get("continue") or {}).get("p90_ms")
+    p90 = ((result.get("endpoints") or {}).get("continue") or {}).get("p90_ms")
+    if base_p90 and p90 is not None and p90 > base_p90 * (1 + max_regression):
+        failures.append(f"continue p90 {p90}ms > baseline {base_p90}ms")
+    base_hit = (baseline.get("speculation") or {}).get("hit_rate")
+    hit = (result.get("speculation") or {}).get("hit_rate")
+    if base_hit and hit is not None and hit < base_hit * (1 - max_regression):
+        failures.append(f"hit_rate {hit} < baseline {base_hit}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端压测")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--continues", type=int, default=5, help="每个玩家 /continue 次数")
+    parser.add_argument("--think-ms", type=float, default=2000, help="玩家思考时间中位数（毫秒），0 为不等待")
+    parser.add_argument("--ramp-seconds", type=float, default=5, help="玩家在该时间内均匀进入")
+    parser.add_argument("--llm-latency-ms", type=float, default=800, help="进程内模式：模拟 LLM 延迟中位数")
+    parser.add_argument("--image-latency-ms", type=float, default=2000, help="进程内模式：模拟配图延迟中位数")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0, help="进程内模式：模拟 LLM 503 概率")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", default="bench")
+    parser.add_argument("--drain-seconds", type=float, default=60, help="结束后等待后台队列清空的上限")
+    parser.add_argument("--base-url", default="", help="压测已运行的服务（不启动进程内服务）")
+    parser.add_argument("--keep-data", action="store_true", help="保留合成玩家的数据")
+    parser.add_argument("--out", default="", help="结果 JSON 写入路径（默认打印到标准输出）")
+    parser.add_argument("--compare", default="", help="基线 JSON 路径")
+    parser.add_argument("--max-regression", type=float, default=0.15)
+    args = parser.parse_args()
+
+    engine = None
+    server = None
+    base_url = args.base_url.rstrip("/")
+    if not base_url:
+        base_url, server, engine = start_server(args)
+
+    counter = QueryCounter()
+    monitor = None
+    if engine is not None:
+        from sqlalchemy import event
+        from database.base import POOL_SIZE, POOL_MAX_OVERFLOW
+        event.listen(engine, "before_cursor_execute", counter)
+        monitor = PoolMonitor(POOL_SIZE, POOL_MAX_OVERFLOW)
+        event.listen(engine, "checkout", monitor.on_checkout)
+        event.listen(engine, "checkin", monitor.on_checkin)
+    stop = threading.Event()
+    peak = [threading.active_count()]
+    sampler = threading.Thread(target=sample_threads, args=(stop, peak), daemon=True)
+    sampler.start()
+
+    run_id = uuid.uuid4().hex[:8]
+    recorder = Recorder()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.users), thread_name_prefix="bench_player") as pool:
+        for index in range(args.users):
+            pool.submit(Player(base_url, index, run_id, args, recorder).play)
+            if args.users > 1:
+                time.sleep(args.ramp_seconds / args.users)
+    elapsed = time.perf_counter() - started
+
+    queries = counter.count if engine is not None else None
+    threads = {"peak": peak[0], "end": threading.active_count()} if engine is not None else None
+    stop.set()
+    metrics = drain(base_url, args.drain_seconds)
+    pool = None
+    if engine is not None:
+        event.remove(engine, "before_cursor_execute", counter)
+        # 峰值覆盖压测与后台队列排空阶段（推演与配图 worker 同样从该池取连接）
+        event.remove(engine, "checkout", monitor.on_checkout)
+        event.remove(engine, "checkin", monitor.on_checkin)
+        pool = monitor.summary()
+        if not args.keep_data:
+            cleanup(run_id)
+        server.should_exit = True
+
+    result = summarize(args, recorder, elapsed, queries, threads, metrics, pool)
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        failures = compare(result, args.compare, args.max_regression)
+        for failure in failures:
+            print(f"REGRESSION: {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+祖先链加载基准：逐级 get_node_by_id 回溯 vs 单次 WITH RECURSIVE
+
+使用方式（在项目根目录执行，需可写的 PostgreSQL，DATABASE_URL 指向它）：
+  python -m backend.scripts.bench_node_path --depths 5 22 50 --repeat 20
+
+脚本会临时创建一个用户、会话和一条线性故事链，结束后全部删除。
+输出每种深度下两种实现的 SQL 语句数与平均耗时。
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+import time
+import uuid
+
+# Add project root to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, 'backend'))
+
+from sqlalchemy import event
+
+from backend.database.base import SessionLocal, engine
+from backend.database import crud, models
+from schemas.story import RawStoryData
+
+
+class QueryCounter:
+    """统计 engine 上执行的 SQL 语句数"""
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        self.count += 1
+
+
+def legacy_path(db, node_id: int) -> list:
+    """旧实现：每个祖先一次 get_node_by_id"""
+    nodes = []
+    cursor = crud.get_node_by_id(db, node_id)
+    while cursor is not None:
+        nodes.append(cursor)
+        if cursor.parent_id is None:
+            break
+        cursor = crud.get_node_by_id(db, cursor.parent_id)
+    nodes.reverse()
+    return nodes
+
+
+def build_chain(db, session_id: int, length: int) -> int:
+    parent_id = None
+    for index in range(length):
+        segment = RawStoryData(
+            text=f"第{index + 1}节",
+            choices=[{"option": "继续", "summary": ""}],
+            image_url="/static/placeholder.png",
+            success_rate=50,
+            metadata={},
+        )
+        node = crud.create_story_node(
+            db,
+            session_id=session_id,
+            segment=segment,
+            parent_id=parent_id,
+            user_choice="继续" if parent_id else None,
+            commit=False,
+        )
+        parent_id = node.id
+    db.commit()
+    return parent_id
+
+
+def measure(func, db, node_id: int, repeat: int) -> tuple[float, float]:
+    counter = QueryCounter()
+    event.listen(engine, "before_cursor_execute", counter)
+    try:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            db.expire_all()
+            func(db, node_id)
+        elapsed_ms = (time.perf_counter() - start) * 1000.0 / repeat
+    finally:
+        event.remove(engine, "before_cursor_execute", counter)
+    return counter.count / repeat, elapsed_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="祖先链加载基准")
+    parser.add_argument("--depths", type=int, nargs="+", default=[5, 22, 50])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    user = models.User(
+        email=f"bench-{uuid.uuid4().hex[:8]}@example.com",
+        hashed_password="x",
+        nickname="bench",
+    )
+    db.add(user)
+    db.commit()
+    try:
+        print(f"{'depth':>6} | {'legacy queries':>14} | {'legacy ms':>9} | {'cte queries':>11} | {'cte ms':>7}")
+        for depth in args.depths:
+            session = models.GameSession(wish=f"bench-{depth}", user_id=user.id)
+            db.add(session)
+            db.commit()
+            leaf_id = build_chain(db, session.id, depth)
+
+            assert [n.id for n in legacy_path(db, leaf_id)] == [row["id"] for row in crud.get_node_path(db, leaf_id)]
+            legacy_q, legacy_ms = measure(legacy_path, db, leaf_id, args.repeat)
+            cte_q, cte_ms = measure(crud.get_node_path, db, leaf_id, args.repeat)
+            print(f"{depth:>6} | {legacy_q:>14.0f} | {legacy_ms:>9.2f} | {cte_q:>11.0f} | {cte_ms:>7.2f}")
+    finally:
+        db.rollback()
+        for session in db.query(models.GameSession).filter(models.GameSession.user_id == user.id).all():
+            db.query(models.StoryNode).filter(models.StoryNode.session_id == session.id).update(
+                {models.StoryNode.parent_id: None}, synchronize_session=False
+            )
+            db.query(models.StoryNode).filter(models.StoryNode.session_id == session.id).delete(synchronize_session=False)
+            db.delete(session)
+        db.delete(user)
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+回溯修剪基准：ORM 逐层遍历 children vs 递归 CTE UPDATE vs 物化路径 UPDATE
+
+使用方式（在项目根目录执行，需可写的 PostgreSQL，DATABASE_URL 指向它）：
+  python -m backend.scripts.bench_prune --branching 3 --depth 6 --repeat 5
+
+脚本会临时创建一个用户、会话和一棵满 N 叉故事树，结束后全部删除。
+每轮先把子孙节点恢复为非推演状态，再在行锁内执行标记并提交，统计 SQL 语句数与平均耗时。
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+import time
+import uuid
+
+# Add project root to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, 'backend'))
+
+from sqlalchemy import event, text
+
+from backend.database.base import SessionLocal, engine
+from backend.database import crud, models
+from backend.scripts.bench_node_path import QueryCounter
+from schemas.story import RawStoryData
+
+SPECULATIVE_DEPTH = 1
+
+
+def legacy_prune(db, node_id: int) -> list:
+    """旧实现：通过 children 关系逐层加载并逐个对象标记"""
+    target = crud.lock_node_for_update(db, node_id)
+    descendants = []
+    stack = list(target.children)
+    while stack:
+        node = stack.pop()
+        descendants.append(node)
+        stack.extend(list(node.children))
+    for node in descendants:
+        node.is_speculative = True
+        node.speculative_depth = SPECULATIVE_DEPTH
+        node.speculative_expires_at = None
+    db.commit()
+    return [n.id for n in descendants]
+
+
+def recursive_cte_prune(db, node_id: int) -> list:
+    """沿 parent_id 递归的单条 UPDATE ... RETURNING"""
+    crud.lock_node_for_update(db, node_id)
+    ids = db.execute(
+        text(
+            """
+            WITH RECURSIVE subtree AS (
+                SELECT id FROM story_nodes WHERE parent_id = :node_id
+                UNION ALL
+                SELECT child.id FROM story_nodes AS child JOIN subtree ON child.parent_id = subtree.id
+            )
+            UPDATE story_nodes
+            SET is_speculative = TRUE, speculative_depth = :spec_depth, speculative_expires_at = NULL
+            WHERE id IN (SELECT id FROM subtree)
+            RETURNING id
+            """
+        ),
+        {"node_id": node_id, "spec_depth": SPECULATIVE_DEPTH},
+    ).scalars().all()
+    db.commit()
+    return ids
+
+
+def path_prune(db, node_id: int) -> list:
+    """当前实现：物化路径 + GIN 索引的单条 UPDATE ... RETURNING"""
+    crud.lock_node_for_update(db, node_id)
+    ids = crud.mark_descendants_speculative(db, node_id, SPECULATIVE_DEPTH)
+    db.commit()
+    return ids
+
+
+def build_tree(db, session_id: int, branching: int, depth: int) -> int:
+    def segment(label: str) -> RawStoryData:
+        return RawStoryData(
+            text=label,
+            choices=[{"option": f"选项{i}", "summary": ""} for i in range(branching)],
+            image_url="/static/placeholder.png",
+            success_rate=50,
+            metadata={},
+        )
+
+    root = crud.create_story_node(db, session_id=session_id, segment=segment("根"), commit=False)
+    frontier = [root]
+    for level in range(depth):
+        next_frontier = []
+        for parent in frontier:
+            for i in range(branching):
+                next_frontier.append(crud.create_story_node(
+                    db,
+                    session_id=session_id,
+                    segment=segment(f"第{level + 2}层"),
+                    parent_id=parent.id,
+                    user_choice=f"选项{i}",
+                    commit=False,
+                ))
+        frontier = next_frontier
+    db.commit()
+    return root.id
+
+
+def reset(db, session_id: int) -> None:
+    db.query(models.StoryNode).filter(models.StoryNode.session_id == session_id).update(
+        {models.StoryNode.is_speculative: False, models.StoryNode.speculative_depth: None},
+        synchronize_session=False,
+    )
+    db.commit()
+    db.expire_all()
+
+
+def measure(func, db, session_id: int, node_id: int, repeat: int) -> tuple[float, float, int]:
+    counter = QueryCounter()
+    total_ms = 0.0
+    marked = 0
+    for _ in range(repeat):
+        reset(db, session_id)
+        event.listen(engine, "before_cursor_execute", counter)
+        try:
+            start = time.perf_counter()
+            marked = len(func(db, node_id))
+            total_ms += (time.perf_counter() - start) * 1000.0
+        finally:
+            event.remove(engine, "before_cursor_execute", counter)
+    return counter.count / repeat, total_ms / repeat, marked
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回溯修剪基准")
+    parser.add_argument("--branching", type=int, default=3)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    user = models.User(
+        email=f"bench-{uuid.uuid4().hex[:8]}@example.com",
+        hashed_password="x",
+        nickname="bench",
+    )
+    db.add(user)
+    db.commit()
+    session = models.GameSession(wish="bench-prune", user_id=user.id)
+    db.add(session)
+    db.commit()
+    try:
+        root_id = build_tree(db, session.id, args.branching, args.depth)
+        print(f"tree: branching={args.branching} depth={args.depth}")
+        print(f"{'strategy':>14} | {'marked':>6} | {'queries':>7} | {'ms':>8}")
+        for name, func in (
+            ("orm-walk", legacy_prune),
+            ("recursive-cte", recursive_cte_prune),
+            ("path", path_prune),
+        ):
+            queries, ms, marked = measure(func, db, session.id, root_id, args.repeat)
+            print(f"{name:>14} | {marked:>6} | {queries:>7.0f} | {ms:>8.2f}")
+    finally:
+        db.rollback()
+        db.query(models.StoryNode).filter(models.StoryNode.session_id == session.id).update(
+            {models.StoryNode.parent_id: None}, synchronize_session=False
+        )
+        db.query(models.StoryNode).filter(models.StoryNode.session_id == session.id).delete(synchronize_session=False)
+        db.delete(session)
+        db.delete(user)
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
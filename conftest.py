@@ -0,0 +1,10 @@
+"""pytest 入口：与 run_server / 脚本一致，把项目根目录与 backend 目录加入导入路径，并使用离线模拟提供商。"""
+import os
+import sys
+
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, "backend"))
+
+os.environ.setdefault("LLM_PROVIDER", "mock")
+os.environ.setdefault("IMAGE_PROVIDER", "mock")
@@ -0,0 +1,64 @@
+"""选项热度模型：位置先验、玩家位置偏好混合与标签提升。"""
+import pytest
+
+from core.choice_model import ChoicePopularityModel, option_tags
+
+
+@pytest.fixture
+def model():
+    model = ChoicePopularityModel()
+    model.warm_start_limit = 0  # 不读库冷启动
+    return model
+
+
+def _observe(model, index, count, tags=None):
+    for _ in range(count):
+        model.observe(index, tags or [[], []])
+
+
+def test_no_options_and_no_data(model):
+    assert model.probabilities([]) == []
+    assert model.probabilities([[], [], []]) == pytest.approx([1 / 3] * 3)
+
+
+def test_position_prior_is_laplace_smoothed_frequency(model):
+    _observe(model, 0, 6)
+    _observe(model, 1, 4)
+    assert model.probabilities([[], []]) == pytest.approx([7 / 12, 5 / 12])
+
+
+def test_personal_counts_blend_with_global_prior_instead_of_squaring_it(model):
+    _observe(model, 0, 6)
+    _observe(model, 1, 4)
+    # 玩家自身计数与全局相同：结果应接近同一频率，而不是被乘成 (7/12)^2 : (5/12)^2 ≈ 0.66 : 0.34
+    p0, p1 = model.probabilities([[], []], position_counts=[6, 4])
+    assert p0 == pytest.approx((6 + 5 * 7 / 12) / 15)
+    assert p0 + p1 == pytest.approx(1.0)
+    assert p0 < 0.62
+
+
+def test_personal_preference_outweighs_global_with_enough_samples(model):
+    _observe(model, 0, 20)
+    p0, p1 = model.probabilities([[], []], position_counts=[0, 30])
+    assert p1 > p0
+
+
+def test_tag_lift_favours_tags_players_pick(model):
+    # 带 intrigue 标签的选项总被选中，且出现在两个位置上
+    for index in (0, 1) * 5:
+        tags = [["intrigue"], []] if index == 0 else [[], ["intrigue"]]
+        model.observe(index, tags)
+    p0, p1 = model.probabilities([[], ["intrigue"]])
+    assert p1 > p0
+
+
+def test_out_of_range_choice_is_ignored(model):
+    model.observe(5, [[], []])
+    model.observe(None, [[], []])
+    assert model.observed_total == 0
+
+
+def test_option_tags_reads_hidden_effects_map():
+    metadata = {"chapter": {"hidden_effects_map": {"a": {"tags": ["military", ""]}, "b": {}}}}
+    assert option_tags(metadata, ["a", "b", None]) == [["military"], [], []]
+    assert option_tags(None, ["a"]) == [[]]
@@ -0,0 +1,122 @@
+"""配图队列：优先级、撤销排队中的预推演配图，以及提交选择时撤销兄弟分支的配图。"""
+import uuid
+
+import pytest
+
+from config.settings import settings
+from core.image_jobs import PRIORITY_INTERACTIVE, PRIORITY_SPECULATIVE, ImageJobService
+
+
+@pytest.fixture
+def service(monkeypatch):
+    # 不启动 worker，直接检查队列状态
+    monkeypatch.setattr(ImageJobService, "_ensure_workers", lambda self: None)
+    return ImageJobService()
+
+
+def test_interactive_jobs_run_before_speculative(service):
+    service.submit(1, "a", priority=PRIORITY_SPECULATIVE)
+    service.submit(2, "b")
+    assert service._next_job() == (2, "b")
+    assert service._next_job() == (1, "a")
+
+
+def test_resubmit_only_raises_priority(service):
+    assert service.submit(1, "a", priority=PRIORITY_SPECULATIVE) is True
+    assert service.submit(1, "a", priority=PRIORITY_SPECULATIVE) is False
+    assert service.submit(1, "a") is True
+    assert service.submit(1, "a", priority=PRIORITY_SPECULATIVE) is False
+    assert service._next_job() == (1, "a")
+    assert service.submitted_total == 1
+
+
+def test_cancel_drops_only_queued_speculative_jobs(service):
+    service.submit(1, "a", priority=PRIORITY_SPECULATIVE)
+    service.submit(2, "b", priority=PRIORITY_SPECULATIVE)
+    service.submit(3, "c", priority=PRIORITY_INTERACTIVE)
+    assert service.has_speculative_queued() is True
+    assert service.cancel([1, 3, 99]) == 1
+    assert service._next_job() == (3, "c")
+    # 被撤销节点的堆条目出队时跳过
+    assert service._next_job() == (2, "b")
+    assert service.has_speculative_queued() is False
+    assert service.get_metrics()["cancelled_total"] == 1
+
+
+def test_cancelled_job_can_be_submitted_again(service):
+    service.submit(1, "a", priority=PRIORITY_SPECULATIVE)
+    service.cancel([1])
+    assert service.is_pending(1) is False
+    assert service.submit(1, "a") is True
+    assert service._next_job() == (1, "a")
+
+
+def test_running_job_is_not_cancelled(service):
+    service.submit(1, "a", priority=PRIORITY_SPECULATIVE)
+    assert service._next_job() == (1, "a")
+    assert service.cancel([1]) == 0
+    assert service.is_pending(1) is True
+
+
+def _postgres_ready() -> bool:
+    if not (settings.database_url or "").startswith("postgresql"):
+        return False
+    try:
+        from sqlalchemy import inspect
+        from database.base import engine
+        return inspect(engine).has_table("story_nodes")
+    except Exception:  # noqa: BLE001
+        return False
+
+
+@pytest.mark.skipif(not _postgres_ready(), reason="需要已迁移的 PostgreSQL（DATABASE_URL）")
+def test_commit_choice_drops_queued_images_of_sibling_branches(monkeypatch, service):
+    from core import speculation as speculation_module
+    from database import crud, models
+    from database.base import SessionLocal
+
+    monkeypatch.setattr(speculation_module, "image_jobs", service)
+
+    db = SessionLocal()
+    user = models.User(email=f"images-{uuid.uuid4().hex[:8]}@test.local", hashed_password="x")
+    db.add(user)
+    db.commit()
+    session = crud.create_game_session(db, wish="成为一代名将", user_id=user.id)
+
+    def add(parent, choice, path):
+        node = models.StoryNode(
+            session_id=session.id, parent_id=parent.id if parent else None, story_text=choice or "开局",
+            image_url="", user_choice=choice, is_speculative=parent is not None, depth=len(path) + 1, path=path,
+        )
+        node.set_choices([{"option": "a"}, {"option": "b"}])
+        db.add(node)
+        db.flush()
+        return node
+
+    root = add(None, None, [])
+    chosen = add(root, "a", [root.id])
+    sibling = add(root, "b", [root.id])
+    chosen_child = add(chosen, "a", [root.id, chosen.id])
+    sibling_child = add(sibling, "a", [root.id, sibling.id])
+    db.commit()
+    nodes = [sibling_child, chosen_child, sibling, chosen, root]
+    try:
+        for node in (chosen, sibling, chosen_child, sibling_child):
+            service.submit(node.id, node.story_text, priority=PRIORITY_SPECULATIVE)
+
+        speculation_module.speculation_service.commit_choice(session.id, root.id, "a")
+
+        # 兄弟分支及其子树的配图被撤销，所选分支下的配图保留
+        assert not service.is_pending(sibling.id)
+        assert not service.is_pending(sibling_child.id)
+        assert service.is_pending(chosen.id)
+        assert service.is_pending(chosen_child.id)
+        assert service.cancelled_total == 2
+    finally:
+        for node in nodes:
+            db.delete(node)
+            db.flush()
+        db.delete(session)
+        db.delete(user)
+        db.commit()
+        db.close()
@@ -0,0 +1,63 @@
+"""本地 JSON 修复：常见的模型输出问题不必走一次模型修复往返。"""
+import pytest
+
+from core.json_repair import coerce_choices, repair_json
+
+
+def test_valid_json_is_unchanged():
+    assert repair_json('{"text": "正文", "choices": []}') == {"text": "正文", "choices": []}
+
+
+def test_empty_and_hopeless_input_returns_none():
+    assert repair_json("") is None
+    assert repair_json("这不是JSON") is None
+
+
+def test_trailing_commas_are_dropped():
+    assert repair_json('{"a": [1, 2,], "b": {"c": 3,},}') == {"a": [1, 2], "b": {"c": 3}}
+
+
+def test_unescaped_quotes_inside_text_are_escaped():
+    raw = '{"text": "他喊道"快走"然后转身, 不再回头", "choices": []}'
+    assert repair_json(raw) == {"text": '他喊道"快走"然后转身, 不再回头', "choices": []}
+
+
+def test_quote_followed_by_comma_and_value_still_closes_the_string():
+    assert repair_json('{"a": "x", "b": "y"}') == {"a": "x", "b": "y"}
+
+
+def test_raw_newlines_inside_strings_are_kept():
+    assert repair_json('{"text": "第一行\n第二行"}') == {"text": "第一行\n第二行"}
+
+
+def test_fullwidth_punctuation_as_structure():
+    raw = '｛“text”：“正文，继续”，“choices”：［］｝'
+    assert repair_json(raw) == {"text": "正文，继续", "choices": []}
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [
+        ('{"text": "被截断的正', {"text": "被截断的正"}),
+        ('{"text": "正文", "choices": [{"option": "A"},', {"text": "正文", "choices": [{"option": "A"}]}),
+        ('{"text": "正文", "choices": [{"option": "A"}, {"option":', {"text": "正文", "choices": [{"option": "A"}, {"option": None}]}),
+        ('{"text": "正文", "cho', {"text": "正文"}),
+    ],
+)
+def test_truncated_output_is_closed(raw, expected):
+    assert repair_json(raw) == expected
+
+
+def test_trailing_noise_after_the_object_is_ignored():
+    assert repair_json('{"a": 1} 以上就是输出') == {"a": 1}
+
+
+def test_coerce_choices_flattens_object_of_objects():
+    choices = {"A": {"summary": "进攻"}, "B": {"option": "撤退"}}
+    assert coerce_choices(choices) == [{"option": "A", "summary": "进攻"}, {"option": "撤退"}]
+
+
+def test_coerce_choices_leaves_other_shapes_alone():
+    assert coerce_choices([{"option": "A"}]) == [{"option": "A"}]
+    assert coerce_choices({"A": "进攻"}) == {"A": "进攻"}
+    assert coerce_choices({}) == {}
@@ -0,0 +1,58 @@
+"""增量节点 JSON 解析：正文随到随发、选项闭合即发，任意切块结果一致。"""
+import json
+
+import pytest
+
+from core.json_stream import IncrementalNodeParser, display_choice
+
+NODE = {
+    "text": "他说：\"出发\"\n然后\\离开。☃",
+    "meta": {"text": "嵌套字段不是正文", "choices": [{"option": "不是选项"}]},
+    "choices": [
+        {"option": "进攻", "summary": "正面突破", "effects": {"hp": -10}},
+        {"option": "撤退", "summary": "保存实力", "tags": ["retreat"]},
+    ],
+}
+
+
+def _run(raw, size):
+    parser = IncrementalNodeParser()
+    events = []
+    for i in range(0, len(raw), size):
+        events.extend(parser.feed(raw[i:i + size]))
+    return parser, events
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 64, 10_000])
+def test_any_chunking_yields_same_text_and_choices(size):
+    raw = "```json\n" + json.dumps(NODE, ensure_ascii=size % 2 == 1) + "\n```"
+    parser, events = _run(raw, size)
+    text = "".join(payload for kind, payload in events if kind == "text")
+    choices = [payload for kind, payload in events if kind == "choice"]
+    assert text == parser.text == NODE["text"]
+    assert choices == list(enumerate(NODE["choices"]))
+    assert parser.raw == raw
+
+
+def test_text_arrives_before_the_string_closes():
+    parser = IncrementalNodeParser()
+    assert parser.feed('{"text": "第一') == [("text", "第一")]
+    assert parser.feed('句\\n') == [("text", "句\n")]
+    assert parser.feed('", "choices": [') == []
+
+
+def test_choice_is_emitted_as_soon_as_its_object_closes():
+    parser = IncrementalNodeParser()
+    parser.feed('{"text": "x", "choices": [{"option": "A", "summary": "a"}')
+    assert parser.feed(', {"option": "B"') == []
+    assert parser.feed("}") == [("choice", (1, {"option": "B"}))]
+
+
+def test_malformed_choice_is_skipped_but_keeps_its_index():
+    parser = IncrementalNodeParser()
+    events = parser.feed('{"choices": [{"option": "A",}, {"option": "B"}]}')
+    assert events == [("choice", (1, {"option": "B"}))]
+
+
+def test_display_choice_hides_internal_fields():
+    assert display_choice({"option": " 进攻 ", "effects": {"hp": 1}}) == {"option": "进攻", "summary": ""}
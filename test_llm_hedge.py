@@ -0,0 +1,84 @@
+"""对冲延迟：延迟直方图分位数、对冲延迟取值区间，以及哪些调用计入直方图。"""
+import pytest
+
+from config.settings import settings
+from core.llm_hedge import LatencyHistogram, hedge_delay_seconds
+
+
+@pytest.fixture
+def hedge_settings(monkeypatch):
+    monkeypatch.setattr(settings, "llm_hedge_quantile", 0.95)
+    monkeypatch.setattr(settings, "llm_hedge_min_samples", 20)
+    monkeypatch.setattr(settings, "llm_hedge_default_delay_ms", 8000)
+    monkeypatch.setattr(settings, "llm_hedge_min_delay_ms", 500)
+    monkeypatch.setattr(settings, "llm_hedge_max_delay_ms", 30000)
+    return monkeypatch
+
+
+def test_empty_histogram_has_no_quantiles():
+    histogram = LatencyHistogram()
+    assert histogram.count == 0
+    assert histogram.quantile(0.5) is None
+    assert histogram.snapshot() == {"count": 0, "p50": None, "p95": None, "p99": None}
+
+
+def test_quantile_returns_bucket_upper_bound():
+    histogram = LatencyHistogram()
+    for _ in range(95):
+        histogram.observe(1000)
+    for _ in range(5):
+        histogram.observe(20000)
+    p50, p99 = histogram.quantile(0.5), histogram.quantile(0.99)
+    # 分桶按 1.25 倍递增，上界与样本值相差不超过一个桶
+    assert 1000 <= p50 < 1250
+    assert 20000 <= p99 < 25000
+    assert histogram.quantile(0.95) == p50
+
+
+def test_overflow_halves_counts_and_follows_recent_latency():
+    histogram = LatencyHistogram(max_samples=100)
+    for _ in range(100):
+        histogram.observe(100)
+    for _ in range(150):
+        histogram.observe(5000)
+    assert histogram.count <= 100
+    assert histogram.quantile(0.5) >= 5000
+
+
+def test_huge_latency_lands_in_last_finite_bucket():
+    histogram = LatencyHistogram()
+    histogram.observe(10_000_000)
+    assert histogram.quantile(1.0) < float("inf")
+
+
+def test_hedge_delay_uses_default_until_enough_samples(hedge_settings):
+    histogram = LatencyHistogram()
+    for _ in range(19):
+        histogram.observe(2000)
+    assert hedge_delay_seconds(histogram) == pytest.approx(8.0)
+    histogram.observe(2000)
+    assert 2.0 <= hedge_delay_seconds(histogram) < 2.5
+
+
+def test_hedge_delay_is_clamped(hedge_settings):
+    fast, slow = LatencyHistogram(), LatencyHistogram()
+    for _ in range(20):
+        fast.observe(20)
+        slow.observe(200_000)
+    assert hedge_delay_seconds(fast) == pytest.approx(0.5)
+    assert hedge_delay_seconds(slow) == pytest.approx(30.0)
+
+
+def test_only_hedge_eligible_calls_feed_the_histogram(monkeypatch):
+    from core.llm_clients import UniversalLLMClient
+
+    monkeypatch.setattr(settings, "llm_provider", "mock")
+    monkeypatch.setattr(settings, "llm_hedge_provider", "")
+    monkeypatch.setitem(settings.LLM_PROVIDERS["mock"], "latency_ms", {"median": 0, "sigma": 0})
+    client = UniversalLLMClient()
+    # 审核、修复、摘要等短调用不带 hedge_validate，不应压低节点生成的对冲延迟
+    client.generate("请审核这个愿望")
+    client.generate("请修复这段 JSON")
+    assert client.latency_histogram.count == 0
+    client.generate("生成下一节剧情", hedge_validate=lambda text: True)
+    assert client.latency_histogram.count == 1
@@ -0,0 +1,46 @@
+"""NotifyHub.wait_for：可等待的判定在线程中执行，不阻塞事件循环。"""
+import asyncio
+import threading
+import time
+
+from core.notify import NotifyHub
+
+
+def test_wait_for_awaits_threaded_predicate_without_blocking_loop():
+    hub = NotifyHub()
+    state = {"ready": False}
+
+    def _blocking_check() -> bool:
+        time.sleep(0.2)  # 模拟一次数据库查询
+        return state["ready"]
+
+    async def _main():
+        ticks = 0
+
+        async def _ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(_ticker())
+
+        def _finish():
+            state["ready"] = True
+            hub.notify("k")
+
+        threading.Timer(0.3, _finish).start()
+        ready = await hub.wait_for("k", lambda: asyncio.to_thread(_blocking_check), timeout=5)
+        ticker.cancel()
+        return ready, ticks
+
+    ready, ticks = asyncio.run(_main())
+    assert ready is True
+    # 判定在线程中阻塞期间事件循环仍在调度其它任务
+    assert ticks >= 10
+
+
+def test_wait_for_sync_predicate_times_out():
+    hub = NotifyHub()
+    assert asyncio.run(hub.wait_for("never", lambda: False, timeout=0.05)) is False
+    assert hub.get_metrics()["wait_timeouts_total"] == 1
@@ -0,0 +1,83 @@
+"""开局池快照：不带入来源会话的元数据，也不收录来源玩家已选中的子节点。"""
+import hashlib
+import uuid
+
+import pytest
+
+from config.settings import settings
+from database import crud, models
+
+
+def _node(**kwargs) -> models.StoryNode:
+    node = models.StoryNode(
+        story_text=kwargs.pop("text", "正文"),
+        image_url="/static/x.jpg",
+        user_choice=kwargs.pop("user_choice", None),
+        **kwargs,
+    )
+    node.set_choices([{"option": "a"}, {"option": "b"}])
+    return node
+
+
+def test_snapshot_strips_session_specific_metadata():
+    node = _node()
+    node.set_metadata({
+        "speculation": {"level": 0, "tokens": 900},
+        "history_summary": {"text": "来源玩家的摘要", "covered": 3},
+        "opening_pool_entry": 7,
+        "image": {"status": "ready"},
+        "chapter": {"enabled": True},
+    })
+    snapshot = crud._opening_snapshot(node)
+    assert snapshot["metadata"] == {"image": {"status": "ready"}, "chapter": {"enabled": True}}
+    # 来源节点本身不受影响
+    assert "speculation" in node.get_metadata()
+
+
+def _postgres_ready() -> bool:
+    if not (settings.database_url or "").startswith("postgresql"):
+        return False
+    try:
+        from sqlalchemy import inspect
+        from database.base import engine
+        return inspect(engine).has_table("opening_pool")
+    except Exception:  # noqa: BLE001
+        return False
+
+
+@pytest.mark.skipif(not _postgres_ready(), reason="需要已迁移的 PostgreSQL（DATABASE_URL）")
+def test_harvest_skips_the_committed_child():
+    from database.base import SessionLocal
+
+    db = SessionLocal()
+    user = models.User(email=f"pool-{uuid.uuid4().hex[:8]}@test.local", hashed_password="x")
+    db.add(user)
+    db.commit()
+    wish = f"开局池-{uuid.uuid4().hex[:6]}"
+    session = crud.create_game_session(db, wish=wish, user_id=user.id)
+    root = _node(session_id=session.id, depth=1, path=[])
+    db.add(root)
+    db.flush()
+    played = _node(text="来源玩家走过的分支", user_choice="a", session_id=session.id, parent_id=root.id,
+                   depth=2, path=[root.id], is_speculative=False)
+    speculative = _node(text="未被选中的分支", user_choice="b", session_id=session.id, parent_id=root.id,
+                        depth=2, path=[root.id], is_speculative=True)
+    speculative.set_metadata({"speculation": {"level": 0}})
+    db.add_all([played, speculative])
+    db.commit()
+
+    entry = crud.create_opening_pool_entry(
+        db, wish=wish, wish_digest=hashlib.sha256(wish.encode("utf-8")).hexdigest(), root=root
+    )
+    try:
+        assert [child["user_choice"] for child in entry.children] == ["b"]
+        assert entry.children[0]["metadata"] == {}
+    finally:
+        db.delete(entry)
+        for node in (played, speculative, root):
+            db.delete(node)
+            db.flush()
+        db.delete(session)
+        db.delete(user)
+        db.commit()
+        db.close()
@@ -0,0 +1,105 @@
+"""数据库连接池大小推导：按短时会话并发取需求，并受整机连接预算约束。"""
+import pytest
+
+from config.settings import settings
+from database.base import _pool_limits
+
+
+@pytest.fixture
+def pool_settings(monkeypatch):
+    monkeypatch.delenv("GUNICORN_WORKERS", raising=False)
+    monkeypatch.setattr(settings, "db_connection_budget", 80)
+    monkeypatch.setattr(settings, "image_worker_count", 4)
+    monkeypatch.setattr(settings, "speculation_max_workers", 60)
+    monkeypatch.setattr(settings, "db_pool_size", None)
+    monkeypatch.setattr(settings, "db_max_overflow", None)
+    return monkeypatch
+
+
+def test_default_covers_requests_image_and_speculation_writers(pool_settings):
+    # 10 个请求数据库段 + 4 个配图 worker + 60 / 10 个预推演落库
+    assert _pool_limits() == (10, 10)
+
+
+@pytest.mark.parametrize("workers", [1, 2, 4, 8, 16, 40])
+def test_all_workers_stay_within_connection_budget(pool_settings, workers):
+    pool_settings.setenv("GUNICORN_WORKERS", str(workers))
+    pool_size, max_overflow = _pool_limits()
+    assert (pool_size + max_overflow) * workers <= max(2 * workers, settings.db_connection_budget)
+
+
+def test_speculation_workers_do_not_reserve_one_connection_each(pool_settings):
+    pool_settings.setattr(settings, "speculation_max_workers", 200)
+    pool_size, max_overflow = _pool_limits()
+    assert pool_size + max_overflow == 10 + 4 + 20
+
+
+def test_explicit_settings_override(pool_settings):
+    pool_settings.setattr(settings, "db_pool_size", 3)
+    pool_settings.setattr(settings, "db_max_overflow", 0)
+    assert _pool_limits() == (3, 0)
+
+
+def test_invalid_worker_count_falls_back_to_one(pool_settings):
+    pool_settings.setenv("GUNICORN_WORKERS", "abc")
+    assert _pool_limits() == (10, 10)
+
+
+def _postgres_ready() -> bool:
+    if not (settings.database_url or "").startswith("postgresql"):
+        return False
+    try:
+        from sqlalchemy import inspect
+        from database.base import engine
+        return inspect(engine).has_table("story_nodes")
+    except Exception:  # noqa: BLE001
+        return False
+
+
+@pytest.mark.skipif(not _postgres_ready(), reason="需要已迁移的 PostgreSQL（DATABASE_URL）")
+def test_pregeneration_returns_its_connection_during_model_calls(monkeypatch):
+    import uuid
+
+    from api import story as story_api
+    from database import crud, models
+    from database.base import SessionLocal, engine
+    from schemas.story import RawStoryData
+
+    held = {}
+
+    def start_story(wish):
+        held["start_story"] = engine.pool.checkedout()
+        return RawStoryData(text="开局", choices=[], image_url="/static/x.jpg")
+
+    def enqueue(session_id, node_id, depth):
+        held["enqueue"] = engine.pool.checkedout()
+
+    monkeypatch.setattr(story_api.story_engine, "start_story", start_story)
+    monkeypatch.setattr(story_api.speculation_service, "enqueue", enqueue)
+    monkeypatch.setattr(story_api.opening_pool, "acquire", lambda db, wish: None)
+    monkeypatch.setattr(story_api.image_jobs, "ensure", lambda node: None)
+    monkeypatch.setattr(settings, "notify_backend", "memory")
+    monkeypatch.setattr(settings, "speculation_queue_backend", "memory")
+
+    db = SessionLocal()
+    user = models.User(email=f"pool-{uuid.uuid4().hex[:8]}@test.local", hashed_password="x")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    wish = f"连接池-{uuid.uuid4().hex[:6]}"
+    baseline = engine.pool.checkedout()
+    try:
+        story_api._background_generate_with_pregeneration(str(user_id), wish)
+        # 模型调用与推演入队期间本线程不占用连接，连接池只需按请求段的并发来配
+        assert held == {"start_story": baseline, "enqueue": baseline}
+    finally:
+        story_api._discard_pregeneration(story_api._make_cache_key(str(user_id), wish))
+        db = SessionLocal()
+        session = crud.get_session_by_user_and_wish(db, user_id=str(user_id), wish=wish)
+        if session is not None:
+            db.query(models.StoryNode).filter(models.StoryNode.session_id == session.id).delete()
+            db.delete(session)
+        db.delete(db.get(models.User, user_id))
+        db.commit()
+        db.close()
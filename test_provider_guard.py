@@ -0,0 +1,138 @@
+"""提供商熔断器与自适应令牌桶：状态转换、预推演让路与 429 降速。"""
+import types
+
+import pytest
+
+import core.llm_clients as llm_clients
+from core.llm_clients import (
+    BREAKER_CLOSED,
+    BREAKER_HALF_OPEN,
+    BREAKER_OPEN,
+    TRAFFIC_SPECULATIVE,
+    LLMUnavailableError,
+    _CircuitBreaker,
+    _ProviderGuard,
+    _TokenBucket,
+    llm_traffic,
+)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(llm_clients, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+class _RateLimited(Exception):
+    status_code = 429
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = _CircuitBreaker(failure_threshold=3, cooldown_seconds=10)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == BREAKER_CLOSED
+    breaker.record_failure()
+    assert breaker.state == BREAKER_OPEN
+    assert breaker.allow() is False
+    assert breaker.snapshot()["rejected_total"] == 1
+
+
+def test_breaker_half_open_admits_a_single_probe(clock):
+    breaker = _CircuitBreaker(failure_threshold=1, cooldown_seconds=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow() is True
+    assert breaker.state == BREAKER_HALF_OPEN
+    assert breaker.allow() is False
+    breaker.record_success()
+    assert breaker.state == BREAKER_CLOSED
+    assert breaker.allow() is True
+
+
+def test_failed_probe_reopens_for_another_cooldown(clock):
+    breaker = _CircuitBreaker(failure_threshold=5, cooldown_seconds=10)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow() is True
+    breaker.record_failure()
+    assert breaker.state == BREAKER_OPEN
+    clock.now += 5
+    assert breaker.allow() is False
+    assert breaker.snapshot()["opened_total"] == 2
+
+
+def test_released_probe_can_be_retried(clock):
+    breaker = _CircuitBreaker(failure_threshold=1, cooldown_seconds=0)
+    breaker.record_failure()
+    assert breaker.allow() is True
+    breaker.release_probe()
+    assert breaker.allow() is True
+
+
+def test_bucket_disabled_when_rate_is_zero(clock):
+    bucket = _TokenBucket(rate=0, burst=1, speculative_reserve=0.5)
+    assert all(bucket.try_acquire(speculative=True) == 0 for _ in range(100))
+
+
+def test_speculative_requests_leave_the_reserve_to_interactive(clock):
+    bucket = _TokenBucket(rate=1, burst=4, speculative_reserve=0.5)
+    assert bucket.try_acquire(speculative=True) == 0
+    assert bucket.try_acquire(speculative=True) == 0
+    # 剩余 2 个令牌是交互请求的保留量
+    assert bucket.try_acquire(speculative=True) == pytest.approx(1.0)
+    assert bucket.try_acquire(speculative=False) == 0
+    assert bucket.try_acquire(speculative=False) == 0
+    assert bucket.try_acquire(speculative=False) == pytest.approx(1.0)
+    clock.now += 1
+    assert bucket.try_acquire(speculative=False) == 0
+
+
+def test_throttling_halves_rate_and_success_recovers_it(clock):
+    bucket = _TokenBucket(rate=10, burst=5, speculative_reserve=0)
+    bucket.on_throttled()
+    assert bucket.rate == pytest.approx(5)
+    for _ in range(4):
+        bucket.on_throttled()
+    # 下限为配置速率的 5%
+    assert bucket.rate == pytest.approx(0.5)
+    for _ in range(30):
+        bucket.on_success()
+    assert bucket.rate == pytest.approx(10)
+    assert bucket.snapshot()["throttled_total"] == 5
+
+
+def test_guard_sheds_speculative_traffic_first(monkeypatch, clock):
+    monkeypatch.setattr(llm_clients.settings, "llm_rate_limit_per_second", 1)
+    monkeypatch.setattr(llm_clients.settings, "llm_rate_limit_burst", 2)
+    monkeypatch.setattr(llm_clients.settings, "llm_rate_limit_speculative_reserve", 0.5)
+    guard = _ProviderGuard("test-provider")
+    with llm_traffic(TRAFFIC_SPECULATIVE):
+        assert guard.admit() == 0
+        with pytest.raises(LLMUnavailableError):
+            guard.admit()
+    assert guard.admit() == 0
+    assert guard.admit() > 0
+    assert guard.snapshot()["shed_total"] == {"interactive": 0, "speculative": 1}
+
+
+def test_guard_rate_limit_failure_opens_breaker_and_slows_bucket(monkeypatch, clock):
+    monkeypatch.setattr(llm_clients.settings, "llm_breaker_failure_threshold", 1)
+    monkeypatch.setattr(llm_clients.settings, "llm_rate_limit_per_second", 4)
+    guard = _ProviderGuard("test-provider")
+    guard.record_failure(_RateLimited("too many requests"))
+    assert guard.bucket.rate == pytest.approx(2)
+    with pytest.raises(LLMUnavailableError):
+        guard.admit()
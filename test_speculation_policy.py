@@ -0,0 +1,163 @@
+"""自适应预推演策略：深度、展开位置与 token 预算。"""
+import types
+
+import pytest
+
+import core.speculation_policy as policy_module
+from config.settings import settings
+from core.speculation_policy import AdaptiveSpeculationPolicy, _PlayerProfile
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(policy_module, "time", types.SimpleNamespace(monotonic=clock.monotonic, time=clock.time))
+    return clock
+
+
+@pytest.fixture
+def policy(monkeypatch, clock):
+    monkeypatch.setattr(settings, "speculation_adaptive_enabled", True)
+    monkeypatch.setattr(settings, "speculation_adaptive_max_depth", 3)
+    monkeypatch.setattr(settings, "speculation_adaptive_min_samples", 2)
+    monkeypatch.setattr(settings, "speculation_adaptive_slow_factor", 3.0)
+    monkeypatch.setattr(settings, "speculation_adaptive_branch_coverage", 0.8)
+    monkeypatch.setattr(settings, "speculation_user_token_budget_per_hour", 0)
+    return AdaptiveSpeculationPolicy(base_depth=1)
+
+
+def _choose(policy, clock, user, intervals, index=0):
+    policy.observe_choice(user, index, 3)
+    for seconds in intervals:
+        clock.now += seconds
+        policy.observe_choice(user, index, 3)
+
+
+def test_unknown_player_gets_base_depth(policy):
+    assert policy.depth_for("nobody") == 1
+    assert policy.depth_for(None) == 1
+
+
+def test_fast_player_is_speculated_deeper(policy, clock):
+    policy.observe_generation(None, 3000.0, 0)
+    _choose(policy, clock, "fast", [1.5, 1.5])
+    # 每层生成 3s 内玩家前进两层，需领先 1 + 2 层
+    assert policy.depth_for("fast") == 3
+
+
+def test_replays_and_double_clicks_are_not_think_time(policy, clock):
+    policy.observe_generation(None, 3000.0, 0)
+    # 同一选择的重放与双击间隔远小于 1 秒，不应把玩家判定为极速玩家
+    _choose(policy, clock, "clicker", [0.05, 0.1, 0.05, 0.2])
+    assert policy.depth_for("clicker") == 1
+
+
+def test_slow_player_expands_only_the_likeliest_branch(policy, clock):
+    policy.observe_generation(None, 1000.0, 0)
+    _choose(policy, clock, "slow", [30.0, 30.0])
+    assert policy.depth_for("slow") == 1
+    assert policy.allowed_positions("slow", 0, [0.2, 0.5, 0.3]) == {1}
+
+
+def test_allowed_positions_cover_probability_mass_below_first_level(policy, clock):
+    policy.observe_generation(None, 3000.0, 0)
+    _choose(policy, clock, "p", [2.0, 2.0])
+    probabilities = [0.6, 0.3, 0.1]
+    assert policy.allowed_positions("p", 0, probabilities) == {0, 1, 2}
+    assert policy.allowed_positions("p", 1, probabilities) == {0, 1}
+    # 没有画像的玩家展开全部选项
+    assert policy.allowed_positions("new", 1, probabilities) == {0, 1, 2}
+
+
+def test_fit_budget_reduces_depth_before_running_out(policy):
+    profile = _PlayerProfile()
+    policy.tokens_per_node = 1000.0
+    # 3 个选项全展开：1 层 3 个节点，2 层 12 个，3 层 39 个
+    assert policy._fit_budget(profile, 3, 40000) == 3
+    assert policy._fit_budget(profile, 3, 15000) == 2
+    assert policy._fit_budget(profile, 3, 5000) == 1
+    assert policy._fit_budget(profile, 3, 0) == 0
+
+
+def test_fit_budget_without_cost_estimate_keeps_depth(policy):
+    assert policy._fit_budget(_PlayerProfile(), 3, 10) == 3
+
+
+def test_exhausted_budget_stops_speculation(monkeypatch, clock):
+    monkeypatch.setattr(settings, "speculation_adaptive_enabled", True)
+    monkeypatch.setattr(settings, "speculation_user_token_budget_per_hour", 1000)
+    policy = AdaptiveSpeculationPolicy(base_depth=2)
+    policy.observe_choice("spender", 0, 3)
+    policy.observe_generation("spender", 500.0, 1200)
+    assert policy.depth_for("spender") == 0
+    assert policy.allowed_positions("spender", 0, [0.4, 0.3, 0.3]) == set()
+
+
+def _postgres_ready() -> bool:
+    if not (settings.database_url or "").startswith("postgresql"):
+        return False
+    try:
+        from sqlalchemy import inspect
+        from database.base import engine
+        return inspect(engine).has_table("story_nodes")
+    except Exception:  # noqa: BLE001
+        return False
+
+
+@pytest.mark.skipif(not _postgres_ready(), reason="需要已迁移的 PostgreSQL（DATABASE_URL）")
+def test_continue_replay_does_not_observe_the_choice_again(monkeypatch):
+    import uuid
+
+    from api import story as story_api
+    from database import crud, models
+    from database.base import SessionLocal
+    from schemas.story import StoryContinueRequest
+
+    observed = []
+    monkeypatch.setattr(story_api.speculation_service, "observe_choice", lambda *args: observed.append(args))
+    monkeypatch.setattr(story_api.speculation_service, "record_hit", lambda node: None)
+    monkeypatch.setattr(story_api.image_jobs, "ensure", lambda node: None)
+
+    db = SessionLocal()
+    user = models.User(email=f"policy-{uuid.uuid4().hex[:8]}@test.local", hashed_password="x")
+    db.add(user)
+    db.commit()
+    session = crud.create_game_session(db, wish="成为一代名将", user_id=user.id)
+    root = models.StoryNode(session_id=session.id, story_text="开局", image_url="", depth=1, path=[])
+    root.set_choices([{"option": "a"}, {"option": "b"}])
+    db.add(root)
+    db.flush()
+    child = models.StoryNode(
+        session_id=session.id, parent_id=root.id, story_text="分支", image_url="", user_choice="a",
+        is_speculative=True, depth=2, path=[root.id],
+    )
+    child.set_choices([])
+    db.add(child)
+    db.commit()
+    db.refresh(root)
+    db.expunge(root)
+    request = StoryContinueRequest(session_id=session.id, node_id=root.id, choice="a")
+    try:
+        assert story_api._take_ready_child(request, root, str(user.id)) == child.id
+        # 双击 / 客户端重试：命中的是已转正的节点，不再计入思考时间与位置偏好
+        assert story_api._take_ready_child(request, root, str(user.id)) == child.id
+        assert len(observed) == 1
+    finally:
+        db.delete(db.get(models.StoryNode, child.id))
+        db.flush()
+        db.delete(db.get(models.StoryNode, root.id))
+        db.delete(session)
+        db.delete(user)
+        db.commit()
+        db.close()
@@ -0,0 +1,89 @@
+"""
+多 worker 模式下的第一节预生成记录：/start 只领取标记完成且未被领取的预生成，
+只在确有预生成进行中时等待。需要 PostgreSQL（DATABASE_URL），不可用时跳过。
+"""
+import uuid
+
+import pytest
+
+from config.settings import settings
+
+if not (settings.database_url or "").startswith("postgresql"):
+    pytest.skip("需要 PostgreSQL DATABASE_URL", allow_module_level=True)
+
+from sqlalchemy import inspect  # noqa: E402
+
+from api import story as story_api  # noqa: E402
+from database import crud, models  # noqa: E402
+from database.base import SessionLocal, engine  # noqa: E402
+from schemas.story import RawStoryData  # noqa: E402
+
+try:
+    if not inspect(engine).has_table("start_pregenerations"):
+        pytest.skip("数据库未迁移到最新版本", allow_module_level=True)
+except Exception as exc:  # noqa: BLE001
+    pytest.skip(f"数据库不可用: {exc}", allow_module_level=True)
+
+
+@pytest.fixture
+def shared_mode(monkeypatch):
+    monkeypatch.setattr(settings, "notify_backend", "postgres")
+
+
+@pytest.fixture
+def played_session():
+    """一个已经玩过的 (用户, 愿望) 会话及其根节点，即“回头玩家”的旧进度。"""
+    db = SessionLocal()
+    user = models.User(email=f"pregen-{uuid.uuid4().hex[:8]}@test.local", hashed_password="x")
+    db.add(user)
+    db.commit()
+    session = crud.create_game_session(db, wish="成为一代名将", user_id=user.id)
+    node = crud.create_story_node(
+        db,
+        session_id=session.id,
+        segment=RawStoryData(text="旧的开局", choices=[], image_url="/static/x.jpg"),
+    )
+    key = story_api._make_cache_key(str(user.id), session.wish)
+    yield key, session.id, node.id
+    crud.delete_start_pregeneration(db, key)
+    db.delete(node)
+    db.delete(session)
+    db.delete(user)
+    db.commit()
+    db.close()
+
+
+def test_existing_root_is_not_taken_as_pregenerated(shared_mode, played_session):
+    key, _, _ = played_session
+    assert story_api._pop_pregenerated(key) is None
+
+
+def test_ready_pregeneration_is_taken_once(shared_mode, played_session):
+    key, session_id, node_id = played_session
+    with SessionLocal() as db:
+        crud.mark_start_pregeneration(db, key, "ready", session_id=session_id, node_id=node_id, trace="t1")
+    assert story_api._pop_pregenerated(key) == {"session_id": session_id, "node_id": node_id, "trace": "t1"}
+    assert story_api._pop_pregenerated(key) is None
+
+
+def test_pending_only_while_a_worker_records_running(shared_mode, played_session):
+    key, session_id, node_id = played_session
+    # 没有任何 worker 在预生成：/start 不应等待
+    assert story_api._pregeneration_pending(key) is False
+
+    with SessionLocal() as db:
+        crud.mark_start_pregeneration(db, key, "running")
+    assert story_api._pregeneration_pending(key) is True
+    # 进行中的记录不可被领取
+    assert story_api._pop_pregenerated(key) is None
+
+    with SessionLocal() as db:
+        crud.mark_start_pregeneration(db, key, "ready", session_id=session_id, node_id=node_id)
+    assert story_api._pregeneration_pending(key) is False
+
+
+def test_stale_running_record_is_not_pending(shared_mode, played_session):
+    key, _, _ = played_session
+    with SessionLocal() as db:
+        crud.mark_start_pregeneration(db, key, "running")
+        assert crud.is_start_pregeneration_running(db, key, 0) is False
@@ -0,0 +1,53 @@
+"""节点 JSON 修复：同步与异步修复器使用同一份节点结构提示词。"""
+import asyncio
+import json
+
+import pytest
+
+import core.story_engine as story_engine_module
+from core.story_engine import NODE_SYSTEM_PREAMBLE, StoryEngine
+
+FIXED = json.dumps({"text": "正文", "choices": [{"option": "a", "summary": "s", "effects": {}}] * 3})
+BROKEN = '{"text": "正文", "choices": [ 这不是JSON'
+
+
+class _RecordingClient:
+    def __init__(self):
+        self.calls = []
+
+    def generate(self, prompt, **kwargs):
+        self.calls.append((prompt, kwargs))
+        return FIXED
+
+
+class _AsyncRecordingClient(_RecordingClient):
+    async def generate(self, prompt, **kwargs):
+        return _RecordingClient.generate(self, prompt, **kwargs)
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    sync_client, async_client = _RecordingClient(), _AsyncRecordingClient()
+    monkeypatch.setattr(story_engine_module, "llm_client", sync_client)
+    monkeypatch.setattr(story_engine_module, "async_llm_client", async_client)
+    return sync_client, async_client
+
+
+def test_sync_and_async_fixers_share_node_schema_prompt(clients):
+    sync_client, async_client = clients
+    engine = StoryEngine()
+
+    assert engine._attempt_json_fix(BROKEN)["text"] == "正文"
+    assert asyncio.run(engine._attempt_json_fix_async(BROKEN))["text"] == "正文"
+
+    (sync_prompt, sync_kwargs), (async_prompt, async_kwargs) = sync_client.calls[0], async_client.calls[0]
+    assert sync_prompt == async_prompt
+    assert sync_kwargs["system_preamble_override"] == async_kwargs["system_preamble_override"] == NODE_SYSTEM_PREAMBLE
+    assert "effects" in sync_prompt and "image_prompts" in sync_prompt
+    assert "success_rate" not in sync_prompt
+
+
+def test_fix_result_without_node_keys_is_not_cached():
+    engine = StoryEngine()
+    assert engine._is_valid_fix(FIXED)
+    assert not engine._is_valid_fix('{"success_rate": 50, "choices": []}')